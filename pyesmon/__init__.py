@@ -4,6 +4,7 @@ ESMON python library
 __all__ = ["collectd",
            "daemon",
            "esmon_build",
+           "esmon_capacity",
            "esmon_common",
            "esmon_config",
            "esmon_influxdb",
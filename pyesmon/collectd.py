@@ -12,7 +12,14 @@ from pyesmon import lustre
 
 COLLECTD_CONFIG_TEST_FNAME = "collectd.conf.test"
 COLLECTD_CONFIG_FINAL_FNAME = "collectd.conf.final"
+# The fingerprint of the config that collectd is running with
+COLLECTD_FINGERPRINT_FPATH = "/etc/collectd.conf.fingerprint"
+# The backup of the config that collectd was running with before an update
+COLLECTD_ROLLBACK_FPATH = "/etc/collectd.conf.rollback"
 COLLECTD_INTERVAL_TEST = 1
+# Values will be dropped if the write queue of collectd exceeds the limit
+COLLECTD_WRITE_QUEUE_LIMIT_HIGH = 1000000
+COLLECTD_WRITE_QUEUE_LIMIT_LOW = 800000
 # ES2 of version ddn18 added support for used inode/space in the future
 ES2_HAS_USED_INODE_SPACE_SUPPORT = False
 # ES4 will add support for used inode/space in the future
@@ -93,12 +100,14 @@ class CollectdConfig(object):
         self.cc_filedatas = collections.OrderedDict()
         self.cc_aggregations = collections.OrderedDict()
         self.cc_post_cache_chain_rules = collections.OrderedDict()
+        # The match plugins used by the rules of PostCacheChain
+        self.cc_post_cache_chain_matches = ["match_regex"]
         self.cc_sfas = collections.OrderedDict()
         self.cc_checks = []
         self.cc_job_id_var = job_id_var
         self.cc_configs["Interval"] = collect_internal
-        self.cc_configs["WriteQueueLimitHigh"] = 1000000
-        self.cc_configs["WriteQueueLimitLow"] = 800000
+        self.cc_configs["WriteQueueLimitHigh"] = COLLECTD_WRITE_QUEUE_LIMIT_HIGH
+        self.cc_configs["WriteQueueLimitLow"] = COLLECTD_WRITE_QUEUE_LIMIT_LOW
         self.cc_plugin_syslog("err")
         self.cc_plugin_memory()
         self.cc_plugin_cpu()
@@ -138,8 +147,9 @@ class CollectdConfig(object):
                 fout.write(config)
 
             if any(self.cc_post_cache_chain_rules):
-                config = """LoadPlugin match_regex
-PostCacheChain "PostCache"
+                for match in self.cc_post_cache_chain_matches:
+                    fout.write("LoadPlugin %s\n" % match)
+                config = """PostCacheChain "PostCache"
 # Don't send "cpu-X" stats
 <Chain "PostCache">
 """
@@ -344,8 +354,11 @@ PostCacheChain "PostCache"
 
     def cc_plugin_lustre(self, lustre_version, lustre_oss=False,
                          lustre_mds=False, lustre_client=False,
-                         lustre_exp_ost=False, lustre_exp_mdt=False):
+                         lustre_exp_ost=False, lustre_exp_mdt=False,
+                         lustre_compact_stats=False, lustre_drop_unused=False,
+                         slow_gauge_periods=1, acct_periods=1):
         # pylint: disable=too-many-arguments,too-many-branches
+        # pylint: disable=too-many-statements
         """
         Config the Lustre plugin
         """
@@ -354,6 +367,10 @@ PostCacheChain "PostCache"
             return -1
 
         enable_zfs = support_zfs(xml_fname)
+        # The items of gauges that change slowly
+        slow_items = []
+        # The items of quota accounting, which are expensive to scan
+        acct_items = []
 
         config = """<Plugin "filedata">
     <Common>
@@ -396,34 +413,15 @@ PostCacheChain "PostCache"
     </Item>
 """
         if lustre_oss:
-            config += """
-    # OST stats
-    <Item>
-        Type "ost_acctuser"
-    </Item>"""
+            acct_items += ["ost_acctuser"]
             if enable_zfs:
-                config += """
-    <Item>
-        Type "zfs_ost_acctuser"
-    </Item>"""
+                acct_items += ["zfs_ost_acctuser"]
             if support_acctgroup_acctproject(lustre_version):
-                config += """
-    <Item>
-        Type "ost_acctgroup"
-    </Item>
-    <Item>
-        Type "ost_acctproject"
-    </Item>"""
+                acct_items += ["ost_acctgroup", "ost_acctproject"]
                 if enable_zfs:
-                    config += """
-    <Item>
-        Type "zfs_ost_acctgroup"
-    </Item>
-    <Item>
-        Type "zfs_ost_acctproject"
-    </Item>
-"""
+                    acct_items += ["zfs_ost_acctgroup", "zfs_ost_acctproject"]
             config += """
+    # OST stats
     <Item>
         Type "ost_brw_stats_rpc_bulk"
     </Item>
@@ -485,19 +483,9 @@ PostCacheChain "PostCache"
 #       </ExtendedParse>
 #       TsdbTags "slurm_job_uid=${extendfield:slurm_job_uid} slurm_job_gid=${extendfield:slurm_job_gid} slurm_job_id=${extendfield:slurm_job_id}"
 #   </ItemType>
-
-    <Item>
-        Type "ost_kbytestotal"
-    </Item>
-    <Item>
-        Type "ost_kbytesfree"
-    </Item>
-    <Item>
-        Type "ost_filestotal"
-    </Item>
-    <Item>
-        Type "ost_filesfree"
-    </Item>"""
+"""
+            slow_items += ["ost_kbytestotal", "ost_kbytesfree",
+                           "ost_filestotal", "ost_filesfree"]
             config += """
 
     # Items of ost_threads_* are not enabled
@@ -746,33 +734,15 @@ PostCacheChain "PostCache"
     </Item>
 """
         if lustre_mds:
-            config += """
-    # MDT stats
-    <Item>
-        Type "mdt_acctuser"
-    </Item>"""
+            acct_items += ["mdt_acctuser"]
             if enable_zfs:
-                config += """
-    <Item>
-        Type "zfs_mdt_acctuser"
-    </Item>"""
+                acct_items += ["zfs_mdt_acctuser"]
             if support_acctgroup_acctproject(lustre_version):
-                config += """
-    <Item>
-        Type "mdt_acctgroup"
-    </Item>
-    <Item>
-        Type "mdt_acctproject"
-    </Item>"""
+                acct_items += ["mdt_acctgroup", "mdt_acctproject"]
                 if enable_zfs:
-                    config += """
-    <Item>
-        Type "zfs_mdt_acctgroup"
-    </Item>
-    <Item>
-        Type "zfs_mdt_acctproject"
-    </Item>"""
+                    acct_items += ["zfs_mdt_acctgroup", "zfs_mdt_acctproject"]
             config += """
+    # MDT stats
     <Item>
         Type "md_stats_open"
     </Item>
@@ -842,13 +812,8 @@ PostCacheChain "PostCache"
 #       </ExtendedParse>
 #       TsdbTags "slurm_job_uid=${extendfield:slurm_job_uid} slurm_job_gid=${extendfield:slurm_job_gid} slurm_job_id=${extendfield:slurm_job_id}"
 #   </ItemType>
-
-    <Item>
-        Type "mdt_filestotal"
-    </Item>
-    <Item>
-        Type "mdt_filesfree"
-    </Item>"""
+"""
+            slow_items += ["mdt_filestotal", "mdt_filesfree"]
 
             if self.cc_job_id_var == lustre.JOB_ID_PROCNAME_UID:
                 config += """
@@ -1020,15 +985,132 @@ PostCacheChain "PostCache"
     </Item>
 """
 
+        # Each class of items is collected by another instance of filedata
+        # with a longer interval if required
+        item_classes = [("lustre_slow_gauge", slow_gauge_periods, slow_items),
+                        ("lustre_acct", acct_periods, acct_items)]
+        for name, periods, items in item_classes:
+            class_config = ""
+            for item in items:
+                class_config += """
+    <Item>
+        Type "%s"
+    </Item>""" % item
+            if class_config == "":
+                continue
+            class_config += "\n"
+
+            if periods > 1:
+                interval = int(self.cc_configs["Interval"]) * periods
+                self.cc_filedatas[name] = ("""<Plugin "filedata">
+    <Common>
+        DefinitionFile "/etc/%s"
+        Interval %d
+    </Common>
+%s</Plugin>
+
+""" % (xml_fname, interval, class_config))
+            else:
+                config += class_config
+
         # Client support, e.g. max_rpcs_in_flight of mdc could be added
         config += "</Plugin>\n\n"
         self.cc_filedatas["lustre"] = config
+
+        if lustre_compact_stats:
+            # The samples, sum and sum_square of the service stats are still
+            # collected to calculate the mean, but are not written to the
+            # server. The dashboards and continuous queries only use min, max
+            # and mean, but the quantile sketches of the streaming rollup need
+            # samples, sum and sum_square, see es_rollup_quantile_rules().
+            self.cc_post_cache_chain_rules["lustre_service_stats"] = """    <Rule>
+        <Match regex>
+            PluginInstance "^stats$"
+            Type "^gauge$"
+            TypeInstance "_(samples|sum|sum_square|mean_square)$"
+        </Match>
+        Target stop
+    </Rule>
+"""
+            if lustre_oss:
+                # The percentage and cum of brw_stats can be calculated from
+                # the samples of all buckets when querying
+                self.cc_post_cache_chain_rules["lustre_ost_brw_stats"] = """    <Rule>
+        <Match regex>
+            PluginInstance "brw_stats_"
+            TypeInstance "^(read|write)_(percentage|cum)$"
+        </Match>
+        Target stop
+    </Rule>
+"""
+                # Only sum_read_bytes and sum_write_bytes of ost_jobstats_bytes
+                # are used
+                self.cc_post_cache_chain_rules["lustre_ost_jobstats"] = """    <Rule>
+        <Match regex>
+            PluginInstance "^jobstat_"
+            TypeInstance "^(min|max)_(read|write)_bytes$"
+        </Match>
+        Target stop
+    </Rule>
+"""
+        if lustre_drop_unused:
+            self.cc_plugin_lustre_drop_unused(lustre_oss=lustre_oss,
+                                              lustre_mds=lustre_mds,
+                                              lustre_exp_ost=lustre_exp_ost)
         client = self.cc_esmon_client
         rpm_name = "collectd-filedata"
         if rpm_name not in client.ec_needed_collectd_rpms:
             client.ec_needed_collectd_rpms.append(rpm_name)
         return 0
 
+    def cc_lustre_unused_rule(self, name, regex_match):
+        """
+        Add a rule that drops the zero values matched by regex_match
+        """
+        self.cc_post_cache_chain_rules[name] = """    <Rule>
+        <Match regex>
+%s        </Match>
+        <Match value>
+            Min 0
+            Max 0
+        </Match>
+        Target stop
+    </Rule>
+""" % regex_match
+        if "match_value" not in self.cc_post_cache_chain_matches:
+            self.cc_post_cache_chain_matches.append("match_value")
+
+    def cc_plugin_lustre_drop_unused(self, lustre_oss=False, lustre_mds=False,
+                                     lustre_exp_ost=False):
+        """
+        Drop the counters of Lustre jobs, exports and users that have never
+        been used. match_value compares the raw value, so a non-zero counter
+        that stays the same is still written every interval.
+        """
+        if lustre_oss:
+            # The counters of the operations that a job has never done stay
+            # zero. The first non-zero value is always written, and the rate
+            # is calculated from the cache, so nothing is lost.
+            self.cc_lustre_unused_rule("lustre_ost_jobstats_unused",
+                                       """            Plugin "-OST[0-9a-fA-F]+$"
+            PluginInstance "^jobstat_"
+""")
+            # The plugin of export stats is
+            # ${exp_client}-${exp_type}_${fs_name}-${ost_index}, e.g.
+            # 10.0.0.1-o2ib_lustre-OST0000
+            if lustre_exp_ost:
+                self.cc_lustre_unused_rule("lustre_exp_ost_stats_unused",
+                                           """            Plugin "-[a-z]+[0-9]*_.+-OST[0-9a-fA-F]+$"
+            PluginInstance "^stats$"
+            Type "^derive$"
+""")
+        if lustre_oss or lustre_mds:
+            # The users/groups/projects without any usage on the target are
+            # not written. Missing value of acct means no usage.
+            self.cc_lustre_unused_rule("lustre_acct_unused",
+                                       """            PluginInstance "^acct(user|group|project)_"
+""")
+
     def cc_plugin_ime(self, ime_version):
         """
         Config the IME plugin
@@ -0,0 +1,1530 @@
+# Copyright (c) 2017 DataDirect Networks, Inc.
+# All Rights Reserved.
+# Author: lixi@ddn.com
+"""
+Archive the completed shards of Influxdb into compressed columnar files
+
+The days covered by the completed shards are streamed out of Influxdb by
+chunked queries, one measurement at a time. The points of each measurement in
+each day are sorted by series and time, and saved in a file under
+<archive_dir>/<retention_policy>/measurements/<measurement>/<YYYY-MM-DD>.esa.
+Each column is compressed in its own block: timestamps are delta encoded,
+tags are dictionary encoded, and the footer of the file records the
+dictionaries, the time range and the offsets of the blocks. So the query
+command only reads the footers to skip the files that can't match the time
+range or the tags, and only reads the blocks of the columns it needs.
+
+When all measurements of a day are archived, a marker is saved under
+<archive_dir>/<retention_policy>/days/, and the days with markers are skipped
+when the export is run again. A shard is only dropped by --drop when all of
+the days that it covers have markers.
+
+The import command loads the archive files or the line protocol files back
+into Influxdb, e.g. after the server is rebuilt. The points are cut into
+batches in the order of series and time, and written by concurrent writers.
+The batch size is tuned by the latency of the writes. The input files are
+split into blocks, and the blocks that have been written are saved in a
+checkpoint, so an interrupted import resumes from the first unfinished block.
+Writing a point again is harmless, since it just overwrites the same point.
+"""
+# pylint: disable=too-many-lines
+import sys
+import os
+import time
+import calendar
+import logging
+import traceback
+import httplib
+import json
+import struct
+import array
+import zlib
+import urllib
+import gzip
+import operator
+import threading
+import Queue
+import yaml
+
+from pyesmon import utils
+from pyesmon import esmon_common
+from pyesmon import esmon_influxdb
+from pyesmon import esmon_install_nodeps
+from pyesmon import esmon_rollup
+from pyesmon import esmon_storage
+
+ESMON_ARCHIVE_MAGIC = "ESMONARC"
+ESMON_ARCHIVE_VERSION = 1
+ESMON_ARCHIVE_SUFFIX = ".esa"
+# The length of the footer, followed by the magic at the end of the file
+ESMON_ARCHIVE_TRAILER = struct.Struct("<Q")
+ESMON_ARCHIVE_COMPRESS_LEVEL = 6
+# The points in each chunk of the responses of the export queries
+ESMON_ARCHIVE_CHUNK_SIZE = 10000
+ESMON_ARCHIVE_DAY_FORMAT = "%Y-%m-%d"
+ESMON_ARCHIVE_TIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+ESMON_ARCHIVE_MEASUREMENT_DIR = "measurements"
+ESMON_ARCHIVE_DAY_DIR = "days"
+ESMON_ARCHIVE_RETENTION_POLICY = "autogen"
+ESMON_ARCHIVE_FUNCTIONS = ["count", "sum", "mean", "min", "max", "last"]
+ESMON_ARCHIVE_FUNCTION = "mean"
+ESMON_ARCHIVE_NUMERIC_TYPES = ["float", "integer"]
+# The array type codes of the numeric fields
+ESMON_ARCHIVE_TYPECODES = {"float": "d",
+                           "integer": "l"}
+ESMON_IMPORT_WRITERS = 4
+ESMON_IMPORT_BATCH_SIZE = 5000
+ESMON_IMPORT_MIN_BATCH_SIZE = 500
+ESMON_IMPORT_MAX_BATCH_SIZE = 100000
+# The batch size is tuned so that each write takes about this many seconds
+ESMON_IMPORT_LATENCY = 1.0
+ESMON_IMPORT_RETRIES = 3
+# The lines of line protocol files are sorted in blocks of this size
+ESMON_IMPORT_SORT_LINES = 1000000
+# Seconds between the saves of the checkpoint
+ESMON_IMPORT_CHECKPOINT_INTERVAL = 10
+ESMON_IMPORT_CHECKPOINT = "esmon_import_checkpoint.json"
+ESMON_IMPORT_LINE_SUFFIXES = [".lp", ".lp.gz"]
+ESMON_IMPORT_PRECISIONS = ["n", "u", "ms", "s", "m", "h"]
+SECONDS_PER_DAY = 86400
+NANOSECONDS_PER_SECOND = 1000000000
+
+
+def esmon_archive_time_parse(string):
+    """
+    Return the seconds of RFC3339 time or day string, None if invalid
+    """
+    if "." in string and string.endswith("Z"):
+        string = string[:string.index(".")] + "Z"
+    for time_format in [ESMON_ARCHIVE_TIME_FORMAT, ESMON_ARCHIVE_DAY_FORMAT]:
+        try:
+            return calendar.timegm(time.strptime(string, time_format))
+        except ValueError:
+            continue
+    return None
+
+
+def esmon_archive_quote(name):
+    """
+    Return the identifier quoted for InfluxQL
+    """
+    return '"%s"' % name.replace("\\", "\\\\").replace('"', '\\"')
+
+
+def esmon_archive_measurement_dir(archive_dir, retention_policy,
+                                  measurement):
+    """
+    Return the directory of the files of the measurement
+    """
+    return os.path.join(archive_dir, retention_policy,
+                        ESMON_ARCHIVE_MEASUREMENT_DIR,
+                        urllib.quote(measurement.encode("utf-8"), safe=""))
+
+
+def esmon_archive_day_marker(archive_dir, retention_policy, day):
+    """
+    Return the path of the marker of the archived day
+    """
+    return os.path.join(archive_dir, retention_policy, ESMON_ARCHIVE_DAY_DIR,
+                        time.strftime(ESMON_ARCHIVE_DAY_FORMAT,
+                                      time.gmtime(day)) + ".json")
+
+
+def esmon_archive_field_value(field_type, value):
+    """
+    Return the value converted to the type of the field
+    """
+    # pylint: disable=too-many-return-statements
+    if value is None:
+        return None
+    if field_type == "float":
+        return float(value)
+    if field_type == "integer":
+        return int(value)
+    if field_type == "boolean":
+        return bool(value)
+    return value
+
+
+def esmon_archive_field_type(values):
+    """
+    Return the type of a field that Influxdb doesn't know the type of
+    """
+    field_type = None
+    for value in values:
+        if value is None:
+            continue
+        if isinstance(value, bool):
+            value_type = "boolean"
+        elif isinstance(value, (int, long)):
+            value_type = "integer"
+        elif isinstance(value, float):
+            value_type = "float"
+        else:
+            return "string"
+        if field_type is None or field_type == value_type:
+            field_type = value_type
+        elif (field_type in ESMON_ARCHIVE_NUMERIC_TYPES and
+              value_type in ESMON_ARCHIVE_NUMERIC_TYPES):
+            field_type = "float"
+        else:
+            return "string"
+    if field_type is None:
+        return "float"
+    return field_type
+
+
+def esmon_archive_block(archive_fd, data):
+    """
+    Compress and write the data, return the offset and length of the block
+    """
+    offset = archive_fd.tell()
+    block = zlib.compress(data, ESMON_ARCHIVE_COMPRESS_LEVEL)
+    archive_fd.write(block)
+    return offset, len(block)
+
+
+class ArchivePartition(object):
+    """
+    The points of a measurement in a day
+    """
+    # pylint: disable=too-many-instance-attributes
+    def __init__(self, retention_policy, measurement, day, field_types):
+        self.ap_retention_policy = retention_policy
+        self.ap_measurement = measurement
+        # The seconds of the start of the day
+        self.ap_day = day
+        # Key is field name, value is the type given by SHOW FIELD KEYS
+        self.ap_field_types = field_types
+        self.ap_fields = []
+        # Key is field name, value is the index of the field in the rows
+        self.ap_field_indexes = {}
+        self.ap_tag_keys = set()
+        # Key is tuple of sorted (tag, value), value is list of rows, each
+        # row is the time followed by the values of the fields
+        self.ap_series = {}
+        self.ap_rows = 0
+
+    def ap_add(self, serie):
+        """
+        Add the points of a serie in a chunk of the query result
+        """
+        indexes = []
+        for column in serie["columns"][1:]:
+            if column not in self.ap_field_indexes:
+                self.ap_field_indexes[column] = len(self.ap_fields)
+                self.ap_fields.append(column)
+            indexes.append(self.ap_field_indexes[column] + 1)
+
+        tags = serie.get("tags", {})
+        self.ap_tag_keys.update(tags.keys())
+        key = tuple(sorted(tags.items()))
+        rows = self.ap_series.setdefault(key, [])
+        for value in serie.get("values", []):
+            row = [value[0]] + [None] * len(self.ap_fields)
+            for column_index, row_index in enumerate(indexes):
+                row[row_index] = value[column_index + 1]
+            rows.append(row)
+            self.ap_rows += 1
+
+    def ap_write(self, fpath):
+        """
+        Write the points into the file, return 0 on success
+        """
+        # pylint: disable=too-many-locals,bare-except
+        tag_keys = sorted(self.ap_tag_keys)
+        tag_dictionaries = {}
+        for tag_key in tag_keys:
+            tag_dictionaries[tag_key] = sorted(set(dict(key).get(tag_key, "")
+                                                   for key in self.ap_series))
+        tag_indexes = {}
+        # Key is tag key, value is dict from tag value to dictionary index
+        tag_positions = {}
+        for tag_key in tag_keys:
+            tag_positions[tag_key] = dict((value, index) for index, value in
+                                          enumerate(tag_dictionaries[tag_key]))
+            if len(tag_dictionaries[tag_key]) <= 0xFFFF:
+                tag_indexes[tag_key] = array.array("H")
+            else:
+                tag_indexes[tag_key] = array.array("I")
+
+        times = array.array("l")
+        field_values = [[] for _ in self.ap_fields]
+        previous = 0
+        min_time = None
+        max_time = None
+        for key in sorted(self.ap_series.keys()):
+            tags = dict(key)
+            rows = self.ap_series[key]
+            rows.sort(key=lambda row: row[0])
+            for tag_key in tag_keys:
+                value_index = tag_positions[tag_key][tags.get(tag_key, "")]
+                tag_indexes[tag_key].extend([value_index] * len(rows))
+            for row in rows:
+                times.append(row[0] - previous)
+                previous = row[0]
+                for field_index, values in enumerate(field_values):
+                    if field_index + 1 < len(row):
+                        values.append(row[field_index + 1])
+                    else:
+                        values.append(None)
+            if min_time is None or rows[0][0] < min_time:
+                min_time = rows[0][0]
+            if max_time is None or rows[-1][0] > max_time:
+                max_time = rows[-1][0]
+
+        tmp_fpath = fpath + ".tmp"
+        try:
+            archive_fd = open(tmp_fpath, "wb")
+            archive_fd.write(ESMON_ARCHIVE_MAGIC)
+            columns = []
+            offset, length = esmon_archive_block(archive_fd, times.tostring())
+            columns.append({"name": "time",
+                            "kind": "time",
+                            "typecode": times.typecode,
+                            "offset": offset,
+                            "length": length})
+            for tag_key in tag_keys:
+                indexes = tag_indexes[tag_key]
+                offset, length = esmon_archive_block(archive_fd,
+                                                     indexes.tostring())
+                columns.append({"name": tag_key,
+                                "kind": "tag",
+                                "typecode": indexes.typecode,
+                                "dictionary": tag_dictionaries[tag_key],
+                                "offset": offset,
+                                "length": length})
+            for field_index, field in enumerate(self.ap_fields):
+                values = field_values[field_index]
+                column = self._ap_write_field(archive_fd, field, values)
+                columns.append(column)
+
+            footer = json.dumps({"version": ESMON_ARCHIVE_VERSION,
+                                 "retention_policy": self.ap_retention_policy,
+                                 "measurement": self.ap_measurement,
+                                 "day": time.strftime(ESMON_ARCHIVE_DAY_FORMAT,
+                                                      time.gmtime(self.ap_day)),
+                                 "rows": len(times),
+                                 "series": len(self.ap_series),
+                                 "min_time": min_time,
+                                 "max_time": max_time,
+                                 "byteorder": sys.byteorder,
+                                 "columns": columns})
+            archive_fd.write(footer)
+            archive_fd.write(ESMON_ARCHIVE_TRAILER.pack(len(footer)))
+            archive_fd.write(ESMON_ARCHIVE_MAGIC)
+            archive_fd.close()
+            os.rename(tmp_fpath, fpath)
+        except:
+            logging.error("failed to write archive file [%s]: %s", fpath,
+                          traceback.format_exc())
+            return -1
+        return 0
+
+    def _ap_write_field(self, archive_fd, field, values):
+        """
+        Write the block of a field, return the column of the footer
+        """
+        field_type = self.ap_field_types.get(field)
+        if field_type is None:
+            field_type = esmon_archive_field_type(values)
+        values = [esmon_archive_field_value(field_type, value)
+                  for value in values]
+        column = {"name": field,
+                  "kind": "field",
+                  "type": field_type}
+        if field_type not in ESMON_ARCHIVE_NUMERIC_TYPES:
+            offset, length = esmon_archive_block(archive_fd,
+                                                 json.dumps(values))
+            column["offset"] = offset
+            column["length"] = length
+            return column
+
+        nulls = array.array("I", [index for index, value in enumerate(values)
+                                  if value is None])
+        numbers = array.array(ESMON_ARCHIVE_TYPECODES[field_type],
+                              [0 if value is None else value
+                               for value in values])
+        offset, length = esmon_archive_block(archive_fd, numbers.tostring())
+        column["typecode"] = numbers.typecode
+        column["offset"] = offset
+        column["length"] = length
+        if len(nulls) > 0:
+            offset, length = esmon_archive_block(archive_fd, nulls.tostring())
+            column["null_offset"] = offset
+            column["null_length"] = length
+        return column
+
+
+class ArchiveFile(object):
+    """
+    A columnar file of the points of a measurement in a day
+    """
+    def __init__(self, fpath):
+        self.af_fpath = fpath
+        self.af_fd = None
+        self.af_footer = None
+        # Key is column name, value is the column in the footer
+        self.af_columns = {}
+
+    def af_open(self):
+        """
+        Open the file and read the footer, return 0 on success
+        """
+        # pylint: disable=bare-except
+        magic_length = len(ESMON_ARCHIVE_MAGIC)
+        trailer_length = ESMON_ARCHIVE_TRAILER.size + magic_length
+        try:
+            self.af_fd = open(self.af_fpath, "rb")
+            self.af_fd.seek(0, os.SEEK_END)
+            size = self.af_fd.tell()
+            self.af_fd.seek(0)
+            if (size < magic_length + trailer_length or
+                    self.af_fd.read(magic_length) != ESMON_ARCHIVE_MAGIC):
+                logging.error("file [%s] is not an archive file",
+                              self.af_fpath)
+                return -1
+            self.af_fd.seek(size - trailer_length)
+            trailer = self.af_fd.read(trailer_length)
+            if trailer[-magic_length:] != ESMON_ARCHIVE_MAGIC:
+                logging.error("archive file [%s] is truncated", self.af_fpath)
+                return -1
+            footer_length = ESMON_ARCHIVE_TRAILER.unpack(
+                trailer[:ESMON_ARCHIVE_TRAILER.size])[0]
+            self.af_fd.seek(size - trailer_length - footer_length)
+            self.af_footer = json.loads(self.af_fd.read(footer_length))
+        except:
+            logging.error("failed to read the footer of archive file [%s]: %s",
+                          self.af_fpath, traceback.format_exc())
+            return -1
+
+        if self.af_footer.get("version") != ESMON_ARCHIVE_VERSION:
+            logging.error("unsupported version [%s] of archive file [%s]",
+                          self.af_footer.get("version"), self.af_fpath)
+            return -1
+        for column in self.af_footer["columns"]:
+            self.af_columns[column["name"]] = column
+        return 0
+
+    def af_close(self):
+        """
+        Close the file
+        """
+        if self.af_fd is not None:
+            self.af_fd.close()
+            self.af_fd = None
+
+    def _af_block(self, offset, length):
+        """
+        Return the decompressed data of a block
+        """
+        self.af_fd.seek(offset)
+        return zlib.decompress(self.af_fd.read(length))
+
+    def _af_array(self, typecode, offset, length):
+        """
+        Return the array saved in a block
+        """
+        values = array.array(typecode)
+        values.fromstring(self._af_block(offset, length))
+        if self.af_footer["byteorder"] != sys.byteorder:
+            values.byteswap()
+        return values
+
+    def af_times(self):
+        """
+        Return the times of the rows in nanoseconds
+        """
+        column = self.af_columns["time"]
+        times = self._af_array(column["typecode"], column["offset"],
+                               column["length"])
+        current = 0
+        for index, delta in enumerate(times):
+            current += delta
+            times[index] = current
+        return times
+
+    def af_tag(self, tag_key):
+        """
+        Return the dictionary of the tag and the indexes of the rows in it,
+        the dictionary only has "" if the measurement has no such tag
+        """
+        column = self.af_columns.get(tag_key)
+        if column is None or column["kind"] != "tag":
+            return [""], array.array("H", [0] * self.af_footer["rows"])
+        return column["dictionary"], self._af_array(column["typecode"],
+                                                    column["offset"],
+                                                    column["length"])
+
+    def af_tag_keys(self):
+        """
+        Return the tag keys of the measurement
+        """
+        return [column["name"] for column in self.af_footer["columns"]
+                if column["kind"] == "tag"]
+
+    def af_field_types(self):
+        """
+        Return the names and types of the fields
+        """
+        return [(column["name"], column["type"])
+                for column in self.af_footer["columns"]
+                if column["kind"] == "field"]
+
+    def af_field(self, field):
+        """
+        Return the values of the field of the rows, None for null, or None if
+        the measurement has no such field
+        """
+        column = self.af_columns.get(field)
+        if column is None or column["kind"] != "field":
+            return None
+        if column["type"] not in ESMON_ARCHIVE_NUMERIC_TYPES:
+            return json.loads(self._af_block(column["offset"],
+                                             column["length"]))
+        values = self._af_array(column["typecode"], column["offset"],
+                                column["length"]).tolist()
+        if "null_offset" in column:
+            nulls = self._af_array("I", column["null_offset"],
+                                   column["null_length"])
+            for index in nulls:
+                values[index] = None
+        return values
+
+
+def esmon_archive_export_partition(client, partition):
+    """
+    Stream the points of the partition out of Influxdb, return 0 on success
+    """
+    # pylint: disable=bare-except
+    query = ("SELECT * FROM %s.%s WHERE time >= %d AND time < %d GROUP BY *" %
+             (esmon_archive_quote(partition.ap_retention_policy),
+              esmon_archive_quote(partition.ap_measurement),
+              partition.ap_day * NANOSECONDS_PER_SECOND,
+              (partition.ap_day + SECONDS_PER_DAY) * NANOSECONDS_PER_SECOND))
+    response = client.ic_query(query, epoch="ns",
+                               chunk_size=ESMON_ARCHIVE_CHUNK_SIZE)
+    if response is None:
+        logging.error("failed to query Influxdb with query [%s]", query)
+        return -1
+
+    if response.status_code != httplib.OK:
+        logging.error("got InfluxDB status [%d] with query [%s]",
+                      response.status_code, query)
+        response.close()
+        return -1
+
+    ret = 0
+    try:
+        for line in response.iter_lines():
+            if not line:
+                continue
+            data = json.loads(line)
+            if "error" in data:
+                logging.error("got InfluxDB error [%s] with query [%s]",
+                              data["error"], query)
+                ret = -1
+                break
+            for result in data.get("results", []):
+                if "error" in result:
+                    logging.error("got InfluxDB error [%s] with query [%s]",
+                                  result["error"], query)
+                    ret = -1
+                    break
+                for serie in result.get("series", []):
+                    partition.ap_add(serie)
+            if ret:
+                break
+    except:
+        logging.error("failed to read the result of query [%s]: %s", query,
+                      traceback.format_exc())
+        ret = -1
+    response.close()
+    return ret
+
+
+def esmon_archive_field_types(client, retention_policy, measurement):
+    """
+    Return the types of the fields of the measurement, None on failure
+    """
+    query = ("SHOW FIELD KEYS FROM %s.%s" %
+             (esmon_archive_quote(retention_policy),
+              esmon_archive_quote(measurement)))
+    result = esmon_storage.esmon_storage_query(client, query)
+    if result is None:
+        return None
+
+    field_types = {}
+    for serie in result.get("series", []):
+        for field, field_type in serie.get("values", []):
+            # A field might have different types in different shards
+            if field not in field_types:
+                field_types[field] = field_type
+    return field_types
+
+
+def esmon_archive_export_day(client, archive_dir, retention_policy,
+                             measurement_types, day):
+    """
+    Archive all measurements in the day, return 0 on success
+    """
+    # pylint: disable=too-many-locals
+    marker = esmon_archive_day_marker(archive_dir, retention_policy, day)
+    if os.path.exists(marker):
+        return 0
+
+    day_string = time.strftime(ESMON_ARCHIVE_DAY_FORMAT, time.gmtime(day))
+    measurement_rows = {}
+    for measurement in sorted(measurement_types.keys()):
+        directory = esmon_archive_measurement_dir(archive_dir,
+                                                  retention_policy,
+                                                  measurement)
+        fpath = os.path.join(directory, day_string + ESMON_ARCHIVE_SUFFIX)
+        if os.path.exists(fpath):
+            # Archived by an interrupted export
+            archive_file = ArchiveFile(fpath)
+            ret = archive_file.af_open()
+            archive_file.af_close()
+            if ret == 0:
+                measurement_rows[measurement] = archive_file.af_footer["rows"]
+                continue
+            logging.warning("archiving measurement [%s] of day [%s] again",
+                            measurement, day_string)
+
+        if measurement_types[measurement] is None:
+            field_types = esmon_archive_field_types(client, retention_policy,
+                                                    measurement)
+            if field_types is None:
+                logging.error("failed to get the field types of measurement "
+                              "[%s]", measurement)
+                return -1
+            measurement_types[measurement] = field_types
+
+        partition = ArchivePartition(retention_policy, measurement, day,
+                                     measurement_types[measurement])
+        ret = esmon_archive_export_partition(client, partition)
+        if ret:
+            logging.error("failed to export measurement [%s] of day [%s]",
+                          measurement, day_string)
+            return -1
+        measurement_rows[measurement] = partition.ap_rows
+        if partition.ap_rows == 0:
+            continue
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        ret = partition.ap_write(fpath)
+        if ret:
+            return -1
+        logging.info("archived [%d] points of measurement [%s] of day [%s]",
+                     partition.ap_rows, measurement, day_string)
+
+    marker_dir = os.path.dirname(marker)
+    if not os.path.isdir(marker_dir):
+        os.makedirs(marker_dir)
+    with open(marker + ".tmp", "w") as marker_fd:
+        json.dump({"day": day_string,
+                   "measurements": measurement_rows}, marker_fd,
+                  indent=4, separators=(',', ': '))
+    os.rename(marker + ".tmp", marker)
+    return 0
+
+
+def esmon_archive_export(client, archive_dir, drop):
+    """
+    Archive the days covered by the completed shards, return 0 on success
+    """
+    # pylint: disable=too-many-locals,too-many-branches
+    shards = esmon_storage.esmon_storage_shards(client)
+    if shards is None:
+        logging.error("failed to get the shards")
+        return -1
+
+    result = esmon_storage.esmon_storage_query(client, "SHOW MEASUREMENTS")
+    if result is None:
+        logging.error("failed to get the measurements")
+        return -1
+    measurements = []
+    for serie in result.get("series", []):
+        measurements += [value[0] for value in serie.get("values", [])]
+
+    now = time.time()
+    rp_shards = {}
+    for shard in shards:
+        rp_shards.setdefault(shard.ss_retention_policy, []).append(shard)
+
+    days = []
+    for retention_policy, rp_shard_list in sorted(rp_shards.items()):
+        completed = []
+        boundary = None
+        for shard in rp_shard_list:
+            start = esmon_archive_time_parse(shard.ss_start_time)
+            end = esmon_archive_time_parse(shard.ss_end_time)
+            if start is None or end is None:
+                logging.error("invalid time range [%s, %s] of shard [%s]",
+                              shard.ss_start_time, shard.ss_end_time,
+                              shard.ss_id)
+                return -1
+            if end <= now:
+                completed.append((shard, start, end))
+            elif boundary is None or start < boundary:
+                boundary = start
+        if len(completed) == 0:
+            continue
+        if boundary is None:
+            boundary = max(end for _, _, end in completed)
+
+        # The field types are queried when the measurement is first exported
+        measurement_types = dict((measurement, None)
+                                 for measurement in measurements)
+        day = (min(start for _, start, _ in completed) /
+               SECONDS_PER_DAY * SECONDS_PER_DAY)
+        while day + SECONDS_PER_DAY <= boundary:
+            ret = esmon_archive_export_day(client, archive_dir,
+                                           retention_policy,
+                                           measurement_types, day)
+            if ret:
+                logging.error("failed to archive day [%s] of retention "
+                              "policy [%s]",
+                              time.strftime(ESMON_ARCHIVE_DAY_FORMAT,
+                                            time.gmtime(day)),
+                              retention_policy)
+                return -1
+            days.append(day)
+            day += SECONDS_PER_DAY
+
+        if not drop:
+            continue
+        for shard, start, end in completed:
+            day = start / SECONDS_PER_DAY * SECONDS_PER_DAY
+            archived = True
+            while day < end:
+                if not os.path.exists(esmon_archive_day_marker(archive_dir,
+                                                               retention_policy,
+                                                               day)):
+                    archived = False
+                    break
+                day += SECONDS_PER_DAY
+            if not archived:
+                logging.warning("shard [%s] of retention policy [%s] is not "
+                                "fully archived, not dropping it",
+                                shard.ss_id, retention_policy)
+                continue
+            result = esmon_storage.esmon_storage_query(client,
+                                                       "DROP SHARD %s" %
+                                                       shard.ss_id)
+            if result is None:
+                logging.error("failed to drop shard [%s]", shard.ss_id)
+                return -1
+            logging.info("dropped archived shard [%s] of retention policy "
+                         "[%s]", shard.ss_id, retention_policy)
+
+    logging.info("archived [%d] days into directory [%s]", len(days),
+                 archive_dir)
+    return 0
+
+
+class ArchiveAggregate(object):
+    """
+    The aggregation of the values of a group in a time interval
+    """
+    # pylint: disable=too-few-public-methods
+    def __init__(self):
+        self.aa_count = 0
+        self.aa_sum = 0
+        self.aa_min = None
+        self.aa_max = None
+        self.aa_last_time = None
+        self.aa_last = None
+
+    def aa_add(self, timestamp, value, numeric):
+        """
+        Add a value
+        """
+        self.aa_count += 1
+        if self.aa_last_time is None or timestamp >= self.aa_last_time:
+            self.aa_last_time = timestamp
+            self.aa_last = value
+        if not numeric:
+            return
+        self.aa_sum += value
+        if self.aa_min is None or value < self.aa_min:
+            self.aa_min = value
+        if self.aa_max is None or value > self.aa_max:
+            self.aa_max = value
+
+    def aa_value(self, function):
+        """
+        Return the value of the aggregation function
+        """
+        # pylint: disable=too-many-return-statements
+        if function == "count":
+            return self.aa_count
+        if function == "sum":
+            return self.aa_sum
+        if function == "mean":
+            return float(self.aa_sum) / self.aa_count
+        if function == "min":
+            return self.aa_min
+        if function == "max":
+            return self.aa_max
+        return self.aa_last
+
+
+def esmon_archive_scan(fpath, field, start, end, wheres, group_bys, function,
+                       interval, aggregates):
+    """
+    Add the values of the field in the file to the aggregates, return 1 if
+    skipped by the footer, 0 if scanned, -1 on failure
+    """
+    # pylint: disable=too-many-arguments,too-many-locals,too-many-branches
+    # pylint: disable=too-many-return-statements
+    archive_file = ArchiveFile(fpath)
+    ret = archive_file.af_open()
+    if ret:
+        archive_file.af_close()
+        return -1
+
+    footer = archive_file.af_footer
+    if ((start is not None and footer["max_time"] < start) or
+            (end is not None and footer["min_time"] >= end) or
+            field not in archive_file.af_columns):
+        archive_file.af_close()
+        return 1
+
+    field_type = archive_file.af_columns[field].get("type")
+    numeric = field_type in ESMON_ARCHIVE_NUMERIC_TYPES
+    if not numeric and function not in ["count", "last"]:
+        logging.error("function [%s] is not supported by field [%s] with "
+                      "type [%s]", function, field, field_type)
+        archive_file.af_close()
+        return -1
+    # The dictionary indexes of the allowed values of each tag
+    tag_filters = []
+    for tag_key, tag_values in wheres.iteritems():
+        column = archive_file.af_columns.get(tag_key)
+        if column is None or column["kind"] != "tag":
+            dictionary = [""]
+        else:
+            dictionary = column["dictionary"]
+        allowed = set(index for index, value in enumerate(dictionary)
+                      if value in tag_values)
+        if len(allowed) == 0:
+            archive_file.af_close()
+            return 1
+        if len(allowed) < len(dictionary):
+            tag_filters.append((allowed, archive_file.af_tag(tag_key)[1]))
+
+    group_tags = [archive_file.af_tag(tag_key) for tag_key in group_bys]
+    times = archive_file.af_times()
+    values = archive_file.af_field(field)
+    archive_file.af_close()
+
+    for row, timestamp in enumerate(times):
+        if start is not None and timestamp < start:
+            continue
+        if end is not None and timestamp >= end:
+            continue
+        value = values[row]
+        if value is None:
+            continue
+        matched = True
+        for allowed, indexes in tag_filters:
+            if indexes[row] not in allowed:
+                matched = False
+                break
+        if not matched:
+            continue
+        if interval is None:
+            bucket = None
+        else:
+            bucket = timestamp - timestamp % interval
+        key = (tuple(dictionary[indexes[row]]
+                     for dictionary, indexes in group_tags), bucket)
+        aggregate = aggregates.get(key)
+        if aggregate is None:
+            aggregate = ArchiveAggregate()
+            aggregates[key] = aggregate
+        aggregate.aa_add(timestamp, value, numeric)
+    return 0
+
+
+def esmon_archive_table(rows, columns):
+    """
+    Return the rows formatted as a table
+    """
+    lines = [[column.upper() for column in columns]]
+    for row in rows:
+        line = []
+        for column in columns:
+            value = row[column]
+            if value is None:
+                value = "-"
+            elif isinstance(value, float):
+                value = "%.2f" % value
+            line.append(unicode(value))
+        lines.append(line)
+
+    widths = [max(len(line[i]) for line in lines)
+              for i in range(len(columns))]
+    return "\n".join("  ".join(value.ljust(widths[i])
+                               for i, value in enumerate(line)).rstrip()
+                     for line in lines)
+
+
+def esmon_archive_query(archive_dir, retention_policy, measurement, field,
+                        start, end, wheres, group_bys, function, interval,
+                        json_output):
+    """
+    Query the archive files of a measurement, return 0 on success
+    """
+    # pylint: disable=too-many-arguments,too-many-locals
+    directory = esmon_archive_measurement_dir(archive_dir, retention_policy,
+                                              measurement)
+    if not os.path.isdir(directory):
+        logging.error("no archive of measurement [%s] in directory [%s]",
+                      measurement, archive_dir)
+        return -1
+
+    aggregates = {}
+    scanned = 0
+    skipped = 0
+    for fname in sorted(os.listdir(directory)):
+        if not fname.endswith(ESMON_ARCHIVE_SUFFIX):
+            continue
+        day = esmon_archive_time_parse(fname[:-len(ESMON_ARCHIVE_SUFFIX)])
+        if day is None:
+            continue
+        day *= NANOSECONDS_PER_SECOND
+        if ((start is not None and
+             day + SECONDS_PER_DAY * NANOSECONDS_PER_SECOND <= start) or
+                (end is not None and day >= end)):
+            skipped += 1
+            continue
+        ret = esmon_archive_scan(os.path.join(directory, fname), field, start,
+                                 end, wheres, group_bys, function, interval,
+                                 aggregates)
+        if ret < 0:
+            return -1
+        elif ret:
+            skipped += 1
+        else:
+            scanned += 1
+    logging.info("scanned [%d] files, skipped [%d] files", scanned, skipped)
+
+    columns = []
+    if interval is not None:
+        columns.append("time")
+    columns += group_bys
+    columns.append(function)
+    rows = []
+    for key in sorted(aggregates.keys()):
+        tag_values, bucket = key
+        row = dict(zip(group_bys, tag_values))
+        if bucket is not None:
+            row["time"] = time.strftime(ESMON_ARCHIVE_TIME_FORMAT,
+                                        time.gmtime(bucket /
+                                                    NANOSECONDS_PER_SECOND))
+        row[function] = aggregates[key].aa_value(function)
+        rows.append(row)
+
+    if json_output:
+        print(json.dumps(rows, indent=4, separators=(',', ': ')))
+    else:
+        print(esmon_archive_table(rows, columns))
+    return 0
+
+
+def esmon_import_sort(lines):
+    """
+    Return the lines of line protocol sorted by series and time
+    """
+    keyed = []
+    for line in lines:
+        sections = esmon_rollup.rollup_split(line, " ")
+        key = sections[0]
+        sections = esmon_rollup.rollup_split(" ".join(sections[1:]), " ",
+                                             quoted_strings=True)
+        timestamp = 0
+        if len(sections) == 2:
+            try:
+                timestamp = int(sections[1])
+            except ValueError:
+                logging.warning("ignoring line [%s] with invalid timestamp",
+                                line)
+                continue
+        elif len(sections) != 1:
+            logging.warning("ignoring invalid line [%s]", line)
+            continue
+        keyed.append((key, timestamp, line))
+    keyed.sort(key=operator.itemgetter(0, 1))
+    return [line for _, _, line in keyed]
+
+
+def esmon_import_field_format(field_type):
+    """
+    Return the function that formats the field value in line protocol
+    """
+    if field_type == "float":
+        return repr
+    if field_type == "integer":
+        return lambda value: "%di" % value
+    if field_type == "boolean":
+        return lambda value: "true" if value else "false"
+    return lambda value: esmon_rollup.rollup_string(value).encode("utf-8")
+
+
+def esmon_import_archive_lines(archive_file):
+    """
+    Return the points of the archive file in line protocol
+    """
+    # The lines are formatted column by column, which is much faster than
+    # formatting each row separately
+    measurement = esmon_rollup.rollup_escape(archive_file.af_footer["measurement"],
+                                             tag=False).encode("utf-8")
+    keys = [measurement] * archive_file.af_footer["rows"]
+    for tag_key in archive_file.af_tag_keys():
+        dictionary, indexes = archive_file.af_tag(tag_key)
+        escaped_key = esmon_rollup.rollup_escape(tag_key)
+        # Empty value means the series doesn't have the tag
+        pairs = ["" if value == "" else
+                 (",%s=%s" % (escaped_key,
+                              esmon_rollup.rollup_escape(value))).encode("utf-8")
+                 for value in dictionary]
+        keys = map(operator.add, keys, [pairs[index] for index in indexes])
+
+    columns = []
+    for field, field_type in archive_file.af_field_types():
+        name = (esmon_rollup.rollup_escape(field) + "=").encode("utf-8")
+        field_format = esmon_import_field_format(field_type)
+        columns.append([None if value is None else name + field_format(value)
+                        for value in archive_file.af_field(field)])
+    if len(columns) == 1:
+        fields = columns[0]
+    else:
+        fields = [",".join(value for value in row if value is not None)
+                  for row in zip(*columns)]
+
+    return ["%s %s %d" % (key, values, timestamp)
+            for key, values, timestamp in zip(keys, fields,
+                                              archive_file.af_times())
+            if values]
+
+
+class ImportBlock(object):
+    """
+    A block of the points of an input file, sorted by series and time. A
+    block is recorded in the checkpoint when all of its batches are written.
+    """
+    # pylint: disable=too-few-public-methods
+    def __init__(self, fname, index):
+        self.ib_fname = fname
+        self.ib_index = index
+        # The number of the batches that are queued but not written yet
+        self.ib_pending = 0
+        # Whether all batches of the block have been queued
+        self.ib_queued = False
+
+
+class ArchiveImport(object):
+    """
+    Import the points into Influxdb by concurrent writers
+    """
+    # pylint: disable=too-many-instance-attributes
+    def __init__(self, hostname, database, checkpoint_fpath, writers):
+        self.ai_hostname = hostname
+        self.ai_database = database
+        self.ai_checkpoint_fpath = checkpoint_fpath
+        self.ai_writers = writers
+        self.ai_lock = threading.Lock()
+        # Batches of (block, lines, precision, retention_policy), None to stop
+        self.ai_queue = Queue.Queue(maxsize=writers * 2)
+        self.ai_batch_size = ESMON_IMPORT_BATCH_SIZE
+        # Key is file name, value is dict of the number of the leading blocks
+        # that have been written, and whether all blocks have been written
+        self.ai_checkpoint = {}
+        # Key is file name, value is the indexes of the written blocks that
+        # are not in the checkpoint yet because earlier blocks are pending
+        self.ai_written_blocks = {}
+        # Key is file name, value is the number of blocks of the file
+        self.ai_file_blocks = {}
+        self.ai_points = 0
+        self.ai_failed = False
+        self.ai_start_time = time.time()
+        self.ai_checkpoint_time = self.ai_start_time
+
+    def ai_checkpoint_load(self):
+        """
+        Load the checkpoint of the interrupted import, return 0 on success
+        """
+        # pylint: disable=bare-except
+        if not os.path.exists(self.ai_checkpoint_fpath):
+            return 0
+        try:
+            with open(self.ai_checkpoint_fpath) as checkpoint_fd:
+                self.ai_checkpoint = json.load(checkpoint_fd)
+        except:
+            logging.error("failed to load checkpoint [%s]: %s",
+                          self.ai_checkpoint_fpath, traceback.format_exc())
+            return -1
+        logging.info("resuming the import from checkpoint [%s]",
+                     self.ai_checkpoint_fpath)
+        return 0
+
+    def _ai_checkpoint_save(self):
+        """
+        Save the checkpoint, the lock should be held
+        """
+        tmp_fpath = self.ai_checkpoint_fpath + ".tmp"
+        with open(tmp_fpath, "w") as checkpoint_fd:
+            json.dump(self.ai_checkpoint, checkpoint_fd, indent=4,
+                      separators=(',', ': '))
+        os.rename(tmp_fpath, self.ai_checkpoint_fpath)
+        self.ai_checkpoint_time = time.time()
+
+    def _ai_block_written(self, block):
+        """
+        Advance the checkpoint of the file, the lock should be held
+        """
+        state = self.ai_checkpoint.setdefault(block.ib_fname,
+                                              {"blocks": 0,
+                                               "finished": False})
+        written_blocks = self.ai_written_blocks.setdefault(block.ib_fname,
+                                                           set())
+        written_blocks.add(block.ib_index)
+        while state["blocks"] in written_blocks:
+            written_blocks.remove(state["blocks"])
+            state["blocks"] += 1
+        self._ai_file_check(block.ib_fname)
+
+    def _ai_file_check(self, fname):
+        """
+        Mark the file as finished if all blocks are written, the lock should
+        be held
+        """
+        state = self.ai_checkpoint.setdefault(fname, {"blocks": 0,
+                                                      "finished": False})
+        if (fname in self.ai_file_blocks and
+                state["blocks"] >= self.ai_file_blocks[fname]):
+            state["finished"] = True
+
+    def ai_batch_written(self, block, points, latency, ret):
+        """
+        Called by the writers after writing a batch
+        """
+        # pylint: disable=too-many-arguments
+        with self.ai_lock:
+            if ret:
+                self.ai_failed = True
+                return
+            self.ai_points += points
+            # Move the batch size half way to the size that would be written
+            # in the target latency, so that the server is neither idle
+            # between small batches nor timing out on huge ones
+            target = points * ESMON_IMPORT_LATENCY / max(latency, 0.001)
+            batch_size = (self.ai_batch_size + target) / 2
+            self.ai_batch_size = int(min(ESMON_IMPORT_MAX_BATCH_SIZE,
+                                         max(ESMON_IMPORT_MIN_BATCH_SIZE,
+                                             batch_size)))
+            block.ib_pending -= 1
+            if block.ib_queued and block.ib_pending == 0:
+                self._ai_block_written(block)
+
+            now = time.time()
+            if now - self.ai_checkpoint_time >= ESMON_IMPORT_CHECKPOINT_INTERVAL:
+                self._ai_checkpoint_save()
+                logging.info("imported [%d] points, [%d] points per second, "
+                             "batch size [%d]", self.ai_points,
+                             self.ai_points / max(now - self.ai_start_time,
+                                                  0.001),
+                             self.ai_batch_size)
+
+    def _ai_block(self, block, lines, precision, retention_policy):
+        """
+        Queue the lines of the block in batches, return 0 on success
+        """
+        if self.ai_failed:
+            return -1
+        batch = []
+        with self.ai_lock:
+            batch_size = self.ai_batch_size
+        for line in lines:
+            batch.append(line)
+            if len(batch) < batch_size:
+                continue
+            if self.ai_failed:
+                return -1
+            with self.ai_lock:
+                block.ib_pending += 1
+                batch_size = self.ai_batch_size
+            self.ai_queue.put((block, batch, precision, retention_policy))
+            batch = []
+        if len(batch) > 0:
+            with self.ai_lock:
+                block.ib_pending += 1
+            self.ai_queue.put((block, batch, precision, retention_policy))
+        with self.ai_lock:
+            block.ib_queued = True
+            if block.ib_pending == 0:
+                self._ai_block_written(block)
+        return 0
+
+    def _ai_file_blocks(self, fname, blocks):
+        """
+        Set the number of blocks of the file after all of them are queued
+        """
+        with self.ai_lock:
+            self.ai_file_blocks[fname] = blocks
+            self._ai_file_check(fname)
+
+    def _ai_archive_file(self, fname, fpath):
+        """
+        Import an archive file as a single block, return 0 on success
+        """
+        archive_file = ArchiveFile(fpath)
+        ret = archive_file.af_open()
+        if ret:
+            archive_file.af_close()
+            return -1
+        lines = esmon_import_archive_lines(archive_file)
+        archive_file.af_close()
+        ret = self._ai_block(ImportBlock(fname, 0), lines, "n",
+                             archive_file.af_footer["retention_policy"])
+        if ret:
+            return -1
+        self._ai_file_blocks(fname, 1)
+        return 0
+
+    def _ai_line_file(self, fname, fpath, precision, written_blocks):
+        """
+        Import a line protocol file, every ESMON_IMPORT_SORT_LINES lines are
+        sorted as a block, return 0 on success
+        """
+        if fpath.endswith(".gz"):
+            line_fd = gzip.open(fpath)
+        else:
+            line_fd = open(fpath)
+        index = 0
+        lines = []
+        ret = 0
+        for line in line_fd:
+            line = line.strip()
+            if line == "" or line.startswith("#"):
+                continue
+            lines.append(line)
+            if len(lines) < ESMON_IMPORT_SORT_LINES:
+                continue
+            if index >= written_blocks:
+                ret = self._ai_block(ImportBlock(fname, index),
+                                     esmon_import_sort(lines), precision, None)
+                if ret:
+                    break
+            index += 1
+            lines = []
+        if ret == 0 and len(lines) > 0:
+            if index >= written_blocks:
+                ret = self._ai_block(ImportBlock(fname, index),
+                                     esmon_import_sort(lines), precision, None)
+            index += 1
+        line_fd.close()
+        if ret:
+            return -1
+        self._ai_file_blocks(fname, index)
+        return 0
+
+    def ai_import(self, inputs, precision):
+        """
+        Import the files, return 0 on success
+        """
+        threads = []
+        for _ in range(self.ai_writers):
+            threads.append(utils.thread_start(esmon_import_writer_thread,
+                                              (self,)))
+
+        ret = 0
+        for fname, fpath in inputs:
+            state = self.ai_checkpoint.get(fname, {"blocks": 0,
+                                                   "finished": False})
+            if state["finished"]:
+                continue
+            logging.info("importing file [%s]", fpath)
+            if fpath.endswith(ESMON_ARCHIVE_SUFFIX):
+                ret = self._ai_archive_file(fname, fpath)
+            else:
+                ret = self._ai_line_file(fname, fpath, precision,
+                                         state["blocks"])
+            if ret or self.ai_failed:
+                logging.error("failed to import file [%s]", fpath)
+                ret = -1
+                break
+
+        for _ in threads:
+            self.ai_queue.put(None)
+        for thread in threads:
+            thread.join()
+        with self.ai_lock:
+            self._ai_checkpoint_save()
+        if ret or self.ai_failed:
+            return -1
+        elapsed = max(time.time() - self.ai_start_time, 0.001)
+        logging.info("imported [%d] points in [%d] seconds, [%d] points per "
+                     "second", self.ai_points, elapsed,
+                     self.ai_points / elapsed)
+        return 0
+
+
+def esmon_import_writer_thread(archive_import):
+    """
+    Write the batches in the queue until stopped
+    """
+    client = esmon_influxdb.InfluxdbClient(archive_import.ai_hostname,
+                                           archive_import.ai_database)
+    while True:
+        item = archive_import.ai_queue.get()
+        if item is None:
+            return
+        block, lines, precision, retention_policy = item
+        if archive_import.ai_failed:
+            # Drain the queue so that the producer is not blocked
+            continue
+        for retry in range(ESMON_IMPORT_RETRIES + 1):
+            if retry > 0:
+                time.sleep(2 ** retry)
+            start_time = time.time()
+            ret = client.ic_write(lines, precision=precision,
+                                  retention_policy=retention_policy)
+            if ret == 0:
+                break
+        archive_import.ai_batch_written(block, len(lines),
+                                        time.time() - start_time, ret)
+
+
+def esmon_import_inputs(path):
+    """
+    Return the (name, path) of the files to import, the name is the relative
+    path used in the checkpoint
+    """
+    if not os.path.isdir(path):
+        return [(os.path.basename(path), path)]
+    inputs = []
+    for dirpath, dirnames, fnames in os.walk(path):
+        dirnames.sort()
+        for fname in sorted(fnames):
+            if (not fname.endswith(ESMON_ARCHIVE_SUFFIX) and
+                    not any(fname.endswith(suffix)
+                            for suffix in ESMON_IMPORT_LINE_SUFFIXES)):
+                continue
+            fpath = os.path.join(dirpath, fname)
+            inputs.append((os.path.relpath(fpath, path), fpath))
+    return inputs
+
+
+def esmon_archive_import(client, path, database, precision, writers):
+    """
+    Import the archive files or line protocol files, return 0 on success
+    """
+    # pylint: disable=too-many-arguments
+    if not os.path.exists(path):
+        logging.error("path [%s] doesn't exist", path)
+        return -1
+    if os.path.isdir(path):
+        checkpoint_fpath = os.path.join(path, ESMON_IMPORT_CHECKPOINT)
+    else:
+        checkpoint_fpath = path + "." + ESMON_IMPORT_CHECKPOINT
+
+    if database is None:
+        database = client.ic_database
+    archive_import = ArchiveImport(client.ic_hostname, database,
+                                   checkpoint_fpath, writers)
+    ret = archive_import.ai_checkpoint_load()
+    if ret:
+        return -1
+    inputs = esmon_import_inputs(path)
+    if len(inputs) == 0:
+        logging.error("no file to import under [%s]", path)
+        return -1
+    return archive_import.ai_import(inputs, precision)
+
+
+def esmon_archive_client(config_fpath):
+    """
+    Return the Influxdb client of the ESMON server, None on failure
+    """
+    # pylint: disable=bare-except
+    config_fd = open(config_fpath)
+    ret = 0
+    try:
+        config = yaml.load(config_fd)
+    except:
+        logging.error("not able to load [%s] as yaml file: %s", config_fpath,
+                      traceback.format_exc())
+        ret = -1
+    config_fd.close()
+    if ret:
+        return None
+
+    ret, server_host, _ = esmon_storage.esmon_storage_parse_config(config,
+                                                                   config_fpath)
+    if ret:
+        logging.error("failed to parse config [%s]", config_fpath)
+        return None
+
+    return esmon_influxdb.InfluxdbClient(server_host.sh_hostname,
+                                         esmon_install_nodeps.INFLUXDB_DATABASE_NAME)
+
+
+def usage():
+    """
+    Print usage string
+    """
+    utils.eprint("Usage: %s export [--drop] <archive_dir> [config_file]\n"
+                 "       %s import [--writers <number>] [--database <database>] "
+                 "[--precision <precision>]\n"
+                 "           <path> [config_file]\n"
+                 "       %s query [--json] [--rp <retention_policy>] "
+                 "[--start <time>] [--end <time>]\n"
+                 "           [--where <tag>=<value>]... [--group-by <tag>]... "
+                 "[--function <function>]\n"
+                 "           [--interval <duration>] <archive_dir> "
+                 "<measurement> <field>\n"
+                 "    --drop: drop the shards that are fully archived\n"
+                 "    --writers: the number of concurrent writers, default %d\n"
+                 "    --database: the database to import into, default %s\n"
+                 "    --precision: the precision of the timestamps of the line "
+                 "protocol files, one of %s, default n\n"
+                 "    --rp: the retention policy, default %s\n"
+                 "    --start, --end: YYYY-MM-DD or YYYY-MM-DDTHH:MM:SSZ, "
+                 "the end is excluded\n"
+                 "    --function: one of %s, default %s\n"
+                 "    --interval: InfluxQL duration of the time buckets, "
+                 "e.g. 1d" %
+                 (sys.argv[0], sys.argv[0], sys.argv[0], ESMON_IMPORT_WRITERS,
+                  esmon_install_nodeps.INFLUXDB_DATABASE_NAME,
+                  "/".join(ESMON_IMPORT_PRECISIONS),
+                  ESMON_ARCHIVE_RETENTION_POLICY,
+                  "/".join(ESMON_ARCHIVE_FUNCTIONS), ESMON_ARCHIVE_FUNCTION))
+
+
+def main():
+    """
+    Archive the completed shards of Influxdb, query or import the archive
+    """
+    # pylint: disable=too-many-branches,too-many-statements
+    reload(sys)
+    sys.setdefaultencoding("utf-8")
+    config_fpath = esmon_common.ESMON_INSTALL_CONFIG
+    json_output = False
+    drop = False
+    retention_policy = ESMON_ARCHIVE_RETENTION_POLICY
+    start = None
+    end = None
+    wheres = {}
+    group_bys = []
+    function = ESMON_ARCHIVE_FUNCTION
+    interval = None
+    writers = ESMON_IMPORT_WRITERS
+    database = None
+    precision = "n"
+
+    if len(sys.argv) < 2 or sys.argv[1] not in ["export", "query", "import"]:
+        usage()
+        sys.exit(-1)
+    command = sys.argv[1]
+    args = sys.argv[2:]
+    while len(args) > 0 and args[0].startswith("--"):
+        if command == "export" and args[0] == "--drop":
+            drop = True
+            args = args[1:]
+        elif command == "query" and args[0] == "--json":
+            json_output = True
+            args = args[1:]
+        elif len(args) < 2:
+            usage()
+            sys.exit(-1)
+        elif (command == "import" and args[0] == "--writers" and
+              args[1].isdigit() and int(args[1]) > 0):
+            writers = int(args[1])
+            args = args[2:]
+        elif command == "import" and args[0] == "--database":
+            database = args[1]
+            args = args[2:]
+        elif (command == "import" and args[0] == "--precision" and
+              args[1] in ESMON_IMPORT_PRECISIONS):
+            precision = args[1]
+            args = args[2:]
+        elif command != "query":
+            usage()
+            sys.exit(-1)
+        elif args[0] == "--rp":
+            retention_policy = args[1]
+            args = args[2:]
+        elif args[0] in ["--start", "--end"]:
+            seconds = esmon_archive_time_parse(args[1])
+            if seconds is None:
+                usage()
+                sys.exit(-1)
+            if args[0] == "--start":
+                start = seconds * NANOSECONDS_PER_SECOND
+            else:
+                end = seconds * NANOSECONDS_PER_SECOND
+            args = args[2:]
+        elif args[0] == "--where" and "=" in args[1]:
+            tag_key, tag_value = args[1].split("=", 1)
+            wheres.setdefault(tag_key, set()).add(tag_value)
+            args = args[2:]
+        elif args[0] == "--group-by":
+            group_bys.append(args[1])
+            args = args[2:]
+        elif args[0] == "--function" and args[1] in ESMON_ARCHIVE_FUNCTIONS:
+            function = args[1]
+            args = args[2:]
+        elif args[0] == "--interval":
+            seconds = esmon_influxdb.influxdb_duration_parse(args[1])
+            if not seconds:
+                usage()
+                sys.exit(-1)
+            interval = int(seconds * NANOSECONDS_PER_SECOND)
+            args = args[2:]
+        else:
+            usage()
+            sys.exit(-1)
+
+    if command in ["export", "import"]:
+        if len(args) == 2:
+            config_fpath = args[1]
+        elif len(args) != 1:
+            usage()
+            sys.exit(-1)
+    elif len(args) != 3:
+        usage()
+        sys.exit(-1)
+
+    utils.configure_logging()
+    console_handler = utils.LOGGING_HANLDERS["console"]
+    console_handler.setLevel(logging.WARNING)
+
+    if command == "query":
+        ret = esmon_archive_query(args[0], retention_policy, args[1], args[2],
+                                  start, end, wheres, group_bys, function,
+                                  interval, json_output)
+        if ret:
+            logging.error("failed to query the archive")
+            sys.exit(ret)
+        sys.exit(0)
+
+    client = esmon_archive_client(config_fpath)
+    if client is None:
+        sys.exit(-1)
+    if command == "import":
+        ret = esmon_archive_import(client, args[0], database, precision,
+                                   writers)
+        if ret:
+            logging.error("failed to import [%s]", args[0])
+            sys.exit(ret)
+        sys.exit(0)
+
+    ret = esmon_archive_export(client, args[0], drop)
+    if ret:
+        logging.error("failed to archive the completed shards")
+        sys.exit(ret)
+    sys.exit(0)
@@ -80,7 +80,7 @@ def download_dependent_rpms(host, dependent_dir, distro, target_cpu):
         command += " " + rpm_name
 
     # Install the RPM to get the fullname and checksum in db
-    retval = host.sh_run(command)
+    retval = host.sh_run(command, tail_size=ssh_host.COMMAND_OUTPUT_TAIL_SIZE)
     if retval.cr_exit_status:
         logging.error("failed to run command [%s] on host [%s], "
                       "ret = [%d], stdout = [%s], stderr = [%s]",
@@ -496,7 +496,8 @@ def host_build(workspace, build_host, local_host, collectd_git_path,
 
     # Update to the latest distro release
     command = "yum update -y"
-    retval = build_host.sh_run(command, timeout=1200)
+    retval = build_host.sh_run(command, timeout=1200,
+                               tail_size=ssh_host.COMMAND_OUTPUT_TAIL_SIZE)
     if retval.cr_exit_status:
         logging.error("failed to run command [%s] on host [%s], "
                       "ret = [%d], stdout = [%s], stderr = [%s]",
@@ -551,7 +552,8 @@ def host_build(workspace, build_host, local_host, collectd_git_path,
                "lua-devel byacc ganglia-devel libmicrohttpd-devel "
                "riemann-c-client-devel xfsprogs-devel uthash-devel "
                "qpid-proton-c-devel perl-ExtUtils-Embed -y")
-    retval = build_host.sh_run(command)
+    retval = build_host.sh_run(command,
+                               tail_size=ssh_host.COMMAND_OUTPUT_TAIL_SIZE)
     if retval.cr_exit_status:
         logging.error("failed to run command [%s] on host [%s], "
                       "ret = [%d], stdout = [%s], stderr = [%s]",
@@ -946,7 +948,8 @@ def influxdb_build(current_dir, local_host, config, iso_cached_dir,
     command = ("cd %s && tar czvf influxdb.tar.gz build influxdb.conf "
                "scripts/influxdb.service scripts/logrotate man/*.1" %
                (influxdb_git_path))
-    retval = local_host.sh_run(command)
+    retval = local_host.sh_run(command,
+                               tail_size=ssh_host.COMMAND_OUTPUT_TAIL_SIZE)
     if retval.cr_exit_status:
         logging.error("failed to run command [%s] on host [%s], "
                       "ret = [%d], stdout = [%s], stderr = [%s]",
@@ -0,0 +1,625 @@
+# Copyright (c) 2018 DataDirect Networks, Inc.
+# All Rights Reserved.
+# Author: lixi@ddn.com
+"""
+Library for planning the capacity of ES PERFMON server
+
+The numbers are estimations based on the items that ESMON enables in the
+collectd config of the agents and the continuous queries that ESMON creates
+on the ES PERFMON server.
+"""
+import logging
+
+from pyesmon import collectd
+from pyesmon import esmon_common
+from pyesmon import esmon_rollup
+from pyesmon import lustre
+
+# Average bytes of a point on the disk after the TSM compression of Influxdb
+ESMON_CAPACITY_BYTES_PER_POINT = 3
+# Number of file systems that the OSTs/MDTs belong to
+ESMON_CAPACITY_FS_NUMBER = 1
+
+# Role that is enabled whenever any Lustre metrics is collected
+ESMON_CAPACITY_ROLE_LUSTRE = "lustre"
+
+# The instance number of the item is the number of hosts
+ESMON_CAPACITY_SCOPE_HOST = "host"
+# The instance number of the item is the number of SFAs
+ESMON_CAPACITY_SCOPE_SFA = "sfa"
+# The instance number of the item is the number of OSTs
+ESMON_CAPACITY_SCOPE_OST = "ost"
+# The instance number of the item is the number of MDTs
+ESMON_CAPACITY_SCOPE_MDT = "mdt"
+# The instance number of the item is OST number * export number
+ESMON_CAPACITY_SCOPE_OST_EXPORT = "ost_export"
+# The instance number of the item is MDT number * export number
+ESMON_CAPACITY_SCOPE_MDT_EXPORT = "mdt_export"
+# The instance number of the item is OST number * job number
+ESMON_CAPACITY_SCOPE_OST_JOB = "ost_job"
+# The instance number of the item is MDT number * job number
+ESMON_CAPACITY_SCOPE_MDT_JOB = "mdt_job"
+# The instance number of the item is OST number * user number
+ESMON_CAPACITY_SCOPE_OST_USER = "ost_user"
+# The instance number of the item is MDT number * user number
+ESMON_CAPACITY_SCOPE_MDT_USER = "mdt_user"
+
+
+class EsmonCapacityItem(object):
+    """
+    Each group of metrics that is collected by the agents has an object of
+    this type
+    """
+    # pylint: disable=too-few-public-methods
+    # pylint: disable=too-many-arguments
+    def __init__(self, name, role, scope, points, compact_points=None,
+                 used_ratio=1.0):
+        self.eci_name = name
+        # The agent option that enables the item, or ESMON_CAPACITY_ROLE_*
+        self.eci_role = role
+        # ESMON_CAPACITY_SCOPE_*
+        self.eci_scope = scope
+        # The number of points of each instance in each collect interval
+        self.eci_points = points
+        # The number of points when lustre_compact_stats is enabled, None if
+        # the option doesn't change the item
+        if compact_points is None:
+            compact_points = points
+        self.eci_compact_points = compact_points
+        # The estimated ratio of the points that are still written when
+        # lustre_drop_unused is enabled
+        self.eci_used_ratio = used_ratio
+
+
+class EsmonCapacityCQ(object):
+    """
+    Each continuous query created by es_reinstall() has an object of this
+    type
+    """
+    # pylint: disable=too-few-public-methods,too-many-arguments
+    def __init__(self, item_name, measurement, groups, where="", optypes=1,
+                 buckets=1):
+        # The name of the item that the source measurement belongs to
+        self.ecc_item_name = item_name
+        self.ecc_measurement = measurement
+        self.ecc_groups = groups
+        self.ecc_where = where
+        # The number of values of the "optype" tag
+        self.ecc_optypes = optypes
+        # The number of values of the "size" tag of brw_stats
+        self.ecc_buckets = buckets
+
+
+# Service stats (samples/min/max/sum/sum_square/mean/mean_square) have seven
+# points per type
+SERVICE_STATS_POINTS = 7
+# Only min/max/mean are sent when lustre_compact_stats is enabled
+SERVICE_STATS_COMPACT_POINTS = 3
+# brw_stats have [read|write]_[sample|percentage|cum] for each bucket
+BRW_STATS_POINTS = 6
+# Only [read|write]_sample are sent when lustre_compact_stats is enabled
+BRW_STATS_COMPACT_POINTS = 2
+BRW_STATS_BUCKETS = {"rpc_bulk": 9,
+                     "page_discontiguous_rpc": 9,
+                     "block_discontiguous_rpc": 9,
+                     "fragmented_io": 9,
+                     "io_in_flight": 16,
+                     "io_time": 16,
+                     "io_size": 14}
+# The number of the request types of the service stats
+SERVICE_STATS_TYPES = {"ldlm_stats": 10,
+                       "ost_service_stats": 18,
+                       "mdt_service_stats": 19}
+
+# Most jobs only use a few types of operations, e.g. read and write
+JOBSTATS_USED_RATIO = 0.5
+# Most users/groups/projects don't have any file on part of the targets
+ACCT_USED_RATIO = 0.5
+# Most clients only read or write on an OST
+EXP_STATS_USED_RATIO = 0.5
+
+ESMON_CAPACITY_ITEMS = []
+# memory, cpu, df, load, sensors, uptime and users
+ESMON_CAPACITY_ITEMS.append(EsmonCapacityItem("system", None,
+                                              ESMON_CAPACITY_SCOPE_HOST, 25))
+ESMON_CAPACITY_ITEMS.append(EsmonCapacityItem("disk",
+                                              esmon_common.CSTR_ENABLE_DISK,
+                                              ESMON_CAPACITY_SCOPE_HOST, 64))
+ESMON_CAPACITY_ITEMS.append(EsmonCapacityItem("ime",
+                                              esmon_common.CSTR_IME,
+                                              ESMON_CAPACITY_SCOPE_HOST, 60))
+ESMON_CAPACITY_ITEMS.append(EsmonCapacityItem("infiniband",
+                                              esmon_common.CSTR_INFINIBAND,
+                                              ESMON_CAPACITY_SCOPE_HOST, 16))
+# vd_* and pd_* of about 32 virtual disks and 100 physical disks
+ESMON_CAPACITY_ITEMS.append(EsmonCapacityItem("sfa",
+                                              esmon_common.CSTR_SFAS,
+                                              ESMON_CAPACITY_SCOPE_SFA, 2640))
+ESMON_CAPACITY_ITEMS.append(EsmonCapacityItem("ldlm_stats",
+                                              ESMON_CAPACITY_ROLE_LUSTRE,
+                                              ESMON_CAPACITY_SCOPE_HOST,
+                                              SERVICE_STATS_TYPES["ldlm_stats"] *
+                                              SERVICE_STATS_POINTS,
+                                              SERVICE_STATS_TYPES["ldlm_stats"] *
+                                              SERVICE_STATS_COMPACT_POINTS))
+ESMON_CAPACITY_ITEMS.append(EsmonCapacityItem("client_stats",
+                                              esmon_common.CSTR_LUSTRE_CLIENT,
+                                              ESMON_CAPACITY_SCOPE_HOST, 68))
+
+# OSS items
+ESMON_CAPACITY_ITEMS.append(EsmonCapacityItem("ost_service_stats",
+                                              esmon_common.CSTR_LUSTRE_OSS,
+                                              ESMON_CAPACITY_SCOPE_HOST,
+                                              SERVICE_STATS_TYPES["ost_service_stats"] *
+                                              SERVICE_STATS_POINTS,
+                                              SERVICE_STATS_TYPES["ost_service_stats"] *
+                                              SERVICE_STATS_COMPACT_POINTS))
+for brw_name, brw_buckets in BRW_STATS_BUCKETS.iteritems():
+    ESMON_CAPACITY_ITEMS.append(EsmonCapacityItem("ost_brw_stats_" + brw_name,
+                                                  esmon_common.CSTR_LUSTRE_OSS,
+                                                  ESMON_CAPACITY_SCOPE_OST,
+                                                  brw_buckets * BRW_STATS_POINTS,
+                                                  brw_buckets * BRW_STATS_COMPACT_POINTS))
+ESMON_CAPACITY_ITEMS.append(EsmonCapacityItem("ost_stats",
+                                              esmon_common.CSTR_LUSTRE_OSS,
+                                              ESMON_CAPACITY_SCOPE_OST, 5))
+ESMON_CAPACITY_ITEMS.append(EsmonCapacityItem("ost_kbytesinfo",
+                                              esmon_common.CSTR_LUSTRE_OSS,
+                                              ESMON_CAPACITY_SCOPE_OST, 6))
+ESMON_CAPACITY_ITEMS.append(EsmonCapacityItem("ost_lock",
+                                              esmon_common.CSTR_LUSTRE_OSS,
+                                              ESMON_CAPACITY_SCOPE_OST, 2))
+ESMON_CAPACITY_ITEMS.append(EsmonCapacityItem("ost_recovery_status",
+                                              esmon_common.CSTR_LUSTRE_OSS,
+                                              ESMON_CAPACITY_SCOPE_OST, 3))
+ESMON_CAPACITY_ITEMS.append(EsmonCapacityItem("ost_jobstats",
+                                              esmon_common.CSTR_LUSTRE_OSS,
+                                              ESMON_CAPACITY_SCOPE_OST_JOB, 14,
+                                              10, used_ratio=JOBSTATS_USED_RATIO))
+ESMON_CAPACITY_ITEMS.append(EsmonCapacityItem("ost_acct",
+                                              esmon_common.CSTR_LUSTRE_OSS,
+                                              ESMON_CAPACITY_SCOPE_OST_USER, 6,
+                                              used_ratio=ACCT_USED_RATIO))
+ESMON_CAPACITY_ITEMS.append(EsmonCapacityItem("exp_ost_stats",
+                                              esmon_common.CSTR_LUSTRE_EXP_OST,
+                                              ESMON_CAPACITY_SCOPE_OST_EXPORT, 4,
+                                              used_ratio=EXP_STATS_USED_RATIO))
+
+# MDS items
+ESMON_CAPACITY_ITEMS.append(EsmonCapacityItem("mdt_service_stats",
+                                              esmon_common.CSTR_LUSTRE_MDS,
+                                              ESMON_CAPACITY_SCOPE_HOST,
+                                              SERVICE_STATS_TYPES["mdt_service_stats"] *
+                                              SERVICE_STATS_POINTS,
+                                              SERVICE_STATS_TYPES["mdt_service_stats"] *
+                                              SERVICE_STATS_COMPACT_POINTS))
+ESMON_CAPACITY_ITEMS.append(EsmonCapacityItem("md_stats",
+                                              esmon_common.CSTR_LUSTRE_MDS,
+                                              ESMON_CAPACITY_SCOPE_MDT, 13))
+ESMON_CAPACITY_ITEMS.append(EsmonCapacityItem("mdt_filesinfo",
+                                              esmon_common.CSTR_LUSTRE_MDS,
+                                              ESMON_CAPACITY_SCOPE_MDT, 3))
+ESMON_CAPACITY_ITEMS.append(EsmonCapacityItem("mdt_lock",
+                                              esmon_common.CSTR_LUSTRE_MDS,
+                                              ESMON_CAPACITY_SCOPE_MDT, 2))
+ESMON_CAPACITY_ITEMS.append(EsmonCapacityItem("mdt_recovery_status",
+                                              esmon_common.CSTR_LUSTRE_MDS,
+                                              ESMON_CAPACITY_SCOPE_MDT, 3))
+ESMON_CAPACITY_ITEMS.append(EsmonCapacityItem("mdt_jobstats",
+                                              esmon_common.CSTR_LUSTRE_MDS,
+                                              ESMON_CAPACITY_SCOPE_MDT_JOB, 16,
+                                              used_ratio=JOBSTATS_USED_RATIO))
+ESMON_CAPACITY_ITEMS.append(EsmonCapacityItem("mdt_acct",
+                                              esmon_common.CSTR_LUSTRE_MDS,
+                                              ESMON_CAPACITY_SCOPE_MDT_USER, 6,
+                                              used_ratio=ACCT_USED_RATIO))
+ESMON_CAPACITY_ITEMS.append(EsmonCapacityItem("exp_md_stats",
+                                              esmon_common.CSTR_LUSTRE_EXP_MDT,
+                                              ESMON_CAPACITY_SCOPE_MDT_EXPORT, 14))
+
+# The items that are not collected every collect_interval seconds, value is
+# the option of the periods
+ESMON_CAPACITY_ITEM_PERIODS = {
+    "ost_kbytesinfo": esmon_common.CSTR_SLOW_GAUGE_PERIODS,
+    "mdt_filesinfo": esmon_common.CSTR_SLOW_GAUGE_PERIODS,
+    "ost_acct": esmon_common.CSTR_ACCT_PERIODS,
+    "mdt_acct": esmon_common.CSTR_ACCT_PERIODS,
+}
+
+# The items that the rollup service keeps the top-K of, value is the tags of
+# the keys
+ESMON_CAPACITY_TOPK_ITEMS = {"ost_jobstats": ["job_id", "uid"],
+                             "mdt_jobstats": ["job_id", "uid"],
+                             "exp_ost_stats": ["exp_client"],
+                             "exp_md_stats": ["exp_client"]}
+
+
+def esmon_capacity_cqs():
+    """
+    Return the continuous queries created by EsmonServer.es_reinstall(), the
+    queries grouped by uid are only created if jobid_var is procname_uid
+    """
+    cqs = []
+    for acct_type in ["user", "group", "project"]:
+        for target in ["mdt", "ost"]:
+            cqs.append(EsmonCapacityCQ(target + "_acct",
+                                       "%s_acct%s_samples" %
+                                       (target, acct_type),
+                                       ["fs_name", "optype",
+                                        acct_type + "_id"]))
+    # Shows summarized client metadata operations
+    cqs.append(EsmonCapacityCQ("exp_md_stats", "exp_md_stats",
+                               ["exp_client", "fs_name"]))
+    # Shows summarized job metadata operations
+    for job_key in ["job_id", "uid"]:
+        cqs.append(EsmonCapacityCQ("mdt_jobstats", "mdt_jobstats_samples",
+                                   ["fs_name", job_key]))
+    for groups in [["fs_name", "optype", "fqdn"], ["fs_name", "ost_index"],
+                   ["fs_name", "fqdn"], ["fs_name", "optype"]]:
+        cqs.append(EsmonCapacityCQ("ost_stats", "ost_stats_bytes",
+                                   groups, optypes=2))
+    for groups in [["fs_name", "optype"], ["fs_name"]]:
+        cqs.append(EsmonCapacityCQ("ost_kbytesinfo",
+                                   "ost_kbytesinfo_used", groups))
+    cqs.append(EsmonCapacityCQ("ost_kbytesinfo",
+                               "ost_kbytesinfo_free", ["fs_name"]))
+    for name, buckets in BRW_STATS_BUCKETS.iteritems():
+        cqs.append(EsmonCapacityCQ("ost_brw_stats_" + name,
+                                   "ost_brw_stats_%s_samples" % name,
+                                   ["field", "fs_name", "size"],
+                                   buckets=buckets))
+    where = "WHERE optype = 'sum_read_bytes' OR optype = 'sum_write_bytes'"
+    for job_key in ["job_id", "uid"]:
+        cqs.append(EsmonCapacityCQ("ost_jobstats", "ost_jobstats_bytes",
+                                   ["fs_name", job_key, "optype"],
+                                   optypes=2))
+        for groups in [["fs_name", job_key],
+                       ["fs_name", job_key, "ost_index"]]:
+            cqs.append(EsmonCapacityCQ("ost_jobstats", "ost_jobstats_bytes",
+                                       groups, where=where, optypes=2))
+    cqs.append(EsmonCapacityCQ("exp_ost_stats", "exp_ost_stats_bytes",
+                               ["fs_name", "exp_client", "optype"],
+                               optypes=2))
+    for groups in [["fs_name"], ["fs_name", "mdt_index"], ["fs_name", "optype"]]:
+        cqs.append(EsmonCapacityCQ("md_stats", "md_stats", groups,
+                                   optypes=13))
+    for measurement in ["mdt_filesinfo_free", "mdt_filesinfo_used"]:
+        cqs.append(EsmonCapacityCQ("mdt_filesinfo", measurement,
+                                   ["fs_name"]))
+    return cqs
+
+
+ESMON_CAPACITY_CQS = esmon_capacity_cqs()
+
+
+def esmon_capacity_cq_enabled(capacity_cq, job_id_var):
+    """
+    Return True if the continuous query is created with the jobid_var
+    """
+    return ("uid" not in capacity_cq.ecc_groups or
+            job_id_var == lustre.JOB_ID_PROCNAME_UID)
+
+
+class EsmonCapacityUsage(object):
+    """
+    The estimated load of an item or a whole system
+    """
+    # pylint: disable=too-few-public-methods
+    def __init__(self, name):
+        self.ecu_name = name
+        # Points written by collectd in each collect interval
+        self.ecu_series = 0
+        # Points written by continuous queries in each period of them
+        self.ecu_cq_series = 0
+        # Points written per second
+        self.ecu_points_per_second = 0.0
+        # Points written by continuous queries per second
+        self.ecu_cq_points_per_second = 0.0
+
+    def ecu_bytes_per_day(self):
+        """
+        Return the estimated bytes written to disk per day
+        """
+        points = self.ecu_points_per_second + self.ecu_cq_points_per_second
+        return points * 86400 * ESMON_CAPACITY_BYTES_PER_POINT
+
+    def ecu_add(self, usage):
+        """
+        Add another usage into this one
+        """
+        self.ecu_series += usage.ecu_series
+        self.ecu_cq_series += usage.ecu_cq_series
+        self.ecu_points_per_second += usage.ecu_points_per_second
+        self.ecu_cq_points_per_second += usage.ecu_cq_points_per_second
+
+
+def esmon_capacity_role_enabled(config, agent, role):
+    """
+    Return True if the item role is enabled on the agent
+    """
+    if role is None:
+        return True
+    if role == ESMON_CAPACITY_ROLE_LUSTRE:
+        return (agent[esmon_common.CSTR_LUSTRE_OSS] or
+                agent[esmon_common.CSTR_LUSTRE_MDS] or
+                agent[esmon_common.CSTR_LUSTRE_CLIENT])
+    if role == esmon_common.CSTR_LUSTRE_EXP_OST:
+        return (agent[esmon_common.CSTR_LUSTRE_OSS] and
+                config[esmon_common.CSTR_LUSTRE_EXP_OST])
+    if role == esmon_common.CSTR_LUSTRE_EXP_MDT:
+        return (agent[esmon_common.CSTR_LUSTRE_MDS] and
+                config[esmon_common.CSTR_LUSTRE_EXP_MDT])
+    if role == esmon_common.CSTR_SFAS:
+        return len(agent[esmon_common.CSTR_SFAS]) > 0
+    return agent[role]
+
+
+def esmon_capacity_instances(agent, scope):
+    """
+    Return the instance number of a item scope on the agent
+    """
+    # pylint: disable=too-many-return-statements
+    ost_number = agent[esmon_common.CSTR_OST_NUMBER]
+    mdt_number = agent[esmon_common.CSTR_MDT_NUMBER]
+    if scope == ESMON_CAPACITY_SCOPE_HOST:
+        return 1
+    elif scope == ESMON_CAPACITY_SCOPE_SFA:
+        return len(agent[esmon_common.CSTR_SFAS])
+    elif scope == ESMON_CAPACITY_SCOPE_OST:
+        return ost_number
+    elif scope == ESMON_CAPACITY_SCOPE_MDT:
+        return mdt_number
+    elif scope == ESMON_CAPACITY_SCOPE_OST_EXPORT:
+        return ost_number * agent[esmon_common.CSTR_EXPORT_NUMBER]
+    elif scope == ESMON_CAPACITY_SCOPE_MDT_EXPORT:
+        return mdt_number * agent[esmon_common.CSTR_EXPORT_NUMBER]
+    elif scope == ESMON_CAPACITY_SCOPE_OST_JOB:
+        return ost_number * agent[esmon_common.CSTR_JOB_NUMBER]
+    elif scope == ESMON_CAPACITY_SCOPE_MDT_JOB:
+        return mdt_number * agent[esmon_common.CSTR_JOB_NUMBER]
+    elif scope == ESMON_CAPACITY_SCOPE_OST_USER:
+        return ost_number * agent[esmon_common.CSTR_USER_NUMBER]
+    elif scope == ESMON_CAPACITY_SCOPE_MDT_USER:
+        return mdt_number * agent[esmon_common.CSTR_USER_NUMBER]
+    logging.error("fix me: unknown scope [%s]", scope)
+    return 0
+
+
+class EsmonCapacityPlan(object):
+    """
+    The capacity plan of the whole monitoring system
+    """
+    # pylint: disable=too-few-public-methods,too-many-instance-attributes
+    def __init__(self, config):
+        self.ecp_config = config
+        self.ecp_collect_interval = config[esmon_common.CSTR_COLLECT_INTERVAL]
+        self.ecp_cq_periods = config[esmon_common.CSTR_CONTINUOUS_QUERY_PERIODS]
+        # Key is item name, value is EsmonCapacityUsage
+        self.ecp_item_usages = {}
+        # Key is host_id of agent, value is EsmonCapacityUsage
+        self.ecp_agent_usages = {}
+        self.ecp_total = EsmonCapacityUsage("total")
+        # Messages of the limits that the plan exceeds
+        self.ecp_warnings = []
+
+    def _ecp_item_usage(self, item_name):
+        """
+        Return the usage of an item, allocate one if necessary
+        """
+        if item_name not in self.ecp_item_usages:
+            self.ecp_item_usages[item_name] = EsmonCapacityUsage(item_name)
+        return self.ecp_item_usages[item_name]
+
+    def _ecp_plan_agents(self):
+        """
+        Estimate the points written by collectd of the agents
+        """
+        config = self.ecp_config
+        for agent in config[esmon_common.CSTR_AGENTS]:
+            host_id = agent[esmon_common.CSTR_HOST_ID]
+            agent_usage = EsmonCapacityUsage(host_id)
+            for item in ESMON_CAPACITY_ITEMS:
+                if not esmon_capacity_role_enabled(config, agent, item.eci_role):
+                    continue
+                instances = esmon_capacity_instances(agent, item.eci_scope)
+                usage = EsmonCapacityUsage(item.eci_name)
+                if config[esmon_common.CSTR_LUSTRE_COMPACT_STATS]:
+                    usage.ecu_series = instances * item.eci_compact_points
+                else:
+                    usage.ecu_series = instances * item.eci_points
+                if config[esmon_common.CSTR_LUSTRE_DROP_UNUSED]:
+                    usage.ecu_series = int(usage.ecu_series *
+                                           item.eci_used_ratio)
+                interval = self.ecp_collect_interval
+                if item.eci_name in ESMON_CAPACITY_ITEM_PERIODS:
+                    cstr = ESMON_CAPACITY_ITEM_PERIODS[item.eci_name]
+                    interval *= config[cstr]
+                usage.ecu_points_per_second = (float(usage.ecu_series) /
+                                               interval)
+                agent_usage.ecu_add(usage)
+                self._ecp_item_usage(item.eci_name).ecu_add(usage)
+            self.ecp_agent_usages[host_id] = agent_usage
+
+            if agent_usage.ecu_series > collectd.COLLECTD_WRITE_QUEUE_LIMIT_HIGH:
+                self.ecp_warnings.append("agent [%s] would generate [%d] values "
+                                         "in each interval, more than the "
+                                         "write queue limit [%d] of collectd" %
+                                         (host_id, agent_usage.ecu_series,
+                                          collectd.COLLECTD_WRITE_QUEUE_LIMIT_HIGH))
+
+    def _ecp_tag_cardinalities(self):
+        """
+        Return the estimated number of values of the tags
+        """
+        config = self.ecp_config
+        ost_number = 0
+        mdt_number = 0
+        oss_number = 0
+        job_number = 0
+        user_number = 0
+        export_number = 0
+        for agent in config[esmon_common.CSTR_AGENTS]:
+            if agent[esmon_common.CSTR_LUSTRE_OSS]:
+                oss_number += 1
+                ost_number += agent[esmon_common.CSTR_OST_NUMBER]
+            if agent[esmon_common.CSTR_LUSTRE_MDS]:
+                mdt_number += agent[esmon_common.CSTR_MDT_NUMBER]
+            # Jobs, users and clients are shared by all servers
+            job_number = max(job_number, agent[esmon_common.CSTR_JOB_NUMBER])
+            user_number = max(user_number, agent[esmon_common.CSTR_USER_NUMBER])
+            export_number = max(export_number,
+                                agent[esmon_common.CSTR_EXPORT_NUMBER])
+        return {"fs_name": ESMON_CAPACITY_FS_NUMBER,
+                "fqdn": oss_number,
+                "ost_index": ost_number,
+                "mdt_index": mdt_number,
+                "job_id": job_number,
+                "uid": user_number,
+                "user_id": user_number,
+                "group_id": user_number,
+                "project_id": user_number,
+                "exp_client": export_number,
+                # read_sample and write_sample
+                "field": 2}
+
+    def _ecp_plan_cqs(self):
+        """
+        Estimate the points written by the continuous queries
+        """
+        config = self.ecp_config
+        cardinalities = self._ecp_tag_cardinalities()
+        cq_time = self.ecp_collect_interval * self.ecp_cq_periods
+        for capacity_cq in ESMON_CAPACITY_CQS:
+            if capacity_cq.ecc_item_name not in self.ecp_item_usages:
+                continue
+            if not esmon_capacity_cq_enabled(capacity_cq,
+                                             config[esmon_common.CSTR_JOBID_VAR]):
+                continue
+            series = 1
+            for group in capacity_cq.ecc_groups:
+                if group == "optype":
+                    series *= capacity_cq.ecc_optypes
+                elif group == "size":
+                    series *= capacity_cq.ecc_buckets
+                else:
+                    series *= cardinalities[group]
+            usage = EsmonCapacityUsage(capacity_cq.ecc_item_name)
+            usage.ecu_cq_series = series
+            usage.ecu_cq_points_per_second = float(series) / cq_time
+            self._ecp_item_usage(capacity_cq.ecc_item_name).ecu_add(usage)
+
+    def _ecp_plan_rollup(self):
+        """
+        Estimate the points written by the rollup service besides the results
+        of the continuous queries that it replaces
+        """
+        config = self.ecp_config
+        cq_time = self.ecp_collect_interval * self.ecp_cq_periods
+        fs_number = ESMON_CAPACITY_FS_NUMBER
+        # The K heavy hitters and the other bucket of each file system
+        topk_series = 0
+        for item_name, key_tags in ESMON_CAPACITY_TOPK_ITEMS.iteritems():
+            if item_name not in self.ecp_item_usages:
+                continue
+            for key_tag in key_tags:
+                if (key_tag == "uid" and
+                        config[esmon_common.CSTR_JOBID_VAR] != lustre.JOB_ID_PROCNAME_UID):
+                    continue
+                topk_series += fs_number * (esmon_rollup.ROLLUP_TOPK_K + 1)
+
+        # A sketch of each request type of the services, the moments are not
+        # written if compact stats is enabled
+        quantile_series = 0
+        if not config[esmon_common.CSTR_LUSTRE_COMPACT_STATS]:
+            for item_name, types in SERVICE_STATS_TYPES.iteritems():
+                if item_name in self.ecp_item_usages:
+                    quantile_series += types
+        # A sketch of the read and write I/O time of each file system
+        if "ost_brw_stats_io_time" in self.ecp_item_usages:
+            quantile_series += 2 * fs_number
+
+        for name, series in [("rollup_topk", topk_series),
+                             ("rollup_quantiles", quantile_series)]:
+            if series == 0:
+                continue
+            usage = EsmonCapacityUsage(name)
+            usage.ecu_cq_series = series
+            usage.ecu_cq_points_per_second = float(series) / cq_time
+            self._ecp_item_usage(name).ecu_add(usage)
+
+    def ecp_plan(self):
+        """
+        Estimate the load and check the limits of the server
+        """
+        self._ecp_plan_agents()
+        self._ecp_plan_cqs()
+        server = self.ecp_config[esmon_common.CSTR_SERVER]
+        if server[esmon_common.CSTR_STREAMING_ROLLUP]:
+            self._ecp_plan_rollup()
+        for usage in self.ecp_item_usages.values():
+            self.ecp_total.ecu_add(usage)
+
+        total = self.ecp_total
+        max_points = server[esmon_common.CSTR_MAX_POINTS_PER_SECOND]
+        points = total.ecu_points_per_second + total.ecu_cq_points_per_second
+        if points > max_points:
+            self.ecp_warnings.append("[%d] points per second would be written "
+                                     "to the server, more than the limit [%d]" %
+                                     (points, max_points))
+
+        max_series = server[esmon_common.CSTR_MAX_SERIES]
+        series = total.ecu_series + total.ecu_cq_series
+        if series > max_series:
+            self.ecp_warnings.append("[%d] series would be active on the "
+                                     "server, more than the limit [%d]" %
+                                     (series, max_series))
+
+        max_disk = server[esmon_common.CSTR_MAX_DISK_GB_PER_DAY]
+        disk = total.ecu_bytes_per_day() / (1024 * 1024 * 1024)
+        if disk > max_disk:
+            self.ecp_warnings.append("[%.1f] GB would be written to the disk "
+                                     "of the server every day, more than the "
+                                     "limit [%d]" % (disk, max_disk))
+
+    def ecp_report(self):
+        """
+        Print the report of the plan
+        """
+        line_format = "%-36s %12s %12s %12s %12s %12s"
+        logging.info(line_format, "Item", "Series", "Points/s", "CQ series",
+                     "CQ points/s", "MB/day")
+        usages = sorted(self.ecp_item_usages.values(),
+                        key=lambda usage: usage.ecu_bytes_per_day(),
+                        reverse=True)
+        usages.append(self.ecp_total)
+        for usage in usages:
+            logging.info(line_format, usage.ecu_name, usage.ecu_series,
+                         "%.1f" % usage.ecu_points_per_second,
+                         usage.ecu_cq_series,
+                         "%.1f" % usage.ecu_cq_points_per_second,
+                         "%.1f" % (usage.ecu_bytes_per_day() / (1024 * 1024)))
+
+        logging.info("")
+        logging.info("%-36s %12s %12s", "Agent", "Series", "Points/s")
+        for host_id in sorted(self.ecp_agent_usages):
+            usage = self.ecp_agent_usages[host_id]
+            logging.info("%-36s %12s %12s", host_id, usage.ecu_series,
+                         "%.1f" % usage.ecu_points_per_second)
+
+        for warning in self.ecp_warnings:
+            logging.warning(warning)
+        if not self.ecp_warnings:
+            logging.info("the plan is within the limits of the server")
+
+
+def esmon_capacity_plan(config):
+    """
+    Estimate and print the load of the config
+    The config should have been checked so that all options are set
+    """
+    plan = EsmonCapacityPlan(config)
+    plan.ecp_plan()
+    plan.ecp_report()
+    if plan.ecp_warnings:
+        return -1
+    return 0
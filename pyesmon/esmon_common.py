@@ -21,11 +21,16 @@ PATTERN_PYTHON_LIBRARY = r"^%s-\d+\.\d+\.\d+\.tar\.gz$"
 ESMON_CONFIG_CSTR_NONE = "None"
 
 # Config used by esmon_install.conf
+CSTR_CONTINUOUS_QUERY_CPU_BUDGET = "continuous_query_cpu_budget"
 CSTR_CONTINUOUS_QUERY_PERIODS = "continuous_query_periods"
 CSTR_CONTROLLER0_HOST = "controller0_host"
 CSTR_CONTROLLER1_HOST = "controller1_host"
+CSTR_ACCT_PERIODS = "acct_periods"
 CSTR_AGENTS = "agents"
 CSTR_AGENTS_REINSTALL = "agents_reinstall"
+CSTR_AGENTS_RESTART_BATCH_SIZE = "agents_restart_batch_size"
+CSTR_AGENTS_RESTART_CONCURRENCY = "agents_restart_concurrency"
+CSTR_AGENTS_RESTART_MAX_FAILURES = "agents_restart_max_failures"
 CSTR_COLLECT_INTERVAL = "collect_interval"
 CSTR_DROP_DATABASE = "drop_database"
 CSTR_ENABLE_DISK = "enable_disk"
@@ -38,18 +43,36 @@ CSTR_INFLUXDB_PATH = "influxdb_path"
 CSTR_ISO_PATH = "iso_path"
 CSTR_JOBID_VAR = "jobid_var"
 CSTR_LOCAL_HOST = "local_host"
+CSTR_LUSTRE_COMPACT_STATS = "lustre_compact_stats"
+CSTR_LUSTRE_DROP_UNUSED = "lustre_drop_unused"
 CSTR_LUSTRE_EXP_MDT = "lustre_exp_mdt"
 CSTR_LUSTRE_EXP_OST = "lustre_exp_ost"
 CSTR_LUSTRE_MDS = "lustre_mds"
 CSTR_LUSTRE_OSS = "lustre_oss"
 CSTR_LUSTRE_CLIENT = "lustre_client"
 CSTR_NAME = "name"
+CSTR_QUERY_CACHE = "query_cache"
+CSTR_QUERY_CACHE_HOT_TIER_SECONDS = "query_cache_hot_tier_seconds"
 CSTR_REINSTALL = "reinstall"
+CSTR_SERIES_REAPER_CLIENT_IDLE_DAYS = "series_reaper_client_idle_days"
+CSTR_SERIES_REAPER_JOB_IDLE_DAYS = "series_reaper_job_idle_days"
 CSTR_SERVER = "server"
 CSTR_SFAS = "sfas"
+CSTR_SLOW_GAUGE_PERIODS = "slow_gauge_periods"
 CSTR_SSH_HOSTS = "ssh_hosts"
+CSTR_STREAMING_ROLLUP = "streaming_rollup"
 CSTR_SSH_IDENTITY_FILE = "ssh_identity_file"
 
+# Config used by the capacity planner of esmon_config
+CSTR_EXPORT_NUMBER = "export_number"
+CSTR_JOB_NUMBER = "job_number"
+CSTR_MAX_DISK_GB_PER_DAY = "max_disk_gb_per_day"
+CSTR_MAX_POINTS_PER_SECOND = "max_points_per_second"
+CSTR_MAX_SERIES = "max_series"
+CSTR_MDT_NUMBER = "mdt_number"
+CSTR_OST_NUMBER = "ost_number"
+CSTR_USER_NUMBER = "user_number"
+
 # Config used by esmon_test.conf
 CSTR_BACKFS_TYPE = "backfs_type"
 CSTR_ESMON_VIRT = "esmon_virt"
@@ -166,6 +189,12 @@ def clone_src_from_git(build_dir, git_url, branch,
 # python-backports-ssl_match_hostname.
 #
 # libyaml is needed by PyYAML.
+#
+# numpy is needed by esmon_imbalance.
+#
+# atlas, libgfortran and python-nose are needed by numpy.
+#
+# libquadmath is needed by libgfortran.
 ESMON_INSTALL_DEPENDENT_RPMS = ["rsync",
                                 "python-chardet",
                                 "python-backports",
@@ -179,7 +208,12 @@ ESMON_INSTALL_DEPENDENT_RPMS = ["rsync",
                                 "python2-filelock",
                                 "python-slugify",
                                 "pytz",
-                                "python-dateutil"]
+                                "python-dateutil",
+                                "libquadmath",
+                                "libgfortran",
+                                "atlas",
+                                "python-nose",
+                                "numpy"]
 
 # patch is needed to patch /etc/influxdb/influxdb.conf file
 # fontconfig and urw-base35-fonts are needed by grafana rpm
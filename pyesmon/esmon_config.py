@@ -17,6 +17,7 @@ import yaml
 from pyesmon import utils
 from pyesmon import time_util
 from pyesmon import esmon_common
+from pyesmon import esmon_capacity
 from pyesmon import lustre
 
 
@@ -30,6 +31,7 @@ ESMON_CONFIG_COMMNAD_EDIT = "e"
 ESMON_CONFIG_COMMNAD_HELP = "h"
 ESMON_CONFIG_COMMNAD_LS = "ls"
 ESMON_CONFIG_COMMNAD_MANUAL = "m"
+ESMON_CONFIG_COMMNAD_PLAN = "p"
 ESMON_CONFIG_COMMNAD_QUIT = "q"
 ESMON_CONFIG_COMMNAD_REMOVE = "rm"
 ESMON_CONFIG_COMMNAD_WRITE = "w"
@@ -374,6 +376,7 @@ def esmon_command_help(arg_string):
    h         print this menu
    ls [-r]   list config content under current directory
    m         print the manual of this option
+   p         estimate the load of the monitoring system
    q [-f]    quit without saving changes
    rm        remove the current item from parent
    w         write config file to disk
@@ -483,6 +486,18 @@ ESMON_CONFIG_COMMNADS[ESMON_CONFIG_COMMNAD_MANUAL] = \
     EsmonConfigCommand(ESMON_CONFIG_COMMNAD_MANUAL, esmon_command_manual)
 
 
+def esmon_command_plan(arg_string):
+    """
+    Estimate the load of the monitoring system
+    """
+    # pylint: disable=unused-argument
+    root = ESMON_CONFIG_WALK_STACK[0]
+    return esmon_capacity.esmon_capacity_plan(root.ewe_config)
+
+ESMON_CONFIG_COMMNADS[ESMON_CONFIG_COMMNAD_PLAN] = \
+    EsmonConfigCommand(ESMON_CONFIG_COMMNAD_PLAN, esmon_command_plan)
+
+
 def esmon_command_quit(arg_string):
     """
     Quit this program
@@ -685,7 +700,14 @@ ESMON_INSTALL_ROOT = \
                                 esmon_common.CSTR_LUSTRE_EXP_OST,
                                 esmon_common.CSTR_SERVER,
                                 esmon_common.CSTR_SSH_HOSTS,
-                                esmon_common.CSTR_JOBID_VAR])
+                                esmon_common.CSTR_JOBID_VAR,
+                                esmon_common.CSTR_LUSTRE_COMPACT_STATS,
+                                esmon_common.CSTR_LUSTRE_DROP_UNUSED,
+                                esmon_common.CSTR_SLOW_GAUGE_PERIODS,
+                                esmon_common.CSTR_ACCT_PERIODS,
+                                esmon_common.CSTR_AGENTS_RESTART_BATCH_SIZE,
+                                esmon_common.CSTR_AGENTS_RESTART_CONCURRENCY,
+                                esmon_common.CSTR_AGENTS_RESTART_MAX_FAILURES])
 
 ESMON_INSTALL_CSTRS["/"] = ESMON_INSTALL_ROOT
 
@@ -702,6 +724,38 @@ larger than "1".""",
                       start=1,
                       default=4)
 
+ESMON_INSTALL_CSTRS[esmon_common.CSTR_ACCT_PERIODS] = \
+    EsmonConfigString(esmon_common.CSTR_ACCT_PERIODS,
+                      ESMON_CONFIG_CSTR_INT,
+                      """This option determines the collect interval of the Lustre quota accounting
+metrics, i.e. [ost|mdt]_acct[user|group|project]_*. Reading and parsing the
+quota accounting files is expensive on large OSTs and MDTs. To calculate the
+interval seconds of these metrics, please multiply this number by the value of
+the "collect_interval" option. If this number is "1", these metrics are
+collected in the same interval with the other metrics. The value of
+"continuous_query_periods" option should be a multiple of this number, so that
+the continuous queries of these metrics can be calculated correctly.""",
+                      start=1,
+                      default=1)
+
+ESMON_INSTALL_CSTRS[esmon_common.CSTR_SLOW_GAUGE_PERIODS] = \
+    EsmonConfigString(esmon_common.CSTR_SLOW_GAUGE_PERIODS,
+                      ESMON_CONFIG_CSTR_INT,
+                      """This option determines the collect interval of the Lustre gauges that
+change slowly, i.e. ost_kbytesinfo_*, ost_filesinfo_* and mdt_filesinfo_*. To
+calculate the interval seconds of these metrics, please multiply this number by
+the value of the "collect_interval" option. If this number is "1", these
+metrics are collected in the same interval with the other metrics. The value of
+"continuous_query_periods" option should be a multiple of this number, so that
+the continuous queries of these metrics can be calculated correctly. The
+capacity and inode usage is only updated once in this interval, so an OST or
+MDT that fills quickly shows up later, and the capacity dashboards can't show
+changes shorter than this interval. A warning is printed if this interval is
+as long as the interval of the continuous queries, because the total capacity
+is then only updated once per continuous query interval.""",
+                      start=1,
+                      default=1)
+
 ESMON_INSTALL_CSTRS[esmon_common.CSTR_CONTROLLER0_HOST] = \
     EsmonConfigString(esmon_common.CSTR_CONTROLLER0_HOST,
                       ESMON_CONFIG_CSTR_STRING,
@@ -815,7 +869,12 @@ ESMON_INSTALL_CSTRS[esmon_common.CSTR_AGENTS] = \
                                 esmon_common.CSTR_LUSTRE_MDS,
                                 esmon_common.CSTR_LUSTRE_CLIENT,
                                 esmon_common.CSTR_LUSTRE_OSS,
-                                esmon_common.CSTR_SFAS],
+                                esmon_common.CSTR_SFAS,
+                                esmon_common.CSTR_OST_NUMBER,
+                                esmon_common.CSTR_MDT_NUMBER,
+                                esmon_common.CSTR_EXPORT_NUMBER,
+                                esmon_common.CSTR_JOB_NUMBER,
+                                esmon_common.CSTR_USER_NUMBER],
                       default=[LOCALHOST_AGENT])
 
 ESMON_INSTALL_CSTRS[esmon_common.CSTR_AGENTS_REINSTALL] = \
@@ -824,6 +883,36 @@ ESMON_INSTALL_CSTRS[esmon_common.CSTR_AGENTS_REINSTALL] = \
                       """This option determines whether to reinstall ESMON agents or not.""",
                       default=True)
 
+ESMON_INSTALL_CSTRS[esmon_common.CSTR_AGENTS_RESTART_BATCH_SIZE] = \
+    EsmonConfigString(esmon_common.CSTR_AGENTS_RESTART_BATCH_SIZE,
+                      ESMON_CONFIG_CSTR_INT,
+                      """This option determines the number of ESMON agents in each batch when
+updating the collectd config of the agents without reinstalling them. The
+agents of a batch are restarted, and then checked whether new datapoints from
+them arrive in the ESMON server, before the next batch is updated.""",
+                      start=1,
+                      default=16)
+
+ESMON_INSTALL_CSTRS[esmon_common.CSTR_AGENTS_RESTART_CONCURRENCY] = \
+    EsmonConfigString(esmon_common.CSTR_AGENTS_RESTART_CONCURRENCY,
+                      ESMON_CONFIG_CSTR_INT,
+                      """This option determines the maximum number of ESMON agents that restart
+collectd at the same time when updating the collectd config of the agents
+without reinstalling them.""",
+                      start=1,
+                      default=4)
+
+ESMON_INSTALL_CSTRS[esmon_common.CSTR_AGENTS_RESTART_MAX_FAILURES] = \
+    EsmonConfigString(esmon_common.CSTR_AGENTS_RESTART_MAX_FAILURES,
+                      ESMON_CONFIG_CSTR_INT,
+                      """This option determines the maximum number of ESMON agents that are allowed
+to fail when updating the collectd config of the agents without reinstalling
+them. The old config is restored on the agents that fail to restart or send
+new datapoints. If the number of failed agents is larger than this number, the
+update is paused, and the remaining agents keep running with their old config.""",
+                      start=0,
+                      default=0)
+
 ESMON_INSTALL_CSTRS[esmon_common.CSTR_COLLECT_INTERVAL] = \
     EsmonConfigString(esmon_common.CSTR_COLLECT_INTERVAL,
                       ESMON_CONFIG_CSTR_INT,
@@ -857,6 +946,27 @@ Important: This option should ONLY be set to "True" if the data/metadata of
            enabling this option.""",
                       default=False)
 
+ESMON_INSTALL_CSTRS[esmon_common.CSTR_EXPORT_NUMBER] = \
+    EsmonConfigString(esmon_common.CSTR_EXPORT_NUMBER,
+                      ESMON_CONFIG_CSTR_INT,
+                      """This option is the expected number of Lustre clients connected to each
+OST/MDT on this ES PERFMON agent. It is only used by the capacity planner of
+esmon_config to estimate the load of exp_ost_stats_* and exp_md_stats_*
+metrics.""",
+                      start=0,
+                      end=1048576,
+                      default=64)
+
+ESMON_INSTALL_CSTRS[esmon_common.CSTR_JOB_NUMBER] = \
+    EsmonConfigString(esmon_common.CSTR_JOB_NUMBER,
+                      ESMON_CONFIG_CSTR_INT,
+                      """This option is the expected number of active jobs on each OST/MDT on this
+ES PERFMON agent. It is only used by the capacity planner of esmon_config to
+estimate the load of jobstats metrics.""",
+                      start=0,
+                      end=1048576,
+                      default=32)
+
 ESMON_INSTALL_CSTRS[esmon_common.CSTR_LUSTRE_EXP_MDT] = \
     EsmonConfigString(esmon_common.CSTR_LUSTRE_EXP_MDT,
                       ESMON_CONFIG_CSTR_BOOL,
@@ -875,6 +985,44 @@ ESMON_INSTALL_CSTRS[esmon_common.CSTR_LUSTRE_EXP_OST] = \
                       INFO,
                       default=False)
 
+INFO = """This option determines whether ES PERFMON agents skip sending some
+detailed Lustre metrics. If this option is enabled, only the min, max and mean
+values of the Lustre service stats (e.g. ost_io_stats_ost_write_*) are sent to
+the server, the samples, sum and sum_square values are not. The
+ost_brw_stats_*_[percentage|cum] metrics, and the min_[read|write]_bytes and
+max_[read|write]_bytes of ost_jobstats_bytes are not sent either. This reduces
+the number of points and series significantly. The skipped values are dropped
+by the agents, not merged into fewer points, so the other values are written
+as before. This option is disabled by default, so a default installation
+doesn't get this reduction. However, the quantiles of the service times
+computed by the streaming rollup service need the samples, sum and sum_square
+values, so they are not calculated if this option is enabled, and their rows
+are left out of the dashboards. If any of the skipped metrics is needed for
+analysis, this option should be disabled."""
+
+ESMON_INSTALL_CSTRS[esmon_common.CSTR_LUSTRE_COMPACT_STATS] = \
+    EsmonConfigString(esmon_common.CSTR_LUSTRE_COMPACT_STATS,
+                      ESMON_CONFIG_CSTR_BOOL,
+                      INFO,
+                      default=False)
+
+INFO = """This option determines whether ES PERFMON agents skip sending the Lustre
+counters that have never been used. If this option is enabled, the
+ost_jobstats_* counters of the operations that a job has never done, the
+exp_ost_stats_* counters of the operations that a client has never done and the
+*_acct* metrics of the users/groups/projects that have no usage are not sent to
+the server. A missing value of these metrics means the value is zero. Only the
+values that are zero are dropped. The counters of a finished job or a quiet
+client that have been used keep the same non-zero value, and they are still
+sent in every interval, so this option doesn't reduce the series of Lustre
+entities that have become idle."""
+
+ESMON_INSTALL_CSTRS[esmon_common.CSTR_LUSTRE_DROP_UNUSED] = \
+    EsmonConfigString(esmon_common.CSTR_LUSTRE_DROP_UNUSED,
+                      ESMON_CONFIG_CSTR_BOOL,
+                      INFO,
+                      default=False)
+
 INFO = """This option determines whether ES PERFMON installation process will open
 the ports on monitoring server node automatically or not. If this options is
 enabled, firewall-cmd will be run on the server node to open ports in the
@@ -976,6 +1124,128 @@ ESMON_INSTALL_CSTRS[esmon_common.CSTR_REINSTALL] = \
                       """This option determines whether to reinstall the ES PERFMON server.""",
                       default=True)
 
+ESMON_INSTALL_CSTRS[esmon_common.CSTR_MAX_DISK_GB_PER_DAY] = \
+    EsmonConfigString(esmon_common.CSTR_MAX_DISK_GB_PER_DAY,
+                      ESMON_CONFIG_CSTR_INT,
+                      """This option is the maximum gigabytes that the ES PERFMON server can afford
+to write into Influxdb every day. The capacity planner of esmon_config warns
+when the estimated disk usage exceeds this limit.""",
+                      start=1,
+                      default=20)
+
+ESMON_INSTALL_CSTRS[esmon_common.CSTR_QUERY_CACHE] = \
+    EsmonConfigString(esmon_common.CSTR_QUERY_CACHE,
+                      ESMON_CONFIG_CSTR_BOOL,
+                      """This option determines whether to install a caching query proxy between
+Grafana and Influxdb on the ES PERFMON server. If enabled, Grafana sends the
+queries to the proxy instead of Influxdb. The proxy aligns the time range of
+the queries to the collect interval, and serves identical queries from a
+memory cache, so that many people watching the same dashboards won't overload
+Influxdb.""",
+                      default=False)
+
+ESMON_INSTALL_CSTRS[esmon_common.CSTR_QUERY_CACHE_HOT_TIER_SECONDS] = \
+    EsmonConfigString(esmon_common.CSTR_QUERY_CACHE_HOT_TIER_SECONDS,
+                      ESMON_CONFIG_CSTR_INT,
+                      """This option is the seconds of the recent points that the caching query
+proxy keeps in memory as a hot tier. Influxdb forwards the written points to
+the proxy through a subscription, and the proxy keeps the points of each
+series in ring buffers of bounded size. The queries of the dashboards on time
+ranges within these seconds are answered from the hot tier, and the other
+queries are sent to Influxdb. 0 means disabling the hot tier. This option only
+takes effect when query_cache is enabled.""",
+                      start=0,
+                      end=86400,
+                      default=3600)
+
+ESMON_INSTALL_CSTRS[esmon_common.CSTR_STREAMING_ROLLUP] = \
+    EsmonConfigString(esmon_common.CSTR_STREAMING_ROLLUP,
+                      ESMON_CONFIG_CSTR_BOOL,
+                      """This option determines whether to replace the continuous queries of
+Influxdb on the ES PERFMON server with a streaming rollup service. If enabled,
+Influxdb forwards the written points to the service through a subscription, and
+the service sums them in memory and writes the same aggregated measurements
+back when each interval ends. So the cost of aggregation grows with the number
+of written points rather than with the data scanned by continuous queries. The
+service also writes the top-K jobs, users and clients of the I/O and metadata
+rates, which are only written by this service, so the "Top Talkers" row of the
+Lustre Statistics dashboard and the "Top Users" row of the Lustre User
+dashboard are left out if this option is disabled. The same is true for the
+quantiles of the service times and the I/O time in the Lustre MDS, Lustre OSS
+and Lustre Statistics dashboards. The quantiles of the service times are not
+calculated if lustre_compact_stats is enabled, so their rows are left out in
+that case too. The points of the interval in progress are lost when the service
+restarts.""",
+                      default=False)
+
+ESMON_INSTALL_CSTRS[esmon_common.CSTR_SERIES_REAPER_JOB_IDLE_DAYS] = \
+    EsmonConfigString(esmon_common.CSTR_SERIES_REAPER_JOB_IDLE_DAYS,
+                      ESMON_CONFIG_CSTR_INT,
+                      """This option is the number of days after which the series of a job are
+dropped from Influxdb if the job has no new data. A reaper runs on the
+ES PERFMON server every day to drop the series of the finished jobs, so that
+the index of Influxdb won't grow forever. If the value is 0, the series of the
+jobs are never dropped.""",
+                      start=0,
+                      default=0)
+
+ESMON_INSTALL_CSTRS[esmon_common.CSTR_SERIES_REAPER_CLIENT_IDLE_DAYS] = \
+    EsmonConfigString(esmon_common.CSTR_SERIES_REAPER_CLIENT_IDLE_DAYS,
+                      ESMON_CONFIG_CSTR_INT,
+                      """This option is the number of days after which the series of a Lustre client
+export are dropped from Influxdb if the client has no new data. A reaper runs
+on the ES PERFMON server every day to drop the series of the departed clients,
+so that the index of Influxdb won't grow forever. If the value is 0, the series
+of the clients are never dropped.""",
+                      start=0,
+                      default=0)
+
+ESMON_INSTALL_CSTRS[esmon_common.CSTR_CONTINUOUS_QUERY_CPU_BUDGET] = \
+    EsmonConfigString(esmon_common.CSTR_CONTINUOUS_QUERY_CPU_BUDGET,
+                      ESMON_CONFIG_CSTR_INT,
+                      """This option is the CPU budget of continuous queries on the ES PERFMON
+server, as the percentage of one CPU core. The esmon_cq command reports the
+execution time of each continuous query, and recommends less frequent RESAMPLE
+periods for the most expensive ones until the total load fits in the budget.""",
+                      start=1,
+                      default=25)
+
+ESMON_INSTALL_CSTRS[esmon_common.CSTR_MAX_POINTS_PER_SECOND] = \
+    EsmonConfigString(esmon_common.CSTR_MAX_POINTS_PER_SECOND,
+                      ESMON_CONFIG_CSTR_INT,
+                      """This option is the maximum number of points per second that the
+ES PERFMON server can write into Influxdb. The capacity planner of esmon_config
+warns when the estimated write rate exceeds this limit.""",
+                      start=1,
+                      end=100000000,
+                      default=100000)
+
+ESMON_INSTALL_CSTRS[esmon_common.CSTR_MAX_SERIES] = \
+    EsmonConfigString(esmon_common.CSTR_MAX_SERIES,
+                      ESMON_CONFIG_CSTR_INT,
+                      """This option is the maximum number of series that the ES PERFMON server can
+hold in Influxdb. The capacity planner of esmon_config warns when the estimated
+series cardinality exceeds this limit.""",
+                      start=1,
+                      end=1000000000,
+                      default=1000000)
+
+ESMON_INSTALL_CSTRS[esmon_common.CSTR_MDT_NUMBER] = \
+    EsmonConfigString(esmon_common.CSTR_MDT_NUMBER,
+                      ESMON_CONFIG_CSTR_INT,
+                      """This option is the expected number of Lustre MDTs on this ES PERFMON agent.
+It is only used by the capacity planner of esmon_config.""",
+                      start=0,
+                      default=1)
+
+ESMON_INSTALL_CSTRS[esmon_common.CSTR_OST_NUMBER] = \
+    EsmonConfigString(esmon_common.CSTR_OST_NUMBER,
+                      ESMON_CONFIG_CSTR_INT,
+                      """This option is the expected number of Lustre OSTs on this ES PERFMON agent.
+It is only used by the capacity planner of esmon_config.""",
+                      start=0,
+                      default=4)
+
 MAPPING_DICT = {lustre.LUSTRE_VERSION_NAME_ERROR: None}
 ESMON_INSTALL_CSTRS[esmon_common.CSTR_LUSTRE_DEFAULT_VERSION] = \
     EsmonConfigString(esmon_common.CSTR_LUSTRE_DEFAULT_VERSION,
@@ -1011,11 +1281,30 @@ ESMON_INSTALL_CSTRS[esmon_common.CSTR_SERVER] = \
                                 esmon_common.CSTR_HOST_ID,
                                 esmon_common.CSTR_INFLUXDB_PATH,
                                 esmon_common.CSTR_REINSTALL,
-                                esmon_common.CSTR_AUTO_OPEN_PORTS_ON_FIREWALL],
+                                esmon_common.CSTR_AUTO_OPEN_PORTS_ON_FIREWALL,
+                                esmon_common.CSTR_MAX_POINTS_PER_SECOND,
+                                esmon_common.CSTR_MAX_SERIES,
+                                esmon_common.CSTR_MAX_DISK_GB_PER_DAY,
+                                esmon_common.CSTR_QUERY_CACHE,
+                                esmon_common.CSTR_QUERY_CACHE_HOT_TIER_SECONDS,
+                                esmon_common.CSTR_SERIES_REAPER_JOB_IDLE_DAYS,
+                                esmon_common.CSTR_SERIES_REAPER_CLIENT_IDLE_DAYS,
+                                esmon_common.CSTR_CONTINUOUS_QUERY_CPU_BUDGET,
+                                esmon_common.CSTR_STREAMING_ROLLUP],
                       default=SERVER_DEFAULT)
 
 ESMON_SFA_NAME_NUM = 0
 
+ESMON_INSTALL_CSTRS[esmon_common.CSTR_USER_NUMBER] = \
+    EsmonConfigString(esmon_common.CSTR_USER_NUMBER,
+                      ESMON_CONFIG_CSTR_INT,
+                      """This option is the expected number of users/groups/projects that have
+quota accounting on each OST/MDT on this ES PERFMON agent. It is only used by
+the capacity planner of esmon_config to estimate the load of acct* metrics.""",
+                      start=0,
+                      end=1048576,
+                      default=64)
+
 
 INFO = "This group of options include the information of this SFA on the ES PERFMON agent."
 ESMON_INSTALL_CSTRS[esmon_common.CSTR_SFAS] = \
@@ -2036,6 +2325,36 @@ def esmon_config(workspace):
     return 0
 
 
+def esmon_config_plan():
+    """
+    Estimate the load of the monitoring system from the config file
+    """
+    # pylint: disable=bare-except
+    if not os.path.exists(CONFIG_FPATH):
+        logging.error('file "%s" doesnot exist', CONFIG_FPATH)
+        return -1
+
+    config_fd = open(CONFIG_FPATH)
+    try:
+        config = yaml.load(config_fd)
+    except:
+        logging.error("not able to load [%s] as yaml file: %s", CONFIG_FPATH,
+                      traceback.format_exc())
+        config_fd.close()
+        return -1
+    config_fd.close()
+
+    if config is None:
+        logging.error('file "%s" is an empty config', CONFIG_FPATH)
+        return -1
+
+    ret = esmon_config_check(config, config, "/", ESMON_INSTALL_ROOT)
+    if ret:
+        return -1
+
+    return esmon_capacity.esmon_capacity_plan(config)
+
+
 def install_config_value(config, key):
     """
     Return the config value
@@ -2066,7 +2385,8 @@ def usage():
     """
     Print usage string
     """
-    utils.eprint("Usage: %s <config_file>" %
+    utils.eprint("Usage: %s [-p] <config_file>\n"
+                 "    -p: estimate the load of the monitoring system and quit" %
                  sys.argv[0])
 
 
@@ -2080,9 +2400,15 @@ def main():
     sys.setdefaultencoding("utf-8")
     CONFIG_FPATH = esmon_common.ESMON_INSTALL_CONFIG
 
-    if len(sys.argv) == 2:
-        CONFIG_FPATH = sys.argv[1]
-    elif len(sys.argv) > 2:
+    args = sys.argv[1:]
+    plan = False
+    if len(args) > 0 and args[0] == "-p":
+        plan = True
+        args = args[1:]
+
+    if len(args) == 1:
+        CONFIG_FPATH = args[0]
+    elif len(args) > 1:
         usage()
         sys.exit(-1)
 
@@ -2103,6 +2429,10 @@ def main():
 
     utils.configure_logging(workspace, simple_console=True)
 
+    if plan:
+        ret = esmon_config_plan()
+        sys.exit(ret)
+
     ret = esmon_config(workspace)
     if ret:
         logging.error("config failed, please check [%s] for more log",
@@ -0,0 +1,406 @@
+# Copyright (c) 2017 DataDirect Networks, Inc.
+# All Rights Reserved.
+# Author: lixi@ddn.com
+"""
+Report the cost of continuous queries in Influxdb and tune their periods
+
+The execution time, the written points and the lag of each continuous query are
+read from the cq_query statistics in the _internal database. If a query runs
+longer than its period, or if all queries together use more CPU than the
+budget, a less frequent RESAMPLE EVERY period is recommended for the most
+expensive queries. The GROUP BY interval is never changed, so the written
+measurements keep the same resolution.
+"""
+import sys
+import logging
+import traceback
+import json
+import yaml
+
+from pyesmon import utils
+from pyesmon import esmon_common
+from pyesmon import esmon_config
+from pyesmon import esmon_influxdb
+from pyesmon import esmon_install_nodeps
+from pyesmon import esmon_storage
+
+# The seconds of the cq_query statistics to analyze
+ESMON_CQ_WINDOW = 3600
+# The part of the execution time that doesn't depend on the length of the
+# RESAMPLE FOR window, e.g. the cost of planning and iterating the series
+ESMON_CQ_FIXED_COST_FRACTION = 0.5
+# The maximum RESAMPLE EVERY period as the multiple of the GROUP BY interval
+ESMON_CQ_MAX_EVERY_PERIODS = 16
+
+ESMON_CQ_COLUMNS = [("name", "CQ"),
+                    ("period", "PERIOD"),
+                    ("every", "EVERY"),
+                    ("for", "FOR"),
+                    ("runs", "RUNS"),
+                    ("mean_ms", "MEAN_MS"),
+                    ("max_ms", "MAX_MS"),
+                    ("points", "POINTS"),
+                    ("lag_s", "LAG_S"),
+                    ("load", "LOAD%"),
+                    ("new_every", "NEW_EVERY"),
+                    ("new_for", "NEW_FOR"),
+                    ("note", "NOTE")]
+
+
+class ContinuousQueryStat(object):
+    """
+    The statistics of a continuous query
+    """
+    # pylint: disable=too-many-instance-attributes
+    def __init__(self, name, query):
+        self.cqs_name = name
+        self.cqs_query = query
+        self.cqs_period, self.cqs_every, self.cqs_for = \
+            esmon_influxdb.influxdb_cq_intervals(query)
+        # Execution seconds of each run
+        self.cqs_durations = []
+        self.cqs_points = 0
+        # Seconds between the end of the query window and the finish of the run
+        self.cqs_max_lag = None
+        self.cqs_new_every = self.cqs_every
+        self.cqs_new_for = self.cqs_for
+        self.cqs_note = ""
+
+    def cqs_duration(self, every, maximum=False):
+        """
+        Return the predicted execution seconds with the RESAMPLE EVERY period,
+        the scanned data grows with the FOR window, which is EVERY + period
+        """
+        if len(self.cqs_durations) == 0:
+            return 0.0
+        if maximum:
+            duration = max(self.cqs_durations)
+        else:
+            duration = sum(self.cqs_durations) / len(self.cqs_durations)
+        if every == self.cqs_every:
+            return duration
+        resample_for = every + self.cqs_period
+        return duration * (ESMON_CQ_FIXED_COST_FRACTION +
+                           (1 - ESMON_CQ_FIXED_COST_FRACTION) *
+                           float(resample_for) / self.cqs_for)
+
+    def cqs_load(self, every=None):
+        """
+        Return the percentage of one CPU used by the query
+        """
+        if every is None:
+            every = self.cqs_every
+        return self.cqs_duration(every) * 100 / every
+
+    def cqs_resample_clause(self):
+        """
+        Return the recommended RESAMPLE clause, None if not changed
+        """
+        if (self.cqs_new_every == self.cqs_every and
+                self.cqs_new_for == self.cqs_for):
+            return None
+        return esmon_influxdb.influxdb_cq_resample_clause(self.cqs_new_every,
+                                                          self.cqs_new_for)
+
+    def cqs_dict(self):
+        """
+        Return the statistics as a dict
+        """
+        mean_ms = None
+        max_ms = None
+        if len(self.cqs_durations) > 0:
+            mean_ms = int(self.cqs_duration(self.cqs_every) * 1000)
+            max_ms = int(self.cqs_duration(self.cqs_every, maximum=True) * 1000)
+            points = self.cqs_points / len(self.cqs_durations)
+        else:
+            points = None
+        if self.cqs_max_lag is None:
+            lag = None
+        else:
+            lag = round(self.cqs_max_lag, 1)
+        return {"name": self.cqs_name,
+                "period": self.cqs_period,
+                "every": self.cqs_every,
+                "for": self.cqs_for,
+                "runs": len(self.cqs_durations),
+                "mean_ms": mean_ms,
+                "max_ms": max_ms,
+                "points": points,
+                "lag_s": lag,
+                "load": round(self.cqs_load(), 2),
+                "new_every": self.cqs_new_every,
+                "new_for": self.cqs_new_for,
+                "note": self.cqs_note}
+
+
+def esmon_cq_queries(client):
+    """
+    Return the continuous queries of the ESMON database
+    """
+    result = esmon_storage.esmon_storage_query(client,
+                                               "SHOW CONTINUOUS QUERIES")
+    if result is None:
+        return None
+
+    stats = []
+    for serie in result.get("series", []):
+        if serie["name"] != esmon_install_nodeps.INFLUXDB_DATABASE_NAME:
+            continue
+        for name, query in serie.get("values", []):
+            stat = ContinuousQueryStat(name, query)
+            if stat.cqs_period is None:
+                logging.warning("ignoring continuous query [%s] without "
+                                "GROUP BY time()", name)
+                continue
+            stats.append(stat)
+    return stats
+
+
+def esmon_cq_statistics(client, stats):
+    """
+    Get the execution statistics of the continuous queries
+    """
+    stat_dict = {}
+    for stat in stats:
+        stat_dict[stat.cqs_name] = stat
+
+    query = ('SELECT "durationNs", "pointsWrittenOK", "endTime" '
+             'FROM "_internal"."monitor"."cq_query" '
+             'WHERE "db" = \'%s\' AND time > now() - %ds GROUP BY "cq"' %
+             (esmon_install_nodeps.INFLUXDB_DATABASE_NAME, ESMON_CQ_WINDOW))
+    result = esmon_storage.esmon_storage_query(client, query, epoch="ms")
+    if result is None:
+        return -1
+
+    for serie in result.get("series", []):
+        name = serie.get("tags", {}).get("cq")
+        if name not in stat_dict:
+            continue
+        stat = stat_dict[name]
+        columns = serie["columns"]
+        for value in serie.get("values", []):
+            point = dict(zip(columns, value))
+            if point["durationNs"] is None:
+                continue
+            stat.cqs_durations.append(point["durationNs"] / 1000000000.0)
+            if point["pointsWrittenOK"] is not None:
+                stat.cqs_points += point["pointsWrittenOK"]
+            if point["endTime"] is not None:
+                # time is in milliseconds, endTime is in nanoseconds
+                lag = point["time"] / 1000.0 - point["endTime"] / 1000000000.0
+                if stat.cqs_max_lag is None or lag > stat.cqs_max_lag:
+                    stat.cqs_max_lag = lag
+    return 0
+
+
+def esmon_cq_recommend(stats, budget):
+    """
+    Recommend the RESAMPLE periods to keep the load of the continuous queries
+    under the budget
+    """
+    active_stats = [stat for stat in stats if len(stat.cqs_durations) > 0]
+    for stat in stats:
+        if len(stat.cqs_durations) == 0:
+            stat.cqs_note = "no statistics"
+            continue
+        if stat.cqs_duration(stat.cqs_every, maximum=True) > stat.cqs_every:
+            stat.cqs_note = "overrun"
+        elif (stat.cqs_max_lag is not None and
+              stat.cqs_max_lag > stat.cqs_every):
+            stat.cqs_note = "delayed"
+
+    # Queries that overrun leave no time for the others at the same boundary
+    for stat in active_stats:
+        max_every = ESMON_CQ_MAX_EVERY_PERIODS * stat.cqs_period
+        while (stat.cqs_duration(stat.cqs_new_every, maximum=True) * 2 >
+               stat.cqs_new_every and stat.cqs_new_every * 2 <= max_every):
+            stat.cqs_new_every *= 2
+
+    while True:
+        load = sum(stat.cqs_load(stat.cqs_new_every) for stat in active_stats)
+        if load <= budget:
+            break
+        candidates = [stat for stat in active_stats
+                      if stat.cqs_new_every * 2 <=
+                      ESMON_CQ_MAX_EVERY_PERIODS * stat.cqs_period]
+        if len(candidates) == 0:
+            logging.warning("the load [%.1f%%] of continuous queries exceeds "
+                            "the budget [%d%%] even with the longest periods, "
+                            "please consider a larger [%s]", load, budget,
+                            esmon_common.CSTR_CONTINUOUS_QUERY_PERIODS)
+            break
+        top = max(candidates,
+                  key=lambda stat: stat.cqs_load(stat.cqs_new_every))
+        top.cqs_new_every *= 2
+
+    for stat in active_stats:
+        if stat.cqs_new_every != stat.cqs_every:
+            # One more period to recompute the interval that was still open
+            stat.cqs_new_for = stat.cqs_new_every + stat.cqs_period
+    return load
+
+
+def esmon_cq_apply(client, stat):
+    """
+    Recreate the continuous query with the recommended RESAMPLE clause
+    """
+    resample_clause = stat.cqs_resample_clause()
+    if resample_clause is None:
+        return 0
+    query = esmon_influxdb.influxdb_cq_resample(stat.cqs_query,
+                                                resample_clause)
+    drop_query = ('DROP CONTINUOUS QUERY %s ON "%s";' %
+                  (stat.cqs_name, esmon_install_nodeps.INFLUXDB_DATABASE_NAME))
+    result = esmon_storage.esmon_storage_query(client, drop_query)
+    if result is None:
+        logging.error("failed to drop continuous query [%s]", stat.cqs_name)
+        return -1
+
+    result = esmon_storage.esmon_storage_query(client, query)
+    if result is None:
+        logging.error("failed to create continuous query [%s], restoring the "
+                      "original one", stat.cqs_name)
+        result = esmon_storage.esmon_storage_query(client, stat.cqs_query)
+        if result is None:
+            logging.error("failed to restore continuous query [%s]",
+                          stat.cqs_name)
+        return -1
+    logging.info("changed continuous query [%s] to [%s]", stat.cqs_name,
+                 resample_clause)
+    return 0
+
+
+def esmon_cq_table(stat_dicts):
+    """
+    Return the statistic dicts formatted as a table
+    """
+    rows = [[title for _, title in ESMON_CQ_COLUMNS]]
+    for stat_dict in stat_dicts:
+        row = []
+        for key, _ in ESMON_CQ_COLUMNS:
+            value = stat_dict[key]
+            if value is None:
+                value = "-"
+            row.append(str(value))
+        rows.append(row)
+
+    widths = [max(len(row[i]) for row in rows)
+              for i in range(len(ESMON_CQ_COLUMNS))]
+    lines = []
+    for row in rows:
+        lines.append("  ".join(value.ljust(widths[i])
+                               for i, value in enumerate(row)).rstrip())
+    return "\n".join(lines)
+
+
+def esmon_cq(config_fpath, json_output, apply_changes):
+    """
+    Print the statistics of the continuous queries and tune them
+    """
+    # pylint: disable=bare-except,too-many-return-statements
+    config_fd = open(config_fpath)
+    ret = 0
+    try:
+        config = yaml.load(config_fd)
+    except:
+        logging.error("not able to load [%s] as yaml file: %s", config_fpath,
+                      traceback.format_exc())
+        ret = -1
+    config_fd.close()
+    if ret:
+        return -1
+
+    ret, server_host, _ = esmon_storage.esmon_storage_parse_config(config,
+                                                                   config_fpath)
+    if ret:
+        logging.error("failed to parse config [%s]", config_fpath)
+        return -1
+
+    ret, server_config = esmon_config.install_config_value(config,
+                                                           esmon_common.CSTR_SERVER)
+    if ret:
+        return -1
+
+    ret, budget = esmon_config.install_config_value(server_config,
+                                                    esmon_common.CSTR_CONTINUOUS_QUERY_CPU_BUDGET)
+    if ret:
+        return -1
+
+    client = esmon_influxdb.InfluxdbClient(server_host.sh_hostname,
+                                           esmon_install_nodeps.INFLUXDB_DATABASE_NAME)
+    stats = esmon_cq_queries(client)
+    if stats is None:
+        logging.error("failed to get the continuous queries from server [%s]",
+                      server_host.sh_hostname)
+        return -1
+
+    ret = esmon_cq_statistics(client, stats)
+    if ret:
+        logging.error("failed to get the statistics of continuous queries "
+                      "from server [%s], please make sure "
+                      "[query-stats-enabled] of [continuous_queries] is "
+                      "enabled in the config of Influxdb",
+                      server_host.sh_hostname)
+        return -1
+
+    esmon_cq_recommend(stats, budget)
+    stats = sorted(stats, key=lambda stat: -stat.cqs_load())
+    stat_dicts = [stat.cqs_dict() for stat in stats]
+    if json_output:
+        print(json.dumps(stat_dicts, indent=4, separators=(',', ': ')))
+    else:
+        print(esmon_cq_table(stat_dicts))
+
+    if not apply_changes:
+        return 0
+
+    for stat in stats:
+        if esmon_cq_apply(client, stat):
+            ret = -1
+    return ret
+
+
+def usage():
+    """
+    Print usage string
+    """
+    utils.eprint("Usage: %s [--json] [--apply] [config_file]\n"
+                 "    --apply: recreate the continuous queries with the "
+                 "recommended RESAMPLE clauses" % sys.argv[0])
+
+
+def main():
+    """
+    Report the cost of continuous queries in Influxdb
+    """
+    reload(sys)
+    sys.setdefaultencoding("utf-8")
+    config_fpath = esmon_common.ESMON_INSTALL_CONFIG
+    json_output = False
+    apply_changes = False
+
+    args = sys.argv[1:]
+    while len(args) > 0 and args[0].startswith("--"):
+        if args[0] == "--json":
+            json_output = True
+        elif args[0] == "--apply":
+            apply_changes = True
+        else:
+            usage()
+            sys.exit(-1)
+        args = args[1:]
+    if len(args) == 1:
+        config_fpath = args[0]
+    elif len(args) > 1:
+        usage()
+        sys.exit(-1)
+
+    utils.configure_logging()
+    console_handler = utils.LOGGING_HANLDERS["console"]
+    console_handler.setLevel(logging.WARNING)
+
+    ret = esmon_cq(config_fpath, json_output, apply_changes)
+    if ret:
+        logging.error("failed to tune the continuous queries of Influxdb")
+        sys.exit(ret)
+    sys.exit(0)
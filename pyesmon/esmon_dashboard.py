@@ -0,0 +1,1592 @@
+# Copyright (c) 2017 DataDirect Networks, Inc.
+# All Rights Reserved.
+# Author: lixi@ddn.com
+"""
+Specs of the Grafana dashboards of ESMON
+
+The dashboards under dashboards/ are generated from these specs by running
+"esmon_dashboard generate <dashboard_dir>", do not edit the generated Json by
+hand. "esmon_dashboard lint <dashboard_dir>" estimates the cost of the queries
+of each dashboard, and fails if any dashboard exceeds its budget or is not
+up to date with the specs.
+"""
+# pylint: disable=too-many-lines
+import sys
+import os
+import re
+import json
+import logging
+
+# Local libs
+from pyesmon import utils
+from pyesmon import grafana
+
+# Should be the same with GRAFANA_DATASOURCE_NAME of esmon_install_nodeps
+DASHBOARD_DATASOURCE = "esmon_datasource"
+DASHBOARD_COLOR_OK = "rgba(50, 172, 45, 0.97)"
+DASHBOARD_COLOR_WARN = "rgba(237, 129, 40, 0.89)"
+DASHBOARD_COLOR_CRIT = "rgba(245, 54, 54, 0.9)"
+
+# The continuous queries save the latest value of each cluster status item as
+# a field of this measurement, so that the status of all hosts can be got by
+# a single query
+CLUSTER_STATUS_MEASUREMENT = "cqm_cluster_status"
+
+# Typical number of values of each tag in a cluster, used to estimate the
+# number of series scanned by a query
+DASHBOARD_TAG_CARDINALITY = {"client_uuid": 1024,
+                             "controller": 2,
+                             "disk_index": 256,
+                             "exp_client": 1024,
+                             "field": 2,
+                             "fqdn": 64,
+                             "fs_name": 2,
+                             "group_id": 64,
+                             "iosize": 12,
+                             "job_id": 1024,
+                             "latency": 12,
+                             "mdt_index": 4,
+                             "optype": 16,
+                             "ost_index": 128,
+                             "rank": 21,
+                             "size": 16,
+                             "type": 12,
+                             "uid": 256,
+                             "user_id": 256}
+# Prefixes of the measurements written by continuous queries or the rollup
+# service, which have no series per host
+DASHBOARD_AGGREGATED_PREFIXES = ("cqm_", "topk_", "qsk_")
+# Prefixes of the measurements only written by the streaming rollup service
+DASHBOARD_ROLLUP_PREFIXES = ("topk_", "qsk_")
+# Cardinality of the tags that are not in DASHBOARD_TAG_CARDINALITY
+DASHBOARD_TAG_CARDINALITY_DEFAULT = 16
+# Typical number of measurements matched by a regular expression
+DASHBOARD_REGEX_MEASUREMENTS = 16
+# Tags that identify the host of a series, the measurements that are not
+# saved by continuous queries have one series per host unless filtered by them
+DASHBOARD_HOST_TAGS = ["fqdn", "ost_index", "mdt_index", "client_uuid",
+                       "disk_index"]
+# Should be the same with the default collect_interval of esmon_install.conf
+DASHBOARD_COLLECT_INTERVAL = 60
+# Typical time ranges of the dashboards, used to estimate the points scanned
+DASHBOARD_TIME_RANGES = [("1h", 3600), ("24h", 86400), ("7d", 604800)]
+# Grafana sends the queries from the browser, which keeps at most 6
+# connections to a server. So the queries when loading a dashboard should be
+# sent in no more than two rounds.
+DASHBOARD_QUERY_BUDGET = 12
+# A panel may show a series for each client, job or OST, but should never
+# scan the series of all the combinations of two such tags
+DASHBOARD_SERIES_BUDGET = 1024
+DASHBOARD_QUERY_FROM = re.compile(r'FROM\s+(?:"([^"]+)"|/(.+?)/)\s')
+DASHBOARD_QUERY_CONDITION = re.compile(r'"(\w+)"\s*(=~|=)\s*(\'[^\']*\'|/[^/]*/)')
+DASHBOARD_QUERY_GROUP_BY = re.compile(r'GROUP BY\s+(.+)$')
+DASHBOARD_QUERY_VARIABLE = re.compile(r'\$(\w+)')
+
+DASHBOARD_AGGREGATIONS = [("min", "Minimum"), ("mean", "Average"),
+                          ("max", "Maximum")]
+
+
+class ClusterStatusItem(object):
+    """
+    Each item shown on the Cluster Status dashboard has an object of this type
+    """
+    # pylint: disable=too-few-public-methods,too-many-arguments
+    def __init__(self, field, title, measurement, select, warn, crit):
+        # field name in CLUSTER_STATUS_MEASUREMENT
+        self.csi_field = field
+        # column title on the dashboard
+        self.csi_title = title
+        # measurement collected by collectd
+        self.csi_measurement = measurement
+        # selector of the continuous query, unit conversion included
+        self.csi_select = select
+        # warning threshold
+        self.csi_warn = warn
+        # critical threshold, bigger than warn if a higher value is worse
+        self.csi_crit = crit
+
+    def csi_table_style(self):
+        """
+        Return the style of the table column, colored by the thresholds
+        """
+        if self.csi_crit > self.csi_warn:
+            thresholds = [str(self.csi_warn), str(self.csi_crit)]
+            colors = [DASHBOARD_COLOR_OK, DASHBOARD_COLOR_WARN,
+                      DASHBOARD_COLOR_CRIT]
+        else:
+            thresholds = [str(self.csi_crit), str(self.csi_warn)]
+            colors = [DASHBOARD_COLOR_CRIT, DASHBOARD_COLOR_WARN,
+                      DASHBOARD_COLOR_OK]
+        return {"alias": self.csi_title,
+                "colorMode": "cell",
+                "colors": colors,
+                "decimals": 2,
+                "pattern": self.csi_field,
+                "thresholds": thresholds,
+                "type": "number",
+                "unit": "none"}
+
+
+CLUSTER_STATUS_ITEMS = [ClusterStatusItem("cpu_idle", "Idle CPU (%)",
+                                          "aggregation.cpu-average.cpu.idle",
+                                          'last("value")', 20, 5),
+                        ClusterStatusItem("load", "Load",
+                                          "load.load.shortterm",
+                                          'last("value")', 5, 10),
+                        ClusterStatusItem("memory_free", "Free Memory (MiB)",
+                                          "memory.free.memory",
+                                          'last("value") / 1048576', 1000, 100),
+                        ClusterStatusItem("root_free",
+                                          "Free Space on Root (GiB)",
+                                          "df.root.df_complex.free",
+                                          'last("value") / 1073741824', 10, 1),
+                        ClusterStatusItem("temperature_max",
+                                          u"Max Temperature (\u00b0C)",
+                                          "aggregation.sensors-max.temperature",
+                                          'last("value")', 60, 80)]
+
+
+class LustreService(object):
+    """
+    Each PTLRPC service shown on the Lustre MDS/OSS dashboards has an object
+    of this type
+    """
+    # pylint: disable=too-few-public-methods
+    def __init__(self, prefix, name, operations, note=""):
+        # prefix of the measurements, i.e. ost_io
+        self.ls_prefix = prefix
+        # name in the titles, empty for the main service of the server
+        self.ls_name = name
+        # list of (operation, title) of the handling time rows
+        self.ls_operations = operations
+        # extra description of the service
+        self.ls_note = note
+
+
+MDS_SERVICES = [LustreService("mdt", "",
+                              [("ldlm_ibits_enqueue", "LDLM Ibits Enqueue"),
+                               ("mds_getattr", "Getattr"),
+                               ("mds_connect", "Connect"),
+                               ("mds_get_root", "Get-root"),
+                               ("mds_statfs", "Statfs"),
+                               ("mds_getxattr", "Getxattr"),
+                               ("obd_ping", "Ping")]),
+                LustreService("mdt_readpage", "Readpage",
+                              [("mds_close", "Close"),
+                               ("mds_readpage", "Readpage")]),
+                LustreService("ldlm_canceld", "LDLM Canceld", []),
+                LustreService("ldlm_cbd", "LDLM Callback", [])]
+
+OSS_SERVICES = [LustreService("ost", "", []),
+                LustreService("ost_io", "I/O",
+                              [("ost_punch", "Punch"),
+                               ("ost_read", "Read"),
+                               ("ost_write", "Write")]),
+                LustreService("ost_create", "Create", [],
+                              note="Create requests include object creation "
+                              "requests and statfs requests. "),
+                LustreService("ldlm_canceld", "LDLM Canceld", []),
+                LustreService("ldlm_cbd", "LDLM Callback", [])]
+
+
+class DashboardSpec(object):
+    """
+    Each dashboard under dashboards/ has an object of this type
+    """
+    # pylint: disable=too-few-public-methods
+    def __init__(self, fname, generate, query_budget=DASHBOARD_QUERY_BUDGET,
+                 series_budget=DASHBOARD_SERIES_BUDGET):
+        # file name under dashboards/
+        self.ds_fname = fname
+        # function to generate the dashboard
+        self.ds_generate = generate
+        # the maximum number of queries when loading the dashboard, including
+        # the queries of template variables and expanded rows
+        self.ds_query_budget = query_budget
+        # the maximum estimated number of series scanned by a panel
+        self.ds_series_budget = series_budget
+
+
+def dashboard_query(select, measurement, tags, group_by=None):
+    """
+    Return the InfluxQL query, tags is a list of (tag, value), and a value
+    quoted by slashes is a regular expression
+    """
+    if measurement.startswith("/"):
+        query = "SELECT %s FROM %s WHERE " % (select, measurement)
+    else:
+        query = 'SELECT %s FROM "%s" WHERE ' % (select, measurement)
+    for tag, value in tags:
+        if value.startswith("/"):
+            query += '"%s" =~ %s AND ' % (tag, value)
+        else:
+            query += '"%s" = \'%s\' AND ' % (tag, value)
+    query += "$timeFilter"
+    if group_by is not None:
+        query += ' GROUP BY "%s"' % group_by
+    return query
+
+
+def dashboard_variable(name, label, query, sort=1):
+    """
+    Return a template variable that only one value can be selected
+    """
+    variable = grafana.GrafanaTemplateVariable(name, label, query,
+                                               DASHBOARD_DATASOURCE)
+    variable.gtv_multi = False
+    variable.gtv_include_all = False
+    variable.gtv_sort = sort
+    return variable
+
+
+def dashboard_fs_name_variable(measurement):
+    """
+    Return the template variable of the file system name
+    """
+    return dashboard_variable("fs_name", "Filesystem Name",
+                              'SHOW TAG VALUES FROM "%s" WITH KEY = fs_name' %
+                              measurement, sort=3)
+
+
+def dashboard_fs_tag_variable(name, label, measurement, key):
+    """
+    Return the template variable of the tag values in the file system
+    """
+    return dashboard_variable(name, label,
+                              'SHOW TAG VALUES FROM "%s" WITH KEY = %s '
+                              'WHERE "fs_name" = \'$fs_name\'' %
+                              (measurement, key))
+
+
+def dashboard_fqdn_variable():
+    """
+    Return the template variable of the server hosts
+    """
+    variable = grafana.GrafanaTemplateVariable("fqdn", "Server Host Name",
+                                               'SHOW TAG VALUES FROM '
+                                               '"memory.buffered.memory" '
+                                               'WITH KEY = fqdn',
+                                               DASHBOARD_DATASOURCE)
+    variable.gtv_sort = 3
+    return variable
+
+
+def dashboard_panel_targets(panel, queries):
+    """
+    Add the targets to the panel, queries is a list of (alias, query)
+    """
+    for alias, query in queries:
+        ref_id = chr(ord("A") + len(panel.gp_targets))
+        panel.gp_targets.append(grafana.GrafanaTarget(query, ref_id=ref_id,
+                                                      alias=alias))
+
+
+def dashboard_graph(title, description, queries, unit="short", span=4):
+    """
+    Return a graph panel, queries is a list of (alias, query)
+    """
+    panel = grafana.GrafanaGraphPanel(title, DASHBOARD_DATASOURCE)
+    panel.gp_description = description
+    panel.gp_span = span
+    panel.ggp_unit = unit
+    dashboard_panel_targets(panel, queries)
+    return panel
+
+
+def dashboard_table(title, description, alias, query, unit="short", span=3):
+    """
+    Return a table panel that shows the aggregations of the series
+    """
+    # pylint: disable=too-many-arguments
+    panel = grafana.GrafanaTablePanel(title, DASHBOARD_DATASOURCE)
+    panel.gp_description = description
+    panel.gp_span = span
+    panel.gtbp_unit = unit
+    dashboard_panel_targets(panel, [(alias, query)])
+    return panel
+
+
+def dashboard_current_table(title, description, alias, query, unit="short",
+                            span=2, sort_desc=True):
+    """
+    Return a table panel that only shows the current values of the series,
+    the query should select the last values only
+    """
+    # pylint: disable=too-many-arguments
+    panel = dashboard_table(title, description, alias, query, unit=unit,
+                            span=span)
+    panel.gtbp_columns = ["Current"]
+    panel.gtbp_sort_col = 1
+    panel.gtbp_sort_desc = sort_desc
+    return panel
+
+
+def dashboard_topk_table(title, description, measurement, unit, span=6):
+    """
+    Return a table panel of the top-K written by the rollup service, which has
+    one row per rank whatever the number of keys
+    """
+    query = dashboard_query('last("key") AS "key", last("sum") AS "sum"',
+                            measurement, [("fs_name", "$fs_name")],
+                            group_by="rank")
+    panel = grafana.GrafanaTablePanel(title, DASHBOARD_DATASOURCE)
+    panel.gp_description = description
+    panel.gp_span = span
+    panel.gtbp_unit = unit
+    panel.gtbp_transform = "table"
+    panel.gtbp_string_columns = ["rank", "key"]
+    # Columns are Time, rank, key and sum
+    panel.gtbp_sort_col = 3
+    panel.gp_targets.append(grafana.GrafanaTarget(query,
+                                                  result_format="table"))
+    return panel
+
+
+def dashboard_piechart(title, description, query, span=6):
+    """
+    Return a pie chart panel, the series are grouped by tag "size"
+    """
+    panel = grafana.GrafanaPiechartPanel(title, DASHBOARD_DATASOURCE)
+    panel.gp_description = description
+    panel.gp_span = span
+    panel.gpp_combine_threshold = "0.01"
+    dashboard_panel_targets(panel, [("$tag_size", query)])
+    return panel
+
+
+def dashboard_row(title, panels, height="300px"):
+    """
+    Return a collapsed row
+    """
+    row = grafana.GrafanaRow(title)
+    row.gr_height = height
+    row.gr_panels = panels
+    return row
+
+
+def dashboard_new(title, variables, rows):
+    """
+    Return a dashboard, only the first row is expanded
+    """
+    dashboard = grafana.GrafanaDashboard(title)
+    dashboard.gd_templating.gt_list = variables
+    dashboard.gd_rows = rows
+    if len(rows) > 0:
+        rows[0].gr_collapse = False
+    return dashboard
+
+
+def dashboard_cluster_status_panel():
+    """
+    Return the table panel of the status of the hosts
+
+    All hosts are shown in one table that is filled by a single query of the
+    measurement saved by the continuous queries of CLUSTER_STATUS_ITEMS.
+    """
+    selects = []
+    styles = [{"pattern": "Time", "type": "hidden"},
+              {"alias": "Server Host Name", "pattern": "fqdn",
+               "type": "string"}]
+    description = ("#### _Warning(yellow)_ or _Critical(red)_ if the value "
+                   "reaches the threshold:\n")
+    for item in CLUSTER_STATUS_ITEMS:
+        selects.append('last("%s") AS "%s"' % (item.csi_field, item.csi_field))
+        styles.append(item.csi_table_style())
+        description += ("  * %s: warning %s, critical %s\n" %
+                        (item.csi_title, item.csi_warn, item.csi_crit))
+    description += ("\n----\n"
+                    "The system load is defined as the number of runnable "
+                    "tasks in the run-queue and is provided by many operating "
+                    "systems as a one minute average.")
+    query = dashboard_query(", ".join(selects), CLUSTER_STATUS_MEASUREMENT,
+                            [("fqdn", "/^$fqdn$/")], group_by="fqdn")
+
+    panel = grafana.GrafanaPanel(None, "Status", "table", DASHBOARD_DATASOURCE)
+    panel.gp_description = description
+    panel.gp_targets.append(grafana.GrafanaTarget(query,
+                                                  result_format="table"))
+    panel.gp_options = {"columns": [],
+                        "fontSize": "100%",
+                        "pageSize": None,
+                        "scroll": False,
+                        "showHeader": True,
+                        "sort": {"col": 1, "desc": False},
+                        "styles": styles,
+                        "transform": "table"}
+    return panel
+
+
+def dashboard_cluster_status():
+    """
+    Return the Cluster Status dashboard
+    """
+    row = dashboard_row("Status", [dashboard_cluster_status_panel()],
+                        height="250px")
+    row.gr_show_title = False
+    dashboard = dashboard_new("Cluster Status", [dashboard_fqdn_variable()],
+                              [row])
+    dashboard.gd_time = grafana.GrafanaTime("now-5m", "now")
+    return dashboard
+
+
+def dashboard_server_statistics():
+    """
+    Return the Server Statistics dashboard
+
+    The series of the same kind are got by a single query of the measurements
+    matched by a regular expression, the alias "$N" is the Nth part of the
+    measurement name split by dots.
+    """
+    tags = [("fqdn", "$fqdn")]
+    status = dashboard_cluster_status_panel()
+    status.gp_title = "General Status"
+    status.gp_span = 4
+
+    cpu = dashboard_graph("CPU Usage",
+                          "The amount of time spent by the CPU in various "
+                          "states, most notably executing user code, "
+                          "executing system code, waiting for IO-operations "
+                          "and being idle.",
+                          [("$3", dashboard_query('"value"',
+                                                  r"/^aggregation\.cpu-average\.cpu\./",
+                                                  tags))],
+                          unit="percent")
+    cpu.ggp_stack = True
+    cpu.ggp_min = 0
+
+    memory = dashboard_graph("Memory Usage",
+                             "The values are reported by the operating "
+                             "system. The categories are used, buffered, "
+                             "cached, free, slab_recl and slab_unrecl.\n\n"
+                             "----\n"
+                             "_Free memory_ is memory you paid for, that's "
+                             "using power and that doesn't do anything "
+                             "useful. It is normal that the operating system "
+                             "puts that memory to use.",
+                             [("$1", dashboard_query('"value"',
+                                                     r"/^memory\.[^.]+\.memory$/",
+                                                     tags))],
+                             unit="bytes")
+    memory.ggp_stack = True
+    general_row = dashboard_row("General Status, CPU and Memory",
+                                [cpu, status, memory], height="250px")
+
+    disk_write = dashboard_graph("Disk Write Rate",
+                                 "The writing rate of each disk.",
+                                 [("$1", dashboard_query('"value"',
+                                                         r"/^disk\..+\.disk_octets\.write$/",
+                                                         tags))],
+                                 unit="Bps")
+    disk_read = dashboard_graph("Disk Read Rate",
+                                "The reading rate of each disk.",
+                                [("$1", dashboard_query('"value"',
+                                                        r"/^disk\..+\.disk_octets\.read$/",
+                                                        tags))],
+                                unit="Bps")
+    root = dashboard_graph("Disk Usage on Root",
+                           "The usage of the disk which is mounted as Root. "
+                           "The categories are free, used and reserved.",
+                           [("$3", dashboard_query('"value"',
+                                                   r"/^df\.root\.df_complex\./",
+                                                   tags))],
+                           unit="decbytes")
+    root.ggp_stack = True
+    disk_row = dashboard_row("Disk", [disk_write, disk_read, root],
+                             height="250px")
+
+    load = dashboard_graph("Load",
+                           "The system load is defined as the number of "
+                           "runnable tasks in the run-queue and is provided "
+                           "by many operating systems as:\n"
+                           "  - shortterm: one minute average\n"
+                           "  - midterm: five minutes average\n"
+                           "  - longterm: fifteen minutes average",
+                           [("$2", dashboard_query('"value"',
+                                                   r"/^load\.load\./",
+                                                   tags))])
+    uptime = dashboard_graph("Uptime",
+                             "The time since the system was booted.",
+                             [("Uptime", dashboard_query('"value"',
+                                                         "uptime.uptime",
+                                                         tags))],
+                             unit="s")
+    users = dashboard_graph("Users",
+                            "The number of users currently logged into the "
+                            "system.",
+                            [("Users", dashboard_query('"value"',
+                                                       "users.users", tags))])
+    load_row = dashboard_row("Load, Uptime and Users", [load, uptime, users],
+                             height="250px")
+
+    temperature = dashboard_graph("Temperature",
+                                  "The temperature collected by the sensors "
+                                  "of the system.",
+                                  [("", dashboard_query('"value"',
+                                                        r"/^sensors\..+\.temperature\./",
+                                                        tags))],
+                                  unit="celsius", span=12)
+    temperature_row = dashboard_row("Temperature", [temperature],
+                                    height="250px")
+
+    fqdn = dashboard_variable("fqdn", "Server Host Name",
+                              'SHOW TAG VALUES FROM "memory.buffered.memory" '
+                              'WITH KEY = fqdn', sort=3)
+    return dashboard_new("Server Statistics", [fqdn],
+                         [general_row, disk_row, load_row, temperature_row])
+
+
+def dashboard_service_rows(service, server, tags):
+    """
+    Return the rows of the PTLRPC service, each row shows the minimum,
+    average and maximum values of a service stat
+    """
+    # pylint: disable=too-many-locals
+    if service.ls_name == "":
+        prefix = ""
+        timeout_title = "Adaptive Timeout Value"
+    else:
+        prefix = service.ls_name + " "
+        timeout_title = "Adaptive Timeout Value of %s Service" % service.ls_name
+    value_sentence = ("The value shown in this graph is the %s " +
+                      "during the last collect interval.")
+    # list of (stat, title, description, select, unit)
+    stats = [("req_active",
+              "Number of Active %sRequests" % prefix,
+              "Active requests are the requests that are being actively "
+              "handled by this %s, not including the requests that are "
+              "waiting in the queue. If the number of active requests is "
+              "smaller than PTLRPC thread number minus two (one for incoming "
+              "request handling and the other for incoming high priority "
+              "request handling), it generally means the thread number "
+              "should be enough. " % server + service.ls_note +
+              value_sentence % "%s number",
+              '"value"', "short"),
+             ("req_qdepth",
+              "Number of Incoming %sRequests" % prefix,
+              "Incoming requests are the requests that are waiting on "
+              "preprocessing. A request is not an incoming request any more "
+              "when its preprocessing begins. And after preprocessing, the "
+              "requests will be put into the processing queue. " +
+              service.ls_note +
+              value_sentence % "%s number of incoming requests",
+              '"value"', "short"),
+             ("req_waittime",
+              "Wait Time of %sRequests" % prefix,
+              "The wait time of a request is the time interval between its "
+              "arrival time and the time when it starts to be handled. " +
+              service.ls_note +
+              value_sentence % "%s wait time of the requests",
+              '"value" * 1000', "ns"),
+             ("req_timeout",
+              timeout_title,
+              "When a client sends a request, it has a timeout deadline for "
+              "the reply. The timeout value of a service is an adaptive "
+              "value negotiated between server and client during run-time. " +
+              service.ls_note +
+              value_sentence % "%s timeout of the service",
+              '"value"', "s"),
+             ("reqbuf_avail",
+              "Number of Available %sRequest Buffers" % prefix,
+              "When a request arrives, one request buffer will be used. When "
+              "the number of available request buffers is under low water, "
+              "more buffers are needed to avoid performance bottleneck. " +
+              service.ls_note +
+              value_sentence % "%s number",
+              '"value"', "short")]
+    for operation, title in service.ls_operations:
+        stats.append((operation,
+                      "Handling Time of %s Requests" % title,
+                      "The handling time of a request is the time interval "
+                      "between the time when it starts to be handled and the "
+                      "time when the handling finishes. " +
+                      value_sentence %
+                      ("%%s handling time of the %s requests" % title),
+                      '"value" * 1000', "ns"))
+
+    rows = []
+    for stat, title, description, select, unit in stats:
+        panels = []
+        for suffix, aggregation in DASHBOARD_AGGREGATIONS:
+            measurement = "%s_stats_%s_%s" % (service.ls_prefix, stat, suffix)
+            panel_title = "%s %s" % (aggregation, title)
+            panel = dashboard_graph(panel_title,
+                                    description % aggregation.lower(),
+                                    [(panel_title,
+                                      dashboard_query(select, measurement,
+                                                      tags))],
+                                    unit=unit)
+            if unit == "short":
+                panel.ggp_decimals = 0
+            elif unit == "s":
+                panel.ggp_right_axis = True
+            panels.append(panel)
+        rows.append(dashboard_row(title, panels))
+    return rows
+
+
+def dashboard_quantile_graph(title, description, measurement, tags, scale,
+                             unit, span=4):
+    """
+    Return a graph of the quantiles written by the rollup service
+    """
+    # pylint: disable=too-many-arguments
+    columns = []
+    for field, name in [("p50", "p50"), ("p90", "p90"), ("p99", "p99"),
+                        ("p999", "p99.9")]:
+        columns.append('"%s"%s AS "%s"' % (field, scale, name))
+    query = dashboard_query(", ".join(columns), measurement, tags)
+    return dashboard_graph(title, description + " Written by the streaming "
+                           "rollup service.", [("$col", query)], unit=unit,
+                           span=span)
+
+
+def dashboard_service_quantile_rows(services, server):
+    """
+    Return the rows of the quantiles of the service times of all servers
+    """
+    waittime_panels = []
+    handling_panels = []
+    for service in services:
+        if service.ls_name == "":
+            prefix = ""
+        else:
+            prefix = service.ls_name + " "
+        title = "Wait Time of %sRequests" % prefix
+        description = ("The quantiles of the wait time of the %srequests on "
+                       "all %ss." % (prefix, server))
+        measurement = "qsk_%s_stats_req_waittime" % service.ls_prefix
+        waittime_panels.append(dashboard_quantile_graph(title, description,
+                                                        measurement, [],
+                                                        " * 1000", "ns",
+                                                        span=3))
+        for operation, operation_title in service.ls_operations:
+            title = "Handling Time of %s Requests" % operation_title
+            description = ("The quantiles of the handling time of the %s "
+                           "requests on all %ss." % (operation_title, server))
+            measurement = "qsk_%s_stats_%s" % (service.ls_prefix, operation)
+            handling_panels.append(dashboard_quantile_graph(title, description,
+                                                            measurement, [],
+                                                            " * 1000", "ns"))
+    rows = [dashboard_row("Quantiles of Request Wait Time of All %ss" % server,
+                          waittime_panels)]
+    if len(handling_panels) > 0:
+        rows.append(dashboard_row("Quantiles of Request Handling Time of "
+                                  "All %ss" % server, handling_panels))
+    return rows
+
+
+def dashboard_lustre_mds():
+    """
+    Return the Lustre MDS dashboard
+    """
+    rows = []
+    for service in MDS_SERVICES:
+        rows += dashboard_service_rows(service, "MDS", [("fqdn", "$mds")])
+    rows += dashboard_service_quantile_rows(MDS_SERVICES, "MDS")
+    variables = [dashboard_fs_name_variable("mdt_filesinfo_free"),
+                 dashboard_fs_tag_variable("mds", "MDS", "mdt_filesinfo_free",
+                                           "fqdn")]
+    return dashboard_new("Lustre MDS", variables, rows)
+
+
+def dashboard_lustre_oss():
+    """
+    Return the Lustre OSS dashboard
+    """
+    tags = [("fs_name", "$fs_name"), ("fqdn", "$oss")]
+    panels = []
+    for optype, title in [(None, "I/O"), ("write", "Write"),
+                          ("read", "Read")]:
+        if optype is None:
+            query = dashboard_query('"sum"', "cqm_ost_stats_bytes-fqdn-fs_name",
+                                    tags)
+        else:
+            query = dashboard_query('"sum"',
+                                    "cqm_ost_stats_bytes-fqdn-fs_name-optype",
+                                    tags + [("optype", optype)])
+        panel = dashboard_graph("%s Throughput" % title,
+                                "The %s throughput on this OSS." %
+                                title.replace("Write", "write").replace("Read", "read"),
+                                [("%s Throughput" % title, query)],
+                                unit="Bps")
+        panel.ggp_min = 0
+        panels.append(panel)
+    rows = [dashboard_row("I/O Bandwidth", panels)]
+
+    for service in OSS_SERVICES:
+        rows += dashboard_service_rows(service, "OSS", [("fqdn", "$oss")])
+    rows += dashboard_service_quantile_rows(OSS_SERVICES, "OSS")
+    variables = [dashboard_fs_name_variable("ost_kbytesinfo_free"),
+                 dashboard_fs_tag_variable("oss", "OSS", "ost_kbytesinfo_free",
+                                           "fqdn")]
+    return dashboard_new("Lustre OSS", variables, rows)
+
+
+def dashboard_usage_row(title, target_type, prefix, tags, optype, unit):
+    """
+    Return the row of the free/used capacity or inode number of an MDT/OST
+    """
+    # pylint: disable=too-many-arguments
+    if optype == "usage_kbytes":
+        what = "Capacity"
+        measurement = "%s_kbytesinfo" % prefix
+    else:
+        what = "Inode Number"
+        measurement = "%s_filesinfo" % prefix
+    panels = []
+    for usage_type in ["free", "used"]:
+        panel_title = "%s %s" % (usage_type.capitalize(), what)
+        panel = dashboard_graph(panel_title,
+                                "%s on this %s." % (panel_title, target_type),
+                                [(panel_title,
+                                  dashboard_query('"value"',
+                                                  "%s_%s" % (measurement, usage_type),
+                                                  tags))],
+                                unit=unit, span=3)
+        panel.ggp_min = 0
+        panels.append(panel)
+    for owner, tag, alias in [("user", "user_id", "UID=$tag_user_id"),
+                              ("group", "group_id", "GID=$tag_group_id")]:
+        query = dashboard_query('"value"', "%s_acct%s_samples" % (prefix, owner),
+                                tags + [("optype", optype)], group_by=tag)
+        panels.append(dashboard_table("Used %s per %s" %
+                                      (what, owner.capitalize()),
+                                      "The used %s of each %s." %
+                                      (what.lower(), owner),
+                                      alias, query, unit=unit))
+    return dashboard_row(title, panels)
+
+
+def dashboard_ldlm_recovery_rows(target_type, prefix, tags):
+    """
+    Return the rows of the LDLM locks and the recovery status of an MDT/OST
+    """
+    lock_count = dashboard_graph("LDLM Lock Count",
+                                 "LDLM lock number allocated on this %s." %
+                                 target_type,
+                                 [("LDLM Lock Count",
+                                   dashboard_query('"value"',
+                                                   "%s_lock_count" % prefix,
+                                                   tags))],
+                                 span=6)
+    lock_timeouts = dashboard_graph("LDLM Lock Timeouts",
+                                    "Number of times this %s evicted clients "
+                                    "due to lack of reply to ASTs." %
+                                    target_type,
+                                    [("LDLM Lock Timeouts",
+                                      dashboard_query('"value"',
+                                                      "%s_lock_timeouts" % prefix,
+                                                      tags))],
+                                    span=6)
+    recovery = dashboard_graph("Number of Recovery Clients",
+                               "When Lustre OST/MDT service re-mounted, a "
+                               "recovery process will be started to recover "
+                               "the connections to the clients.\n\n"
+                               "evicted_clients: The number of clients that "
+                               "have been evicted during the recovery "
+                               "process.\n\n"
+                               "connected_clients: The number of clients that "
+                               "connected successfully.\n\n"
+                               "recoverable_clients: The maximum number of "
+                               "clients that can possibily be recovered.",
+                               [("$tag_optype",
+                                 dashboard_query('"value"',
+                                                 "%s_recovery_status" % prefix,
+                                                 tags, group_by="optype"))],
+                               span=12)
+    for panel in [lock_count, lock_timeouts, recovery]:
+        panel.ggp_decimals = 0
+    return [dashboard_row("LDLM Lock", [lock_count, lock_timeouts]),
+            dashboard_row("Recovery Status", [recovery])]
+
+
+def dashboard_brw_stats_rows(field, measurement_format, tags):
+    """
+    Return the rows of the BRW stats of OSTs, all sizes of a BRW stat are got
+    by a single query grouped by tag "size". The pie charts only select the
+    last values.
+    """
+    # list of (row title, [(stat, title format, description)], span)
+    brw_stats = [("Discontiguous Pages/Blocks",
+                  [("page_discontiguous_rpc",
+                    "Distribution of Discontiguous Pages in Each %s I/O",
+                    "If the next page to be written or read in the I/O is not "
+                    "with the next offset, that page is a discontiguous page. "
+                    "There could be multiple discontiguous pages in an I/O. "
+                    "I/Os with less discontiguous pages are more friendly to "
+                    "OSDs."),
+                   ("block_discontiguous_rpc",
+                    "Distribution of Discontiguous Blocks in Each %s I/O",
+                    "If the next block to be written or read in the I/O is "
+                    "not with the next offset, that block is a discontiguous "
+                    "block. There could be multiple discontiguous blocks in "
+                    "an I/O. I/Os with less discontiguous blocks are more "
+                    "friendly to OSDs. One page contains multiple blocks. The "
+                    "block size is determined by underlying file system "
+                    "(Ldiskfs or ZFS).")], 3),
+                 ("I/O Fragments",
+                  [("fragmented_io",
+                    "Distribution of Fragments in Each %s I/O",
+                    "Sometimes an I/O is not able to be written/read in a "
+                    "single BIO on OST, instead, multiple BIOs are submitted. "
+                    "The fragment number of this I/O equals to the BIO "
+                    "number. Usually, less fragments in the I/Os mean better "
+                    "performance.")], 6),
+                 ("In-flight I/O Number",
+                  [("io_in_flight",
+                    "Distribution of In-flight I/O Number when Starting Each "
+                    "%s I/O",
+                    "The in-flight I/O number means the BIOs that have "
+                    "started but not ended yet. When starting a BIO, the "
+                    "current in-flight I/O number will be collected. More "
+                    "in-flight I/Os means more concurrent I/Os on the OST, "
+                    "and thus heavier load for the OST.")], 6),
+                 ("Distribution of I/O Time",
+                  [("io_time",
+                    "Distribution of %s I/O Time",
+                    "The I/O time is the elapsed time between an I/O (Not "
+                    "BIO. A single I/O could submit multiple BIOs) starts and "
+                    "ends. Less I/O time is better.")], 6),
+                 ("Distribution of I/O Size",
+                  [("io_size",
+                    "Distribution of %s I/O Size on Disk",
+                    "The I/O size on disk is the size of submitted BIO. "
+                    "Usually, bigger I/O size means better performance.")], 6)]
+    rpc_measurement = measurement_format % "rpc_bulk_samples"
+    panels = []
+    for sample, title in [("write_sample", "Write"), ("read_sample", "Read")]:
+        sample_tags = tags + [("field", sample)]
+        graph = dashboard_graph("%s Bulk RPC Rate per Size" % title,
+                                "The number of %s bulk RPCs of each size." %
+                                title.lower(),
+                                [("$tag_size",
+                                  dashboard_query('"%s"' % field,
+                                                  rpc_measurement, sample_tags,
+                                                  group_by="size"))],
+                                span=3)
+        graph.ggp_stack = True
+        piechart = dashboard_piechart("Size Distribution of %s Bulk RPC" % title,
+                                      "The distribution of the %s bulk RPC "
+                                      "sizes." % title.lower(),
+                                      dashboard_query('last("%s")' % field,
+                                                      rpc_measurement,
+                                                      sample_tags,
+                                                      group_by="size"),
+                                      span=3)
+        piechart.gpp_combine_threshold = ""
+        panels += [graph, piechart]
+    rows = [dashboard_row("RPC Size", panels)]
+
+    for row_title, stats, span in brw_stats:
+        panels = []
+        for stat, title_format, description in stats:
+            measurement = measurement_format % (stat + "_samples")
+            for sample, title in [("write_sample", "Write"),
+                                  ("read_sample", "Read")]:
+                query = dashboard_query('last("%s")' % field, measurement,
+                                        tags + [("field", sample)],
+                                        group_by="size")
+                panels.append(dashboard_piechart(title_format % title,
+                                                 description, query,
+                                                 span=span))
+        rows.append(dashboard_row(row_title, panels))
+    return rows
+
+
+def dashboard_jobstats_row(fs_tags, ost_tags, cqm_ost_prefix, field):
+    """
+    Return the row of the I/O throughput and metadata rate of each job
+    """
+    io_query = dashboard_query('"sum"', cqm_ost_prefix, ost_tags,
+                               group_by="job_id")
+    if field == "sum":
+        measurement = "cqm_ost_jobstats_bytes-fs_name-job_id-optype"
+    else:
+        measurement = "ost_jobstats_bytes"
+    panels = [dashboard_table("I/O Throughput per Job",
+                              "The I/O throughput of each job.",
+                              "$tag_job_id", io_query, unit="Bps")]
+    for optype, title in [("sum_write_bytes", "Write"),
+                          ("sum_read_bytes", "Read")]:
+        query = dashboard_query('"%s"' % field, measurement,
+                                ost_tags + [("optype", optype)],
+                                group_by="job_id")
+        panels.append(dashboard_table("%s Throughput per Job" % title,
+                                      "The %s throughput of each job." %
+                                      title.lower(),
+                                      "$tag_job_id", query, unit="Bps"))
+    query = dashboard_query('"sum"', "cqm_mdt_jobstats_samples-fs_name-job_id",
+                            fs_tags, group_by="job_id")
+    panels.append(dashboard_table("Metadata Performance per Job",
+                                  "The metadata operation rate of each job.",
+                                  "$tag_job_id", query, unit="ops"))
+    return dashboard_row("Bandwidth and Metadata Rate per Job", panels,
+                         height="280px")
+
+
+def dashboard_lustre_mdt():
+    """
+    Return the Lustre MDT dashboard
+    """
+    tags = [("fs_name", "$fs_name"), ("mdt_index", "$mdt_index")]
+    rows = [dashboard_usage_row("Inode Number", "MDT", "mdt", tags,
+                                "usage_inodes", "short")]
+    rows += dashboard_ldlm_recovery_rows("MDT", "mdt", tags)
+    variables = [dashboard_fs_name_variable("mdt_filesinfo_free"),
+                 dashboard_fs_tag_variable("mdt_index", "MDT Index",
+                                           "mdt_filesinfo_free", "mdt_index")]
+    return dashboard_new("Lustre MDT", variables, rows)
+
+
+def dashboard_lustre_ost():
+    """
+    Return the Lustre OST dashboard
+    """
+    fs_tags = [("fs_name", "$fs_name")]
+    tags = fs_tags + [("ost_index", "$ost_index")]
+    rows = [dashboard_usage_row("Capacity", "OST", "ost", tags,
+                                "usage_kbytes", "deckbytes"),
+            dashboard_usage_row("Inode Number", "OST", "ost", tags,
+                                "usage_inodes", "short")]
+
+    panels = []
+    for optype, title in [(None, "I/O"), ("write", "Write"),
+                          ("read", "Read")]:
+        if optype is None:
+            query = dashboard_query('"sum"',
+                                    "cqm_ost_stats_bytes-fs_name-ost_index",
+                                    tags)
+        else:
+            query = dashboard_query('"value"', "ost_stats_bytes",
+                                    tags + [("optype", optype)])
+        panel = dashboard_graph("%s Throughput" % title,
+                                "The %s throughput on this OST." %
+                                title.replace("Write", "write").replace("Read", "read"),
+                                [("%s Throughput" % title, query)],
+                                unit="Bps")
+        panel.ggp_min = 0
+        panels.append(panel)
+    rows.append(dashboard_row("I/O Bandwidth", panels))
+    rows += dashboard_brw_stats_rows("value", "ost_brw_stats_%s", tags)
+
+    panels = []
+    for optype, title in [("write", "Write"), ("read", "Read")]:
+        query = dashboard_query('"value"', "exp_ost_stats_bytes",
+                                tags + [("optype", optype)],
+                                group_by="exp_client")
+        panels.append(dashboard_table("%s Throughput per Client" % title,
+                                      "The %s throughput of each client." %
+                                      title.lower(),
+                                      "$tag_exp_client", query, unit="Bps",
+                                      span=6))
+    rows.append(dashboard_row("Write/Read Bandwidth per Client", panels))
+    rows.append(dashboard_jobstats_row(fs_tags, tags,
+                                       "cqm_ost_jobstats_bytes-fs_name-job_id-ost_index",
+                                       "value"))
+    rows += dashboard_ldlm_recovery_rows("OST", "ost", tags)
+    variables = [dashboard_fs_name_variable("ost_kbytesinfo_free"),
+                 dashboard_fs_tag_variable("ost_index", "OST Index",
+                                           "ost_kbytesinfo_free", "ost_index")]
+    return dashboard_new("Lustre OST", variables, rows)
+
+
+def dashboard_lustre_statistics():
+    """
+    Return the Lustre Statistics dashboard
+
+    The tables only showing the current values select the last values only.
+    """
+    # pylint: disable=too-many-locals
+    tags = [("fs_name", "$fs_name")]
+    rows = []
+    # list of (row title, measurement name, target measurement prefix,
+    #          target type, optype, unit)
+    usages = [("Capacity", "Capacity", "ost_kbytesinfo", "ost", "OST",
+               "usage_kbytes", "deckbytes"),
+              ("Inode Number", "Inode Number", "mdt_filesinfo", "mdt", "MDT",
+               "usage_inodes", "short")]
+    for row_title, what, measurement, prefix, target_type, optype, unit in usages:
+        panels = []
+        for usage_type in ["free", "used"]:
+            title = "%s %s" % (usage_type.capitalize(), what)
+            panel = dashboard_graph("%s in Total" % title,
+                                    "%s of the whole file system." % title,
+                                    [(title,
+                                      dashboard_query('"sum"',
+                                                      "cqm_%s_%s-fs_name" %
+                                                      (measurement, usage_type),
+                                                      tags))],
+                                    unit=unit, span=2)
+            panel.ggp_min = 0
+            panels.append(panel)
+        for usage_type in ["free", "used"]:
+            title = "%s %s per %s" % (usage_type.capitalize(), what, target_type)
+            query = dashboard_query('last("value")',
+                                    "%s_%s" % (measurement, usage_type), tags,
+                                    group_by="%s_index" % prefix)
+            panels.append(dashboard_current_table(title,
+                                                  "%s %s on each %s." %
+                                                  (usage_type.capitalize(),
+                                                   what.lower(), target_type),
+                                                  "$tag_%s_index" % prefix,
+                                                  query, unit=unit,
+                                                  sort_desc=(usage_type == "used")))
+        for owner, tag, alias in [("user", "user_id", "UID=$tag_user_id"),
+                                  ("group", "group_id", "GID=$tag_group_id")]:
+            if owner == "user":
+                measurement_name = ("cqm_%s_acctuser_samples-fs_name-optype-user_id" %
+                                    prefix)
+            else:
+                measurement_name = ("cqm_%s_acctgroup_samples-fs_name-group_id-optype" %
+                                    prefix)
+            query = dashboard_query('last("sum")', measurement_name,
+                                    tags + [("optype", optype)], group_by=tag)
+            panels.append(dashboard_current_table("Used %s per %s" %
+                                                  (what, owner.capitalize()),
+                                                  "The used %s of each %s." %
+                                                  (what.lower(), owner),
+                                                  alias, query, unit=unit))
+        rows.append(dashboard_row(row_title, panels))
+
+    panel = dashboard_graph("I/O Throughput in Total",
+                            "I/O throughput of the whole file system.",
+                            [("$tag_optype",
+                              dashboard_query('"sum"',
+                                              "cqm_ost_stats_bytes-fs_name-optype",
+                                              tags, group_by="optype"))],
+                            unit="Bps", span=3)
+    panels = [panel,
+              dashboard_table("I/O Throughput per OST",
+                              "The I/O throughput of each OST.",
+                              "$tag_ost_index",
+                              dashboard_query('"sum"',
+                                              "cqm_ost_stats_bytes-fs_name-ost_index",
+                                              tags, group_by="ost_index"),
+                              unit="Bps")]
+    for optype, title in [("write", "Write"), ("read", "Read")]:
+        query = dashboard_query('"value"', "ost_stats_bytes",
+                                tags + [("optype", optype)],
+                                group_by="ost_index")
+        panels.append(dashboard_table("%s Throughput per OST" % title,
+                                      "The %s throughput of each OST." %
+                                      title.lower(),
+                                      "$tag_ost_index", query, unit="Bps"))
+    rows.append(dashboard_row("I/O Bandwidth", panels))
+
+    panels = [dashboard_graph("Metadata Operation Rate in Total",
+                              "Metadata operation rate of the whole file "
+                              "system.",
+                              [("Metadata Operation Rate",
+                                dashboard_query('"sum"', "cqm_md_stats-fs_name",
+                                                tags))],
+                              unit="ops", span=3)]
+    for measurement, what, tag in [("cqm_md_stats-fs_name-mdt_index", "MDT",
+                                    "mdt_index"),
+                                   ("cqm_exp_md_stats-exp_client-fs_name",
+                                    "Client", "exp_client"),
+                                   ("cqm_md_stats-fs_name-optype", "Type",
+                                    "optype")]:
+        panels.append(dashboard_table("Metadata Operation Rate per %s" % what,
+                                      "The metadata operation rate of each "
+                                      "%s." % what.lower(),
+                                      "$tag_%s" % tag,
+                                      dashboard_query('"sum"', measurement,
+                                                      tags, group_by=tag),
+                                      unit="ops"))
+    rows.append(dashboard_row("Metadata Operation Rate", panels))
+    rows += dashboard_brw_stats_rows("sum",
+                                     "cqm_ost_brw_stats_%s-field-fs_name-size",
+                                     tags)
+    panels = []
+    for sample, title in [("write_sample", "Write"), ("read_sample", "Read")]:
+        panels.append(dashboard_quantile_graph("Quantiles of %s I/O Time" %
+                                               title,
+                                               "The quantiles of the %s I/O "
+                                               "time on all OSTs." %
+                                               title.lower(),
+                                               "qsk_ost_brw_stats_io_time_samples-field-fs_name",
+                                               tags + [("field", sample)],
+                                               "", "ms", span=6))
+    rows.append(dashboard_row("Quantiles of I/O Time", panels))
+
+    panels = []
+    for optype, title in [("write", "Write"), ("read", "Read")]:
+        query = dashboard_query('"sum"',
+                                "cqm_exp_ost_stats_bytes-exp_client-fs_name-optype",
+                                tags + [("optype", optype)],
+                                group_by="exp_client")
+        panels.append(dashboard_table("%s Throughput per Client" % title,
+                                      "The %s throughput of each client." %
+                                      title.lower(),
+                                      "$tag_exp_client", query, unit="Bps",
+                                      span=6))
+    rows.append(dashboard_row("Write/Read Bandwidth per Client", panels))
+    rows.append(dashboard_jobstats_row(tags, tags,
+                                       "cqm_ost_jobstats_bytes-fs_name-job_id",
+                                       "sum"))
+    panels = []
+    for measurement, what, unit in [("topk_ost_jobstats_bytes-fs_name-job_id",
+                                     "I/O Throughput per Job", "Bps"),
+                                    ("topk_mdt_jobstats_samples-fs_name-job_id",
+                                     "Metadata Performance per Job", "ops"),
+                                    ("topk_exp_ost_stats_bytes-fs_name-exp_client",
+                                     "I/O Throughput per Client", "Bps"),
+                                    ("topk_exp_md_stats-fs_name-exp_client",
+                                     "Metadata Performance per Client", "ops")]:
+        panels.append(dashboard_topk_table("Top %s" % what,
+                                           "The heavy hitters of the last "
+                                           "hour, and the sum of the others. "
+                                           "Written by the streaming rollup "
+                                           "service.", measurement, unit))
+    rows.append(dashboard_row("Top Talkers", panels))
+    variables = [dashboard_fs_name_variable("ost_kbytesinfo_free")]
+    return dashboard_new("Lustre Statistics", variables, rows)
+
+
+def dashboard_lustre_user():
+    """
+    Return the Lustre User dashboard
+    """
+    tags = [("fs_name", "$fs_name")]
+    io_query = dashboard_query('"sum"', "cqm_ost_jobstats_bytes-fs_name-uid",
+                               tags, group_by="uid")
+    md_query = dashboard_query('"sum"', "cqm_mdt_jobstats_samples-fs_name-uid",
+                               tags, group_by="uid")
+    panels = [dashboard_table("I/O Throughput per User",
+                              "The I/O throughput of each user.",
+                              "$tag_uid", io_query, unit="Bps")]
+    for optype, title in [("sum_write_bytes", "Write"),
+                          ("sum_read_bytes", "Read")]:
+        query = dashboard_query('"sum"',
+                                "cqm_ost_jobstats_bytes-fs_name-optype-uid",
+                                tags + [("optype", optype)], group_by="uid")
+        panels.append(dashboard_table("%s Throughput per User" % title,
+                                      "The %s throughput of each user." %
+                                      title.lower(),
+                                      "$tag_uid", query, unit="Bps"))
+    panels.append(dashboard_table("Metadata Performance per User",
+                                  "The metadata operation rate of each user.",
+                                  "$tag_uid", md_query, unit="ops"))
+    rows = [dashboard_row("Bandwidth and Metadata Rate per User", panels)]
+
+    panels = [dashboard_graph("I/O Throughput per User",
+                              "The I/O throughput of each user.",
+                              [("$tag_uid", io_query)], unit="Bps", span=6),
+              dashboard_graph("Metadata Performance per User",
+                              "The metadata operation rate of each user.",
+                              [("$tag_uid", md_query)], unit="ops", span=6)]
+    rows.append(dashboard_row("Bandwidth and Metadata Rate History per User",
+                              panels))
+
+    panels = []
+    for measurement, what, unit in [("topk_ost_jobstats_bytes-fs_name-uid",
+                                     "I/O Throughput", "Bps"),
+                                    ("topk_mdt_jobstats_samples-fs_name-uid",
+                                     "Metadata Performance", "ops")]:
+        panels.append(dashboard_topk_table("Top Users of %s" % what,
+                                           "The heavy hitters of the last "
+                                           "hour, and the sum of the others. "
+                                           "Written by the streaming rollup "
+                                           "service.", measurement, unit))
+    rows.append(dashboard_row("Top Users", panels))
+    variables = [dashboard_fs_name_variable("ost_kbytesinfo_free")]
+    return dashboard_new("Lustre User", variables, rows)
+
+
+def dashboard_lustre_client():
+    """
+    Return the Lustre Client dashboard
+
+    The latencies of all operations are got by a single query of the
+    measurements matched by a regular expression.
+    """
+    tags = [("fs_name", "$fs_name"), ("client_uuid", "$client_uuid")]
+    panels = []
+    for suffix, aggregation in [("max", "Maximum"), ("mean", "Average")]:
+        query = dashboard_query('"value"', "/^client_stats_.+_%s$/" % suffix,
+                                tags)
+        panel = dashboard_graph("%s Latency of Client Operations" %
+                                aggregation,
+                                "The %s latency of each operation on this "
+                                "client during the last collect interval." %
+                                aggregation.lower(),
+                                [("$measurement", query)], span=12)
+        panel.ggp_decimals = 0
+        panels.append(panel)
+    rows = [dashboard_row("Client Operation Latency", panels)]
+    variables = [dashboard_fs_name_variable("client_stats_open_max"),
+                 dashboard_fs_tag_variable("client_uuid", "Client UUID",
+                                           "client_stats_open_max",
+                                           "client_uuid")]
+    return dashboard_new("Lustre Client", variables, rows)
+
+
+def dashboard_sfa_disk(disk_type, prefix, iops_per_interval):
+    """
+    Return the SFA Physical/Virtual Disk dashboard
+
+    "$COLLECT_INTERVAL" is replaced by the installer, and all buckets of an
+    I/O size or latency histogram are got by a single query.
+    """
+    tags = [("fqdn", "$fqdn"), ("disk_index", "$disk_index")]
+    suffix = ' on %s Disk "$disk_index" of SFA "$fqdn"' % disk_type
+    rate_measurement = "%s_rate" % prefix
+
+    def rate_graph(title, rate_type, unit, span, label=None, select='"value"'):
+        """
+        Return the graph of the rate grouped by controller
+        """
+        # pylint: disable=too-many-arguments
+        panel = dashboard_graph(title + suffix, "",
+                                [("Controller $tag_controller",
+                                  dashboard_query(select, rate_measurement,
+                                                  tags + [("type", rate_type)],
+                                                  group_by="controller"))],
+                                unit=unit, span=span)
+        panel.ggp_stack = True
+        panel.ggp_label = label
+        return panel
+
+    if iops_per_interval:
+        iops_select = '"value" / $COLLECT_INTERVAL'
+    else:
+        iops_select = '"value"'
+    rows = [dashboard_row("Performance, IOPS and I/O Size",
+                          [rate_graph("I/O Performance", "KiBps", "KBs", 4),
+                           rate_graph("IOPS", "iops", "short", 4,
+                                      label="IOs/sec", select=iops_select),
+                           rate_graph("Bytes per I/O", "KiBpIO", "kbytes", 4)],
+                          height="250px"),
+            dashboard_row("Write/Read Performance",
+                          [rate_graph("Write Performance", "W_KiBps", "KBs", 6),
+                           rate_graph("Read Performance", "R_KiBps", "KBs", 6)],
+                          height="250px")]
+
+    for row_title, what, tag, unit in [("Write/Read I/O Size Distribution",
+                                        "I/O Size", "iosize", "short"),
+                                       ("Write/Read Latency Distribution",
+                                        "Latency", "latency", "none")]:
+        panels = []
+        for io_type, title in [("write", "Write"), ("read", "Read")]:
+            query = dashboard_query('"value" / $COLLECT_INTERVAL',
+                                    "%s_%s" % (prefix, tag),
+                                    tags + [("type", io_type)], group_by=tag)
+            panel = dashboard_graph("%s %s Samples%s" % (title, what, suffix),
+                                    "", [("$tag_%s" % tag, query)],
+                                    unit=unit, span=6)
+            panel.ggp_stack = True
+            panel.ggp_label = "Samples/s"
+            panels.append(panel)
+        rows.append(dashboard_row(row_title, panels, height="250px"))
+
+    rows.append(dashboard_row("Forwarding Performance and IOPS",
+                              [rate_graph("Forwarding I/O Performance",
+                                          "Fwd_KiBps", "KBs", 6),
+                               rate_graph("Forwarding IOPS", "Fwd_iops",
+                                          "short", 6, label="IOs/sec")],
+                              height="250px"))
+    iosize_measurement = "%s_iosize" % prefix
+    variables = [dashboard_variable("fqdn", "SFA Name",
+                                    'SHOW TAG VALUES FROM "%s" WITH KEY = fqdn' %
+                                    iosize_measurement, sort=3),
+                 dashboard_variable("disk_index", "Disk Index",
+                                    'SHOW TAG VALUES FROM "%s" WITH KEY = '
+                                    'disk_index WHERE "fqdn" = \'$fqdn\'' %
+                                    iosize_measurement, sort=3)]
+    return dashboard_new("SFA %s Disk" % disk_type, variables, rows)
+
+
+def dashboard_sfa_physical_disk():
+    """
+    Return the SFA Physical Disk dashboard
+    """
+    return dashboard_sfa_disk("Physical", "pd", True)
+
+
+def dashboard_sfa_virtual_disk():
+    """
+    Return the SFA Virtual Disk dashboard
+    """
+    return dashboard_sfa_disk("Virtual", "vd", False)
+
+
+# Key is the file name under dashboards/
+ESMON_DASHBOARDS = {}
+for DASHBOARD_SPEC in [DashboardSpec("SFA_physical_disk.json.template",
+                                     dashboard_sfa_physical_disk),
+                       DashboardSpec("SFA_virtual_disk.json.template",
+                                     dashboard_sfa_virtual_disk),
+                       DashboardSpec("cluster_status.json",
+                                     dashboard_cluster_status),
+                       DashboardSpec("lustre_client.json",
+                                     dashboard_lustre_client),
+                       DashboardSpec("lustre_mds.json", dashboard_lustre_mds),
+                       DashboardSpec("lustre_mdt.json", dashboard_lustre_mdt),
+                       DashboardSpec("lustre_oss.json", dashboard_lustre_oss),
+                       DashboardSpec("lustre_ost.json", dashboard_lustre_ost),
+                       DashboardSpec("lustre_statistics.json",
+                                     dashboard_lustre_statistics),
+                       DashboardSpec("lustre_user.json", dashboard_lustre_user),
+                       DashboardSpec("server_statistics.json",
+                                     dashboard_server_statistics)]:
+    ESMON_DASHBOARDS[DASHBOARD_SPEC.ds_fname] = DASHBOARD_SPEC
+
+
+def dashboard_json(dashboard):
+    """
+    Return the Json string of the dashboard
+    """
+    return json.dumps(dashboard, cls=grafana.GrafanaEncoder, indent=2,
+                      separators=(',', ': '), sort_keys=True) + "\n"
+
+
+def dashboard_rollup_filter(dashboard, rollup_measurements):
+    """
+    Remove the panels that query the measurements of the streaming rollup
+    service which are not in rollup_measurements, and the rows left empty.
+    The measurements don't exist if the rollup service is disabled.
+    """
+    rows = []
+    for row in dashboard["rows"]:
+        panels = []
+        for panel in row["panels"]:
+            missing = False
+            for target in panel.get("targets", []):
+                match = DASHBOARD_QUERY_FROM.search(target.get("query", ""))
+                if match is None or match.group(1) is None:
+                    continue
+                measurement = match.group(1)
+                if (measurement.startswith(DASHBOARD_ROLLUP_PREFIXES) and
+                        measurement not in rollup_measurements):
+                    missing = True
+            if not missing:
+                panels.append(panel)
+        if len(panels) > 0:
+            row["panels"] = panels
+            rows.append(row)
+    dashboard["rows"] = rows
+    return dashboard
+
+
+def dashboard_query_series(query, multi_variables):
+    """
+    Return the estimated number of series scanned by the query
+    """
+    match = DASHBOARD_QUERY_FROM.search(query)
+    if match is None:
+        return 1
+    measurement = match.group(1)
+    if measurement is None:
+        series = DASHBOARD_REGEX_MEASUREMENTS
+        measurement = match.group(2)
+    else:
+        series = 1
+
+    # Tags that are filtered to one value
+    pinned_tags = []
+    # Tags that could have all of their values scanned
+    scanned_tags = []
+    for tag, operator, value in DASHBOARD_QUERY_CONDITION.findall(query):
+        if operator == "=":
+            pinned_tags.append(tag)
+            continue
+        variables = DASHBOARD_QUERY_VARIABLE.findall(value)
+        if len(variables) == 0:
+            scanned_tags.append(tag)
+            continue
+        for variable in variables:
+            if variable in multi_variables:
+                scanned_tags.append(tag)
+                break
+        else:
+            pinned_tags.append(tag)
+
+    match = DASHBOARD_QUERY_GROUP_BY.search(query)
+    if match is not None:
+        for tag in re.findall(r'"(\w+)"', match.group(1)):
+            if tag not in pinned_tags:
+                scanned_tags.append(tag)
+
+    for tag in set(scanned_tags):
+        series *= DASHBOARD_TAG_CARDINALITY.get(tag,
+                                                DASHBOARD_TAG_CARDINALITY_DEFAULT)
+
+    if not measurement.startswith(DASHBOARD_AGGREGATED_PREFIXES):
+        for tag in DASHBOARD_HOST_TAGS:
+            if tag in pinned_tags or tag in scanned_tags:
+                break
+        else:
+            series *= DASHBOARD_TAG_CARDINALITY["fqdn"]
+    return series
+
+
+class DashboardPanelCost(object):
+    """
+    The estimated cost of a panel
+    """
+    # pylint: disable=too-few-public-methods
+    def __init__(self, row_title, panel_title, lazy, queries, series):
+        # pylint: disable=too-many-arguments
+        self.dpc_row_title = row_title
+        self.dpc_panel_title = panel_title
+        # whether the panel is not queried until its row is expanded
+        self.dpc_lazy = lazy
+        self.dpc_queries = queries
+        self.dpc_series = series
+
+    def dpc_row(self):
+        """
+        Return the columns of the report
+        """
+        row = [self.dpc_row_title, self.dpc_panel_title,
+               "yes" if self.dpc_lazy else "no",
+               str(self.dpc_queries), str(self.dpc_series)]
+        for _, seconds in DASHBOARD_TIME_RANGES:
+            row.append(str(self.dpc_series * seconds /
+                           DASHBOARD_COLLECT_INTERVAL))
+        return row
+
+
+def dashboard_costs(dashboard):
+    """
+    Return the number of queries when loading the dashboard and the costs of
+    the panels, dashboard is the dict loaded from the Json
+    """
+    multi_variables = []
+    load_queries = 0
+    for variable in dashboard["templating"]["list"]:
+        if variable["type"] != "query":
+            continue
+        load_queries += 1
+        if variable["multi"] or variable["includeAll"]:
+            multi_variables.append(variable["name"])
+
+    costs = []
+    for row in dashboard["rows"]:
+        for panel in row["panels"]:
+            queries = 0
+            series = 0
+            for target in panel["targets"]:
+                if target.get("hide"):
+                    continue
+                queries += 1
+                series += dashboard_query_series(target["query"],
+                                                 multi_variables)
+            if not row["collapse"]:
+                load_queries += queries
+            costs.append(DashboardPanelCost(row["title"], panel["title"],
+                                            row["collapse"], queries, series))
+    return load_queries, costs
+
+
+def dashboard_cost_table(costs):
+    """
+    Return the costs of the panels formatted as a table
+    """
+    titles = ["ROW", "PANEL", "LAZY", "QUERIES", "SERIES"]
+    for name, _ in DASHBOARD_TIME_RANGES:
+        titles.append("POINTS_%s" % name.upper())
+    rows = [titles]
+    for cost in costs:
+        rows.append(cost.dpc_row())
+
+    widths = [max(len(row[i]) for row in rows) for i in range(len(titles))]
+    lines = []
+    for row in rows:
+        lines.append("  ".join(value.ljust(widths[i])
+                               for i, value in enumerate(row)).rstrip())
+    return "\n".join(lines)
+
+
+def esmon_dashboard_lint(dashboard_dir):
+    """
+    Check whether the dashboards are up to date and within the budgets
+    """
+    ret = 0
+    for fname in sorted(os.listdir(dashboard_dir)):
+        if fname not in ESMON_DASHBOARDS:
+            logging.error("dashboard [%s] is not generated from the specs, "
+                          "please add it to ESMON_DASHBOARDS",
+                          os.path.join(dashboard_dir, fname))
+            ret = -1
+
+    for fname in sorted(ESMON_DASHBOARDS.keys()):
+        spec = ESMON_DASHBOARDS[fname]
+        fpath = os.path.join(dashboard_dir, fname)
+        dashboard_string = dashboard_json(spec.ds_generate())
+        if not os.path.isfile(fpath):
+            logging.error("dashboard [%s] does not exist, please generate it",
+                          fpath)
+            ret = -1
+        else:
+            with open(fpath) as json_file:
+                if json_file.read() != dashboard_string:
+                    logging.error("dashboard [%s] is not up to date with the "
+                                  "specs, please regenerate it", fpath)
+                    ret = -1
+
+        load_queries, costs = dashboard_costs(json.loads(dashboard_string))
+        print("%s: %d queries when loading, budget %d" %
+              (fname, load_queries, spec.ds_query_budget))
+        print(dashboard_cost_table(costs) + "\n")
+        if load_queries > spec.ds_query_budget:
+            logging.error("dashboard [%s] sends [%d] queries when loading, "
+                          "exceeds the budget [%d]", fname, load_queries,
+                          spec.ds_query_budget)
+            ret = -1
+        for cost in costs:
+            if cost.dpc_series > spec.ds_series_budget:
+                logging.error("panel [%s] of dashboard [%s] scans about [%d] "
+                              "series, exceeds the budget [%d]",
+                              cost.dpc_panel_title, fname, cost.dpc_series,
+                              spec.ds_series_budget)
+                ret = -1
+    return ret
+
+
+def esmon_dashboard_generate(dashboard_dir):
+    """
+    Generate the dashboards into the directory
+    """
+    for fname in sorted(ESMON_DASHBOARDS.keys()):
+        dashboard = ESMON_DASHBOARDS[fname].ds_generate()
+        fpath = os.path.join(dashboard_dir, fname)
+        with open(fpath, "w") as json_file:
+            json_file.write(dashboard_json(dashboard))
+        logging.info("generated dashboard [%s]", fpath)
+    return 0
+
+
+def usage():
+    """
+    Print usage string
+    """
+    utils.eprint("Usage: %s <generate|lint> <dashboard_dir>" %
+                 sys.argv[0])
+
+
+def main():
+    """
+    Generate or lint the Grafana dashboards of ESMON
+    """
+    if len(sys.argv) != 3:
+        usage()
+        sys.exit(-1)
+    command = sys.argv[1]
+    dashboard_dir = sys.argv[2]
+
+    logging.basicConfig(level=logging.INFO)
+    if command == "generate":
+        ret = esmon_dashboard_generate(dashboard_dir)
+        if ret:
+            logging.error("failed to generate dashboards into [%s]",
+                          dashboard_dir)
+    elif command == "lint":
+        ret = esmon_dashboard_lint(dashboard_dir)
+        if ret:
+            logging.error("dashboards in [%s] failed the lint",
+                          dashboard_dir)
+    else:
+        usage()
+        ret = -1
+    sys.exit(ret)
@@ -0,0 +1,534 @@
+# Copyright (c) 2017 DataDirect Networks, Inc.
+# All Rights Reserved.
+# Author: lixi@ddn.com
+"""
+Find the imbalanced, hot or nearly full OSTs/MDTs
+
+The series of all targets of a metric are pulled from Influxdb by one query,
+and put into a matrix with a row for each target and a column for each time
+bucket. The statistics of all targets are then computed at once by NumPy, so
+that thousands of targets can be analyzed in seconds.
+"""
+import sys
+import time
+import logging
+import traceback
+import json
+import yaml
+import numpy
+
+from pyesmon import utils
+from pyesmon import esmon_common
+from pyesmon import esmon_influxdb
+from pyesmon import esmon_install_nodeps
+from pyesmon import esmon_storage
+
+# The default hours of the data to analyze
+ESMON_IMBALANCE_HOURS = 24
+# The number of time buckets in the window
+ESMON_IMBALANCE_BUCKETS = 96
+# Targets with larger z-score than this are hot spots
+ESMON_IMBALANCE_Z_WARN = 3.0
+# Targets that would be full within these days are flagged
+ESMON_IMBALANCE_FULL_DAYS_WARN = 14
+# Targets that are used more than this ratio are flagged
+ESMON_IMBALANCE_USED_RATIO_WARN = 0.9
+ESMON_IMBALANCE_PERCENTS = [50, 95, 99]
+# The measurements that the summaries are published to
+ESMON_IMBALANCE_MEASUREMENT = "esmon_imbalance"
+ESMON_IMBALANCE_TARGET_MEASUREMENT = "esmon_imbalance_target"
+
+ESMON_IMBALANCE_COLUMNS = [("fs_name", "FS"),
+                           ("metric", "METRIC"),
+                           ("targets", "TARGETS"),
+                           ("mean", "MEAN"),
+                           ("max", "MAX"),
+                           ("max_target", "MAX_TARGET"),
+                           ("max_ratio", "MAX/MEAN"),
+                           ("cv", "CV"),
+                           ("p50", "P50"),
+                           ("p95", "P95"),
+                           ("p99", "P99"),
+                           ("flagged", "FLAGGED"),
+                           ("min_full_days", "MIN_FULL_DAYS")]
+ESMON_IMBALANCE_TARGET_COLUMNS = [("fs_name", "FS"),
+                                  ("metric", "METRIC"),
+                                  ("target", "TARGET"),
+                                  ("value", "VALUE"),
+                                  ("z", "Z"),
+                                  ("used_ratio", "USED_RATIO"),
+                                  ("full_days", "FULL_DAYS"),
+                                  ("note", "NOTE")]
+
+
+class ImbalanceMetric(object):
+    """
+    A metric of the OSTs or MDTs
+    """
+    # pylint: disable=too-few-public-methods,too-many-arguments
+    def __init__(self, name, measurement, field, target_tag,
+                 free_measurement=None):
+        self.im_name = name
+        self.im_measurement = measurement
+        self.im_field = field
+        self.im_target_tag = target_tag
+        # The measurement of the free space if this is a usage of space
+        self.im_free_measurement = free_measurement
+
+
+ESMON_IMBALANCE_METRICS = [ImbalanceMetric("ost_throughput",
+                                           "cqm_ost_stats_bytes-fs_name-ost_index",
+                                           "sum", "ost_index"),
+                           ImbalanceMetric("mdt_ops",
+                                           "cqm_md_stats-fs_name-mdt_index",
+                                           "sum", "mdt_index"),
+                           ImbalanceMetric("ost_kbytes_used",
+                                           "ost_kbytesinfo_used",
+                                           "value", "ost_index",
+                                           free_measurement="ost_kbytesinfo_free"),
+                           ImbalanceMetric("mdt_files_used",
+                                           "mdt_filesinfo_used",
+                                           "value", "mdt_index",
+                                           free_measurement="mdt_filesinfo_free")]
+
+
+def imbalance_float(value):
+    """
+    Return the value as float, None if it is NaN or infinite
+    """
+    value = float(value)
+    if numpy.isnan(value) or numpy.isinf(value):
+        return None
+    return value
+
+
+def imbalance_nan_mean(matrix, axis):
+    """
+    Return the mean of the values that are not NaN along the axis
+    """
+    valid = ~numpy.isnan(matrix)
+    counts = valid.sum(axis=axis)
+    sums = numpy.nansum(matrix, axis=axis)
+    with numpy.errstate(invalid="ignore", divide="ignore"):
+        means = sums / counts
+    means[counts == 0] = numpy.nan
+    return means
+
+
+def imbalance_nan_std(matrix, axis):
+    """
+    Return the standard deviation of the values that are not NaN along the
+    axis
+    """
+    means = numpy.expand_dims(imbalance_nan_mean(matrix, axis), axis)
+    return numpy.sqrt(imbalance_nan_mean((matrix - means) ** 2, axis))
+
+
+def imbalance_percentiles(matrix, percent):
+    """
+    Return the percentile of the values that are not NaN in each column
+    """
+    # NaN is sorted to the end
+    sorted_matrix = numpy.sort(matrix, axis=0)
+    counts = (~numpy.isnan(matrix)).sum(axis=0)
+    columns = numpy.arange(matrix.shape[1])
+    positions = numpy.maximum(counts - 1, 0) * (percent / 100.0)
+    lower = numpy.floor(positions).astype(int)
+    upper = numpy.clip(lower + 1, 0, numpy.maximum(counts - 1, 0))
+    fractions = positions - lower
+    values = (sorted_matrix[lower, columns] * (1 - fractions) +
+              sorted_matrix[upper, columns] * fractions)
+    values[counts == 0] = numpy.nan
+    return values
+
+
+def imbalance_last(matrix):
+    """
+    Return the last value that is not NaN in each row
+    """
+    valid = ~numpy.isnan(matrix)
+    indexes = matrix.shape[1] - 1 - numpy.argmax(valid[:, ::-1], axis=1)
+    values = matrix[numpy.arange(matrix.shape[0]), indexes]
+    values[~valid.any(axis=1)] = numpy.nan
+    return values
+
+
+def imbalance_slopes(times, matrix):
+    """
+    Return the slope of the least squares line of each row
+    """
+    valid = ~numpy.isnan(matrix)
+    # Relative times keep the precision of the sums of squares
+    times = times - times[0]
+    times = numpy.where(valid, times[numpy.newaxis, :], 0.0)
+    values = numpy.where(valid, matrix, 0.0)
+    counts = valid.sum(axis=1)
+    sum_t = numpy.sum(times, axis=1)
+    sum_v = numpy.sum(values, axis=1)
+    sum_tt = (times * times).sum(axis=1)
+    sum_tv = (times * values).sum(axis=1)
+    denominators = counts * sum_tt - sum_t * sum_t
+    with numpy.errstate(invalid="ignore", divide="ignore"):
+        slopes = (counts * sum_tv - sum_t * sum_v) / denominators
+    slopes[(counts < 2) | (denominators == 0)] = numpy.nan
+    return slopes
+
+
+class ImbalanceSeries(object):
+    """
+    The series of all targets of a metric in a file system
+    """
+    # pylint: disable=too-few-public-methods
+    def __init__(self, fs_name, targets, times, matrix):
+        self.ims_fs_name = fs_name
+        self.ims_targets = targets
+        # Start second of each bucket
+        self.ims_times = times
+        # A row for each target and a column for each bucket
+        self.ims_matrix = matrix
+
+    def ims_align(self, targets):
+        """
+        Return the matrix with the rows in the order of the targets
+        """
+        rows = dict((target, index)
+                    for index, target in enumerate(self.ims_targets))
+        matrix = numpy.empty((len(targets), self.ims_matrix.shape[1]))
+        matrix.fill(numpy.nan)
+        for index, target in enumerate(targets):
+            if target in rows:
+                matrix[index] = self.ims_matrix[rows[target]]
+        return matrix
+
+
+def esmon_imbalance_series(client, measurement, field, target_tag, hours):
+    """
+    Return the series of each file system in a dict with fs_name as key
+    """
+    window = hours * 3600
+    bucket = max(window / ESMON_IMBALANCE_BUCKETS, 1)
+    end = int(time.time()) / bucket * bucket + bucket
+    start = end - ESMON_IMBALANCE_BUCKETS * bucket
+    query = ('SELECT mean("%s") FROM "%s" WHERE time >= %ds AND time < %ds '
+             'GROUP BY time(%ds), "fs_name", "%s" fill(none)' %
+             (field, measurement, start, end, bucket, target_tag))
+    result = esmon_storage.esmon_storage_query(client, query, epoch="s")
+    if result is None:
+        return None
+
+    fs_series = {}
+    for serie in result.get("series", []):
+        tags = serie.get("tags", {})
+        fs_name = tags.get("fs_name", "")
+        target = tags.get(target_tag, "")
+        if target == "":
+            continue
+        fs_series.setdefault(fs_name, []).append((target,
+                                                  serie.get("values", [])))
+
+    times = numpy.arange(start, end, bucket, dtype=float)
+    series = {}
+    for fs_name, target_values in fs_series.iteritems():
+        target_values.sort()
+        matrix = numpy.empty((len(target_values), ESMON_IMBALANCE_BUCKETS))
+        matrix.fill(numpy.nan)
+        for row, (_, values) in enumerate(target_values):
+            if len(values) == 0:
+                continue
+            points = numpy.array(values, dtype=float)
+            columns = ((points[:, 0] - start) / bucket).astype(int)
+            in_window = (columns >= 0) & (columns < ESMON_IMBALANCE_BUCKETS)
+            matrix[row, columns[in_window]] = points[in_window, 1]
+        targets = [name for name, _ in target_values]
+        series[fs_name] = ImbalanceSeries(fs_name, targets, times, matrix)
+    return series
+
+
+def esmon_imbalance_analyze(metric, used, free):
+    """
+    Return the summary and the flagged targets of the metric of a file system
+    """
+    # pylint: disable=too-many-locals
+    targets = used.ims_targets
+    target_means = imbalance_nan_mean(used.ims_matrix, 1)
+    mean = float(imbalance_nan_mean(target_means[numpy.newaxis, :], 1)[0])
+    std = float(imbalance_nan_std(target_means[numpy.newaxis, :], 1)[0])
+    with numpy.errstate(invalid="ignore", divide="ignore"):
+        z_scores = (target_means - mean) / std
+
+    # The percentiles across the targets in each bucket, the latest bucket
+    # with data is reported
+    bucket_counts = (~numpy.isnan(used.ims_matrix)).sum(axis=0)
+    percentiles = {}
+    for percent in ESMON_IMBALANCE_PERCENTS:
+        values = imbalance_percentiles(used.ims_matrix, percent)
+        values = values[bucket_counts > 0]
+        if len(values) == 0:
+            percentiles[percent] = None
+        else:
+            percentiles[percent] = float(values[-1])
+
+    used_ratios = None
+    full_days = None
+    if free is not None:
+        used_last = imbalance_last(used.ims_matrix)
+        free_last = imbalance_last(free.ims_align(targets))
+        with numpy.errstate(invalid="ignore", divide="ignore"):
+            used_ratios = used_last / (used_last + free_last)
+            # Slope is the growth per second
+            slopes = imbalance_slopes(used.ims_times, used.ims_matrix)
+            full_days = free_last / slopes / 86400
+            full_days[~(slopes > 0)] = numpy.nan
+
+    flagged = numpy.zeros(len(targets), dtype=bool)
+    with numpy.errstate(invalid="ignore"):
+        flagged |= z_scores > ESMON_IMBALANCE_Z_WARN
+        if free is not None:
+            flagged |= used_ratios > ESMON_IMBALANCE_USED_RATIO_WARN
+            flagged |= full_days < ESMON_IMBALANCE_FULL_DAYS_WARN
+
+    summary = {"fs_name": used.ims_fs_name,
+               "metric": metric.im_name,
+               "targets": len(targets),
+               "mean": None,
+               "max": None,
+               "max_target": None,
+               "max_ratio": None,
+               "cv": None,
+               "p50": percentiles[50],
+               "p95": percentiles[95],
+               "p99": percentiles[99],
+               "flagged": int(flagged.sum()),
+               "min_full_days": None}
+    if not numpy.isnan(mean):
+        max_index = int(numpy.nanargmax(target_means))
+        summary["mean"] = mean
+        summary["max"] = float(target_means[max_index])
+        summary["max_target"] = targets[max_index]
+        if mean != 0:
+            summary["max_ratio"] = summary["max"] / mean
+            summary["cv"] = imbalance_float(std / mean)
+    if full_days is not None and (~numpy.isnan(full_days)).any():
+        summary["min_full_days"] = float(numpy.nanmin(full_days))
+
+    flagged_targets = []
+    for index in numpy.nonzero(flagged)[0]:
+        target = {"fs_name": used.ims_fs_name,
+                  "metric": metric.im_name,
+                  "target": targets[index],
+                  "value": imbalance_float(target_means[index]),
+                  "z": imbalance_float(z_scores[index]),
+                  "used_ratio": None,
+                  "full_days": None,
+                  "note": ""}
+        notes = []
+        if z_scores[index] > ESMON_IMBALANCE_Z_WARN:
+            notes.append("hot")
+        if used_ratios is not None and not numpy.isnan(used_ratios[index]):
+            target["used_ratio"] = imbalance_float(used_ratios[index])
+            if used_ratios[index] > ESMON_IMBALANCE_USED_RATIO_WARN:
+                notes.append("nearly full")
+        if full_days is not None and not numpy.isnan(full_days[index]):
+            target["full_days"] = imbalance_float(full_days[index])
+            if full_days[index] < ESMON_IMBALANCE_FULL_DAYS_WARN:
+                notes.append("filling up")
+        target["note"] = ", ".join(notes)
+        flagged_targets.append(target)
+    flagged_targets.sort(key=lambda target: -(target["z"] or 0))
+    return summary, flagged_targets
+
+
+def esmon_imbalance_lines(summaries, targets):
+    """
+    Return the summaries and the flagged targets in line protocol
+    """
+    lines = []
+    for measurement, items, tags in [(ESMON_IMBALANCE_MEASUREMENT, summaries,
+                                      ["fs_name", "metric"]),
+                                     (ESMON_IMBALANCE_TARGET_MEASUREMENT,
+                                      targets, ["fs_name", "metric", "target"])]:
+        for item in items:
+            key = measurement
+            for tag in tags:
+                if item[tag] != "":
+                    key += ",%s=%s" % (tag, esmon_imbalance_escape(item[tag]))
+            fields = []
+            for name, value in sorted(item.iteritems()):
+                if name in tags or value is None:
+                    continue
+                if isinstance(value, basestring):
+                    fields.append('%s="%s"' % (name,
+                                               value.replace('"', '\\"')))
+                else:
+                    fields.append("%s=%r" % (name, float(value)))
+            lines.append("%s %s" % (key, ",".join(fields)))
+    return lines
+
+
+def esmon_imbalance_escape(value):
+    """
+    Escape the tag value of line protocol
+    """
+    return (value.replace(",", "\\,").replace("=", "\\=")
+            .replace(" ", "\\ "))
+
+
+def esmon_imbalance_table(items, columns):
+    """
+    Return the dicts formatted as a table
+    """
+    rows = [[title for _, title in columns]]
+    for item in items:
+        row = []
+        for key, _ in columns:
+            value = item[key]
+            if value is None:
+                value = "-"
+            elif isinstance(value, float):
+                value = "%.2f" % value
+            row.append(str(value))
+        rows.append(row)
+
+    widths = [max(len(row[i]) for row in rows)
+              for i in range(len(columns))]
+    lines = []
+    for row in rows:
+        lines.append("  ".join(value.ljust(widths[i])
+                               for i, value in enumerate(row)).rstrip())
+    return "\n".join(lines)
+
+
+def esmon_imbalance(config_fpath, json_output, publish, hours):
+    """
+    Print the imbalance of the OSTs/MDTs
+    """
+    # pylint: disable=bare-except,too-many-return-statements,too-many-locals
+    config_fd = open(config_fpath)
+    ret = 0
+    try:
+        config = yaml.load(config_fd)
+    except:
+        logging.error("not able to load [%s] as yaml file: %s", config_fpath,
+                      traceback.format_exc())
+        ret = -1
+    config_fd.close()
+    if ret:
+        return -1
+
+    ret, server_host, _ = esmon_storage.esmon_storage_parse_config(config,
+                                                                   config_fpath)
+    if ret:
+        logging.error("failed to parse config [%s]", config_fpath)
+        return -1
+
+    client = esmon_influxdb.InfluxdbClient(server_host.sh_hostname,
+                                           esmon_install_nodeps.INFLUXDB_DATABASE_NAME)
+    summaries = []
+    targets = []
+    for metric in ESMON_IMBALANCE_METRICS:
+        used_series = esmon_imbalance_series(client, metric.im_measurement,
+                                             metric.im_field,
+                                             metric.im_target_tag, hours)
+        if used_series is None:
+            logging.error("failed to get the series of measurement [%s]",
+                          metric.im_measurement)
+            return -1
+
+        free_series = None
+        if metric.im_free_measurement is not None:
+            free_series = esmon_imbalance_series(client,
+                                                 metric.im_free_measurement,
+                                                 metric.im_field,
+                                                 metric.im_target_tag, hours)
+            if free_series is None:
+                logging.error("failed to get the series of measurement [%s]",
+                              metric.im_free_measurement)
+                return -1
+
+        for fs_name in sorted(used_series.keys()):
+            free = None
+            if free_series is not None:
+                free = free_series.get(fs_name)
+                if free is None:
+                    logging.warning("no series of measurement [%s] of file "
+                                    "system [%s]", metric.im_free_measurement,
+                                    fs_name)
+                    continue
+            summary, flagged_targets = \
+                esmon_imbalance_analyze(metric, used_series[fs_name], free)
+            summaries.append(summary)
+            targets += flagged_targets
+
+    if json_output:
+        print(json.dumps({"summaries": summaries, "targets": targets},
+                         indent=4, separators=(',', ': ')))
+    else:
+        print(esmon_imbalance_table(summaries, ESMON_IMBALANCE_COLUMNS))
+        if len(targets) > 0:
+            print("")
+            print(esmon_imbalance_table(targets,
+                                        ESMON_IMBALANCE_TARGET_COLUMNS))
+
+    if not publish or len(summaries) == 0:
+        return 0
+    ret = client.ic_write(esmon_imbalance_lines(summaries, targets))
+    if ret:
+        logging.error("failed to publish the imbalance summaries to server "
+                      "[%s]", server_host.sh_hostname)
+        return -1
+    return 0
+
+
+def usage():
+    """
+    Print usage string
+    """
+    utils.eprint("Usage: %s [--json] [--publish] [--hours <number>] "
+                 "[config_file]\n"
+                 "    --publish: write the summaries to measurements [%s] and "
+                 "[%s]\n"
+                 "    --hours: the hours of data to analyze, default %d" %
+                 (sys.argv[0], ESMON_IMBALANCE_MEASUREMENT,
+                  ESMON_IMBALANCE_TARGET_MEASUREMENT, ESMON_IMBALANCE_HOURS))
+
+
+def main():
+    """
+    Find the imbalanced, hot or nearly full OSTs/MDTs
+    """
+    reload(sys)
+    sys.setdefaultencoding("utf-8")
+    config_fpath = esmon_common.ESMON_INSTALL_CONFIG
+    json_output = False
+    publish = False
+    hours = ESMON_IMBALANCE_HOURS
+
+    args = sys.argv[1:]
+    while len(args) > 0 and args[0].startswith("--"):
+        if args[0] == "--json":
+            json_output = True
+            args = args[1:]
+        elif args[0] == "--publish":
+            publish = True
+            args = args[1:]
+        elif args[0] == "--hours" and len(args) > 1 and args[1].isdigit():
+            hours = int(args[1])
+            args = args[2:]
+        else:
+            usage()
+            sys.exit(-1)
+    if len(args) == 1:
+        config_fpath = args[0]
+    elif len(args) > 1 or hours == 0:
+        usage()
+        sys.exit(-1)
+
+    utils.configure_logging()
+    console_handler = utils.LOGGING_HANLDERS["console"]
+    console_handler.setLevel(logging.WARNING)
+
+    ret = esmon_imbalance(config_fpath, json_output, publish, hours)
+    if ret:
+        logging.error("failed to analyze the imbalance of OSTs/MDTs")
+        sys.exit(ret)
+    sys.exit(0)
@@ -7,12 +7,102 @@ Library for access Influxdb through HTTP API
 import logging
 import traceback
 import sys
+import re
 import httplib
 import requests
 
 from pyesmon import time_util
 from pyesmon import utils
 
+# Seconds of the duration units of InfluxQL
+INFLUXDB_DURATION_UNITS = {"ns": 0.000000001,
+                           "u": 0.000001,
+                           "ms": 0.001,
+                           "s": 1,
+                           "m": 60,
+                           "h": 3600,
+                           "d": 86400,
+                           "w": 604800}
+INFLUXDB_DURATION_PATTERN = re.compile(r"(\d+)(ns|u|ms|s|m|h|d|w)")
+INFLUXDB_CQ_GROUP_BY_TIME_PATTERN = re.compile(r"GROUP BY time\((\w+)\)",
+                                               re.IGNORECASE)
+INFLUXDB_CQ_RESAMPLE_PATTERN = re.compile(r"\s*RESAMPLE(\s+EVERY\s+(\w+))?"
+                                          r"(\s+FOR\s+(\w+))?",
+                                          re.IGNORECASE)
+INFLUXDB_CQ_BEGIN_PATTERN = re.compile(r"\s+BEGIN\s", re.IGNORECASE)
+
+
+def influxdb_duration_parse(duration):
+    """
+    Return the seconds of the InfluxQL duration, e.g. "1h30m", None if invalid
+    """
+    seconds = 0
+    position = 0
+    for match in INFLUXDB_DURATION_PATTERN.finditer(duration):
+        if match.start() != position:
+            return None
+        seconds += int(match.group(1)) * INFLUXDB_DURATION_UNITS[match.group(2)]
+        position = match.end()
+    if position == 0 or position != len(duration):
+        return None
+    return seconds
+
+
+def influxdb_cq_intervals(query):
+    """
+    Return the seconds of the GROUP BY time(), RESAMPLE EVERY and RESAMPLE FOR
+    of the continuous query, EVERY and FOR default to the GROUP BY interval
+    """
+    match = INFLUXDB_CQ_GROUP_BY_TIME_PATTERN.search(query)
+    if match is None:
+        return None, None, None
+    group_by = influxdb_duration_parse(match.group(1))
+    every = group_by
+    resample_for = group_by
+    match = INFLUXDB_CQ_RESAMPLE_PATTERN.search(query)
+    if match is not None:
+        if match.group(2) is not None:
+            every = influxdb_duration_parse(match.group(2))
+        if match.group(4) is not None:
+            resample_for = influxdb_duration_parse(match.group(4))
+    return group_by, every, resample_for
+
+
+def influxdb_cq_resample_valid(query, cq_time):
+    """
+    Return the GROUP BY time(), RESAMPLE EVERY and RESAMPLE FOR of the
+    continuous query if it is tuned with a RESAMPLE clause that is still valid
+    for the interval cq_time, otherwise return None
+    """
+    group_by, every, resample_for = influxdb_cq_intervals(query)
+    # The tuning is invalid if the interval has been changed
+    if group_by != cq_time or every is None or resample_for is None:
+        return None
+    if every % cq_time != 0:
+        return None
+    if every == group_by and resample_for == group_by:
+        return None
+    return group_by, every, resample_for
+
+
+def influxdb_cq_resample_clause(every, resample_for):
+    """
+    Return the RESAMPLE clause of the continuous query
+    """
+    return "RESAMPLE EVERY %ds FOR %ds" % (every, resample_for)
+
+
+def influxdb_cq_resample(query, resample_clause):
+    """
+    Return the continuous query with the RESAMPLE clause replaced, the clause
+    is removed if resample_clause is empty
+    """
+    query = INFLUXDB_CQ_RESAMPLE_PATTERN.sub("", query, count=1)
+    if resample_clause == "":
+        return query
+    return INFLUXDB_CQ_BEGIN_PATTERN.sub(" %s BEGIN " % resample_clause, query,
+                                         count=1)
+
 
 class InfluxdbClient(object):
     """
@@ -33,13 +123,17 @@ class InfluxdbClient(object):
         }
         self.ic_session = requests.Session()
 
-    def ic_query(self, query, epoch=None):
+    def ic_query(self, query, epoch=None, chunk_size=None):
         """
         Send a query to InfluxDB.
         :param epoch: response timestamps to be in epoch format either 'h',
             'm', 's', 'ms', 'u', or 'ns',defaults to `None` which is
             RFC3339 UTC format with nanosecond precision
         :type epoch: str
+        :param chunk_size: if not `None`, the points are streamed back in
+            chunks of this size, each line of the response is a JSON
+            document that should be read by iter_lines()
+        :type chunk_size: int
         """
         # pylint: disable=bare-except
         params = {}
@@ -49,12 +143,17 @@ class InfluxdbClient(object):
         if epoch is not None:
             params['epoch'] = epoch
 
+        if chunk_size is not None:
+            params['chunked'] = 'true'
+            params['chunk_size'] = chunk_size
+
         logging.debug("querying [%s] to [%s]", query, self.ic_queryurl)
         try:
             response = self.ic_session.request(method='GET',
                                                url=self.ic_queryurl,
                                                params=params,
-                                               headers=self.ic_headers)
+                                               headers=self.ic_headers,
+                                               stream=chunk_size is not None)
         except:
             logging.error("got exception with query [%s]: %s", query,
                           traceback.format_exc())
@@ -62,6 +161,36 @@ class InfluxdbClient(object):
 
         return response
 
+    def ic_write(self, lines, precision="s", retention_policy=None):
+        """
+        Write the points in line protocol to InfluxDB, return 0 on success
+        """
+        # pylint: disable=bare-except
+        params = {}
+        params['db'] = self.ic_database
+        params['precision'] = precision
+        if retention_policy is not None:
+            params['rp'] = retention_policy
+
+        logging.debug("writing [%d] points to [%s]", len(lines),
+                      self.ic_baseurl)
+        try:
+            response = self.ic_session.request(method='POST',
+                                               url=self.ic_baseurl + "/write",
+                                               params=params,
+                                               data="\n".join(lines))
+        except:
+            logging.error("got exception when writing [%d] points: %s",
+                          len(lines), traceback.format_exc())
+            return -1
+
+        if response.status_code != httplib.NO_CONTENT:
+            logging.error("got InfluxDB status [%d] when writing [%d] "
+                          "points: %s", response.status_code, len(lines),
+                          response.text)
+            return -1
+        return 0
+
 
 def esmon_influxdb_query(influx_server, influx_database,
                          query_string):
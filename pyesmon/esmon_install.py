@@ -98,7 +98,8 @@ class EsmonInstallServer(object):
 
         command = ("cd %s && rpm -ivh %s" %
                    (rpm_dir, matched_fname))
-        retval = self.eis_host.sh_run(command)
+        retval = self.eis_host.sh_run(command,
+                                      tail_size=ssh_host.COMMAND_OUTPUT_TAIL_SIZE)
         if retval.cr_exit_status:
             logging.error("failed to run command [%s] on host [%s], "
                           "ret = [%d], stdout = [%s], stderr = [%s]",
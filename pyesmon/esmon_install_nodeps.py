@@ -13,6 +13,7 @@ import shutil
 import httplib
 import re
 import json
+import hashlib
 
 # Local libs
 from pyesmon import lustre
@@ -21,9 +22,14 @@ from pyesmon import time_util
 from pyesmon import ssh_host
 from pyesmon import collectd
 from pyesmon import esmon_common
+from pyesmon import esmon_capacity
 from pyesmon import esmon_influxdb
 from pyesmon import esmon_install_common
 from pyesmon import esmon_config
+from pyesmon import esmon_query_cache
+from pyesmon import esmon_series_reaper
+from pyesmon import esmon_rollup
+from pyesmon import esmon_dashboard
 import requests
 import yaml
 import filelock
@@ -34,10 +40,29 @@ ESMON_INSTALL_LOG_DIR = "/var/log/esmon_install"
 INFLUXDB_CONFIG_FPATH = "/etc/influxdb/influxdb.conf"
 INFLUXDB_CONFIG_DIFF = "influxdb.conf.diff"
 GRAFANA_DATASOURCE_NAME = "esmon_datasource"
+QUERY_CACHE_SERVICE = "esmon_query_cache"
+QUERY_CACHE_FPATH = "/usr/sbin/" + QUERY_CACHE_SERVICE
+QUERY_CACHE_UNIT_FPATH = "/etc/systemd/system/%s.service" % QUERY_CACHE_SERVICE
+SERIES_REAPER_SERVICE = "esmon_series_reaper"
+SERIES_REAPER_FPATH = "/usr/sbin/" + SERIES_REAPER_SERVICE
+SERIES_REAPER_CONFIG_FPATH = "/etc/%s.conf" % SERIES_REAPER_SERVICE
+SERIES_REAPER_UNIT_DIR = "/etc/systemd/system"
+ROLLUP_SERVICE = "esmon_rollup"
+ROLLUP_FPATH = "/usr/sbin/" + ROLLUP_SERVICE
+ROLLUP_CONFIG_FPATH = "/etc/%s.conf" % ROLLUP_SERVICE
+ROLLUP_UNIT_FPATH = "/etc/systemd/system/%s.service" % ROLLUP_SERVICE
 INFLUXDB_DATABASE_NAME = "esmon_database"
 INFLUXDB_CQ_PREFIX = "cq_"
 INFLUXDB_CQ_MEASUREMENT_PREFIX = "cqm_"
+INFLUXDB_TOPK_MEASUREMENT_PREFIX = "topk_"
+INFLUXDB_QUANTILE_MEASUREMENT_PREFIX = "qsk_"
+# The default timeout of checking whether a measurement is updated
+ESMON_MEASUREMENT_CHECK_TIMEOUT = 90
+# The measurement to check whether collectd on a client works well
+ESMON_CLIENT_HEALTH_MEASUREMENT = "memory.buffered.memory"
 GRAFANA_DASHBOARD_DIR = "dashboards"
+# The maximum number of dashboards to sync with Grafana at the same time
+GRAFANA_SYNC_CONCURRENCY = 4
 GRAFANA_PLUGIN_DIR = "/var/lib/grafana/plugins"
 GRAFANA_DASHBOARDS = {}
 GRAFANA_DASHBOARDS["Cluster Status"] = "cluster_status.json"
@@ -83,6 +108,28 @@ def grafana_dashboard_check(name, dashboard):
     return 0
 
 
+def grafana_dashboard_fingerprint(dashboard, keep_uid=True):
+    """
+    Return the hash of the normalized dashboard, the fields changed by Grafana
+    when saving the dashboard are ignored
+    """
+    normalized = dict(dashboard)
+    for key in ["id", "version"]:
+        normalized.pop(key, None)
+    if not keep_uid:
+        normalized.pop("uid", None)
+    content = json.dumps(normalized, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def grafana_dashboard_sync_thread(esmon_server, name, dashboard, results):
+    """
+    Sync a dashboard to Grafana, save the result into the results dict with
+    the name as key
+    """
+    results[name] = esmon_server.es_grafana_dashboard_sync(name, dashboard)
+
+
 def sed_replacement_escape(path):
     """
     Escape the '/' so "sed s///" can use it for replacement
@@ -97,11 +144,18 @@ class EsmonServer(object):
     # pylint: disable=too-many-public-methods,too-many-instance-attributes
     # pylint: disable=too-many-arguments
     def __init__(self, host, workspace, collect_interval,
-                 continuous_query_periods, job_id_var):
+                 continuous_query_periods, job_id_var, slow_gauge_periods=1,
+                 acct_periods=1, query_cache=False, job_idle_days=0,
+                 client_idle_days=0, streaming_rollup=False,
+                 hot_tier_seconds=0, lustre_compact_stats=False):
         self.es_host = host
         self.es_workspace = workspace
         self.es_iso_dir = workspace + "/ISO"
         self.es_grafana_failure = False
+        # Pooled session shared by the concurrent Grafana requests
+        self.es_grafana_session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=GRAFANA_SYNC_CONCURRENCY)
+        self.es_grafana_session.mount("http://", adapter)
         hostname = host.sh_hostname
         self.es_influxdb_client = esmon_influxdb.InfluxdbClient(hostname,
                                                                 INFLUXDB_DATABASE_NAME)
@@ -109,6 +163,31 @@ class EsmonServer(object):
         self.es_collect_interval = collect_interval
         self.es_continuous_query_periods = continuous_query_periods
         self.es_job_id_var = job_id_var
+        # The collect interval of slowly-changing gauges is
+        # slow_gauge_periods * collect_interval
+        self.es_slow_gauge_periods = slow_gauge_periods
+        # The collect interval of quota accounting is
+        # acct_periods * collect_interval
+        self.es_acct_periods = acct_periods
+        # Whether to put a caching query proxy between Grafana and Influxdb
+        self.es_query_cache = query_cache
+        # Seconds of the recent points kept in the hot tier of the proxy,
+        # 0 means disabled
+        self.es_hot_tier_seconds = hot_tier_seconds
+        # The series of the jobs/clients that have no new data for these days
+        # are dropped by the reaper, 0 means never
+        self.es_job_idle_days = job_idle_days
+        self.es_client_idle_days = client_idle_days
+        # Key is the name of continuous query, value is the RESAMPLE clause
+        # tuned by esmon_cq, which is kept when recreating the query
+        self.es_cq_resamples = {}
+        # Whether to replace the continuous queries with the rollup service
+        self.es_streaming_rollup = streaming_rollup
+        # The continuous queries replaced by the rollup service
+        self.es_rollup_rules = []
+        # Whether the collectd of the clients drops the samples, sum and
+        # sum_square of the service stats
+        self.es_lustre_compact_stats = lustre_compact_stats
 
     def es_check(self):
         """
@@ -409,7 +488,10 @@ class EsmonServer(object):
         Add influxdb source to grafana
         """
         # pylint: disable=bare-except
-        influxdb_url = "http://%s:8086" % self.es_host.sh_hostname
+        if self.es_query_cache:
+            influxdb_url = "http://localhost:%d" % esmon_query_cache.QUERY_CACHE_PORT
+        else:
+            influxdb_url = "http://%s:8086" % self.es_host.sh_hostname
         data = {
             "name": GRAFANA_DATASOURCE_NAME,
             "isDefault": True,
@@ -504,7 +586,7 @@ class EsmonServer(object):
             return -1
         return 0
 
-    def es_grafana_dashboard_add(self, name, dashboard):
+    def es_grafana_dashboard_add(self, name, dashboard, overwrite=False):
         """
         Add dashboard of grafana
         """
@@ -515,7 +597,7 @@ class EsmonServer(object):
 
         data = {
             "dashboard": dashboard,
-            "overwrite": False,
+            "overwrite": overwrite,
         }
 
         headers = {"Content-type": "application/json",
@@ -523,7 +605,8 @@ class EsmonServer(object):
 
         url = self.es_grafana_url("/api/dashboards/db")
         try:
-            response = requests.post(url, json=data, headers=headers)
+            response = self.es_grafana_session.post(url, json=data,
+                                                    headers=headers)
         except:
             logging.error("not able to add bashboard through [%s]: %s",
                           url, traceback.format_exc())
@@ -581,19 +664,81 @@ class EsmonServer(object):
                       response.status_code)
         return -1
 
-    def es_grafana_dashboard_replace(self, name, dashboard):
+    def es_grafana_dashboard_get(self, name):
         """
-        Replace a bashboard in grafana
+        Get the dashboard from grafana
+        Return (0, dashboard) if has dashboard, return (0, None) if not,
+        return (-1, None) if error
         """
-        ret = self.es_grafana_has_dashboard(name)
-        if ret < 0:
+        # pylint: disable=bare-except
+        headers = {"Content-type": "application/json",
+                   "Accept": "application/json"}
+
+        url = self.es_grafana_url("/api/dashboards/db/%s" %
+                                  slugify.slugify(name.decode('unicode-escape')))
+        try:
+            response = self.es_grafana_session.get(url, headers=headers)
+        except:
+            logging.error("not able to get dashboard through [%s]: %s",
+                          url, traceback.format_exc())
+            return -1, None
+        if response.status_code == httplib.NOT_FOUND:
+            return 0, None
+        elif response.status_code != httplib.OK:
+            logging.error("got grafana status [%d] when get dashboard",
+                          response.status_code)
+            return -1, None
+
+        data = response.json()
+        if "dashboard" not in data:
+            logging.error("got wrong data [%s] when get dashboard [%s]",
+                          data, name)
+            return -1, None
+        return 0, data["dashboard"]
+
+    def es_grafana_dashboard_sync(self, name, dashboard):
+        """
+        Overwrite a bashboard in grafana if it is changed
+        """
+        ret, existing = self.es_grafana_dashboard_get(name)
+        if ret:
             return -1
-        elif ret == 1:
-            ret = self.es_grafana_dashboard_delete(name)
-            if ret:
-                return ret
 
-        ret = self.es_grafana_dashboard_add(name, dashboard)
+        if existing is not None:
+            keep_uid = "uid" in dashboard
+            fingerprint = grafana_dashboard_fingerprint(dashboard,
+                                                        keep_uid=keep_uid)
+            if fingerprint == grafana_dashboard_fingerprint(existing,
+                                                            keep_uid=keep_uid):
+                logging.debug("dashboard [%s] is not changed, skipping",
+                              name)
+                return 0
+
+        logging.debug("updating dashboard [%s]", name)
+        return self.es_grafana_dashboard_add(name, dashboard, overwrite=True)
+
+    def es_grafana_dashboards_sync(self, dashboards):
+        """
+        Sync the dashboards to grafana concurrently, dashboards is a dict with
+        the name as key
+        """
+        results = {}
+        names = dashboards.keys()
+        for start in range(0, len(names), GRAFANA_SYNC_CONCURRENCY):
+            threads = []
+            for name in names[start:start + GRAFANA_SYNC_CONCURRENCY]:
+                threads.append(utils.thread_start(grafana_dashboard_sync_thread,
+                                                  (self, name, dashboards[name],
+                                                   results)))
+            for thread in threads:
+                thread.join()
+
+        ret = 0
+        for name in names:
+            # The result is missing if the thread raised an exception
+            if results.get(name, -1):
+                logging.error("failed to sync dashboard [%s] to grafana", name)
+                ret = -1
         return ret
 
     def es_grafana_change_logo(self):
@@ -767,6 +912,410 @@ class EsmonServer(object):
         logging.debug("User [%s] added", name)
         return 0
 
+    def es_query_cache_reinstall(self):
+        """
+        Install and start the caching query proxy, or stop it if disabled
+        """
+        if not self.es_query_cache:
+            command = ("systemctl stop %s; systemctl disable %s" %
+                       (QUERY_CACHE_SERVICE, QUERY_CACHE_SERVICE))
+            retval = self.es_host.sh_run(command)
+            if retval.cr_exit_status:
+                logging.debug("failed to stop query cache on host [%s], "
+                              "it might not be installed",
+                              self.es_host.sh_hostname)
+            return 0
+
+        # The module is standalone, so it can run without pyesmon
+        source_fpath = os.path.splitext(esmon_query_cache.__file__)[0] + ".py"
+        ret = self.es_host.sh_send_file(source_fpath, QUERY_CACHE_FPATH)
+        if ret:
+            logging.error("failed to send file [%s] on local host to "
+                          "[%s] on host [%s]", source_fpath, QUERY_CACHE_FPATH,
+                          self.es_host.sh_hostname)
+            return -1
+
+        exec_start = ("%s %d localhost 8086 %d %d" %
+                      (QUERY_CACHE_FPATH, esmon_query_cache.QUERY_CACHE_PORT,
+                       self.es_collect_interval, self.es_collect_interval))
+        if self.es_hot_tier_seconds > 0:
+            # Room for the points sent late in each series
+            points = self.es_hot_tier_seconds / int(self.es_collect_interval) + 2
+            exec_start += (" %s %d %d" %
+                           (INFLUXDB_DATABASE_NAME, self.es_hot_tier_seconds,
+                            points))
+        unit_fpath = self.es_workspace + "/" + QUERY_CACHE_SERVICE + ".service"
+        with open(unit_fpath, "w") as unit_file:
+            unit_file.write("[Unit]\n"
+                            "Description=ESMON caching query proxy between "
+                            "Grafana and Influxdb\n"
+                            "After=network.target influxdb.service\n"
+                            "\n"
+                            "[Service]\n"
+                            "ExecStart=/usr/bin/python %s\n"
+                            "Restart=always\n"
+                            "\n"
+                            "[Install]\n"
+                            "WantedBy=multi-user.target\n" % exec_start)
+        ret = self.es_host.sh_send_file(unit_fpath, QUERY_CACHE_UNIT_FPATH)
+        if ret:
+            logging.error("failed to send file [%s] on local host to "
+                          "[%s] on host [%s]", unit_fpath,
+                          QUERY_CACHE_UNIT_FPATH, self.es_host.sh_hostname)
+            return -1
+
+        command = ("systemctl daemon-reload && systemctl enable %s && "
+                   "systemctl restart %s" %
+                   (QUERY_CACHE_SERVICE, QUERY_CACHE_SERVICE))
+        retval = self.es_host.sh_run(command)
+        if retval.cr_exit_status:
+            logging.error("failed to run command [%s] on host [%s], "
+                          "ret = [%d], stdout = [%s], stderr = [%s]",
+                          command,
+                          self.es_host.sh_hostname,
+                          retval.cr_exit_status,
+                          retval.cr_stdout,
+                          retval.cr_stderr)
+            return -1
+        return 0
+
+    def es_influxdb_subscription(self, name, destination, create):
+        """
+        Drop the subscription, and create it with the destination if create
+        """
+        queries = ['DROP SUBSCRIPTION "%s" ON "%s"."autogen"' %
+                   (name, INFLUXDB_DATABASE_NAME)]
+        if create:
+            queries.append('CREATE SUBSCRIPTION "%s" ON "%s"."autogen" '
+                           "DESTINATIONS ALL '%s'" %
+                           (name, INFLUXDB_DATABASE_NAME, destination))
+        for query in queries:
+            response = self.es_influxdb_client.ic_query(query)
+            if response is None:
+                logging.error("failed to query Influxdb with query [%s]", query)
+                return -1
+
+            if response.status_code != httplib.OK:
+                logging.error("got InfluxDB status [%d] with query [%s]",
+                              response.status_code, query)
+                return -1
+
+            result = response.json()["results"][0]
+            # Dropping a subscription that doesn't exist is fine
+            if "error" in result and query.startswith("CREATE"):
+                logging.error("got InfluxDB error [%s] with query [%s]",
+                              result["error"], query)
+                return -1
+        return 0
+
+    def es_rollup_topk_rules(self):
+        """
+        Return the top-K rules of jobs, users and clients for the rollup
+        service
+        """
+        cq_time = int(self.es_collect_interval) * int(self.es_continuous_query_periods)
+        windows = max(1, esmon_rollup.ROLLUP_TOPK_SECONDS / cq_time)
+        # The optype of jobstats is the field name, while the optype of
+        # export stats is only read or write
+        jobstats_where = {"optype": ["sum_read_bytes", "sum_write_bytes"]}
+        exp_where = {"optype": ["read", "write"]}
+        keys = [("ost_jobstats_bytes", "job_id", jobstats_where),
+                ("mdt_jobstats_samples", "job_id", {}),
+                ("exp_ost_stats_bytes", "exp_client", exp_where),
+                ("exp_md_stats", "exp_client", {})]
+        if self.es_job_id_var == lustre.JOB_ID_PROCNAME_UID:
+            keys += [("ost_jobstats_bytes", "uid", jobstats_where),
+                     ("mdt_jobstats_samples", "uid", {})]
+
+        rules = []
+        for measurement, key_tag, where in keys:
+            topk_measurement = ("%s%s-fs_name-%s" %
+                                (INFLUXDB_TOPK_MEASUREMENT_PREFIX, measurement,
+                                 key_tag))
+            rules.append({"measurement": measurement,
+                          "topk_measurement": topk_measurement,
+                          "key_tag": key_tag,
+                          "groups": ["fs_name"],
+                          "where": where,
+                          "periods": int(self.es_continuous_query_periods),
+                          "k": esmon_rollup.ROLLUP_TOPK_K,
+                          "windows": windows})
+        return rules
+
+    def es_rollup_quantile_rules(self):
+        """
+        Return the quantile rules of the service times and I/O time for the
+        rollup service
+        """
+        rules = []
+        measurements = []
+        services = esmon_dashboard.MDS_SERVICES + esmon_dashboard.OSS_SERVICES
+        # The moments sketches need the samples, sum and sum_square of the
+        # service stats, which are not written to the server if compact stats
+        # is enabled
+        if self.es_lustre_compact_stats:
+            logging.info("lustre_compact_stats is enabled, the quantiles of "
+                         "the service times won't be calculated by the "
+                         "rollup service")
+            services = []
+        for service in services:
+            stats = ["req_waittime"]
+            stats += [operation for operation, _ in service.ls_operations]
+            for stat in stats:
+                measurement = "%s_stats_%s" % (service.ls_prefix, stat)
+                # The LDLM services are on both MDS and OSS
+                if measurement in measurements:
+                    continue
+                measurements.append(measurement)
+                rules.append({"kind": "moments",
+                              "measurement": measurement,
+                              "quantile_measurement":
+                              INFLUXDB_QUANTILE_MEASUREMENT_PREFIX + measurement,
+                              "groups": [],
+                              "host_tag": "fqdn"})
+
+        measurement = "ost_brw_stats_io_time_samples"
+        rules.append({"kind": "histogram",
+                      "measurement": measurement,
+                      "quantile_measurement":
+                      ("%s%s-field-fs_name" %
+                       (INFLUXDB_QUANTILE_MEASUREMENT_PREFIX, measurement)),
+                      "groups": ["field", "fs_name"],
+                      "bucket_tag": "size"})
+        return rules
+
+    def es_rollup_subscription(self, create):
+        """
+        Drop the subscription of the rollup service, and create it if create
+        """
+        return self.es_influxdb_subscription(ROLLUP_SERVICE,
+                                             "http://127.0.0.1:%d" %
+                                             esmon_rollup.ROLLUP_PORT,
+                                             create)
+
+    def es_hot_tier_subscription(self):
+        """
+        Create the subscription of the hot tier of the query cache, or drop
+        it if disabled
+        """
+        create = self.es_query_cache and self.es_hot_tier_seconds > 0
+        destination = ("http://127.0.0.1:%d%s" %
+                       (esmon_query_cache.QUERY_CACHE_PORT,
+                        esmon_query_cache.HOT_TIER_SUBSCRIPTION_PATH))
+        ret = self.es_influxdb_subscription(QUERY_CACHE_SERVICE, destination,
+                                            create)
+        if ret:
+            logging.error("failed to update the subscription of hot tier on "
+                          "host [%s]", self.es_host.sh_hostname)
+        return ret
+
+    def es_rollup_reinstall(self):
+        """
+        Install and start the rollup service, or stop it if disabled
+        """
+        # pylint: disable=too-many-return-statements
+        if len(self.es_rollup_rules) == 0:
+            ret = self.es_rollup_subscription(False)
+            if ret:
+                logging.error("failed to drop the subscription of rollup "
+                              "service on host [%s]", self.es_host.sh_hostname)
+                return -1
+
+            command = ("systemctl stop %s; systemctl disable %s" %
+                       (ROLLUP_SERVICE, ROLLUP_SERVICE))
+            retval = self.es_host.sh_run(command)
+            if retval.cr_exit_status:
+                logging.debug("failed to stop rollup service on host [%s], "
+                              "it might not be installed",
+                              self.es_host.sh_hostname)
+            return 0
+
+        # The module is standalone, so it can run without pyesmon
+        source_fpath = os.path.splitext(esmon_rollup.__file__)[0] + ".py"
+        ret = self.es_host.sh_send_file(source_fpath, ROLLUP_FPATH)
+        if ret:
+            logging.error("failed to send file [%s] on local host to "
+                          "[%s] on host [%s]", source_fpath, ROLLUP_FPATH,
+                          self.es_host.sh_hostname)
+            return -1
+
+        cq_time = int(self.es_collect_interval) * int(self.es_continuous_query_periods)
+        config = {"influxdb_host": "localhost",
+                  "influxdb_port": 8086,
+                  "database": INFLUXDB_DATABASE_NAME,
+                  "listen_port": esmon_rollup.ROLLUP_PORT,
+                  "interval": cq_time,
+                  # Wait for the points sent late by collectd
+                  "delay": int(self.es_collect_interval),
+                  "rules": self.es_rollup_rules,
+                  "topk_rules": self.es_rollup_topk_rules(),
+                  "quantile_rules": self.es_rollup_quantile_rules()}
+        files = {}
+        files[ROLLUP_CONFIG_FPATH] = \
+            json.dumps(config, indent=4, separators=(',', ': '),
+                       sort_keys=True) + "\n"
+        files[ROLLUP_UNIT_FPATH] = \
+            ("[Unit]\n"
+             "Description=ESMON streaming rollup of the points written to "
+             "Influxdb\n"
+             "After=network.target influxdb.service\n"
+             "\n"
+             "[Service]\n"
+             "ExecStart=/usr/bin/python %s %s\n"
+             "Restart=always\n"
+             "\n"
+             "[Install]\n"
+             "WantedBy=multi-user.target\n" %
+             (ROLLUP_FPATH, ROLLUP_CONFIG_FPATH))
+        for fpath, content in files.iteritems():
+            local_fpath = self.es_workspace + "/" + os.path.basename(fpath)
+            with open(local_fpath, "w") as local_file:
+                local_file.write(content)
+            ret = self.es_host.sh_send_file(local_fpath, fpath)
+            if ret:
+                logging.error("failed to send file [%s] on local host to "
+                              "[%s] on host [%s]", local_fpath, fpath,
+                              self.es_host.sh_hostname)
+                return -1
+
+        command = ("systemctl daemon-reload && systemctl enable %s && "
+                   "systemctl restart %s" %
+                   (ROLLUP_SERVICE, ROLLUP_SERVICE))
+        retval = self.es_host.sh_run(command)
+        if retval.cr_exit_status:
+            logging.error("failed to run command [%s] on host [%s], "
+                          "ret = [%d], stdout = [%s], stderr = [%s]",
+                          command,
+                          self.es_host.sh_hostname,
+                          retval.cr_exit_status,
+                          retval.cr_stdout,
+                          retval.cr_stderr)
+            return -1
+
+        ret = self.es_rollup_subscription(True)
+        if ret:
+            logging.error("failed to subscribe rollup service to Influxdb on "
+                          "host [%s]", self.es_host.sh_hostname)
+            return -1
+        logging.info("[%d] continuous queries are replaced by rollup service "
+                     "on host [%s]", len(self.es_rollup_rules),
+                     self.es_host.sh_hostname)
+        return 0
+
+    def es_series_reaper_rules(self):
+        """
+        Return the rules of the series reaper in the Json config
+        """
+        rules = []
+        for measurement_regex, tag, idle_days in \
+                [(esmon_series_reaper.SERIES_REAPER_JOB_MEASUREMENTS, "job_id",
+                  self.es_job_idle_days),
+                 (esmon_series_reaper.SERIES_REAPER_CLIENT_MEASUREMENTS,
+                  "exp_client", self.es_client_idle_days)]:
+            if idle_days == 0:
+                continue
+            rules.append({"measurement_regex": measurement_regex,
+                          "tag": tag,
+                          "idle_seconds": idle_days * 86400})
+        return rules
+
+    def es_series_reaper_reinstall(self):
+        """
+        Install the daily timer of the series reaper, or stop it if disabled
+        """
+        # pylint: disable=too-many-return-statements
+        rules = self.es_series_reaper_rules()
+        if len(rules) == 0:
+            command = ("systemctl stop %s.timer; systemctl disable %s.timer" %
+                       (SERIES_REAPER_SERVICE, SERIES_REAPER_SERVICE))
+            retval = self.es_host.sh_run(command)
+            if retval.cr_exit_status:
+                logging.debug("failed to stop series reaper on host [%s], "
+                              "it might not be installed",
+                              self.es_host.sh_hostname)
+            return 0
+
+        # The module is standalone, so it can run without pyesmon
+        source_fpath = os.path.splitext(esmon_series_reaper.__file__)[0] + ".py"
+        ret = self.es_host.sh_send_file(source_fpath, SERIES_REAPER_FPATH)
+        if ret:
+            logging.error("failed to send file [%s] on local host to "
+                          "[%s] on host [%s]", source_fpath,
+                          SERIES_REAPER_FPATH, self.es_host.sh_hostname)
+            return -1
+
+        config = {"influxdb_host": "localhost",
+                  "influxdb_port": 8086,
+                  "database": INFLUXDB_DATABASE_NAME,
+                  "batch_size": esmon_series_reaper.SERIES_REAPER_BATCH_SIZE,
+                  "batch_interval": esmon_series_reaper.SERIES_REAPER_BATCH_INTERVAL,
+                  "rules": rules}
+        files = {}
+        files[SERIES_REAPER_CONFIG_FPATH] = \
+            json.dumps(config, indent=4, separators=(',', ': '),
+                       sort_keys=True) + "\n"
+        files[SERIES_REAPER_UNIT_DIR + "/" + SERIES_REAPER_SERVICE + ".service"] = \
+            ("[Unit]\n"
+             "Description=ESMON reaper of the stale series in Influxdb\n"
+             "After=influxdb.service\n"
+             "\n"
+             "[Service]\n"
+             "Type=oneshot\n"
+             "ExecStart=/usr/bin/python %s %s\n" %
+             (SERIES_REAPER_FPATH, SERIES_REAPER_CONFIG_FPATH))
+        files[SERIES_REAPER_UNIT_DIR + "/" + SERIES_REAPER_SERVICE + ".timer"] = \
+            ("[Unit]\n"
+             "Description=Daily reaping of the stale series in Influxdb\n"
+             "\n"
+             "[Timer]\n"
+             "OnCalendar=daily\n"
+             "Persistent=true\n"
+             "\n"
+             "[Install]\n"
+             "WantedBy=timers.target\n")
+        for fpath, content in files.iteritems():
+            local_fpath = self.es_workspace + "/" + os.path.basename(fpath)
+            with open(local_fpath, "w") as local_file:
+                local_file.write(content)
+            ret = self.es_host.sh_send_file(local_fpath, fpath)
+            if ret:
+                logging.error("failed to send file [%s] on local host to "
+                              "[%s] on host [%s]", local_fpath, fpath,
+                              self.es_host.sh_hostname)
+                return -1
+
+        # Report what would be dropped before the first run of the timer
+        command = ("/usr/bin/python %s --dry-run %s" %
+                   (SERIES_REAPER_FPATH, SERIES_REAPER_CONFIG_FPATH))
+        retval = self.es_host.sh_run(command)
+        if retval.cr_exit_status:
+            logging.error("failed to run command [%s] on host [%s], "
+                          "ret = [%d], stdout = [%s], stderr = [%s]",
+                          command,
+                          self.es_host.sh_hostname,
+                          retval.cr_exit_status,
+                          retval.cr_stdout,
+                          retval.cr_stderr)
+            return -1
+        logging.info("stale series that will be dropped by the reaper on "
+                     "host [%s]:\n%s", self.es_host.sh_hostname,
+                     retval.cr_stdout)
+
+        command = ("systemctl daemon-reload && systemctl enable %s.timer && "
+                   "systemctl restart %s.timer" %
+                   (SERIES_REAPER_SERVICE, SERIES_REAPER_SERVICE))
+        retval = self.es_host.sh_run(command)
+        if retval.cr_exit_status:
+            logging.error("failed to run command [%s] on host [%s], "
+                          "ret = [%d], stdout = [%s], stderr = [%s]",
+                          command,
+                          self.es_host.sh_hostname,
+                          retval.cr_exit_status,
+                          retval.cr_stdout,
+                          retval.cr_stderr)
+            return -1
+        return 0
+
     def es_grafana_reinstall(self, mnt_path):
         """
         Reinstall grafana RPM
@@ -824,6 +1373,12 @@ class EsmonServer(object):
                           retval.cr_stderr)
             return -1
 
+        ret = self.es_query_cache_reinstall()
+        if ret:
+            logging.error("failed to reinstall query cache on host [%s]",
+                          self.es_host.sh_hostname)
+            return -1
+
         ret = self.es_grafana_has_influxdb()
         if ret < 0:
             return -1
@@ -836,7 +1391,19 @@ class EsmonServer(object):
         if ret:
             return ret
 
+        # The panels of the measurements that are not written by the rollup
+        # service would have no data
+        rollup_measurements = []
+        if self.es_streaming_rollup:
+            for rule in self.es_rollup_topk_rules():
+                rollup_measurements.append(rule["topk_measurement"])
+            # The quantiles of the service times are not calculated if
+            # compact stats is enabled
+            for rule in self.es_rollup_quantile_rules():
+                rollup_measurements.append(rule["quantile_measurement"])
+
         collect_interval = str(self.es_collect_interval)
+        dashboards = {}
         for name, fname in GRAFANA_DASHBOARDS.iteritems():
             dashboard_template_fpath = (mnt_path + "/" + GRAFANA_DASHBOARD_DIR +
                                         "/" + fname + ".template")
@@ -866,10 +1433,13 @@ class EsmonServer(object):
                     if ret:
                         return ret
                 continue
+            dashboards[name] = \
+                esmon_dashboard.dashboard_rollup_filter(dashboard,
+                                                        rollup_measurements)
 
-            ret = self.es_grafana_dashboard_replace(name, dashboard)
-            if ret:
-                return ret
+        ret = self.es_grafana_dashboards_sync(dashboards)
+        if ret:
+            return ret
 
         #ret = self.es_grafana_change_logo()
         #if ret:
@@ -927,198 +1497,100 @@ class EsmonServer(object):
                           self.es_host.sh_hostname)
             return -1
 
-        ret = self.es_influxdb_cq_create("mdt_acctuser_samples",
-                                         ["fs_name", "optype", "user_id", ])
-        if ret:
-            return -1
-
-        ret = self.es_influxdb_cq_create("mdt_acctgroup_samples",
-                                         ["fs_name", "group_id", "optype", ])
-        if ret:
-            return -1
-
-        ret = self.es_influxdb_cq_create("mdt_acctproject_samples",
-                                         ["fs_name", "optype", "project_id"])
-        if ret:
-            return -1
-
-        ret = self.es_influxdb_cq_create("ost_acctuser_samples",
-                                         ["fs_name", "optype", "user_id", ])
-        if ret:
-            return -1
-
-        ret = self.es_influxdb_cq_create("ost_acctgroup_samples",
-                                         ["fs_name", "optype", "group_id"])
-        if ret:
-            return -1
-
-        ret = self.es_influxdb_cq_create("ost_acctproject_samples",
-                                         ["fs_name", "optype", "project_id"])
-        if ret:
-            return -1
-
-        # Shows summarized client metadata operations
-        ret = self.es_influxdb_cq_create("exp_md_stats",
-                                         ["exp_client", "fs_name"])
-        if ret:
-            return -1
-
-        # Shows summarized job metadata operations
-        ret = self.es_influxdb_cq_create("mdt_jobstats_samples",
-                                         ["fs_name", "job_id"])
-        if ret:
-            return -1
-
-        if self.es_job_id_var == lustre.JOB_ID_PROCNAME_UID:
-            ret = self.es_influxdb_cq_create("mdt_jobstats_samples",
-                                             ["fs_name", "uid"])
-            if ret:
-                return -1
-
-        ret = self.es_influxdb_cq_create("ost_stats_bytes",
-                                         ["fs_name", "optype", "fqdn"])
-        if ret:
-            return -1
-
-        ret = self.es_influxdb_cq_create("ost_stats_bytes",
-                                         ["fs_name", "ost_index"])
+        ret = self.es_influxdb_cq_resamples_load()
         if ret:
+            logging.error("failed to load the RESAMPLE clauses of continuous "
+                          "queries on host [%s]", self.es_host.sh_hostname)
             return -1
 
-        ret = self.es_influxdb_cq_create("ost_stats_bytes",
-                                         ["fs_name", "fqdn"])
-        if ret:
-            return -1
-
-        ret = self.es_influxdb_cq_create("ost_stats_bytes",
-                                         ["fs_name", "optype"])
-        if ret:
-            return -1
-
-        ret = self.es_influxdb_cq_create("ost_kbytesinfo_used",
-                                         ["fs_name", "optype"])
-        if ret:
-            return -1
-
-        ret = self.es_influxdb_cq_create("ost_brw_stats_page_discontiguous_rpc_samples",
-                                         ["field", "fs_name", "size"])
-        if ret:
-            return -1
-
-        ret = self.es_influxdb_cq_create("ost_brw_stats_block_discontiguous_rpc_samples",
-                                         ["field", "fs_name", "size"])
-        if ret:
-            return -1
-
-        ret = self.es_influxdb_cq_create("ost_brw_stats_fragmented_io_samples",
-                                         ["field", "fs_name", "size"])
-        if ret:
-            return -1
+        self.es_rollup_rules = []
 
-        ret = self.es_influxdb_cq_create("ost_brw_stats_io_in_flight_samples",
-                                         ["field", "fs_name", "size"])
-        if ret:
-            return -1
-
-        ret = self.es_influxdb_cq_create("ost_brw_stats_io_time_samples",
-                                         ["field", "fs_name", "size"])
-        if ret:
-            return -1
-
-        ret = self.es_influxdb_cq_create("ost_brw_stats_io_size_samples",
-                                         ["field", "fs_name", "size"])
-        if ret:
-            return -1
-
-        ret = self.es_influxdb_cq_create("ost_jobstats_bytes",
-                                         ["fs_name", "job_id", "optype"])
-        if ret:
-            return -1
-
-        where = "WHERE optype = 'sum_read_bytes' OR optype = 'sum_write_bytes'"
-        ret = self.es_influxdb_cq_create("ost_jobstats_bytes",
-                                         ["fs_name", "job_id"],
-                                         where=where)
-        if ret:
-            return -1
-
-        where = "WHERE optype = 'sum_read_bytes' OR optype = 'sum_write_bytes'"
-        ret = self.es_influxdb_cq_create("ost_jobstats_bytes",
-                                         ["fs_name", "job_id", "ost_index"],
-                                         where=where)
-        if ret:
-            return -1
-
-        if self.es_job_id_var == lustre.JOB_ID_PROCNAME_UID:
-            ret = self.es_influxdb_cq_create("ost_jobstats_bytes",
-                                             ["fs_name", "uid", "optype"])
-            if ret:
-                return -1
-
-            where = "WHERE optype = 'sum_read_bytes' OR optype = 'sum_write_bytes'"
-            ret = self.es_influxdb_cq_create("ost_jobstats_bytes",
-                                             ["fs_name", "uid"],
-                                             where=where)
+        # The options of the items that are collected every few intervals
+        item_periods_options = {
+            esmon_common.CSTR_SLOW_GAUGE_PERIODS: self.es_slow_gauge_periods,
+            esmon_common.CSTR_ACCT_PERIODS: self.es_acct_periods}
+        for capacity_cq in esmon_capacity.ESMON_CAPACITY_CQS:
+            if not esmon_capacity.esmon_capacity_cq_enabled(capacity_cq,
+                                                            self.es_job_id_var):
+                continue
+            item_periods = 1
+            if capacity_cq.ecc_item_name in esmon_capacity.ESMON_CAPACITY_ITEM_PERIODS:
+                cstr = esmon_capacity.ESMON_CAPACITY_ITEM_PERIODS[capacity_cq.ecc_item_name]
+                item_periods = item_periods_options[cstr]
+            # es_influxdb_cq_create() sorts the groups
+            ret = self.es_influxdb_cq_create(capacity_cq.ecc_measurement,
+                                             list(capacity_cq.ecc_groups),
+                                             where=capacity_cq.ecc_where,
+                                             item_periods=item_periods)
             if ret:
                 return -1
 
-            where = "WHERE optype = 'sum_read_bytes' OR optype = 'sum_write_bytes'"
-            ret = self.es_influxdb_cq_create("ost_jobstats_bytes",
-                                             ["fs_name", "uid", "ost_index"],
-                                             where=where)
+        for item in esmon_dashboard.CLUSTER_STATUS_ITEMS:
+            ret = self.es_influxdb_status_cq_create(item)
             if ret:
                 return -1
 
-        ret = self.es_influxdb_cq_create("ost_brw_stats_rpc_bulk_samples",
-                                         ["field", "fs_name", "size"])
-        if ret:
-            return -1
-
-        ret = self.es_influxdb_cq_create("exp_ost_stats_bytes",
-                                         ["fs_name", "exp_client", "optype"])
-        if ret:
-            return -1
-
-        ret = self.es_influxdb_cq_create("md_stats",
-                                         ["fs_name"])
-        if ret:
-            return -1
-
-        ret = self.es_influxdb_cq_create("md_stats",
-                                         ["fs_name", "mdt_index"])
+        ret = self.es_rollup_reinstall()
         if ret:
+            logging.error("failed to reinstall rollup service on host [%s]",
+                          self.es_host.sh_hostname)
             return -1
 
-        ret = self.es_influxdb_cq_create("md_stats",
-                                         ["fs_name", "optype"])
+        ret = self.es_hot_tier_subscription()
         if ret:
             return -1
 
-        ret = self.es_influxdb_cq_create("mdt_filesinfo_free",
-                                         ["fs_name"])
+        ret = self.es_series_reaper_reinstall()
         if ret:
+            logging.error("failed to reinstall series reaper on host [%s]",
+                          self.es_host.sh_hostname)
             return -1
+        return 0
 
-        ret = self.es_influxdb_cq_create("mdt_filesinfo_used",
-                                         ["fs_name"])
-        if ret:
+    def es_influxdb_cq_resamples_load(self):
+        """
+        Load the RESAMPLE clauses of the existing continuous queries, so that
+        the tuning of esmon_cq is not lost when recreating them
+        """
+        query = "SHOW CONTINUOUS QUERIES"
+        response = self.es_influxdb_client.ic_query(query)
+        if response is None:
+            logging.error("failed to query Influxdb with query [%s]", query)
             return -1
 
-        ret = self.es_influxdb_cq_create("ost_kbytesinfo_free",
-                                         ["fs_name"])
-        if ret:
+        if response.status_code != httplib.OK:
+            logging.error("got InfluxDB status [%d] with query [%s]",
+                          response.status_code, query)
             return -1
 
-        ret = self.es_influxdb_cq_create("ost_kbytesinfo_used",
-                                         ["fs_name"])
-        if ret:
+        data = response.json()
+        if "results" not in data or len(data["results"]) != 1:
+            logging.error("got wrong InfluxDB data [%s]", data)
             return -1
 
+        cq_time = int(self.es_collect_interval) * int(self.es_continuous_query_periods)
+        self.es_cq_resamples = {}
+        for serie in data["results"][0].get("series", []):
+            if serie["name"] != INFLUXDB_DATABASE_NAME:
+                continue
+            for name, cq_query in serie.get("values", []):
+                intervals = esmon_influxdb.influxdb_cq_resample_valid(cq_query,
+                                                                      cq_time)
+                if intervals is None:
+                    continue
+                _, every, resample_for = intervals
+                self.es_cq_resamples[name] = \
+                    esmon_influxdb.influxdb_cq_resample_clause(every,
+                                                               resample_for)
+                logging.debug("keeping [%s] of continuous query [%s]",
+                              self.es_cq_resamples[name], name)
         return 0
 
-    def _es_influxdb_cq_create(self, measurement, groups, where=""):
+    def _es_influxdb_cq_create(self, measurement, groups, where="",
+                               item_periods=1):
         """
-        Create continuous query in influxdb
+        Create continuous query in influxdb, the measurement is collected
+        every item_periods * collect_interval seconds
         """
         # pylint: disable=bare-except
         cq_query = INFLUXDB_CQ_PREFIX + measurement
@@ -1130,13 +1602,23 @@ class EsmonServer(object):
             cq_measurement += "-%s" % group
 
         cq_time = int(self.es_collect_interval) * int(self.es_continuous_query_periods)
-        query = ('CREATE CONTINUOUS QUERY %s ON "%s" \n'
+        # The number of points of each series in the interval of the query
+        periods = int(self.es_continuous_query_periods) / int(item_periods)
+        resample = self.es_cq_resamples.get(cq_query, "")
+        # The measurement collected with a longer interval might have no point
+        # in an interval of the query if the collection is delayed, use the
+        # value of the previous interval instead of leaving a gap
+        if int(item_periods) > 1:
+            fill = " fill(previous)"
+        else:
+            fill = ""
+        query = ('CREATE CONTINUOUS QUERY %s ON "%s" %s\n'
                  'BEGIN SELECT sum("value") / %s INTO "%s" \n'
-                 '    FROM "%s" %s GROUP BY time(%ds)%s \n'
+                 '    FROM "%s" %s GROUP BY time(%ds)%s%s \n'
                  'END;' %
-                 (cq_query, INFLUXDB_DATABASE_NAME,
-                  self.es_continuous_query_periods, cq_measurement,
-                  measurement, where, cq_time, group_string))
+                 (cq_query, INFLUXDB_DATABASE_NAME, resample,
+                  periods, cq_measurement,
+                  measurement, where, cq_time, group_string, fill))
         response = self.es_influxdb_client.ic_query(query)
         if response is None:
             logging.error("failed to create continuous query with query [%s]",
@@ -1154,10 +1636,16 @@ class EsmonServer(object):
         """
         Delete continuous query in influxdb
         """
-        # pylint: disable=bare-except
         cq_query = INFLUXDB_CQ_PREFIX + measurement
         for group in groups:
             cq_query += "_%s" % group
+        return self.es_influxdb_cq_drop(cq_query)
+
+    def es_influxdb_cq_drop(self, cq_query):
+        """
+        Drop continuous query in influxdb by name
+        """
+        # pylint: disable=bare-except
         query = ('DROP CONTINUOUS QUERY %s ON "%s";' %
                  (cq_query, INFLUXDB_DATABASE_NAME))
         response = self.es_influxdb_client.ic_query(query)
@@ -1173,13 +1661,38 @@ class EsmonServer(object):
             return -1
         return 0
 
-    def es_influxdb_cq_create(self, measurement, groups, where=""):
+    def es_influxdb_cq_create(self, measurement, groups, where="",
+                              item_periods=1):
         """
         Create continuous query in influxdb, delete one first if necesary
         """
         # Sort the groups so that we will get a unique cq name for the same groups
         groups.sort()
-        ret = self._es_influxdb_cq_create(measurement, groups, where=where)
+        if self.es_streaming_rollup:
+            rollup_where = esmon_rollup.rollup_where_parse(where)
+            if rollup_where is not None:
+                cq_measurement = INFLUXDB_CQ_MEASUREMENT_PREFIX + measurement
+                for group in groups:
+                    cq_measurement += "-%s" % group
+                periods = int(self.es_continuous_query_periods) / int(item_periods)
+                where_values = {}
+                for tag, values in rollup_where.iteritems():
+                    where_values[tag] = sorted(values)
+                self.es_rollup_rules.append({"measurement": measurement,
+                                             "cq_measurement": cq_measurement,
+                                             "groups": groups,
+                                             "where": where_values,
+                                             "periods": periods,
+                                             "fill_previous":
+                                             int(item_periods) > 1})
+                # The rollup service writes the same measurement instead
+                return self.es_influxdb_cq_delete(measurement, groups)
+            logging.warning("condition [%s] of the continuous query of "
+                            "measurement [%s] is not supported by the rollup "
+                            "service, keeping the continuous query",
+                            where, measurement)
+        ret = self._es_influxdb_cq_create(measurement, groups, where=where,
+                                          item_periods=item_periods)
         if ret == 0:
             return 0
 
@@ -1187,12 +1700,59 @@ class EsmonServer(object):
         if ret:
             return ret
 
-        ret = self._es_influxdb_cq_create(measurement, groups, where=where)
+        ret = self._es_influxdb_cq_create(measurement, groups, where=where,
+                                          item_periods=item_periods)
         if ret:
             logging.error("failed to create continuous query for measurement [%s]",
                           measurement)
         return ret
 
+    def _es_influxdb_status_cq_create(self, cq_query, item):
+        """
+        Create continuous query in influxdb that saves the latest value of
+        each host as a field of the cluster status measurement
+        """
+        query = ('CREATE CONTINUOUS QUERY %s ON "%s" \n'
+                 'BEGIN SELECT %s AS "%s" INTO "%s" \n'
+                 '    FROM "%s" GROUP BY time(%ds), "fqdn" \n'
+                 'END;' %
+                 (cq_query, INFLUXDB_DATABASE_NAME,
+                  item.csi_select, item.csi_field,
+                  esmon_dashboard.CLUSTER_STATUS_MEASUREMENT,
+                  item.csi_measurement, int(self.es_collect_interval)))
+        response = self.es_influxdb_client.ic_query(query)
+        if response is None:
+            logging.error("failed to create continuous query with query [%s]",
+                          query)
+            return -1
+
+        if response.status_code != httplib.OK:
+            logging.error("got InfluxDB status [%d] when creating "
+                          "continuous query with query [%s]",
+                          response.status_code, query)
+            return -1
+        return 0
+
+    def es_influxdb_status_cq_create(self, item):
+        """
+        Create continuous query of a cluster status item, delete one first if
+        necesary
+        """
+        cq_query = INFLUXDB_CQ_PREFIX + "cluster_status_" + item.csi_field
+        ret = self._es_influxdb_status_cq_create(cq_query, item)
+        if ret == 0:
+            return 0
+
+        ret = self.es_influxdb_cq_drop(cq_query)
+        if ret:
+            return ret
+
+        ret = self._es_influxdb_status_cq_create(cq_query, item)
+        if ret:
+            logging.error("failed to create continuous query for cluster "
+                          "status item [%s]", item.csi_field)
+        return ret
+
 
 def int_safe(int_str):
     """
@@ -1320,7 +1880,8 @@ class EsmonSFA(object):
                             "install it", host.sh_hostname)
             # sshpass rely on epel-release on centos6
             command = "yum install epel-release -y"
-            retval = host.sh_run(command)
+            retval = host.sh_run(command,
+                                 tail_size=ssh_host.COMMAND_OUTPUT_TAIL_SIZE)
             if retval.cr_exit_status:
                 logging.error("failed to run command [%s] on host [%s], "
                               "ret = [%d], stdout = [%s], stderr = [%s]",
@@ -1331,7 +1892,8 @@ class EsmonSFA(object):
                               retval.cr_stderr)
                 return -1
             command = "yum install sshpass -y"
-            retval = host.sh_run(command)
+            retval = host.sh_run(command,
+                                 tail_size=ssh_host.COMMAND_OUTPUT_TAIL_SIZE)
             if retval.cr_exit_status:
                 logging.error("failed to run command [%s] on host [%s], "
                               "ret = [%d], stdout = [%s], stderr = [%s]",
@@ -1430,13 +1992,15 @@ class EsmonClient(object):
     """
     Each client ESMON host has an object of this type
     """
-    # pylint: disable=too-few-public-methods,too-many-instance-attributes
+    # pylint: disable=too-many-public-methods,too-many-instance-attributes
     # pylint: disable=too-many-arguments
     def __init__(self, host, workspace, esmon_server, collect_interval,
                  enable_disk=False, lustre_oss=False, lustre_mds=False,
                  lustre_client=False, ime=False, infiniband=False, sfas=None,
                  enabled_plugins="", lustre_exp_ost=False, lustre_exp_mdt=False,
-                 job_id_var=lustre.JOB_ID_UNKNOWN):
+                 job_id_var=lustre.JOB_ID_UNKNOWN, lustre_compact_stats=False,
+                 lustre_drop_unused=False, slow_gauge_periods=1,
+                 acct_periods=1):
         self.ec_host = host
         self.ec_workspace = workspace
         self.ec_iso_basename = "ISO"
@@ -1456,8 +2020,14 @@ class EsmonClient(object):
         self.ec_sfas = sfas
         self.ec_enable_lustre_exp_ost = lustre_exp_ost
         self.ec_enable_lustre_exp_mdt = lustre_exp_mdt
+        self.ec_enable_lustre_compact_stats = lustre_compact_stats
+        self.ec_enable_lustre_drop_unused = lustre_drop_unused
+        self.ec_slow_gauge_periods = slow_gauge_periods
+        self.ec_acct_periods = acct_periods
         self.ec_collectd_config_test = None
         self.ec_collectd_config_final = None
+        # The fingerprint of the final collectd config and definition files
+        self.ec_collectd_config_fingerprint = None
         self.ec_influxdb_update_time = None
         self.ec_distro = None
         self.ec_cpu_target = None
@@ -1702,7 +2272,11 @@ class EsmonClient(object):
                                           lustre_mds=self.ec_enable_lustre_mds,
                                           lustre_client=self.ec_enable_lustre_client,
                                           lustre_exp_ost=self.ec_enable_lustre_exp_ost,
-                                          lustre_exp_mdt=self.ec_enable_lustre_exp_mdt)
+                                          lustre_exp_mdt=self.ec_enable_lustre_exp_mdt,
+                                          lustre_compact_stats=self.ec_enable_lustre_compact_stats,
+                                          lustre_drop_unused=self.ec_enable_lustre_drop_unused,
+                                          slow_gauge_periods=self.ec_slow_gauge_periods,
+                                          acct_periods=self.ec_acct_periods)
             if ret:
                 logging.error("failed to config Lustre plugin of Collectd")
                 return -1
@@ -1727,7 +2301,11 @@ class EsmonClient(object):
                                           lustre_mds=self.ec_enable_lustre_mds,
                                           lustre_client=self.ec_enable_lustre_client,
                                           lustre_exp_ost=self.ec_enable_lustre_exp_ost,
-                                          lustre_exp_mdt=self.ec_enable_lustre_exp_mdt)
+                                          lustre_exp_mdt=self.ec_enable_lustre_exp_mdt,
+                                          lustre_compact_stats=self.ec_enable_lustre_compact_stats,
+                                          lustre_drop_unused=self.ec_enable_lustre_drop_unused,
+                                          slow_gauge_periods=self.ec_slow_gauge_periods,
+                                          acct_periods=self.ec_acct_periods)
             if ret:
                 logging.error("failed to config Lustre plugin of Collectd")
                 return -1
@@ -1894,7 +2472,8 @@ class EsmonClient(object):
 
         command = ("cd %s && rpm -ivh %s" %
                    (rpm_dir, matched_fname))
-        retval = self.ec_host.sh_run(command)
+        retval = self.ec_host.sh_run(command,
+                                     tail_size=ssh_host.COMMAND_OUTPUT_TAIL_SIZE)
         if retval.cr_exit_status:
             logging.error("failed to run command [%s] on host [%s], "
                           "ret = [%d], stdout = [%s], stderr = [%s]",
@@ -1918,9 +2497,9 @@ class EsmonClient(object):
                 return ret
         return 0
 
-    def ec_collectd_send_config(self, test_config):
+    def ec_collectd_dump_config(self, test_config):
         """
-        Send collectd config to client
+        Dump collectd config to local file, return the file path
         """
         fpath = self.ec_workspace + "/"
         if test_config:
@@ -1932,6 +2511,169 @@ class EsmonClient(object):
         fpath += "." + self.ec_host.sh_hostname
 
         config.cc_dump(fpath)
+        return fpath
+
+    def ec_collectd_fingerprint(self):
+        """
+        Return the fingerprint of the final collectd config together with the
+        definition files it uses
+        """
+        fpath = self.ec_collectd_dump_config(False)
+        with open(fpath) as config_file:
+            config_text = config_file.read()
+        sha = hashlib.sha256(config_text)
+
+        definition_fpaths = re.findall(r'DefinitionFile "(.+)"', config_text)
+        if len(definition_fpaths) > 0:
+            command = "sha256sum " + " ".join(sorted(set(definition_fpaths)))
+            retval = self.ec_host.sh_run(command)
+            if retval.cr_exit_status:
+                logging.error("failed to run command [%s] on host [%s], "
+                              "ret = [%d], stdout = [%s], stderr = [%s]",
+                              command,
+                              self.ec_host.sh_hostname,
+                              retval.cr_exit_status,
+                              retval.cr_stdout,
+                              retval.cr_stderr)
+                return -1, None
+            sha.update(retval.cr_stdout)
+        return 0, sha.hexdigest()
+
+    def ec_collectd_config_changed(self):
+        """
+        Check whether the final collectd config or the definition files have
+        been changed since collectd was restarted with them last time.
+        Return (-1, None) on error, (0, True) if changed.
+        """
+        ret, fingerprint = self.ec_collectd_fingerprint()
+        if ret:
+            return -1, None
+        self.ec_collectd_config_fingerprint = fingerprint
+
+        command = "cat %s" % collectd.COLLECTD_FINGERPRINT_FPATH
+        retval = self.ec_host.sh_run(command)
+        if retval.cr_exit_status:
+            logging.debug("no fingerprint of collectd config on host [%s]",
+                          self.ec_host.sh_hostname)
+            return 0, True
+
+        if retval.cr_stdout.strip() != fingerprint:
+            return 0, True
+
+        # Start collectd if it is not running even the config is not changed
+        command = "service collectd status"
+        retval = self.ec_host.sh_run(command)
+        if retval.cr_exit_status:
+            logging.debug("collectd is not running on host [%s]",
+                          self.ec_host.sh_hostname)
+            return 0, True
+        return 0, False
+
+    def ec_collectd_fingerprint_save(self):
+        """
+        Save the fingerprint of the running collectd config on the client
+        """
+        if self.ec_collectd_config_fingerprint is None:
+            ret, fingerprint = self.ec_collectd_fingerprint()
+            if ret:
+                return -1
+            self.ec_collectd_config_fingerprint = fingerprint
+
+        command = ("echo %s > %s" % (self.ec_collectd_config_fingerprint,
+                                     collectd.COLLECTD_FINGERPRINT_FPATH))
+        retval = self.ec_host.sh_run(command)
+        if retval.cr_exit_status:
+            logging.error("failed to run command [%s] on host [%s], "
+                          "ret = [%d], stdout = [%s], stderr = [%s]",
+                          command,
+                          self.ec_host.sh_hostname,
+                          retval.cr_exit_status,
+                          retval.cr_stdout,
+                          retval.cr_stderr)
+            return -1
+        return 0
+
+    def ec_collectd_config_apply(self):
+        """
+        Backup the running collectd config, send the final collectd config and
+        restart collectd
+        """
+        # Remember the time of the latest datapoint before restarting, so that
+        # ec_collectd_config_verify() can wait for a newer one
+        self.ec_influxdb_update_time = None
+        self._ec_influxdb_measurement_check([ESMON_CLIENT_HEALTH_MEASUREMENT,
+                                             {"fqdn": self.ec_fqdn}])
+
+        command = ("cp -f /etc/collectd.conf %s" %
+                   collectd.COLLECTD_ROLLBACK_FPATH)
+        retval = self.ec_host.sh_run(command)
+        if retval.cr_exit_status:
+            logging.error("failed to run command [%s] on host [%s], "
+                          "ret = [%d], stdout = [%s], stderr = [%s]",
+                          command,
+                          self.ec_host.sh_hostname,
+                          retval.cr_exit_status,
+                          retval.cr_stdout,
+                          retval.cr_stderr)
+            return -1
+
+        ret = self.ec_collectd_send_config(False)
+        if ret:
+            logging.error("failed to send final config to esmon client on host [%s]",
+                          self.ec_host.sh_hostname)
+            return -1
+
+        ret = self.ec_collectd_restart()
+        if ret:
+            logging.error("failed to start esmon client on host [%s]",
+                          self.ec_host.sh_hostname)
+            return -1
+        return 0
+
+    def ec_collectd_config_verify(self):
+        """
+        Check whether new datapoints arrive after collectd is restarted with
+        the final config, and save the fingerprint if so
+        """
+        ret = self.ec_influxdb_measurement_check(ESMON_CLIENT_HEALTH_MEASUREMENT,
+                                                 interval=self.ec_collect_interval)
+        if ret:
+            logging.error("Influxdb doesn't have new datapoints from host [%s] "
+                          "after restarting collectd", self.ec_host.sh_hostname)
+            return -1
+
+        return self.ec_collectd_fingerprint_save()
+
+    def ec_collectd_config_rollback(self):
+        """
+        Restore the collectd config before the last update and restart
+        collectd
+        """
+        command = ("cp -f %s /etc/collectd.conf" %
+                   collectd.COLLECTD_ROLLBACK_FPATH)
+        retval = self.ec_host.sh_run(command)
+        if retval.cr_exit_status:
+            logging.error("failed to run command [%s] on host [%s], "
+                          "ret = [%d], stdout = [%s], stderr = [%s]",
+                          command,
+                          self.ec_host.sh_hostname,
+                          retval.cr_exit_status,
+                          retval.cr_stdout,
+                          retval.cr_stderr)
+            return -1
+
+        ret = self.ec_collectd_restart()
+        if ret:
+            logging.error("failed to restart esmon client on host [%s] with "
+                          "the old config", self.ec_host.sh_hostname)
+            return -1
+        return 0
+
+    def ec_collectd_send_config(self, test_config):
+        """
+        Send collectd config to client
+        """
+        fpath = self.ec_collectd_dump_config(test_config)
 
         etc_path = "/etc/collectd.conf"
         ret = self.ec_host.sh_send_file(fpath, etc_path)
@@ -2216,14 +2958,20 @@ class EsmonClient(object):
                       timestamp, query)
         return -1
 
-    def ec_influxdb_measurement_check(self, measurement_name, **tags):
+    def ec_influxdb_measurement_check(self, measurement_name, interval=None,
+                                      **tags):
         """
-        Check whether influxdb has datapoint
+        Check whether influxdb has datapoint, interval is the seconds between
+        two datapoints of the measurement if it is longer than usual
         """
         if "fqdn" not in tags:
             tags["fqdn"] = self.ec_fqdn
+        timeout = ESMON_MEASUREMENT_CHECK_TIMEOUT
+        if interval is not None:
+            # Need to wait for at least two datapoints to see the update
+            timeout = max(timeout, interval * 3)
         ret = utils.wait_condition(self._ec_influxdb_measurement_check,
-                                   [measurement_name, tags])
+                                   [measurement_name, tags], timeout=timeout)
         if ret:
             logging.error("failed to check measurement [%s]", measurement_name)
         return ret
@@ -2283,6 +3031,11 @@ class EsmonClient(object):
                           self.ec_host.sh_hostname)
             return -1
 
+        ret = self.ec_collectd_fingerprint_save()
+        if ret:
+            logging.error("failed to save fingerprint of collectd config on "
+                          "host [%s]", self.ec_host.sh_hostname)
+            return -1
         return 0
 
 
@@ -2392,9 +3145,96 @@ def esmon_install_parse_config(workspace, config, config_fpath):
     if ret:
         return -1, esmon_server, esmon_clients
 
+    ret, lustre_compact_stats = \
+        esmon_config.install_config_value(config,
+                                          esmon_common.CSTR_LUSTRE_COMPACT_STATS)
+    if ret:
+        return -1, esmon_server, esmon_clients
+
+    ret, lustre_drop_unused = \
+        esmon_config.install_config_value(config,
+                                          esmon_common.CSTR_LUSTRE_DROP_UNUSED)
+    if ret:
+        return -1, esmon_server, esmon_clients
+
+    ret, slow_gauge_periods = \
+        esmon_config.install_config_value(config,
+                                          esmon_common.CSTR_SLOW_GAUGE_PERIODS)
+    if ret:
+        return -1, esmon_server, esmon_clients
+
+    ret, acct_periods = \
+        esmon_config.install_config_value(config,
+                                          esmon_common.CSTR_ACCT_PERIODS)
+    if ret:
+        return -1, esmon_server, esmon_clients
+
+    # The continuous queries need the same number of points of each series in
+    # each interval
+    for cstr, item_periods in [(esmon_common.CSTR_SLOW_GAUGE_PERIODS,
+                                slow_gauge_periods),
+                               (esmon_common.CSTR_ACCT_PERIODS,
+                                acct_periods)]:
+        if continuous_query_periods % item_periods != 0:
+            logging.error("the value [%d] of [%s] is not a multiple of the "
+                          "value [%d] of [%s], please correct file [%s]",
+                          continuous_query_periods,
+                          esmon_common.CSTR_CONTINUOUS_QUERY_PERIODS,
+                          item_periods, cstr, config_fpath)
+            return -1, esmon_server, esmon_clients
+
+    # The capacity dashboards show the sums of the continuous queries, which
+    # don't change within an interval of the slow gauges
+    if (slow_gauge_periods > 1 and
+            slow_gauge_periods >= continuous_query_periods):
+        logging.warning("the capacity and inode usage is only updated every "
+                        "[%d] seconds, which is as long as the interval of "
+                        "the continuous queries, please consider a smaller "
+                        "[%s] in file [%s]",
+                        slow_gauge_periods * collect_interval,
+                        esmon_common.CSTR_SLOW_GAUGE_PERIODS, config_fpath)
+
     host = hosts[host_id]
+    ret, query_cache = \
+        esmon_config.install_config_value(server_host_config,
+                                          esmon_common.CSTR_QUERY_CACHE)
+    if ret:
+        return -1, esmon_server, esmon_clients
+
+    ret, hot_tier_seconds = \
+        esmon_config.install_config_value(server_host_config,
+                                          esmon_common.CSTR_QUERY_CACHE_HOT_TIER_SECONDS)
+    if ret:
+        return -1, esmon_server, esmon_clients
+
+    ret, job_idle_days = \
+        esmon_config.install_config_value(server_host_config,
+                                          esmon_common.CSTR_SERIES_REAPER_JOB_IDLE_DAYS)
+    if ret:
+        return -1, esmon_server, esmon_clients
+
+    ret, client_idle_days = \
+        esmon_config.install_config_value(server_host_config,
+                                          esmon_common.CSTR_SERIES_REAPER_CLIENT_IDLE_DAYS)
+    if ret:
+        return -1, esmon_server, esmon_clients
+
+    ret, streaming_rollup = \
+        esmon_config.install_config_value(server_host_config,
+                                          esmon_common.CSTR_STREAMING_ROLLUP)
+    if ret:
+        return -1, esmon_server, esmon_clients
+
     esmon_server = EsmonServer(host, workspace, collect_interval,
-                               continuous_query_periods, job_id_var)
+                               continuous_query_periods, job_id_var,
+                               slow_gauge_periods=slow_gauge_periods,
+                               acct_periods=acct_periods,
+                               query_cache=query_cache,
+                               job_idle_days=job_idle_days,
+                               client_idle_days=client_idle_days,
+                               streaming_rollup=streaming_rollup,
+                               hot_tier_seconds=hot_tier_seconds,
+                               lustre_compact_stats=lustre_compact_stats)
     ret = esmon_server.es_check()
     if ret:
         logging.error("checking of ESMON server [%s] failed, please fix the "
@@ -2543,7 +3383,11 @@ def esmon_install_parse_config(workspace, config, config_fpath):
                                    enabled_plugins=enabled_plugins,
                                    lustre_exp_ost=lustre_exp_ost,
                                    lustre_exp_mdt=lustre_exp_mdt,
-                                   job_id_var=job_id_var)
+                                   job_id_var=job_id_var,
+                                   lustre_compact_stats=lustre_compact_stats,
+                                   lustre_drop_unused=lustre_drop_unused,
+                                   slow_gauge_periods=slow_gauge_periods,
+                                   acct_periods=acct_periods)
         esmon_clients[host_id] = esmon_client
         ret = esmon_client.ec_prepare()
         if ret:
@@ -2555,6 +3399,121 @@ def esmon_install_parse_config(workspace, config, config_fpath):
     return 0, esmon_server, esmon_clients
 
 
+def esmon_client_config_apply(esmon_client, results):
+    """
+    Apply the collectd config on a client, save the result into the results
+    dict with the hostname as key
+    """
+    results[esmon_client.ec_host.sh_hostname] = \
+        esmon_client.ec_collectd_config_apply()
+
+
+def esmon_client_config_verify(esmon_client, results):
+    """
+    Verify the collectd config on a client, save the result into the results
+    dict with the hostname as key
+    """
+    results[esmon_client.ec_host.sh_hostname] = \
+        esmon_client.ec_collectd_config_verify()
+
+
+def esmon_clients_rolling_update(config, esmon_clients):
+    """
+    Update the collectd config of the ESMON clients batch by batch, only the
+    clients with changed config are restarted
+    """
+    # pylint: disable=too-many-return-statements,too-many-branches
+    # pylint: disable=too-many-locals
+    ret, batch_size = \
+        esmon_config.install_config_value(config,
+                                          esmon_common.CSTR_AGENTS_RESTART_BATCH_SIZE)
+    if ret:
+        return -1
+
+    ret, concurrency = \
+        esmon_config.install_config_value(config,
+                                          esmon_common.CSTR_AGENTS_RESTART_CONCURRENCY)
+    if ret:
+        return -1
+
+    ret, max_failures = \
+        esmon_config.install_config_value(config,
+                                          esmon_common.CSTR_AGENTS_RESTART_MAX_FAILURES)
+    if ret:
+        return -1
+
+    changed_clients = []
+    for esmon_client in esmon_clients.values():
+        hostname = esmon_client.ec_host.sh_hostname
+        ret, changed = esmon_client.ec_collectd_config_changed()
+        if ret:
+            logging.error("failed to check whether collectd config is changed "
+                          "on host [%s]", hostname)
+            return -1
+        if changed:
+            changed_clients.append(esmon_client)
+        else:
+            logging.info("collectd config is not changed on host [%s], "
+                         "skipping restart", hostname)
+
+    failures = []
+    for batch_start in range(0, len(changed_clients), batch_size):
+        batch = changed_clients[batch_start:batch_start + batch_size]
+        logging.info("updating collectd config on hosts %s",
+                     [client.ec_host.sh_hostname for client in batch])
+
+        results = {}
+        for thread_start in range(0, len(batch), concurrency):
+            threads = []
+            for esmon_client in batch[thread_start:thread_start + concurrency]:
+                threads.append(utils.thread_start(esmon_client_config_apply,
+                                                  (esmon_client, results)))
+            for thread in threads:
+                thread.join()
+
+        # Each check waits for new datapoints for up to a few collect
+        # intervals, so the clients of the batch are checked in parallel
+        applied_clients = [client for client in batch
+                           if results.get(client.ec_host.sh_hostname) == 0]
+        results = {}
+        threads = []
+        for esmon_client in applied_clients:
+            threads.append(utils.thread_start(esmon_client_config_verify,
+                                              (esmon_client, results)))
+        for thread in threads:
+            thread.join()
+
+        for esmon_client in batch:
+            hostname = esmon_client.ec_host.sh_hostname
+            # The result is missing if applying failed or the thread raised an
+            # exception
+            ret = results.get(hostname, -1)
+            if ret == 0:
+                continue
+
+            logging.error("failed to update collectd config on host [%s], "
+                          "restoring the old config", hostname)
+            failures.append(hostname)
+            ret = esmon_client.ec_collectd_config_rollback()
+            if ret:
+                logging.error("failed to restore the old collectd config on "
+                              "host [%s]", hostname)
+
+        if len(failures) > max_failures:
+            not_updated = [client.ec_host.sh_hostname for client in
+                           changed_clients[batch_start + batch_size:]]
+            logging.error("failed to update collectd config on hosts %s, "
+                          "more than [%d] failures, pausing the update, "
+                          "hosts %s are not updated", failures, max_failures,
+                          not_updated)
+            return -1
+
+    if len(failures) > 0:
+        logging.warning("failed to update collectd config on hosts %s, "
+                        "the old config is restored", failures)
+    return 0
+
+
 def esmon_do_install(workspace, config, config_fpath, mnt_path):
     """
     Start to install with the ISO mounted
@@ -2644,13 +3603,11 @@ def esmon_do_install(workspace, config, config_fpath, mnt_path):
                 return -1
     else:
         logging.info("ESMON clients won't be reinstalled according to the "
-                     "config, restarting ESMON client instead")
-        for esmon_client in esmon_clients.values():
-            ret = esmon_client.ec_collectd_restart()
-            if ret:
-                logging.error("failed to start esmon client on host [%s]",
-                              esmon_client.ec_host.sh_hostname)
-                return -1
+                     "config, updating the config of ESMON client instead")
+        ret = esmon_clients_rolling_update(config, esmon_clients)
+        if ret:
+            logging.error("failed to update the config of ESMON clients")
+            return -1
     return 0
 
 
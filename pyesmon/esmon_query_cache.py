@@ -0,0 +1,1025 @@
+# Copyright (c) 2017 DataDirect Networks, Inc.
+# All Rights Reserved.
+# Author: lixi@ddn.com
+"""
+Caching query proxy between Grafana and Influxdb
+
+If the hot tier is enabled, Influxdb also forwards every write to the proxy
+through a subscription, and the recent points of each series are kept in ring
+buffers. The simple queries of the dashboards on the recent time ranges are
+answered from memory without Influxdb, and the other queries fall back to
+Influxdb.
+
+This file only depends on the standard library, because it is copied to and
+run on the ESMON server as a standalone script.
+"""
+# pylint: disable=too-many-lines
+import sys
+import re
+import time
+import array
+import json
+import socket
+import logging
+import httplib
+import urllib
+import urlparse
+import threading
+import collections
+import SocketServer
+import BaseHTTPServer
+
+QUERY_CACHE_PORT = 8087
+QUERY_CACHE_STATS_PATH = "/esmon_query_cache/stats"
+QUERY_CACHE_MAX_ENTRIES = 10000
+# The longest time to wait for an identical query that is in flight
+QUERY_CACHE_COALESCE_TIMEOUT = 60
+QUERY_CACHE_UPSTREAM_TIMEOUT = 120
+# Absolute time conditions generated by $timeFilter of Grafana
+QUERY_TIME_PATTERN = re.compile(r"time\s*(>=|>|<=|<)\s*(\d+)ms", re.IGNORECASE)
+# Influxdb appends "/write" to the destination of the subscription
+HOT_TIER_SUBSCRIPTION_PATH = "/esmon_query_cache"
+HOT_TIER_WRITE_PATH = HOT_TIER_SUBSCRIPTION_PATH + "/write"
+HOT_TIER_MAX_SERIES = 1000000
+# Seconds between the removals of the series that have no point in the window
+HOT_TIER_EXPIRE_INTERVAL = 60
+HOT_TIER_MAX_NS = 2 ** 63 - 1
+# Nanoseconds of the duration units of InfluxQL
+HOT_TIER_DURATION_UNITS = {"ns": 1, "u": 1000, "ms": 1000000, "s": 1000000000,
+                           "m": 60000000000, "h": 3600000000000,
+                           "d": 86400000000000, "w": 604800000000000}
+# Nanoseconds of each epoch of the query API
+HOT_TIER_EPOCHS = {"ns": 1, "u": 1000, "ms": 1000000, "s": 1000000000,
+                   "m": 60000000000, "h": 3600000000000}
+# Nanoseconds of each precision of the write API
+HOT_TIER_PRECISIONS = {"n": 1, "ns": 1, "u": 1000, "ms": 1000000,
+                       "s": 1000000000, "m": 60000000000, "h": 3600000000000}
+HOT_TIER_UNESCAPE_PATTERN = re.compile(r"\\([,= ])")
+# The subset of InfluxQL that is used by the dashboards
+HOT_TIER_SELECT_PATTERN = re.compile(r'^SELECT (.+?) FROM ("(?:[^"\\]|\\.)+"|\w+) '
+                                     r'WHERE (.+?)(?: GROUP BY (.+?))?$',
+                                     re.IGNORECASE)
+HOT_TIER_PROJECTION_PATTERN = re.compile(r'^(last\()?"(\w+)"(\))?'
+                                         r'(?:\s*([*/])\s*(\d+(?:\.\d+)?))?'
+                                         r'(?:\s+AS\s+"([^"]+)")?$',
+                                         re.IGNORECASE)
+HOT_TIER_CONDITION_PATTERN = re.compile(r'\s*(?:"(\w+)"\s*(=~|!~|!=|=)\s*'
+                                        r'(\'(?:[^\'\\]|\\.)*\'|/(?:[^/\\]|\\.)*/)|'
+                                        r'time\s*(>=|>|<=|<|=)\s*'
+                                        r'(now\(\)(?:\s*[-+]\s*\w+)?|\d+\w*))'
+                                        r'\s*(?:AND\b|$)', re.IGNORECASE)
+HOT_TIER_GROUP_BY_PATTERN = re.compile(r'^"(\w+)"$')
+HOT_TIER_NOW_PATTERN = re.compile(r"^now\(\)(?:\s*([-+])\s*(\w+))?$",
+                                  re.IGNORECASE)
+HOT_TIER_EPOCH_PATTERN = re.compile(r"^(\d+)(ns|u|ms|s)?$")
+HOT_TIER_DURATION_PATTERN = re.compile(r"(\d+)(ns|u|ms|s|m|h|d|w)")
+
+
+def query_normalize(query, bucket_ms):
+    """
+    Collapse the white spaces and align the absolute time conditions to the
+    bucket boundaries, so that queries sent at slightly different times can
+    share the same result
+    """
+    query = " ".join(query.split())
+
+    def time_align(match):
+        """
+        Align the lower bound down and the upper bound up
+        """
+        operator = match.group(1)
+        time_ms = int(match.group(2))
+        if operator.startswith(">"):
+            time_ms -= time_ms % bucket_ms
+        elif time_ms % bucket_ms != 0:
+            time_ms += bucket_ms - time_ms % bucket_ms
+        return "time %s %dms" % (operator, time_ms)
+
+    return QUERY_TIME_PATTERN.sub(time_align, query)
+
+
+def query_cacheable(query):
+    """
+    Only cache read only queries
+    """
+    words = query.split(None, 1)
+    if len(words) == 0:
+        return False
+    return words[0].upper() in ["SELECT", "SHOW"]
+
+
+class QueryCache(object):
+    """
+    LRU cache of query results with TTL
+    """
+    # pylint: disable=too-many-instance-attributes
+    def __init__(self, ttl, max_entries):
+        self.qc_ttl = ttl
+        self.qc_max_entries = max_entries
+        self.qc_lock = threading.Lock()
+        # Key is the normalized query, value is (expire_time, result)
+        self.qc_entries = collections.OrderedDict()
+        # Key is the normalized query, value is the event to wait for
+        self.qc_inflight = {}
+        self.qc_requests = 0
+        self.qc_hits = 0
+        self.qc_misses = 0
+        self.qc_coalesced = 0
+        self.qc_uncacheable = 0
+
+    def _qc_get(self, key):
+        """
+        Get the result of the key, lock should be held
+        """
+        if key not in self.qc_entries:
+            return None
+        expire_time, result = self.qc_entries.pop(key)
+        if expire_time < time.time():
+            return None
+        # Move to the end as the most recently used one
+        self.qc_entries[key] = (expire_time, result)
+        return result
+
+    def qc_put(self, key, result):
+        """
+        Save the result of the key, evict the least recently used ones
+        """
+        with self.qc_lock:
+            self.qc_entries.pop(key, None)
+            self.qc_entries[key] = (time.time() + self.qc_ttl, result)
+            while len(self.qc_entries) > self.qc_max_entries:
+                self.qc_entries.popitem(last=False)
+
+    def qc_query(self, key, fetch_func):
+        """
+        Return the result of the key from cache, or call fetch_func to get it.
+        Concurrent fetches of the same key are coalesced into one.
+        """
+        with self.qc_lock:
+            self.qc_requests += 1
+            result = self._qc_get(key)
+            if result is not None:
+                self.qc_hits += 1
+                return result
+            event = self.qc_inflight.get(key)
+            if event is None:
+                leader = True
+                event = threading.Event()
+                self.qc_inflight[key] = event
+                self.qc_misses += 1
+            else:
+                leader = False
+                self.qc_coalesced += 1
+
+        if not leader:
+            event.wait(QUERY_CACHE_COALESCE_TIMEOUT)
+            with self.qc_lock:
+                result = self._qc_get(key)
+            if result is not None:
+                return result
+            # The leader failed, fetch by itself
+            return fetch_func()
+
+        try:
+            result = fetch_func()
+            status = result[0]
+            if status == httplib.OK:
+                self.qc_put(key, result)
+        finally:
+            with self.qc_lock:
+                del self.qc_inflight[key]
+            event.set()
+        return result
+
+    def qc_uncacheable_inc(self):
+        """
+        Count a request that is passed through without caching
+        """
+        with self.qc_lock:
+            self.qc_requests += 1
+            self.qc_uncacheable += 1
+
+    def qc_stats(self):
+        """
+        Return the statistics of the cache
+        """
+        with self.qc_lock:
+            cacheable = self.qc_hits + self.qc_misses + self.qc_coalesced
+            if cacheable == 0:
+                hit_rate = 0.0
+            else:
+                hit_rate = float(self.qc_hits + self.qc_coalesced) / cacheable
+            return {"requests": self.qc_requests,
+                    "hits": self.qc_hits,
+                    "misses": self.qc_misses,
+                    "coalesced": self.qc_coalesced,
+                    "uncacheable": self.qc_uncacheable,
+                    "entries": len(self.qc_entries),
+                    "hit_rate": hit_rate}
+
+
+def hot_split(text, separator, quoted_strings=False):
+    """
+    Split the text of line protocol at the separators that are not escaped,
+    or quoted if quoted_strings
+    """
+    if "\\" not in text and (not quoted_strings or '"' not in text):
+        return text.split(separator)
+    fields = []
+    start = 0
+    index = 0
+    quoted = False
+    while index < len(text):
+        char = text[index]
+        if char == "\\":
+            index += 2
+            continue
+        if quoted_strings and char == '"':
+            quoted = not quoted
+        elif char == separator and not quoted:
+            fields.append(text[start:index])
+            start = index + 1
+        index += 1
+    fields.append(text[start:])
+    return fields
+
+
+def hot_unescape(text):
+    """
+    Remove the escape characters of the measurement, tag key or tag value
+    """
+    return HOT_TIER_UNESCAPE_PATTERN.sub(r"\1", text)
+
+
+def hot_field_value(text):
+    """
+    Return the value of the field in line protocol, None if invalid
+    """
+    if text.startswith('"'):
+        return text[1:-1].replace('\\"', '"').replace("\\\\", "\\")
+    if text in ["t", "T", "true", "True", "TRUE"]:
+        return True
+    if text in ["f", "F", "false", "False", "FALSE"]:
+        return False
+    if text.endswith("i") or text.endswith("u"):
+        text = text[:-1]
+    try:
+        return float(text)
+    except ValueError:
+        return None
+
+
+def hot_line_parse(line, precision_ns):
+    """
+    Return (measurement, tags, fields, timestamp_ns) of the line, tags is a
+    sorted tuple of (key, value), None if invalid
+    """
+    # pylint: disable=too-many-return-statements
+    sections = hot_split(line, " ")
+    if len(sections) < 2:
+        return None
+    key = sections[0]
+    sections = hot_split(" ".join(sections[1:]), " ", quoted_strings=True)
+    if len(sections) == 1:
+        timestamp = int(time.time() * 1000000000)
+    elif len(sections) == 2:
+        try:
+            timestamp = int(sections[1]) * precision_ns
+        except ValueError:
+            return None
+    else:
+        return None
+
+    fields = {}
+    for field in hot_split(sections[0], ",", quoted_strings=True):
+        name, _, text = field.partition("=")
+        value = hot_field_value(text)
+        if value is None:
+            return None
+        fields[intern(hot_unescape(name))] = value
+
+    items = hot_split(key, ",")
+    tags = []
+    for item in items[1:]:
+        parts = hot_split(item, "=")
+        if len(parts) != 2:
+            return None
+        # The tags are interned, so the series of the same host or file
+        # system share the strings
+        tags.append((intern(hot_unescape(parts[0])),
+                     intern(hot_unescape(parts[1]))))
+    tags.sort()
+    return intern(hot_unescape(items[0])), tuple(tags), fields, timestamp
+
+
+def hot_time_parse(text, now_ns):
+    """
+    Return the nanoseconds of the time expression, None if not supported
+    """
+    # pylint: disable=too-many-return-statements
+    match = HOT_TIER_NOW_PATTERN.match(text)
+    if match is not None:
+        if match.group(1) is None:
+            return now_ns
+        offset = 0
+        position = 0
+        duration = match.group(2)
+        for unit_match in HOT_TIER_DURATION_PATTERN.finditer(duration):
+            if unit_match.start() != position:
+                return None
+            offset += (int(unit_match.group(1)) *
+                       HOT_TIER_DURATION_UNITS[unit_match.group(2)])
+            position = unit_match.end()
+        if position == 0 or position != len(duration):
+            return None
+        if match.group(1) == "-":
+            return now_ns - offset
+        return now_ns + offset
+    match = HOT_TIER_EPOCH_PATTERN.match(text)
+    if match is None:
+        return None
+    return int(match.group(1)) * HOT_TIER_DURATION_UNITS[match.group(2) or "ns"]
+
+
+class HotStatement(object):
+    """
+    Each parsed SELECT statement that can be answered by the hot tier has an
+    object of this type
+    """
+    # pylint: disable=too-few-public-methods,too-many-instance-attributes
+    def __init__(self, measurement):
+        self.hst_measurement = measurement
+        # List of (field, operator, operand, column)
+        self.hst_projections = []
+        # Whether the projections are last() rather than raw values
+        self.hst_last = False
+        # List of (tag, operator, value), the value of regular expression
+        # operators is compiled
+        self.hst_conditions = []
+        self.hst_lower = None
+        self.hst_upper = HOT_TIER_MAX_NS
+        self.hst_group_by = []
+
+
+def hot_statement_parse(query, now_ns):
+    """
+    Return the HotStatement of the query, None if not supported
+    """
+    # pylint: disable=too-many-return-statements,too-many-branches
+    match = HOT_TIER_SELECT_PATTERN.match(" ".join(query.split()))
+    if match is None:
+        return None
+    measurement = match.group(2)
+    if measurement.startswith('"'):
+        measurement = measurement[1:-1].replace('\\"', '"')
+    statement = HotStatement(measurement)
+
+    lasts = []
+    for projection in match.group(1).split(","):
+        projection_match = HOT_TIER_PROJECTION_PATTERN.match(projection.strip())
+        if projection_match is None:
+            return None
+        last = projection_match.group(1) is not None
+        if last != (projection_match.group(3) is not None):
+            return None
+        lasts.append(last)
+        field = projection_match.group(2)
+        operand = projection_match.group(5)
+        if operand is not None:
+            operand = float(operand)
+        column = projection_match.group(6)
+        if column is None:
+            column = "last" if last else field
+        statement.hst_projections.append((field, projection_match.group(4),
+                                          operand, column))
+    # Mixing raw values and selectors needs the semantics of Influxdb
+    if len(set(lasts)) != 1:
+        return None
+    statement.hst_last = lasts[0]
+
+    where = match.group(3)
+    position = 0
+    while position < len(where):
+        condition_match = HOT_TIER_CONDITION_PATTERN.match(where, position)
+        if condition_match is None:
+            return None
+        position = condition_match.end()
+        if condition_match.group(1) is not None:
+            operator = condition_match.group(2)
+            value = condition_match.group(3)
+            if operator in ["=~", "!~"]:
+                if not value.startswith("/"):
+                    return None
+                try:
+                    value = re.compile(value[1:-1].replace("\\/", "/"))
+                except re.error:
+                    return None
+            elif value.startswith("'"):
+                value = value[1:-1].replace("\\'", "'")
+            else:
+                return None
+            statement.hst_conditions.append((condition_match.group(1),
+                                             operator, value))
+            continue
+        operator = condition_match.group(4)
+        nanoseconds = hot_time_parse(condition_match.group(5), now_ns)
+        if nanoseconds is None:
+            return None
+        if operator == ">" or operator == ">=":
+            if operator == ">":
+                nanoseconds += 1
+            if statement.hst_lower is None or nanoseconds > statement.hst_lower:
+                statement.hst_lower = nanoseconds
+        elif operator == "<":
+            statement.hst_upper = min(statement.hst_upper, nanoseconds - 1)
+        elif operator == "<=":
+            statement.hst_upper = min(statement.hst_upper, nanoseconds)
+        else:
+            return None
+    # Influxdb scans the whole history without a lower bound
+    if statement.hst_lower is None:
+        return None
+
+    if match.group(4) is not None:
+        for group in match.group(4).split(","):
+            group_match = HOT_TIER_GROUP_BY_PATTERN.match(group.strip())
+            if group_match is None:
+                return None
+            statement.hst_group_by.append(group_match.group(1))
+    return statement
+
+
+def hot_condition_match(conditions, tags):
+    """
+    Return whether the tags of the series match the conditions
+    """
+    for tag, operator, value in conditions:
+        tag_value = tags.get(tag, "")
+        if operator == "=":
+            matched = tag_value == value
+        elif operator == "!=":
+            matched = tag_value != value
+        elif operator == "=~":
+            matched = value.search(tag_value) is not None
+        else:
+            matched = value.search(tag_value) is None
+        if not matched:
+            return False
+    return True
+
+
+def hot_value(value, operator, operand):
+    """
+    Return the value after the arithmetic of the projection
+    """
+    if operator is None or value is None:
+        return value
+    if isinstance(value, (bool, basestring)):
+        return None
+    if operator == "*":
+        return value * operand
+    if operand == 0:
+        return None
+    return value / operand
+
+
+def hot_last_rows(projections, series_list, lower, upper):
+    """
+    Return the rows of the last values of the projections in the series
+    """
+    row = [None]
+    for field, operator, operand, _ in projections:
+        last_time = None
+        last_value = None
+        for series in series_list:
+            ring = series.hs_fields.get(field)
+            if ring is None:
+                continue
+            point = ring.hr_last(lower, upper)
+            if point is not None and (last_time is None or
+                                      point[0] > last_time):
+                last_time, last_value = point
+        if last_time is None:
+            row.append(None)
+            continue
+        row[0] = last_time
+        row.append(hot_value(last_value, operator, operand))
+    if row[0] is None:
+        return []
+    # Influxdb uses the start of the time range as the time of multiple
+    # selectors
+    if len(projections) > 1:
+        row[0] = lower
+    return [row]
+
+
+def hot_point_rows(projections, series_list, lower, upper):
+    """
+    Return the rows of the points of the projections in the series, sorted
+    by time
+    """
+    rows = []
+    for series in series_list:
+        # Key is timestamp, value is the list of values
+        series_rows = {}
+        for index, projection in enumerate(projections):
+            field, operator, operand, _ = projection
+            ring = series.hs_fields.get(field)
+            if ring is None:
+                continue
+            for timestamp, value in ring.hr_points(lower, upper):
+                if timestamp not in series_rows:
+                    series_rows[timestamp] = ([timestamp] +
+                                              [None] * len(projections))
+                series_rows[timestamp][index + 1] = \
+                    hot_value(value, operator, operand)
+        rows += series_rows.values()
+    rows.sort(key=lambda row: row[0])
+    return rows
+
+
+class HotRing(object):
+    """
+    Ring buffer of the recent points of a field of a series, the timestamps
+    and numeric values are kept in compact arrays
+    """
+    def __init__(self, capacity, numeric):
+        self.hr_capacity = capacity
+        self.hr_numeric = numeric
+        self.hr_times = array.array("l")
+        if numeric:
+            self.hr_values = array.array("d")
+        else:
+            self.hr_values = []
+        # Index of the oldest point when the ring is full
+        self.hr_start = 0
+        # The points at or before this time might be missing, because they
+        # were overwritten, arrived out of order or had another type
+        self.hr_evicted_until = -1
+
+    def hr_add(self, timestamp, value):
+        """
+        Add the point
+        """
+        numeric = not isinstance(value, (bool, basestring))
+        length = len(self.hr_times)
+        if numeric != self.hr_numeric:
+            self.hr_evicted_until = max(self.hr_evicted_until, timestamp)
+            return
+        if length > 0:
+            newest = (self.hr_start - 1) % length
+            newest_time = self.hr_times[newest]
+            if timestamp == newest_time:
+                self.hr_values[newest] = value
+                return
+            if timestamp < newest_time:
+                self.hr_evicted_until = max(self.hr_evicted_until, timestamp)
+                return
+        if length < self.hr_capacity:
+            self.hr_times.append(timestamp)
+            self.hr_values.append(value)
+            return
+        self.hr_evicted_until = max(self.hr_evicted_until,
+                                    self.hr_times[self.hr_start])
+        self.hr_times[self.hr_start] = timestamp
+        self.hr_values[self.hr_start] = value
+        self.hr_start = (self.hr_start + 1) % length
+
+    def hr_points(self, lower, upper):
+        """
+        Return the list of (timestamp, value) in the time range, in time
+        order
+        """
+        length = len(self.hr_times)
+        if length < self.hr_capacity:
+            indexes = xrange(length)
+        else:
+            indexes = [(self.hr_start + index) % length
+                       for index in xrange(length)]
+        points = []
+        for index in indexes:
+            timestamp = self.hr_times[index]
+            if lower <= timestamp <= upper:
+                points.append((timestamp, self.hr_values[index]))
+        return points
+
+    def hr_last(self, lower, upper):
+        """
+        Return the last (timestamp, value) in the time range, None if empty
+        """
+        length = len(self.hr_times)
+        for offset in xrange(1, length + 1):
+            index = (self.hr_start - offset) % length
+            timestamp = self.hr_times[index]
+            if timestamp < lower:
+                return None
+            if timestamp <= upper:
+                return timestamp, self.hr_values[index]
+        return None
+
+    def hr_bytes(self):
+        """
+        Return the approximate memory used by the points
+        """
+        size = self.hr_times.itemsize * len(self.hr_times)
+        if self.hr_numeric:
+            size += self.hr_values.itemsize * len(self.hr_values)
+        else:
+            size += sum(sys.getsizeof(value) + 8 for value in self.hr_values)
+        return size
+
+
+class HotSeries(object):
+    """
+    Each series in the hot tier has an object of this type
+    """
+    # pylint: disable=too-few-public-methods
+    def __init__(self, tags):
+        self.hs_tags = dict(tags)
+        # Key is the field name, value is the HotRing
+        self.hs_fields = {}
+        self.hs_last_time = 0
+
+
+class HotTier(object):
+    """
+    The points of the most recent window of all series, fed by the
+    subscription of Influxdb, which can answer the simple queries of the
+    dashboards without reading TSM files of Influxdb
+    """
+    # pylint: disable=too-many-instance-attributes
+    def __init__(self, database, seconds, points,
+                 max_series=HOT_TIER_MAX_SERIES):
+        self.ht_database = database
+        self.ht_window_ns = seconds * 1000000000
+        # The maximum number of points of each field of each series
+        self.ht_points = points
+        self.ht_max_series = max_series
+        self.ht_lock = threading.Lock()
+        # Key is measurement, value is a dict with the tags tuple as key and
+        # HotSeries as value
+        self.ht_measurements = {}
+        # The measurements that have series not kept because of the limit
+        self.ht_incomplete = set()
+        self.ht_series = 0
+        # The points before this time might be missing
+        self.ht_start_time = int(time.time() * 1000000000)
+        self.ht_expire_time = time.time()
+        self.ht_writes = 0
+        self.ht_hits = 0
+        self.ht_misses = 0
+        self.ht_expired = 0
+        self.ht_rejected = 0
+
+    def ht_write(self, data, precision_ns):
+        """
+        Add the points in line protocol
+        """
+        points = []
+        for line in data.splitlines():
+            line = line.strip()
+            if line == "" or line.startswith("#"):
+                continue
+            point = hot_line_parse(line, precision_ns)
+            if point is not None:
+                points.append(point)
+
+        with self.ht_lock:
+            for measurement, tags, fields, timestamp in points:
+                series_dict = self.ht_measurements.setdefault(measurement, {})
+                series = series_dict.get(tags)
+                if series is None:
+                    if self.ht_series >= self.ht_max_series:
+                        self.ht_incomplete.add(measurement)
+                        self.ht_rejected += 1
+                        continue
+                    series = HotSeries(tags)
+                    series_dict[tags] = series
+                    self.ht_series += 1
+                for field, value in fields.iteritems():
+                    ring = series.hs_fields.get(field)
+                    if ring is None:
+                        numeric = not isinstance(value, (bool, basestring))
+                        ring = HotRing(self.ht_points, numeric)
+                        series.hs_fields[field] = ring
+                    ring.hr_add(timestamp, value)
+                series.hs_last_time = max(series.hs_last_time, timestamp)
+            self.ht_writes += len(points)
+            if time.time() - self.ht_expire_time >= HOT_TIER_EXPIRE_INTERVAL:
+                self._ht_expire()
+
+    def _ht_expire(self):
+        """
+        Remove the series that have no point in the window, the lock should
+        be held
+        """
+        self.ht_expire_time = time.time()
+        oldest = int(self.ht_expire_time * 1000000000) - self.ht_window_ns
+        for measurement in list(self.ht_measurements):
+            series_dict = self.ht_measurements[measurement]
+            for tags in list(series_dict):
+                if series_dict[tags].hs_last_time < oldest:
+                    del series_dict[tags]
+                    self.ht_series -= 1
+                    self.ht_expired += 1
+            if len(series_dict) == 0:
+                del self.ht_measurements[measurement]
+
+    def _ht_statement(self, statement, now_ns):
+        """
+        Return the series of the result of the statement, None if the hot
+        tier doesn't have all of the points, the lock should be held
+        """
+        if (statement.hst_lower < self.ht_start_time or
+                statement.hst_lower < now_ns - self.ht_window_ns or
+                statement.hst_measurement in self.ht_incomplete):
+            return None
+        lower = statement.hst_lower
+        upper = statement.hst_upper
+        fields = [projection[0] for projection in statement.hst_projections]
+
+        # Key is the values of the group by tags, value is the list of series
+        groups = {}
+        series_dict = self.ht_measurements.get(statement.hst_measurement, {})
+        for series in series_dict.itervalues():
+            if not hot_condition_match(statement.hst_conditions,
+                                       series.hs_tags):
+                continue
+            for field in fields:
+                ring = series.hs_fields.get(field)
+                if ring is not None and ring.hr_evicted_until >= lower:
+                    return None
+            key = tuple(series.hs_tags.get(tag, "")
+                        for tag in statement.hst_group_by)
+            groups.setdefault(key, []).append(series)
+
+        columns = ["time"] + [projection[3]
+                              for projection in statement.hst_projections]
+        result = []
+        for key in sorted(groups.keys()):
+            if statement.hst_last:
+                rows = hot_last_rows(statement.hst_projections, groups[key],
+                                     lower, upper)
+            else:
+                rows = hot_point_rows(statement.hst_projections, groups[key],
+                                      lower, upper)
+            if len(rows) == 0:
+                continue
+            series_result = {"name": statement.hst_measurement,
+                             "columns": columns,
+                             "values": rows}
+            if len(statement.hst_group_by) > 0:
+                series_result["tags"] = dict(zip(statement.hst_group_by, key))
+            result.append(series_result)
+        return result
+
+    def ht_query(self, params):
+        """
+        Return the Json body of the result of the query, None if the query
+        should be sent to Influxdb
+        """
+        # pylint: disable=too-many-return-statements
+        params = dict(params)
+        query = params.get("q")
+        if (query is None or params.get("db") != self.ht_database or
+                params.get("epoch") not in HOT_TIER_EPOCHS or
+                "chunked" in params):
+            return None
+        epoch_ns = HOT_TIER_EPOCHS[params["epoch"]]
+        now_ns = int(time.time() * 1000000000)
+        statements = []
+        for text in query.split(";"):
+            if text.strip() == "":
+                continue
+            statement = hot_statement_parse(text, now_ns)
+            if statement is None:
+                with self.ht_lock:
+                    self.ht_misses += 1
+                return None
+            statements.append(statement)
+        if len(statements) == 0:
+            return None
+
+        results = []
+        with self.ht_lock:
+            for statement_id, statement in enumerate(statements):
+                series = self._ht_statement(statement, now_ns)
+                if series is None:
+                    self.ht_misses += 1
+                    return None
+                result = {"statement_id": statement_id}
+                if len(series) > 0:
+                    result["series"] = series
+                results.append(result)
+            self.ht_hits += 1
+
+        for result in results:
+            for series in result.get("series", []):
+                for row in series["values"]:
+                    row[0] = row[0] / epoch_ns
+        return json.dumps({"results": results})
+
+    def ht_stats(self):
+        """
+        Return the statistics of the hot tier
+        """
+        with self.ht_lock:
+            points = 0
+            memory = 0
+            for series_dict in self.ht_measurements.itervalues():
+                for series in series_dict.itervalues():
+                    for ring in series.hs_fields.itervalues():
+                        points += len(ring.hr_times)
+                        memory += ring.hr_bytes()
+            queries = self.ht_hits + self.ht_misses
+            if queries == 0:
+                hit_rate = 0.0
+            else:
+                hit_rate = float(self.ht_hits) / queries
+            return {"measurements": len(self.ht_measurements),
+                    "series": self.ht_series,
+                    "points": points,
+                    "memory_bytes": memory,
+                    "writes": self.ht_writes,
+                    "hits": self.ht_hits,
+                    "misses": self.ht_misses,
+                    "hit_rate": hit_rate,
+                    "expired": self.ht_expired,
+                    "rejected": self.ht_rejected}
+
+
+class QueryCacheHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Handle the HTTP requests from Grafana
+    """
+    # pylint: disable=invalid-name
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format_string, *args):
+        # pylint: disable=arguments-differ
+        logging.debug("%s - %s", self.address_string(), format_string % args)
+
+    def qch_upstream(self, method, path, body=None):
+        """
+        Send the request to Influxdb, return (status, content_type, body)
+        """
+        server = self.server
+        headers = {}
+        for name in ["Authorization", "Content-Type", "Accept"]:
+            value = self.headers.getheader(name)
+            if value is not None:
+                headers[name] = value
+        try:
+            connection = httplib.HTTPConnection(server.qcs_upstream_host,
+                                                server.qcs_upstream_port,
+                                                timeout=QUERY_CACHE_UPSTREAM_TIMEOUT)
+            connection.request(method, path, body, headers)
+            response = connection.getresponse()
+            result = (response.status,
+                      response.getheader("Content-Type", "application/json"),
+                      response.read())
+            connection.close()
+        except (socket.error, httplib.HTTPException), err:
+            logging.error("failed to send request [%s] to Influxdb: %s",
+                          path, err)
+            result = (httplib.BAD_GATEWAY, "text/plain", str(err))
+        return result
+
+    def qch_reply(self, result):
+        """
+        Send the result back to Grafana
+        """
+        status, content_type, body = result
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        """
+        Serve a GET request
+        """
+        server = self.server
+        url = urlparse.urlparse(self.path)
+        if url.path == QUERY_CACHE_STATS_PATH:
+            stats = server.qcs_cache.qc_stats()
+            if server.qcs_hot_tier is not None:
+                stats["hot_tier"] = server.qcs_hot_tier.ht_stats()
+            body = json.dumps(stats, indent=4, separators=(',', ': '))
+            self.qch_reply((httplib.OK, "application/json", body))
+            return
+
+        params = urlparse.parse_qsl(url.query, keep_blank_values=True)
+        if url.path == "/query" and server.qcs_hot_tier is not None:
+            body = server.qcs_hot_tier.ht_query(params)
+            if body is not None:
+                self.qch_reply((httplib.OK, "application/json", body))
+                return
+
+        query = None
+        for name, value in params:
+            if name == "q":
+                query = value
+        if url.path != "/query" or query is None or not query_cacheable(query):
+            server.qcs_cache.qc_uncacheable_inc()
+            self.qch_reply(self.qch_upstream("GET", self.path))
+            return
+
+        normalized = query_normalize(query, server.qcs_bucket * 1000)
+        # Relative time range changes as time goes by
+        if "now()" in normalized:
+            bucket_index = int(time.time()) / server.qcs_bucket
+        else:
+            bucket_index = None
+        new_params = []
+        for name, value in params:
+            if name == "q":
+                value = normalized
+            new_params.append((name, value))
+        path = url.path + "?" + urllib.urlencode(sorted(new_params))
+        key = (path, bucket_index)
+        result = server.qcs_cache.qc_query(key,
+                                           lambda: self.qch_upstream("GET", path))
+        self.qch_reply(result)
+
+    def do_POST(self):
+        """
+        Add the writes forwarded by the subscription into the hot tier, and
+        pass the other POST requests through
+        """
+        server = self.server
+        length = int(self.headers.getheader("Content-Length", "0"))
+        body = self.rfile.read(length)
+        url = urlparse.urlparse(self.path)
+        if url.path == HOT_TIER_WRITE_PATH:
+            params = dict(urlparse.parse_qsl(url.query))
+            precision_ns = HOT_TIER_PRECISIONS.get(params.get("precision", "ns"))
+            if server.qcs_hot_tier is None or precision_ns is None:
+                self.qch_reply((httplib.BAD_REQUEST, "text/plain",
+                                "hot tier is disabled or precision is invalid"))
+                return
+            if params.get("db") == server.qcs_hot_tier.ht_database:
+                server.qcs_hot_tier.ht_write(body, precision_ns)
+            self.qch_reply((httplib.NO_CONTENT, "text/plain", ""))
+            return
+
+        server.qcs_cache.qc_uncacheable_inc()
+        self.qch_reply(self.qch_upstream("POST", self.path, body))
+
+
+class QueryCacheServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    The caching query proxy
+    """
+    # pylint: disable=too-many-arguments
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, listen_address, upstream_host, upstream_port, bucket,
+                 ttl, max_entries=QUERY_CACHE_MAX_ENTRIES, hot_tier=None):
+        BaseHTTPServer.HTTPServer.__init__(self, listen_address,
+                                           QueryCacheHandler)
+        self.qcs_upstream_host = upstream_host
+        self.qcs_upstream_port = upstream_port
+        self.qcs_bucket = bucket
+        self.qcs_cache = QueryCache(ttl, max_entries)
+        # The HotTier, None if disabled
+        self.qcs_hot_tier = hot_tier
+
+
+def usage():
+    """
+    Print usage string
+    """
+    sys.stderr.write("Usage: %s <listen_port> <influxdb_host> <influxdb_port> "
+                     "<bucket_seconds> <ttl_seconds> [<database> "
+                     "<hot_tier_seconds> <hot_tier_points>]\n" % sys.argv[0])
+
+
+def main():
+    """
+    Run the caching query proxy
+    """
+    if len(sys.argv) != 6 and len(sys.argv) != 9:
+        usage()
+        sys.exit(-1)
+    listen_port = int(sys.argv[1])
+    upstream_host = sys.argv[2]
+    upstream_port = int(sys.argv[3])
+    bucket = int(sys.argv[4])
+    ttl = int(sys.argv[5])
+    hot_tier = None
+    if len(sys.argv) == 9:
+        hot_tier = HotTier(sys.argv[6], int(sys.argv[7]), int(sys.argv[8]))
+
+    logging.basicConfig(level=logging.INFO)
+    server = QueryCacheServer(("127.0.0.1", listen_port), upstream_host,
+                              upstream_port, bucket, ttl, hot_tier=hot_tier)
+    logging.info("caching queries to Influxdb [%s:%d] on port [%d]",
+                 upstream_host, upstream_port, listen_port)
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1057 @@
+# Copyright (c) 2017 DataDirect Networks, Inc.
+# All Rights Reserved.
+# Author: lixi@ddn.com
+"""
+Streaming rollup service fed by the subscription of Influxdb
+
+Influxdb forwards every write of the ESMON database to this service. The points
+are summed into tumbling windows in memory, and when a window is closed, the
+same cqm_* points as the continuous queries are written back in batches. So
+the cost of the rollup grows with the ingest rate rather than with the data
+that continuous queries scan again and again.
+
+The heavy hitters, e.g. the jobs with the most I/O, are tracked by bounded
+space-saving sketches over a sliding window, and only the top-K of them plus
+an "other" bucket are written with the rank as tag. So the number of series
+stays the same however many jobs there are.
+
+The latency distributions, e.g. the wait time of the requests of a service, are
+summarized by mergeable DDSketch-style quantile sketches. Histogram sources
+are added bucket by bucket, and sources that only have the moments, i.e.
+samples, sum and sum_square, are approximated by log-normal distributions of
+the intervals of each server. The sketches of all servers are merged, and only
+the quantiles are written, one point per interval.
+
+This file only depends on the standard library, because it is copied to and
+run on the ESMON server as a standalone script.
+"""
+# pylint: disable=too-many-lines
+import sys
+import re
+import math
+import time
+import json
+import socket
+import logging
+import httplib
+import urllib
+import urlparse
+import heapq
+import operator
+import threading
+import SocketServer
+import BaseHTTPServer
+
+ROLLUP_PORT = 8096
+ROLLUP_STATS_PATH = "/esmon_rollup/stats"
+# The maximum number of lines written to Influxdb by one request
+ROLLUP_BATCH_SIZE = 5000
+# The maximum number of lines kept when Influxdb is not writable
+ROLLUP_MAX_PENDING = 1000000
+# Seconds between the checks of closed windows
+ROLLUP_FLUSH_INTERVAL = 1
+ROLLUP_TIMEOUT = 60
+# The field that collectd writes through the OpenTSDB listener
+ROLLUP_VALUE_FIELD = "value"
+# The field that "SELECT sum(...) / N INTO" of the continuous queries writes
+ROLLUP_CQ_FIELD = "sum"
+# The default number of heavy hitters written by each top-K rule
+ROLLUP_TOPK_K = 20
+# The default seconds of the sliding window of top-K rules
+ROLLUP_TOPK_SECONDS = 3600
+# The counters of a sketch are this multiple of K, more counters give
+# smaller errors of the estimated values
+ROLLUP_TOPK_CAPACITY_FACTOR = 10
+# The rank and key of the bucket of all keys that are not in top-K
+ROLLUP_TOPK_OTHER = "other"
+# The relative accuracy of the values of the quantile sketches
+ROLLUP_QUANTILE_ACCURACY = 0.01
+# The lowest buckets are collapsed if a sketch has more buckets than this
+ROLLUP_QUANTILE_MAX_BUCKETS = 2048
+# Key is the field name, value is the quantile written by the quantile rules
+ROLLUP_QUANTILES = {"p50": 0.5, "p90": 0.9, "p99": 0.99, "p999": 0.999}
+# The bounds of the probability strata of the approximated log-normal
+# distributions, narrower at the tail to keep the high quantiles
+ROLLUP_QUANTILE_STRATA = (list(step * 0.05 for step in range(19)) +
+                          [0.95, 0.97, 0.98, 0.99, 0.995, 0.998, 0.999,
+                           0.9995, 1.0])
+# The roles of the measurements of the moments, e.g. mdt_stats_req_waittime_sum
+ROLLUP_MOMENT_SUFFIXES = ["samples", "sum", "sum_square", "min", "max"]
+# The bucket tag of histograms, e.g. "1K_milliseconds"
+ROLLUP_BUCKET_PATTERN = re.compile(r"^(\d+)([KM]?)")
+ROLLUP_BUCKET_UNITS = {"": 1, "K": 1024, "M": 1048576}
+# Nanoseconds of each precision of the write API
+ROLLUP_PRECISIONS = {"n": 1, "ns": 1, "u": 1000, "ms": 1000000,
+                     "s": 1000000000, "m": 60000000000, "h": 3600000000000}
+# The WHERE clauses of continuous queries that can be rolled up, e.g.
+# "WHERE optype = 'sum_read_bytes' OR optype = 'sum_write_bytes'"
+ROLLUP_WHERE_CONDITION_PATTERN = re.compile(r"^\s*\"?(\w+)\"?\s*=\s*'([^'\\]*)'\s*$")
+ROLLUP_UNESCAPE_PATTERN = re.compile(r"\\([,= ])")
+
+
+def rollup_where_parse(where):
+    """
+    Return the WHERE clause of a continuous query as a dict with tag as key
+    and the set of the allowed values as value, None if it is not supported
+    """
+    where = where.strip()
+    if where == "":
+        return {}
+    if not where.upper().startswith("WHERE "):
+        return None
+    conditions = {}
+    for condition in re.split(r"\s+OR\s+", where[len("WHERE "):],
+                              flags=re.IGNORECASE):
+        match = ROLLUP_WHERE_CONDITION_PATTERN.match(condition)
+        if match is None:
+            return None
+        conditions.setdefault(match.group(1), set()).add(match.group(2))
+    # "a = 'x' OR b = 'y'" can not be expressed as the allowed values of tags
+    if len(conditions) > 1:
+        return None
+    return conditions
+
+
+def rollup_split(text, separator, quoted_strings=False):
+    """
+    Split the text of line protocol at the separators that are not escaped,
+    or quoted if quoted_strings
+    """
+    if "\\" not in text and (not quoted_strings or '"' not in text):
+        return text.split(separator)
+    fields = []
+    start = 0
+    index = 0
+    quoted = False
+    while index < len(text):
+        char = text[index]
+        if char == "\\":
+            index += 2
+            continue
+        if quoted_strings and char == '"':
+            quoted = not quoted
+        elif char == separator and not quoted:
+            fields.append(text[start:index])
+            start = index + 1
+        index += 1
+    fields.append(text[start:])
+    return fields
+
+
+def rollup_unescape(text):
+    """
+    Remove the escape characters of the measurement, tag key or tag value
+    """
+    return ROLLUP_UNESCAPE_PATTERN.sub(r"\1", text)
+
+
+def rollup_escape(text, tag=True):
+    """
+    Escape the measurement, or the tag key/value if tag
+    """
+    text = text.replace(",", "\\,").replace(" ", "\\ ")
+    if tag:
+        text = text.replace("=", "\\=")
+    return text
+
+
+def rollup_string(text):
+    """
+    Quote the string field value
+    """
+    return '"%s"' % text.replace("\\", "\\\\").replace('"', '\\"')
+
+
+def rollup_line_parse(line, precision_ns):
+    """
+    Return (measurement, tags, value, timestamp_ns) of the line, None if the
+    line has no numeric value field
+    """
+    # pylint: disable=too-many-return-statements
+    sections = rollup_split(line, " ")
+    if len(sections) < 2:
+        return None
+    key = sections[0]
+    rest = " ".join(sections[1:])
+    sections = rollup_split(rest, " ", quoted_strings=True)
+    if len(sections) == 1:
+        timestamp = int(time.time() * 1000000000)
+    elif len(sections) == 2:
+        try:
+            timestamp = int(sections[1]) * precision_ns
+        except ValueError:
+            return None
+    else:
+        return None
+
+    value = None
+    for field in rollup_split(sections[0], ",", quoted_strings=True):
+        name, _, field_value = field.partition("=")
+        if rollup_unescape(name) != ROLLUP_VALUE_FIELD:
+            continue
+        if field_value.endswith("i") or field_value.endswith("u"):
+            field_value = field_value[:-1]
+        try:
+            value = float(field_value)
+        except ValueError:
+            return None
+    if value is None:
+        return None
+
+    items = rollup_split(key, ",")
+    tags = {}
+    for item in items[1:]:
+        parts = rollup_split(item, "=")
+        if len(parts) != 2:
+            return None
+        tags[rollup_unescape(parts[0])] = rollup_unescape(parts[1])
+    return rollup_unescape(items[0]), tags, value, timestamp
+
+
+class RollupRule(object):
+    """
+    Each continuous query replaced by the rollup has an object of this type
+    """
+    # pylint: disable=too-few-public-methods,too-many-arguments
+    # pylint: disable=too-many-instance-attributes
+    def __init__(self, measurement, cq_measurement, groups, where, periods,
+                 fill_previous=False):
+        self.rr_measurement = measurement
+        self.rr_cq_measurement = cq_measurement
+        self.rr_groups = groups
+        # Key is tag, value is the set of allowed values
+        self.rr_where = where
+        # The number of points of each series in a window
+        self.rr_periods = periods
+        # Whether to write the sum of the previous window for the keys
+        # without point in a window, like fill(previous) of the query
+        self.rr_fill_previous = fill_previous
+        # The start second of the last closed window
+        self.rr_previous_start = None
+        # Key is the key, value is the sum in the last closed window
+        self.rr_previous = {}
+
+    def rr_key(self, tags):
+        """
+        Return the values of the grouped tags, None if the point is filtered
+        """
+        for tag, values in self.rr_where.iteritems():
+            if tags.get(tag, "") not in values:
+                return None
+        return tuple(tags.get(group, "") for group in self.rr_groups)
+
+    def rr_line(self, key, total, window_start):
+        """
+        Return the line of the rolled up point, the tags with empty values are
+        omitted like the ones written by continuous queries
+        """
+        line = rollup_escape(self.rr_cq_measurement, tag=False)
+        for group, value in zip(self.rr_groups, key):
+            if value != "":
+                line += ",%s=%s" % (rollup_escape(group), rollup_escape(value))
+        return "%s %s=%r %d" % (line, ROLLUP_CQ_FIELD,
+                                total / self.rr_periods, window_start)
+
+
+class SpaceSaving(object):
+    """
+    Space-saving sketch that estimates the sums of the heavy hitters with
+    bounded counters. A key that is not counted has a sum no larger than the
+    floor. The counters are trimmed in batches so that adding is O(1)
+    amortized.
+    """
+    def __init__(self, capacity):
+        self.ss_capacity = capacity
+        # Key is the key, value is the estimated sum
+        self.ss_counts = {}
+        # Key is the key, value is the maximum overestimation of the sum
+        self.ss_errors = {}
+        self.ss_floor = 0.0
+        self.ss_total = 0.0
+
+    def ss_add(self, key, weight):
+        """
+        Add the weight to the key
+        """
+        self.ss_total += weight
+        if key in self.ss_counts:
+            self.ss_counts[key] += weight
+        else:
+            self.ss_counts[key] = self.ss_floor + weight
+            self.ss_errors[key] = self.ss_floor
+            if len(self.ss_counts) > 2 * self.ss_capacity:
+                self.ss_trim()
+
+    def ss_trim(self):
+        """
+        Only keep the largest counters
+        """
+        if len(self.ss_counts) <= self.ss_capacity:
+            return
+        items = sorted(self.ss_counts.iteritems(),
+                       key=operator.itemgetter(1), reverse=True)
+        for key, count in items[self.ss_capacity:]:
+            self.ss_floor = max(self.ss_floor, count)
+            del self.ss_counts[key]
+            del self.ss_errors[key]
+
+    def ss_merge(self, sketch):
+        """
+        Merge the other sketch into this one
+        """
+        keys = set(self.ss_counts.keys()) | set(sketch.ss_counts.keys())
+        counts = {}
+        errors = {}
+        for key in keys:
+            counts[key] = (self.ss_counts.get(key, self.ss_floor) +
+                           sketch.ss_counts.get(key, sketch.ss_floor))
+            errors[key] = (self.ss_errors.get(key, self.ss_floor) +
+                           sketch.ss_errors.get(key, sketch.ss_floor))
+        self.ss_counts = counts
+        self.ss_errors = errors
+        self.ss_floor += sketch.ss_floor
+        self.ss_total += sketch.ss_total
+        self.ss_trim()
+
+    def ss_top(self, k):
+        """
+        Return the list of (key, sum, error) of the top-K keys
+        """
+        items = heapq.nlargest(k, self.ss_counts.iteritems(),
+                               key=operator.itemgetter(1))
+        return [(key, count, self.ss_errors[key]) for key, count in items]
+
+
+class TopkRule(object):
+    """
+    Each top-K summary maintained by the rollup has an object of this type
+    """
+    # pylint: disable=too-few-public-methods,too-many-arguments
+    # pylint: disable=too-many-instance-attributes
+    def __init__(self, measurement, topk_measurement, key_tag, groups, where,
+                 periods, k, windows):
+        self.tr_measurement = measurement
+        self.tr_topk_measurement = topk_measurement
+        # The tag of the heavy hitters, e.g. job_id
+        self.tr_key_tag = key_tag
+        # The top-K is computed in each group of these tags, e.g. fs_name
+        self.tr_groups = groups
+        # Key is tag, value is the set of allowed values
+        self.tr_where = where
+        # The number of points of each series in a window
+        self.tr_periods = periods
+        self.tr_k = k
+        # The number of tumbling windows in the sliding window
+        self.tr_windows = windows
+
+    def tr_group(self, tags):
+        """
+        Return the values of the grouped tags, None if the point is filtered
+        """
+        for tag, values in self.tr_where.iteritems():
+            if tags.get(tag, "") not in values:
+                return None
+        return tuple(tags.get(group, "") for group in self.tr_groups)
+
+    def tr_lines(self, group, sketch, windows, window_start):
+        """
+        Return the lines of the top-K and other bucket, the values are the
+        average rates in the sliding window like the ones of continuous
+        queries
+        """
+        prefix = rollup_escape(self.tr_topk_measurement, tag=False)
+        for tag, value in zip(self.tr_groups, group):
+            if value != "":
+                prefix += ",%s=%s" % (rollup_escape(tag), rollup_escape(value))
+        scale = float(self.tr_periods * windows)
+        top = sketch.ss_top(self.tr_k)
+        lines = []
+        for rank in range(1, self.tr_k + 1):
+            if rank <= len(top):
+                key, count, error = top[rank - 1]
+            else:
+                # Overwrite the rank that was used in the last window
+                key, count, error = "", 0.0, 0.0
+            lines.append("%s,rank=%d key=%s,sum=%r,error=%r %d" %
+                         (prefix, rank, rollup_string(key), count / scale,
+                          error / scale, window_start))
+        other = max(sketch.ss_total - sum(count for _, count, _ in top), 0.0)
+        lines.append("%s,rank=%s key=%s,sum=%r,error=0.0 %d" %
+                     (prefix, ROLLUP_TOPK_OTHER,
+                      rollup_string(ROLLUP_TOPK_OTHER), other / scale,
+                      window_start))
+        return lines
+
+
+def rollup_normal_quantile(probability):
+    """
+    Return the quantile of the standard normal distribution
+    """
+    low = -10.0
+    high = 10.0
+    for _ in range(60):
+        middle = (low + high) / 2
+        if 0.5 * (1 + math.erf(middle / math.sqrt(2))) < probability:
+            low = middle
+        else:
+            high = middle
+    return (low + high) / 2
+
+
+def rollup_normal_points():
+    """
+    Return the list of (z, weight) of the strata of the standard normal
+    distribution
+    """
+    points = []
+    for lower, upper in zip(ROLLUP_QUANTILE_STRATA[:-1],
+                            ROLLUP_QUANTILE_STRATA[1:]):
+        points.append((rollup_normal_quantile((lower + upper) / 2),
+                       upper - lower))
+    return points
+
+
+ROLLUP_NORMAL_POINTS = rollup_normal_points()
+
+
+def rollup_bucket_value(bucket):
+    """
+    Return the value of the histogram bucket, None if invalid
+    """
+    match = ROLLUP_BUCKET_PATTERN.match(bucket)
+    if match is None:
+        return None
+    return int(match.group(1)) * ROLLUP_BUCKET_UNITS[match.group(2)]
+
+
+class DDSketch(object):
+    """
+    Quantile sketch with logarithmic buckets, the estimated quantiles have
+    bounded relative errors, and sketches are merged by adding the buckets
+    """
+    def __init__(self, accuracy=ROLLUP_QUANTILE_ACCURACY,
+                 max_buckets=ROLLUP_QUANTILE_MAX_BUCKETS):
+        self.dds_gamma = (1 + accuracy) / (1 - accuracy)
+        self.dds_log_gamma = math.log(self.dds_gamma)
+        self.dds_max_buckets = max_buckets
+        # Key is the bucket index, value is the weight
+        self.dds_buckets = {}
+        # The weight of the values that are not positive
+        self.dds_zero = 0.0
+        self.dds_count = 0.0
+
+    def dds_add(self, value, weight=1.0):
+        """
+        Add the value with the weight
+        """
+        if weight <= 0:
+            return
+        self.dds_count += weight
+        if value <= 0:
+            self.dds_zero += weight
+            return
+        index = int(math.ceil(math.log(value) / self.dds_log_gamma))
+        self.dds_buckets[index] = self.dds_buckets.get(index, 0.0) + weight
+        if len(self.dds_buckets) > self.dds_max_buckets:
+            self.dds_collapse()
+
+    def dds_add_lognormal(self, mean, variance, weight, low=None, high=None):
+        """
+        Add the log-normal distribution with the mean and variance, the values
+        are clamped between low and high
+        """
+        # pylint: disable=too-many-arguments
+        if mean <= 0:
+            self.dds_add(0, weight)
+            return
+        sigma_square = math.log(1 + variance / (mean * mean))
+        sigma = math.sqrt(sigma_square)
+        log_mean = math.log(mean) - sigma_square / 2
+        for z_value, probability in ROLLUP_NORMAL_POINTS:
+            value = math.exp(log_mean + sigma * z_value)
+            if low is not None:
+                value = max(value, low)
+            if high is not None:
+                value = min(value, high)
+            self.dds_add(value, weight * probability)
+
+    def dds_collapse(self):
+        """
+        Collapse the lowest buckets into one
+        """
+        indexes = sorted(self.dds_buckets.keys())
+        collapsed = len(indexes) - self.dds_max_buckets + 1
+        target = indexes[collapsed - 1]
+        for index in indexes[:collapsed - 1]:
+            self.dds_buckets[target] += self.dds_buckets.pop(index)
+
+    def dds_merge(self, sketch):
+        """
+        Merge the other sketch into this one
+        """
+        for index, weight in sketch.dds_buckets.iteritems():
+            self.dds_buckets[index] = self.dds_buckets.get(index, 0.0) + weight
+        self.dds_zero += sketch.dds_zero
+        self.dds_count += sketch.dds_count
+        if len(self.dds_buckets) > self.dds_max_buckets:
+            self.dds_collapse()
+
+    def dds_quantile(self, quantile):
+        """
+        Return the estimated value of the quantile, None if empty
+        """
+        if self.dds_count <= 0:
+            return None
+        rank = quantile * self.dds_count
+        total = self.dds_zero
+        if total > rank:
+            return 0.0
+        index = None
+        for index in sorted(self.dds_buckets.keys()):
+            total += self.dds_buckets[index]
+            if total > rank:
+                break
+        if index is None:
+            return 0.0
+        return 2 * math.pow(self.dds_gamma, index) / (self.dds_gamma + 1)
+
+
+class QuantileRule(object):
+    """
+    Each quantile sketch maintained by the rollup has an object of this type
+    """
+    # pylint: disable=too-few-public-methods,too-many-arguments
+    def __init__(self, kind, measurement, quantile_measurement, groups,
+                 bucket_tag="size", host_tag="fqdn"):
+        # "histogram" if each point is the weight of a bucket, "moments" if
+        # the measurement is the prefix of the measurements of the moments
+        self.qr_kind = kind
+        self.qr_measurement = measurement
+        self.qr_quantile_measurement = quantile_measurement
+        self.qr_groups = groups
+        # The tag of the bucket value of histogram
+        self.qr_bucket_tag = bucket_tag
+        # The tag of the server of moments
+        self.qr_host_tag = host_tag
+
+    def qr_measurements(self):
+        """
+        Return a dict with the matched measurements as keys and their roles
+        as values
+        """
+        if self.qr_kind == "histogram":
+            return {self.qr_measurement: "bucket"}
+        measurements = {}
+        for suffix in ROLLUP_MOMENT_SUFFIXES:
+            measurements[self.qr_measurement + "_" + suffix] = suffix
+        return measurements
+
+    def qr_group(self, tags):
+        """
+        Return the values of the grouped tags
+        """
+        return tuple(tags.get(group, "") for group in self.qr_groups)
+
+    def qr_line(self, group, sketch, window_start):
+        """
+        Return the line of the quantiles, None if the sketch is empty
+        """
+        if sketch.dds_count <= 0:
+            return None
+        line = rollup_escape(self.qr_quantile_measurement, tag=False)
+        for tag, value in zip(self.qr_groups, group):
+            if value != "":
+                line += ",%s=%s" % (rollup_escape(tag), rollup_escape(value))
+        fields = []
+        for field, quantile in sorted(ROLLUP_QUANTILES.items()):
+            fields.append("%s=%r" % (field, sketch.dds_quantile(quantile)))
+        return "%s %s %d" % (line, ",".join(fields), window_start)
+
+
+class Rollup(object):
+    """
+    The sums of the tumbling windows
+    """
+    # pylint: disable=too-many-instance-attributes,too-many-arguments
+    def __init__(self, host, port, database, interval, delay, rules,
+                 topk_rules, quantile_rules):
+        self.ru_host = host
+        self.ru_port = port
+        self.ru_database = database
+        # Seconds of each window, the GROUP BY interval of continuous queries
+        self.ru_interval = interval
+        # Seconds to wait for the points of a window after it ends
+        self.ru_delay = delay
+        # Key is measurement, value is the list of rules
+        self.ru_rules = {}
+        for rule in rules:
+            self.ru_rules.setdefault(rule.rr_measurement, []).append(rule)
+        # Key is measurement, value is the list of top-K rules
+        self.ru_topk_rules = {}
+        for rule in topk_rules:
+            self.ru_topk_rules.setdefault(rule.tr_measurement, []).append(rule)
+        # Key is measurement, value is the list of (quantile rule, role)
+        self.ru_quantile_rules = {}
+        for rule in quantile_rules:
+            for measurement, role in rule.qr_measurements().iteritems():
+                self.ru_quantile_rules.setdefault(measurement,
+                                                  []).append((rule, role))
+        self.ru_lock = threading.Lock()
+        # Key is the start second of window, value is a dict with
+        # (rule, key) as key and sum as value
+        self.ru_windows = {}
+        # Key is the start second of window, value is a dict with
+        # (top-K rule, group) as key and sketch as value
+        self.ru_topk_windows = {}
+        # Key is (top-K rule, group), value is the list of
+        # (window_start, sketch) in the sliding window
+        self.ru_topk_history = {}
+        # Key is the start second of window, value is a dict with
+        # (quantile rule, group) as key. The value is the sketch of
+        # histogram, or a dict of moments with host as key and a dict of the
+        # last values with role as key as value.
+        self.ru_quantile_windows = {}
+        # Key is (quantile rule, host), value is the dict of the last
+        # cumulative moments with role as key
+        self.ru_quantile_moments = {}
+        # Points of the windows before this second are dropped. The window
+        # in progress when starting is incomplete, so it is skipped too.
+        self.ru_closed_until = (int(time.time()) / interval + 1) * interval
+        self.ru_first_window = self.ru_closed_until
+        # Lines not written to Influxdb yet
+        self.ru_pending = []
+        self.ru_received = 0
+        self.ru_matched = 0
+        self.ru_late = 0
+        self.ru_written = 0
+        self.ru_dropped = 0
+
+    def ru_add(self, data, precision_ns):
+        """
+        Add the points in line protocol into the windows
+        """
+        received = 0
+        matched = 0
+        late = 0
+        points = []
+        for line in data.splitlines():
+            line = line.strip()
+            if line == "" or line.startswith("#"):
+                continue
+            received += 1
+            key = rollup_split(line, " ")[0]
+            measurement = rollup_unescape(rollup_split(key, ",")[0])
+            if (measurement not in self.ru_rules and
+                    measurement not in self.ru_topk_rules and
+                    measurement not in self.ru_quantile_rules):
+                continue
+            point = rollup_line_parse(line, precision_ns)
+            if point is not None:
+                points.append(point)
+
+        with self.ru_lock:
+            for measurement, tags, value, timestamp in points:
+                second = timestamp / 1000000000
+                window_start = second - second % self.ru_interval
+                if window_start < self.ru_closed_until:
+                    late += 1
+                    continue
+                for rule in self.ru_rules.get(measurement, []):
+                    key = rule.rr_key(tags)
+                    if key is None:
+                        continue
+                    matched += 1
+                    window = self.ru_windows.setdefault(window_start, {})
+                    window_key = (rule, key)
+                    window[window_key] = window.get(window_key, 0.0) + value
+                for rule in self.ru_topk_rules.get(measurement, []):
+                    group = rule.tr_group(tags)
+                    key = tags.get(rule.tr_key_tag, "")
+                    if group is None or key == "":
+                        continue
+                    matched += 1
+                    window = self.ru_topk_windows.setdefault(window_start, {})
+                    window_key = (rule, group)
+                    if window_key not in window:
+                        capacity = rule.tr_k * ROLLUP_TOPK_CAPACITY_FACTOR
+                        window[window_key] = SpaceSaving(capacity)
+                    window[window_key].ss_add(key, value)
+                for rule, role in self.ru_quantile_rules.get(measurement, []):
+                    window = self.ru_quantile_windows.setdefault(window_start,
+                                                                 {})
+                    window_key = (rule, rule.qr_group(tags))
+                    if role == "bucket":
+                        bucket = rollup_bucket_value(tags.get(rule.qr_bucket_tag,
+                                                              ""))
+                        if bucket is None:
+                            continue
+                        if window_key not in window:
+                            window[window_key] = DDSketch()
+                        window[window_key].dds_add(bucket, value)
+                    else:
+                        host = tags.get(rule.qr_host_tag, "")
+                        moments = window.setdefault(window_key, {})
+                        moments.setdefault(host, {})[role] = value
+                    matched += 1
+            self.ru_received += received
+            self.ru_matched += matched
+            self.ru_late += late
+
+    def _ru_topk_close(self, window_start):
+        """
+        Return the lines of the sliding windows that end with the window,
+        the lock should be held
+        """
+        for window_key, sketch in self.ru_topk_windows.pop(window_start,
+                                                           {}).iteritems():
+            self.ru_topk_history.setdefault(window_key, []).append((window_start,
+                                                                    sketch))
+
+        lines = []
+        for window_key in list(self.ru_topk_history):
+            rule, group = window_key
+            oldest = window_start - (rule.tr_windows - 1) * self.ru_interval
+            history = [(start, sketch)
+                       for start, sketch in self.ru_topk_history[window_key]
+                       if start >= oldest]
+            if len(history) == 0:
+                del self.ru_topk_history[window_key]
+                continue
+            self.ru_topk_history[window_key] = history
+
+            merged = SpaceSaving(rule.tr_k * ROLLUP_TOPK_CAPACITY_FACTOR)
+            for _, sketch in history:
+                merged.ss_merge(sketch)
+            # The sliding window is shorter since the service started
+            windows = min(rule.tr_windows,
+                          (window_start - self.ru_first_window) /
+                          self.ru_interval + 1)
+            lines += rule.tr_lines(group, merged, windows, window_start)
+        return lines
+
+    def _ru_quantile_close(self, window_start):
+        """
+        Return the lines of the quantiles of the window, the lock should be
+        held
+        """
+        lines = []
+        window = self.ru_quantile_windows.pop(window_start, {})
+        for window_key, state in window.iteritems():
+            rule, group = window_key
+            if rule.qr_kind == "histogram":
+                line = rule.qr_line(group, state, window_start)
+                if line is not None:
+                    lines.append(line)
+                continue
+
+            sketch = DDSketch()
+            for host, moments in state.iteritems():
+                if ("samples" not in moments or "sum" not in moments or
+                        "sum_square" not in moments):
+                    continue
+                last = self.ru_quantile_moments.get((rule, host))
+                self.ru_quantile_moments[(rule, host)] = moments
+                if last is None:
+                    continue
+                samples = moments["samples"] - last["samples"]
+                total = moments["sum"] - last["sum"]
+                total_square = moments["sum_square"] - last["sum_square"]
+                # The stats are cleared, e.g. the service restarted
+                if samples <= 0 or total < 0 or total_square < 0:
+                    continue
+                mean = total / samples
+                variance = max(total_square / samples - mean * mean, 0.0)
+                # The min and max are cumulative, so they still bound the
+                # values of the interval
+                sketch.dds_add_lognormal(mean, variance, samples,
+                                         low=moments.get("min"),
+                                         high=moments.get("max"))
+            line = rule.qr_line(group, sketch, window_start)
+            if line is not None:
+                lines.append(line)
+        return lines
+
+    def _ru_fill_close(self, window, window_start):
+        """
+        Return the lines of the keys that have no point in the window but
+        have in the previous window, for the rules with fill_previous
+        """
+        lines = []
+        totals = {}
+        for (rule, key), total in window.iteritems():
+            if rule.rr_fill_previous:
+                totals.setdefault(rule, {})[key] = total
+        for rules in self.ru_rules.itervalues():
+            for rule in rules:
+                if not rule.rr_fill_previous:
+                    continue
+                current = totals.get(rule, {})
+                if rule.rr_previous_start == window_start - self.ru_interval:
+                    for key, total in rule.rr_previous.iteritems():
+                        if key not in current:
+                            lines.append(rule.rr_line(key, total,
+                                                      window_start))
+                # Only the window right after the one with points is filled
+                rule.rr_previous_start = window_start
+                rule.rr_previous = current
+        return lines
+
+    def ru_close(self, now):
+        """
+        Move the points of the windows that have ended to the pending lines
+        """
+        lines = []
+        with self.ru_lock:
+            window_starts = (set(self.ru_windows.keys()) |
+                             set(self.ru_topk_windows.keys()) |
+                             set(self.ru_quantile_windows.keys()))
+            for window_start in sorted(window_starts):
+                window_end = window_start + self.ru_interval
+                if window_end + self.ru_delay > now:
+                    break
+                window = self.ru_windows.pop(window_start, {})
+                for (rule, key), total in window.iteritems():
+                    lines.append(rule.rr_line(key, total, window_start))
+                lines += self._ru_fill_close(window, window_start)
+                lines += self._ru_topk_close(window_start)
+                lines += self._ru_quantile_close(window_start)
+                self.ru_closed_until = max(self.ru_closed_until, window_end)
+            closed_until = (int(now) - self.ru_delay) / self.ru_interval * self.ru_interval
+            self.ru_closed_until = max(self.ru_closed_until, closed_until)
+        self.ru_pending += lines
+        if len(self.ru_pending) > ROLLUP_MAX_PENDING:
+            dropped = len(self.ru_pending) - ROLLUP_MAX_PENDING
+            logging.error("dropping [%d] rolled up points that are not "
+                          "written to Influxdb", dropped)
+            self.ru_pending = self.ru_pending[dropped:]
+            self.ru_dropped += dropped
+
+    def ru_write(self, lines):
+        """
+        Write the lines to Influxdb
+        """
+        path = "/write?" + urllib.urlencode({"db": self.ru_database,
+                                             "precision": "s"})
+        try:
+            connection = httplib.HTTPConnection(self.ru_host, self.ru_port,
+                                                timeout=ROLLUP_TIMEOUT)
+            connection.request("POST", path, "\n".join(lines))
+            response = connection.getresponse()
+            status = response.status
+            data = response.read()
+            connection.close()
+        except (socket.error, httplib.HTTPException), err:
+            logging.error("failed to write [%d] points to Influxdb: %s",
+                          len(lines), err)
+            return -1
+
+        if status != httplib.NO_CONTENT:
+            logging.error("got InfluxDB status [%d] when writing [%d] points: "
+                          "%s", status, len(lines), data)
+            return -1
+        return 0
+
+    def ru_flush(self, now):
+        """
+        Close the ended windows and write the pending lines in batches
+        """
+        self.ru_close(now)
+        while len(self.ru_pending) > 0:
+            lines = self.ru_pending[:ROLLUP_BATCH_SIZE]
+            if self.ru_write(lines):
+                return -1
+            self.ru_pending = self.ru_pending[len(lines):]
+            self.ru_written += len(lines)
+        return 0
+
+    def ru_stats(self):
+        """
+        Return the statistics of the rollup
+        """
+        with self.ru_lock:
+            window_points = sum(len(window)
+                                for window in self.ru_windows.values())
+            sketches = (sum(len(window)
+                            for window in self.ru_topk_windows.values()) +
+                        sum(len(history)
+                            for history in self.ru_topk_history.values()) +
+                        sum(len(window)
+                            for window in self.ru_quantile_windows.values()))
+            return {"received": self.ru_received,
+                    "matched": self.ru_matched,
+                    "late": self.ru_late,
+                    "written": self.ru_written,
+                    "dropped": self.ru_dropped,
+                    "pending": len(self.ru_pending),
+                    "windows": len(self.ru_windows),
+                    "window_points": window_points,
+                    "sketches": sketches}
+
+
+class RollupHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Handle the writes forwarded by the subscription of Influxdb
+    """
+    # pylint: disable=invalid-name
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format_string, *args):
+        # pylint: disable=arguments-differ
+        logging.debug("%s - %s", self.address_string(), format_string % args)
+
+    def rh_reply(self, status, body="", content_type="text/plain"):
+        """
+        Send the reply back
+        """
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        """
+        Serve the statistics and ping
+        """
+        url = urlparse.urlparse(self.path)
+        if url.path == ROLLUP_STATS_PATH:
+            body = json.dumps(self.server.rs_rollup.ru_stats(), indent=4,
+                              separators=(',', ': '))
+            self.rh_reply(httplib.OK, body, "application/json")
+        elif url.path == "/ping":
+            self.rh_reply(httplib.NO_CONTENT)
+        else:
+            self.rh_reply(httplib.NOT_FOUND)
+
+    def do_POST(self):
+        """
+        Add the written points into the windows
+        """
+        length = int(self.headers.getheader("Content-Length", "0"))
+        body = self.rfile.read(length)
+        url = urlparse.urlparse(self.path)
+        if url.path != "/write":
+            self.rh_reply(httplib.NOT_FOUND)
+            return
+        params = dict(urlparse.parse_qsl(url.query))
+        precision_ns = ROLLUP_PRECISIONS.get(params.get("precision", "ns"))
+        if precision_ns is None:
+            self.rh_reply(httplib.BAD_REQUEST, "invalid precision")
+            return
+        self.server.rs_rollup.ru_add(body, precision_ns)
+        self.rh_reply(httplib.NO_CONTENT)
+
+
+class RollupServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    The rollup service
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, listen_address, rollup):
+        BaseHTTPServer.HTTPServer.__init__(self, listen_address,
+                                           RollupHandler)
+        self.rs_rollup = rollup
+
+
+def rollup_flush_thread(rollup):
+    """
+    Write the closed windows to Influxdb periodically
+    """
+    while True:
+        time.sleep(ROLLUP_FLUSH_INTERVAL)
+        rollup.ru_flush(time.time())
+
+
+def rollup_load(config_fpath):
+    """
+    Load the Json config and return the listen port and the rollup
+    """
+    try:
+        with open(config_fpath) as config_file:
+            config = json.load(config_file)
+    except (IOError, ValueError), err:
+        logging.error("failed to load config [%s]: %s", config_fpath, err)
+        return None, None
+
+    try:
+        rules = []
+        for rule_config in config["rules"]:
+            where = {}
+            for tag, values in rule_config["where"].iteritems():
+                where[tag] = set(values)
+            rules.append(RollupRule(rule_config["measurement"],
+                                    rule_config["cq_measurement"],
+                                    rule_config["groups"], where,
+                                    int(rule_config["periods"]),
+                                    fill_previous=rule_config.get("fill_previous",
+                                                                  False)))
+        topk_rules = []
+        for rule_config in config.get("topk_rules", []):
+            where = {}
+            for tag, values in rule_config["where"].iteritems():
+                where[tag] = set(values)
+            topk_rules.append(TopkRule(rule_config["measurement"],
+                                       rule_config["topk_measurement"],
+                                       rule_config["key_tag"],
+                                       rule_config["groups"], where,
+                                       int(rule_config["periods"]),
+                                       int(rule_config.get("k", ROLLUP_TOPK_K)),
+                                       int(rule_config["windows"])))
+        quantile_rules = []
+        for rule_config in config.get("quantile_rules", []):
+            quantile_rules.append(QuantileRule(rule_config["kind"],
+                                               rule_config["measurement"],
+                                               rule_config["quantile_measurement"],
+                                               rule_config["groups"],
+                                               bucket_tag=rule_config.get("bucket_tag",
+                                                                          "size"),
+                                               host_tag=rule_config.get("host_tag",
+                                                                        "fqdn")))
+        rollup = Rollup(config["influxdb_host"], int(config["influxdb_port"]),
+                        config["database"], int(config["interval"]),
+                        int(config["delay"]), rules, topk_rules,
+                        quantile_rules)
+        listen_port = int(config.get("listen_port", ROLLUP_PORT))
+    except (KeyError, TypeError, ValueError, AttributeError), err:
+        logging.error("invalid config [%s]: %s", config_fpath, err)
+        return None, None
+    return listen_port, rollup
+
+
+def usage():
+    """
+    Print usage string
+    """
+    sys.stderr.write("Usage: %s <config_file>\n" % sys.argv[0])
+
+
+def main():
+    """
+    Run the rollup service
+    """
+    if len(sys.argv) != 2:
+        usage()
+        sys.exit(-1)
+
+    logging.basicConfig(level=logging.INFO)
+    listen_port, rollup = rollup_load(sys.argv[1])
+    if rollup is None:
+        sys.exit(-1)
+    server = RollupServer(("127.0.0.1", listen_port), rollup)
+    flush_thread = threading.Thread(target=rollup_flush_thread,
+                                    args=(rollup,))
+    flush_thread.daemon = True
+    flush_thread.start()
+    logging.info("rolling up [%d] measurements, top-K of [%d] measurements "
+                 "and quantiles of [%d] measurements in windows of [%d] "
+                 "seconds on port [%d]",
+                 len(rollup.ru_rules), len(rollup.ru_topk_rules),
+                 len(rollup.ru_quantile_rules), rollup.ru_interval,
+                 listen_port)
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,339 @@
+# Copyright (c) 2017 DataDirect Networks, Inc.
+# All Rights Reserved.
+# Author: lixi@ddn.com
+"""
+Reaper of the stale series in Influxdb
+
+Every new job ID and client NID adds series that stay in the index of Influxdb
+even after the job finished or the client is gone. This script finds the tag
+values that have no point written within the idle horizon, and drops their
+series in rate-limited batches.
+
+This file only depends on the standard library, because it is copied to and
+run on the ESMON server as a standalone script.
+"""
+import sys
+import time
+import json
+import socket
+import logging
+import httplib
+import urllib
+
+# Measurements with job_id tag, including the ones saved by continuous queries
+SERIES_REAPER_JOB_MEASUREMENTS = r"^(cqm_)?(ost|mdt)_jobstats_"
+# Measurements with exp_client tag, including the ones saved by continuous
+# queries
+SERIES_REAPER_CLIENT_MEASUREMENTS = r"^(cqm_)?exp_(ost|md)_"
+# The maximum number of tag values dropped by one DROP SERIES statement
+SERIES_REAPER_BATCH_SIZE = 100
+# Seconds to sleep between batches, so Influxdb won't be blocked for long
+SERIES_REAPER_BATCH_INTERVAL = 1
+SERIES_REAPER_TIMEOUT = 600
+
+SERIES_REAPER_COLUMNS = ["MEASUREMENT", "TAG", "IDLE_DAYS", "VALUES", "ACTIVE",
+                         "STALE"]
+
+
+def influxql_string(value):
+    """
+    Quote the string for InfluxQL
+    """
+    return "'%s'" % value.replace("\\", "\\\\").replace("'", "\\'")
+
+
+def influxql_identifier(value):
+    """
+    Quote the identifier for InfluxQL
+    """
+    return '"%s"' % value.replace("\\", "\\\\").replace('"', '\\"')
+
+
+class SeriesReaperRule(object):
+    """
+    The series of the measurements matched by the regular expression are
+    dropped if the tag value has no point written within the idle horizon
+    """
+    # pylint: disable=too-few-public-methods
+    def __init__(self, measurement_regex, tag, idle_seconds):
+        self.srr_measurement_regex = measurement_regex
+        self.srr_tag = tag
+        self.srr_idle_seconds = idle_seconds
+
+
+class SeriesReaperStale(object):
+    """
+    The stale tag values of a measurement
+    """
+    # pylint: disable=too-few-public-methods
+    def __init__(self, rule, measurement, values, active_values):
+        self.srs_rule = rule
+        self.srs_measurement = measurement
+        # All values of the tag in the index
+        self.srs_values = values
+        # Values of the tag written within the idle horizon
+        self.srs_active_values = active_values
+        self.srs_stale_values = sorted(values - active_values)
+
+    def srs_row(self):
+        """
+        Return the columns of the report
+        """
+        return [self.srs_measurement, self.srs_rule.srr_tag,
+                "%g" % (self.srs_rule.srr_idle_seconds / 86400.0),
+                str(len(self.srs_values)), str(len(self.srs_active_values)),
+                str(len(self.srs_stale_values))]
+
+
+class SeriesReaper(object):
+    """
+    Find and drop the stale series
+    """
+    # pylint: disable=too-many-arguments
+    def __init__(self, host, port, database, rules,
+                 batch_size=SERIES_REAPER_BATCH_SIZE,
+                 batch_interval=SERIES_REAPER_BATCH_INTERVAL):
+        self.sr_host = host
+        self.sr_port = port
+        self.sr_database = database
+        self.sr_rules = rules
+        self.sr_batch_size = batch_size
+        self.sr_batch_interval = batch_interval
+
+    def sr_query(self, query):
+        """
+        Send the query to Influxdb, return the result of the statement or None
+        """
+        body = urllib.urlencode({"q": query, "db": self.sr_database,
+                                 "epoch": "s"})
+        headers = {"Content-Type": "application/x-www-form-urlencoded"}
+        logging.debug("querying [%s]", query)
+        try:
+            connection = httplib.HTTPConnection(self.sr_host, self.sr_port,
+                                                timeout=SERIES_REAPER_TIMEOUT)
+            connection.request("POST", "/query", body, headers)
+            response = connection.getresponse()
+            status = response.status
+            data = response.read()
+            connection.close()
+        except (socket.error, httplib.HTTPException), err:
+            logging.error("failed to send query [%s] to Influxdb: %s",
+                          query, err)
+            return None
+
+        if status != httplib.OK:
+            logging.error("got InfluxDB status [%d] with query [%s]: %s",
+                          status, query, data)
+            return None
+
+        try:
+            data = json.loads(data)
+        except ValueError, err:
+            logging.error("got invalid Json [%s] with query [%s]: %s",
+                          data, query, err)
+            return None
+        if "results" not in data or len(data["results"]) != 1:
+            logging.error("got wrong InfluxDB data [%s] with query [%s]",
+                          data, query)
+            return None
+        result = data["results"][0]
+        if "error" in result:
+            logging.error("got InfluxDB error [%s] with query [%s]",
+                          result["error"], query)
+            return None
+        return result
+
+    def sr_tag_values(self, rule):
+        """
+        Return all values of the tag in the index in a dict with measurement
+        as key
+        """
+        query = ("SHOW TAG VALUES FROM /%s/ WITH KEY = %s" %
+                 (rule.srr_measurement_regex, influxql_identifier(rule.srr_tag)))
+        result = self.sr_query(query)
+        if result is None:
+            return None
+
+        measurement_values = {}
+        for serie in result.get("series", []):
+            values = measurement_values.setdefault(serie["name"], set())
+            for _, value in serie.get("values", []):
+                values.add(value)
+        return measurement_values
+
+    def sr_active_tag_values(self, rule):
+        """
+        Return the values of the tag that are written within the idle horizon
+        in a dict with measurement as key
+        """
+        query = ("SELECT last(*) FROM /%s/ WHERE time > now() - %ds "
+                 "GROUP BY %s" %
+                 (rule.srr_measurement_regex, rule.srr_idle_seconds,
+                  influxql_identifier(rule.srr_tag)))
+        result = self.sr_query(query)
+        if result is None:
+            return None
+
+        measurement_values = {}
+        for serie in result.get("series", []):
+            values = measurement_values.setdefault(serie["name"], set())
+            value = serie.get("tags", {}).get(rule.srr_tag, "")
+            if value != "":
+                values.add(value)
+        return measurement_values
+
+    def sr_find(self):
+        """
+        Return the list of stale tag values of the measurements
+        """
+        stales = []
+        for rule in self.sr_rules:
+            measurement_values = self.sr_tag_values(rule)
+            if measurement_values is None:
+                logging.error("failed to get the values of tag [%s] of "
+                              "measurements [%s]", rule.srr_tag,
+                              rule.srr_measurement_regex)
+                return None
+
+            measurement_active_values = self.sr_active_tag_values(rule)
+            if measurement_active_values is None:
+                logging.error("failed to get the active values of tag [%s] of "
+                              "measurements [%s]", rule.srr_tag,
+                              rule.srr_measurement_regex)
+                return None
+
+            for measurement in sorted(measurement_values.keys()):
+                values = measurement_values[measurement]
+                active_values = measurement_active_values.get(measurement,
+                                                              set())
+                stales.append(SeriesReaperStale(rule, measurement, values,
+                                                values & active_values))
+        return stales
+
+    def sr_drop(self, stale):
+        """
+        Drop the series of the stale tag values in batches
+        """
+        tag = influxql_identifier(stale.srs_rule.srr_tag)
+        values = stale.srs_stale_values
+        for start in range(0, len(values), self.sr_batch_size):
+            if start > 0:
+                time.sleep(self.sr_batch_interval)
+            conditions = ["%s = %s" % (tag, influxql_string(value))
+                          for value in values[start:start + self.sr_batch_size]]
+            query = ("DROP SERIES FROM %s WHERE %s" %
+                     (influxql_identifier(stale.srs_measurement),
+                      " OR ".join(conditions)))
+            result = self.sr_query(query)
+            if result is None:
+                logging.error("failed to drop stale series of measurement [%s]",
+                              stale.srs_measurement)
+                return -1
+        logging.info("dropped the series of [%d] stale values of tag [%s] of "
+                     "measurement [%s]", len(values), stale.srs_rule.srr_tag,
+                     stale.srs_measurement)
+        return 0
+
+    def sr_reap(self, dry_run):
+        """
+        Report the stale series, and drop them unless dry_run
+        """
+        stales = self.sr_find()
+        if stales is None:
+            return -1
+
+        print(series_reaper_table(stales))
+        if dry_run:
+            return 0
+
+        ret = 0
+        for stale in stales:
+            if len(stale.srs_stale_values) == 0:
+                continue
+            if self.sr_drop(stale):
+                ret = -1
+        return ret
+
+
+def series_reaper_table(stales):
+    """
+    Return the stale tag values formatted as a table
+    """
+    rows = [SERIES_REAPER_COLUMNS]
+    for stale in stales:
+        rows.append(stale.srs_row())
+
+    widths = [max(len(row[i]) for row in rows)
+              for i in range(len(SERIES_REAPER_COLUMNS))]
+    lines = []
+    for row in rows:
+        lines.append("  ".join(value.ljust(widths[i])
+                               for i, value in enumerate(row)).rstrip())
+    return "\n".join(lines)
+
+
+def series_reaper_load(config_fpath):
+    """
+    Load the Json config and return the reaper
+    """
+    try:
+        with open(config_fpath) as config_file:
+            config = json.load(config_file)
+    except (IOError, ValueError), err:
+        logging.error("failed to load config [%s]: %s", config_fpath, err)
+        return None
+
+    try:
+        rules = []
+        for rule_config in config["rules"]:
+            rules.append(SeriesReaperRule(rule_config["measurement_regex"],
+                                          rule_config["tag"],
+                                          int(rule_config["idle_seconds"])))
+        reaper = SeriesReaper(config["influxdb_host"],
+                              int(config["influxdb_port"]),
+                              config["database"], rules,
+                              batch_size=int(config.get("batch_size",
+                                                        SERIES_REAPER_BATCH_SIZE)),
+                              batch_interval=float(config.get("batch_interval",
+                                                              SERIES_REAPER_BATCH_INTERVAL)))
+    except (KeyError, TypeError, ValueError), err:
+        logging.error("invalid config [%s]: %s", config_fpath, err)
+        return None
+    return reaper
+
+
+def usage():
+    """
+    Print usage string
+    """
+    sys.stderr.write("Usage: %s [--dry-run] <config_file>\n"
+                     "    --dry-run: report the stale series without dropping "
+                     "them\n" % sys.argv[0])
+
+
+def main():
+    """
+    Drop the stale series in Influxdb
+    """
+    args = sys.argv[1:]
+    dry_run = False
+    if len(args) > 0 and args[0] == "--dry-run":
+        dry_run = True
+        args = args[1:]
+    if len(args) != 1:
+        usage()
+        sys.exit(-1)
+
+    logging.basicConfig(level=logging.INFO)
+    reaper = series_reaper_load(args[0])
+    if reaper is None:
+        sys.exit(-1)
+    ret = reaper.sr_reap(dry_run)
+    if ret:
+        logging.error("failed to reap stale series")
+        sys.exit(ret)
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,383 @@
+# Copyright (c) 2017 DataDirect Networks, Inc.
+# All Rights Reserved.
+# Author: lixi@ddn.com
+"""
+Report the status of the ESMON agents
+"""
+import sys
+import logging
+import traceback
+import httplib
+import json
+import time
+import Queue
+import yaml
+
+from pyesmon import utils
+from pyesmon import ssh_host
+from pyesmon import collectd
+from pyesmon import esmon_common
+from pyesmon import esmon_config
+from pyesmon import esmon_influxdb
+from pyesmon import esmon_install_nodeps
+
+# The maximum number of agents that are probed at the same time
+ESMON_STATUS_CONCURRENCY = 32
+# Timeout of the probe command on each agent
+ESMON_STATUS_PROBE_TIMEOUT = 10
+# Only check the datapoints in this time range when looking for last seen time
+ESMON_STATUS_LAST_SEEN_RANGE = "1d"
+
+# A single command to probe everything on an agent, so that only one SSH
+# connection is needed for each agent. The fqdn tag of the datapoints is the
+# output of command "hostname", which is configured as the Hostname of Collectd
+ESMON_STATUS_PROBE_COMMAND = \
+    ("service collectd status > /dev/null 2>&1; echo \"running=$?\"; "
+     "echo \"fqdn=$(hostname)\"; "
+     "echo \"fingerprint=$(cat %s 2>/dev/null)\"; "
+     "echo \"process=$(ps -C collectd -o rss=,etimes= | head -n 1)\"" %
+     collectd.COLLECTD_FINGERPRINT_FPATH)
+
+ESMON_STATUS_COLUMNS = [("host_id", "HOST_ID"),
+                        ("hostname", "HOSTNAME"),
+                        ("fqdn", "FQDN"),
+                        ("collectd", "COLLECTD"),
+                        ("fingerprint", "FINGERPRINT"),
+                        ("rss_kb", "RSS_KB"),
+                        ("uptime", "UPTIME"),
+                        ("last_seen_ago", "LAST_SEEN_AGO")]
+
+
+class EsmonAgentStatus(object):
+    """
+    The status of an ESMON agent
+    """
+    # pylint: disable=too-few-public-methods,too-many-instance-attributes
+    def __init__(self, host):
+        self.eas_host = host
+        self.eas_fqdn = None
+        # None if failed to probe
+        self.eas_collectd_running = None
+        self.eas_fingerprint = None
+        self.eas_rss_kb = None
+        self.eas_uptime = None
+        # Seconds since the epoch of the last datapoint in InfluxDB
+        self.eas_last_seen = None
+
+    def eas_probe(self):
+        """
+        Probe the status of the agent
+        """
+        command = ESMON_STATUS_PROBE_COMMAND
+        retval = self.eas_host.sh_run(command,
+                                      timeout=ESMON_STATUS_PROBE_TIMEOUT)
+        if retval.cr_exit_status:
+            logging.error("failed to run command [%s] on host [%s], "
+                          "ret = [%d], stdout = [%s], stderr = [%s]",
+                          command,
+                          self.eas_host.sh_hostname,
+                          retval.cr_exit_status,
+                          retval.cr_stdout,
+                          retval.cr_stderr)
+            return -1
+
+        for line in retval.cr_stdout.splitlines():
+            key, _, value = line.partition("=")
+            value = value.strip()
+            if key == "running":
+                self.eas_collectd_running = (value == "0")
+            elif key == "fqdn":
+                self.eas_fqdn = value
+            elif key == "fingerprint" and value != "":
+                self.eas_fingerprint = value
+            elif key == "process" and value != "":
+                fields = value.split()
+                if len(fields) != 2:
+                    logging.error("unexpected process info [%s] of collectd on "
+                                  "host [%s]", value, self.eas_host.sh_hostname)
+                    return -1
+                self.eas_rss_kb = int(fields[0])
+                self.eas_uptime = int(fields[1])
+        return 0
+
+    def eas_dict(self, now):
+        """
+        Return the status as a dict
+        """
+        if self.eas_collectd_running is None:
+            collectd_status = "unknown"
+        elif self.eas_collectd_running:
+            collectd_status = "running"
+        else:
+            collectd_status = "stopped"
+
+        if self.eas_last_seen is None:
+            last_seen_ago = None
+        else:
+            last_seen_ago = max(0, now - self.eas_last_seen)
+
+        return {"host_id": self.eas_host.sh_host_id,
+                "hostname": self.eas_host.sh_hostname,
+                "fqdn": self.eas_fqdn,
+                "collectd": collectd_status,
+                "fingerprint": self.eas_fingerprint,
+                "rss_kb": self.eas_rss_kb,
+                "uptime": self.eas_uptime,
+                "last_seen_ago": last_seen_ago}
+
+
+def esmon_status_probe_thread(status_queue):
+    """
+    Probe the agents in the queue until it is empty
+    """
+    while True:
+        try:
+            agent_status = status_queue.get_nowait()
+        except Queue.Empty:
+            return
+        ret = agent_status.eas_probe()
+        if ret:
+            logging.error("failed to probe status of host [%s]",
+                          agent_status.eas_host.sh_hostname)
+
+
+def esmon_status_probe(agent_statuses):
+    """
+    Probe the agents in parallel
+    """
+    status_queue = Queue.Queue()
+    for agent_status in agent_statuses:
+        status_queue.put(agent_status)
+
+    threads = []
+    for _ in range(min(ESMON_STATUS_CONCURRENCY, len(agent_statuses))):
+        threads.append(utils.thread_start(esmon_status_probe_thread,
+                                          (status_queue,)))
+    for thread in threads:
+        thread.join()
+
+
+def esmon_status_last_seen(server_hostname):
+    """
+    Return the last seen time of all agents in a dict with fqdn as key
+    """
+    # pylint: disable=too-many-return-statements
+    client = esmon_influxdb.InfluxdbClient(server_hostname,
+                                           esmon_install_nodeps.INFLUXDB_DATABASE_NAME)
+    query = ('SELECT last("value") FROM "%s" WHERE time > now() - %s '
+             'GROUP BY "fqdn";' %
+             (esmon_install_nodeps.ESMON_CLIENT_HEALTH_MEASUREMENT,
+              ESMON_STATUS_LAST_SEEN_RANGE))
+    response = client.ic_query(query, epoch="s")
+    if response is None:
+        logging.error("failed to query Influxdb with query [%s]", query)
+        return None
+
+    if response.status_code != httplib.OK:
+        logging.error("got InfluxDB status [%d] with query [%s]",
+                      response.status_code, query)
+        return None
+
+    data = response.json()
+    last_seens = {}
+    if "results" not in data or len(data["results"]) != 1:
+        logging.error("got wrong InfluxDB data [%s]", data)
+        return None
+    result = data["results"][0]
+    if "series" not in result:
+        # No datapoint from any agent
+        return last_seens
+
+    for serie in result["series"]:
+        if "tags" not in serie or "fqdn" not in serie["tags"]:
+            logging.error("got wrong InfluxDB serie [%s], no fqdn tag", serie)
+            return None
+        if "values" not in serie or len(serie["values"]) != 1:
+            logging.error("got wrong InfluxDB serie [%s]", serie)
+            return None
+        fqdn = serie["tags"]["fqdn"]
+        last_seens[fqdn] = int(serie["values"][0][0])
+    return last_seens
+
+
+def esmon_status_parse_config(config, config_fpath):
+    """
+    Return the server host and the agent status list
+    """
+    # pylint: disable=too-many-return-statements
+    ret, host_configs = esmon_config.install_config_value(config, esmon_common.CSTR_SSH_HOSTS)
+    if ret:
+        return -1, None, None
+
+    hosts = {}
+    for host_config in host_configs:
+        ret, host_id = esmon_config.install_config_value(host_config,
+                                                         esmon_common.CSTR_HOST_ID)
+        if ret:
+            return -1, None, None
+
+        ret, hostname = esmon_config.install_config_value(host_config,
+                                                          esmon_common.CSTR_HOSTNAME)
+        if ret:
+            return -1, None, None
+
+        ret, local = esmon_config.install_config_value(host_config,
+                                                       esmon_common.CSTR_LOCAL_HOST)
+        if ret:
+            return -1, None, None
+
+        ret, ssh_identity_file = \
+            esmon_config.install_config_value(host_config,
+                                              esmon_common.CSTR_SSH_IDENTITY_FILE)
+        if ret:
+            return -1, None, None
+        hosts[host_id] = ssh_host.SSHHost(hostname,
+                                          identity_file=ssh_identity_file,
+                                          host_id=host_id, local=local)
+
+    ret, server_host_config = esmon_config.install_config_value(config, esmon_common.CSTR_SERVER)
+    if ret:
+        return -1, None, None
+
+    ret, host_id = esmon_config.install_config_value(server_host_config,
+                                                     esmon_common.CSTR_HOST_ID)
+    if ret:
+        return -1, None, None
+
+    if host_id not in hosts:
+        logging.error("SSH host with ID [%s] is NOT configured in "
+                      "[ssh_hosts], please correct file [%s]",
+                      host_id, config_fpath)
+        return -1, None, None
+    server_host = hosts[host_id]
+
+    ret, client_host_configs = esmon_config.install_config_value(config,
+                                                                 esmon_common.CSTR_AGENTS)
+    if ret:
+        return -1, None, None
+
+    agent_statuses = []
+    for client_host_config in client_host_configs:
+        ret, host_id = esmon_config.install_config_value(client_host_config,
+                                                         esmon_common.CSTR_HOST_ID)
+        if ret:
+            return -1, None, None
+
+        if host_id not in hosts:
+            logging.error("ESMON agent with ID [%s] is NOT configured in "
+                          "[ssh_hosts], please correct file [%s]",
+                          host_id, config_fpath)
+            return -1, None, None
+        agent_statuses.append(EsmonAgentStatus(hosts[host_id]))
+    return 0, server_host, agent_statuses
+
+
+def esmon_status_table(status_dicts):
+    """
+    Return the status dicts formatted as a table
+    """
+    rows = [[title for _, title in ESMON_STATUS_COLUMNS]]
+    for status_dict in status_dicts:
+        row = []
+        for key, _ in ESMON_STATUS_COLUMNS:
+            value = status_dict[key]
+            if value is None:
+                value = "-"
+            elif key == "fingerprint":
+                value = value[:12]
+            row.append(str(value))
+        rows.append(row)
+
+    widths = [max(len(row[i]) for row in rows)
+              for i in range(len(ESMON_STATUS_COLUMNS))]
+    lines = []
+    for row in rows:
+        lines.append("  ".join(value.ljust(widths[i])
+                               for i, value in enumerate(row)).rstrip())
+    return "\n".join(lines)
+
+
+def esmon_status(config_fpath, json_output):
+    """
+    Print the status of the ESMON agents
+    """
+    # pylint: disable=bare-except
+    config_fd = open(config_fpath)
+    ret = 0
+    try:
+        config = yaml.load(config_fd)
+    except:
+        logging.error("not able to load [%s] as yaml file: %s", config_fpath,
+                      traceback.format_exc())
+        ret = -1
+    config_fd.close()
+    if ret:
+        return -1
+
+    ret, server_host, agent_statuses = esmon_status_parse_config(config,
+                                                                 config_fpath)
+    if ret:
+        logging.error("failed to parse config [%s]", config_fpath)
+        return -1
+
+    probe_thread = utils.thread_start(esmon_status_probe, (agent_statuses,))
+    last_seens = esmon_status_last_seen(server_host.sh_hostname)
+    probe_thread.join()
+    if last_seens is None:
+        logging.error("failed to get the last seen time of the agents from "
+                      "server [%s]", server_host.sh_hostname)
+        last_seens = {}
+
+    for agent_status in agent_statuses:
+        if agent_status.eas_fqdn in last_seens:
+            agent_status.eas_last_seen = last_seens[agent_status.eas_fqdn]
+
+    now = int(time.time())
+    status_dicts = [agent_status.eas_dict(now) for agent_status in agent_statuses]
+    # Agents that have not been seen for the longest time go first
+    status_dicts.sort(key=lambda status_dict: (status_dict["last_seen_ago"] is not None,
+                                               -(status_dict["last_seen_ago"] or 0),
+                                               status_dict["host_id"]))
+    if json_output:
+        print(json.dumps(status_dicts, indent=4, separators=(',', ': ')))
+    else:
+        print(esmon_status_table(status_dicts))
+    return 0
+
+
+def usage():
+    """
+    Print usage string
+    """
+    utils.eprint("Usage: %s [--json] [config_file]" %
+                 sys.argv[0])
+
+
+def main():
+    """
+    Report the status of the ESMON agents
+    """
+    reload(sys)
+    sys.setdefaultencoding("utf-8")
+    config_fpath = esmon_common.ESMON_INSTALL_CONFIG
+    json_output = False
+
+    args = sys.argv[1:]
+    if len(args) > 0 and args[0] == "--json":
+        json_output = True
+        args = args[1:]
+    if len(args) == 1:
+        config_fpath = args[0]
+    elif len(args) > 1:
+        usage()
+        sys.exit(-1)
+
+    utils.configure_logging()
+    console_handler = utils.LOGGING_HANLDERS["console"]
+    console_handler.setLevel(logging.WARNING)
+
+    ret = esmon_status(config_fpath, json_output)
+    if ret:
+        logging.error("failed to get the status of ESMON agents")
+        sys.exit(ret)
+    sys.exit(0)
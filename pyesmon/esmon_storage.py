@@ -0,0 +1,533 @@
+# Copyright (c) 2017 DataDirect Networks, Inc.
+# All Rights Reserved.
+# Author: lixi@ddn.com
+"""
+Report the storage efficiency of each measurement in Influxdb
+
+The shards are listed by SHOW SHARDS, their sizes are got from the disk under
+influxdb_path, and the sizes of the measurements in each shard are got by
+"influx_inspect report-disk". If report-disk is not available, the size of a
+shard is attributed to its measurements in proportion to their points.
+"""
+import sys
+import logging
+import traceback
+import httplib
+import json
+import yaml
+
+from pyesmon import utils
+from pyesmon import ssh_host
+from pyesmon import esmon_common
+from pyesmon import esmon_config
+from pyesmon import esmon_influxdb
+from pyesmon import esmon_install_nodeps
+
+# The default number of the latest shards of each retention policy to report
+ESMON_STORAGE_SHARDS = 4
+# Float values that change a little every time are compressed badly, while a
+# series of stable values only needs about 1-2 bytes per point
+ESMON_STORAGE_BYTES_PER_POINT_WARN = 4.0
+# If series only have a few points in each shard, the measurement has tags
+# with too many values, and the cost of the series keys dominates
+ESMON_STORAGE_POINTS_PER_SERIES_WARN = 100
+
+ESMON_STORAGE_COLUMNS = [("retention_policy", "RP"),
+                         ("measurement", "MEASUREMENT"),
+                         ("bytes", "BYTES"),
+                         ("points", "POINTS"),
+                         ("series", "SERIES"),
+                         ("bytes_per_point", "BYTES_PER_POINT"),
+                         ("trend", "TREND"),
+                         ("note", "NOTE")]
+
+
+class StorageShard(object):
+    """
+    Each shard of the ESMON database has an object of this type
+    """
+    # pylint: disable=too-few-public-methods,too-many-arguments
+    def __init__(self, shard_id, retention_policy, start_time, end_time):
+        self.ss_id = shard_id
+        self.ss_retention_policy = retention_policy
+        # RFC3339 time strings
+        self.ss_start_time = start_time
+        self.ss_end_time = end_time
+        # Bytes on disk, None if unknown
+        self.ss_bytes = None
+        # Key is measurement name, value is bytes of TSM blocks
+        self.ss_measurement_bytes = None
+        # Key is measurement name, value is number of points
+        self.ss_measurement_points = {}
+
+    def ss_attributed_bytes(self, measurement):
+        """
+        Return the bytes of the measurement in this shard
+        """
+        if self.ss_measurement_bytes is not None:
+            return self.ss_measurement_bytes.get(measurement, 0)
+        total_points = sum(self.ss_measurement_points.values())
+        if self.ss_bytes is None or total_points == 0:
+            return 0
+        return (self.ss_bytes * self.ss_measurement_points.get(measurement, 0) /
+                total_points)
+
+
+class StorageMeasurement(object):
+    """
+    The storage usage of a measurement in a retention policy
+    """
+    # pylint: disable=too-few-public-methods,too-many-instance-attributes
+    def __init__(self, retention_policy, measurement):
+        self.sm_retention_policy = retention_policy
+        self.sm_measurement = measurement
+        self.sm_bytes = 0
+        self.sm_points = 0
+        self.sm_shards = 0
+        # None if unknown
+        self.sm_series = None
+        # Bytes per point in each shard, from old to new
+        self.sm_trend = []
+        self.sm_note = ""
+
+    def sm_bytes_per_point(self):
+        """
+        Return the average bytes per point, None if no point
+        """
+        if self.sm_points == 0:
+            return None
+        return float(self.sm_bytes) / self.sm_points
+
+    def sm_points_per_series(self):
+        """
+        Return the average points of each series in a shard
+        """
+        if not self.sm_series or self.sm_shards == 0:
+            return None
+        return float(self.sm_points) / self.sm_shards / self.sm_series
+
+    def sm_dict(self):
+        """
+        Return the usage as a dict
+        """
+        bytes_per_point = self.sm_bytes_per_point()
+        if bytes_per_point is not None:
+            bytes_per_point = round(bytes_per_point, 2)
+        return {"retention_policy": self.sm_retention_policy,
+                "measurement": self.sm_measurement,
+                "bytes": self.sm_bytes,
+                "points": self.sm_points,
+                "series": self.sm_series,
+                "bytes_per_point": bytes_per_point,
+                "trend": [round(value, 2) for value in self.sm_trend],
+                "note": self.sm_note}
+
+
+def esmon_storage_query(client, query, epoch=None):
+    """
+    Return the result of the query, or None on failure
+    """
+    response = client.ic_query(query, epoch=epoch)
+    if response is None:
+        logging.error("failed to query Influxdb with query [%s]", query)
+        return None
+
+    if response.status_code != httplib.OK:
+        logging.error("got InfluxDB status [%d] with query [%s]",
+                      response.status_code, query)
+        return None
+
+    data = response.json()
+    if "results" not in data or len(data["results"]) != 1:
+        logging.error("got wrong InfluxDB data [%s]", data)
+        return None
+    result = data["results"][0]
+    if "error" in result:
+        logging.error("got InfluxDB error [%s] with query [%s]",
+                      result["error"], query)
+        return None
+    return result
+
+
+def esmon_storage_shards(client):
+    """
+    Return the shards of the ESMON database
+    """
+    result = esmon_storage_query(client, "SHOW SHARDS")
+    if result is None:
+        return None
+
+    shards = []
+    for serie in result.get("series", []):
+        if serie["name"] != esmon_install_nodeps.INFLUXDB_DATABASE_NAME:
+            continue
+        columns = serie["columns"]
+        for value in serie.get("values", []):
+            shard = dict(zip(columns, value))
+            shards.append(StorageShard(str(shard["id"]),
+                                       shard["retention_policy"],
+                                       shard["start_time"],
+                                       shard["end_time"]))
+    return shards
+
+
+def esmon_storage_disk(server_host, influxdb_path, shards):
+    """
+    Get the bytes of the shards and their measurements on disk
+    """
+    data_path = "%s/data/%s" % (influxdb_path,
+                                esmon_install_nodeps.INFLUXDB_DATABASE_NAME)
+    shard_dict = {}
+    for shard in shards:
+        shard_dict[(shard.ss_retention_policy, shard.ss_id)] = shard
+
+    command = "du -sb %s/*/*" % data_path
+    retval = server_host.sh_run(command)
+    if retval.cr_exit_status:
+        logging.error("failed to run command [%s] on host [%s], "
+                      "ret = [%d], stdout = [%s], stderr = [%s]",
+                      command,
+                      server_host.sh_hostname,
+                      retval.cr_exit_status,
+                      retval.cr_stdout,
+                      retval.cr_stderr)
+        return -1
+    for line in retval.cr_stdout.splitlines():
+        fields = line.split()
+        if len(fields) != 2:
+            continue
+        key = tuple(fields[1].split("/")[-2:])
+        if key in shard_dict:
+            shard_dict[key].ss_bytes = int(fields[0])
+
+    command = "influx_inspect report-disk -detailed %s/data" % influxdb_path
+    retval = server_host.sh_run(command)
+    if retval.cr_exit_status:
+        logging.warning("failed to get the sizes of measurements by command "
+                        "[%s] on host [%s], attributing the shard sizes by "
+                        "points instead", command, server_host.sh_hostname)
+        return 0
+    try:
+        report = json.loads(retval.cr_stdout)
+        for item in report.get("Measurement", []):
+            if item["db"] != esmon_install_nodeps.INFLUXDB_DATABASE_NAME:
+                continue
+            key = (item["rp"], str(item["shard"]))
+            if key not in shard_dict:
+                continue
+            shard = shard_dict[key]
+            if shard.ss_measurement_bytes is None:
+                shard.ss_measurement_bytes = {}
+            shard.ss_measurement_bytes[item["measurement"]] = int(item["size"])
+    except (ValueError, KeyError, TypeError, AttributeError), err:
+        logging.warning("unexpected output of command [%s] on host [%s]: %s, "
+                        "attributing the shard sizes by points instead",
+                        command, server_host.sh_hostname, err)
+        for shard in shards:
+            shard.ss_measurement_bytes = None
+    return 0
+
+
+def esmon_storage_points(client, shard):
+    """
+    Get the number of points of each measurement in the shard by one query
+    """
+    query = ("SELECT count(*) FROM \"%s\"./.*/ WHERE time >= '%s' AND "
+             "time < '%s'" %
+             (shard.ss_retention_policy, shard.ss_start_time,
+              shard.ss_end_time))
+    result = esmon_storage_query(client, query)
+    if result is None:
+        return -1
+
+    for serie in result.get("series", []):
+        points = 0
+        for value in serie.get("values", []):
+            # The first column is time, the others are the counts of fields
+            points += sum(count for count in value[1:] if count is not None)
+        shard.ss_measurement_points[serie["name"]] = points
+    return 0
+
+
+def esmon_storage_series(client):
+    """
+    Return the number of series of each measurement in a dict
+    """
+    result = esmon_storage_query(client, "SHOW SERIES EXACT CARDINALITY")
+    if result is None:
+        return None
+
+    measurement_series = {}
+    for serie in result.get("series", []):
+        values = serie.get("values", [])
+        if len(values) == 1:
+            measurement_series[serie["name"]] = values[0][0]
+    return measurement_series
+
+
+def esmon_storage_top_tag(client, measurement):
+    """
+    Return the tag of the measurement with the most values and the number
+    """
+    result = esmon_storage_query(client, 'SHOW TAG KEYS FROM "%s"' %
+                                 measurement)
+    if result is None:
+        return None, 0
+
+    top_tag = None
+    top_number = 0
+    for serie in result.get("series", []):
+        for value in serie.get("values", []):
+            tag = value[0]
+            query = ('SHOW TAG VALUES EXACT CARDINALITY FROM "%s" '
+                     'WITH KEY = "%s"' % (measurement, tag))
+            tag_result = esmon_storage_query(client, query)
+            if tag_result is None:
+                continue
+            for tag_serie in tag_result.get("series", []):
+                number = tag_serie["values"][0][0]
+                if number > top_number:
+                    top_tag = tag
+                    top_number = number
+    return top_tag, top_number
+
+
+def esmon_storage_measurements(client, shards):
+    """
+    Return the usages of the measurements, sorted by bytes
+    """
+    usages = {}
+    for shard in sorted(shards, key=lambda shard: shard.ss_start_time):
+        measurements = set(shard.ss_measurement_points.keys())
+        if shard.ss_measurement_bytes is not None:
+            measurements |= set(shard.ss_measurement_bytes.keys())
+        for measurement in measurements:
+            key = (shard.ss_retention_policy, measurement)
+            if key not in usages:
+                usages[key] = StorageMeasurement(shard.ss_retention_policy,
+                                                 measurement)
+            storage_usage = usages[key]
+            shard_bytes = shard.ss_attributed_bytes(measurement)
+            shard_points = shard.ss_measurement_points.get(measurement, 0)
+            storage_usage.sm_bytes += shard_bytes
+            storage_usage.sm_points += shard_points
+            storage_usage.sm_shards += 1
+            if shard_points > 0:
+                storage_usage.sm_trend.append(float(shard_bytes) /
+                                              shard_points)
+
+    measurement_series = esmon_storage_series(client)
+    if measurement_series is None:
+        logging.warning("failed to get the series number of measurements")
+        measurement_series = {}
+
+    for storage_usage in usages.values():
+        measurement = storage_usage.sm_measurement
+        storage_usage.sm_series = measurement_series.get(measurement)
+        points_per_series = storage_usage.sm_points_per_series()
+        bytes_per_point = storage_usage.sm_bytes_per_point()
+        if (points_per_series is not None and
+                points_per_series < ESMON_STORAGE_POINTS_PER_SERIES_WARN):
+            tag, number = esmon_storage_top_tag(client, measurement)
+            storage_usage.sm_note = ("high-entropy tags, %.1f points per "
+                                     "series in a shard" % points_per_series)
+            if tag is not None:
+                storage_usage.sm_note += (", tag [%s] has %d values" %
+                                          (tag, number))
+        elif (bytes_per_point is not None and
+              bytes_per_point > ESMON_STORAGE_BYTES_PER_POINT_WARN):
+            storage_usage.sm_note = ("poor compression, values might have "
+                                     "float jitter")
+    return sorted(usages.values(),
+                  key=lambda storage_usage: -storage_usage.sm_bytes)
+
+
+def esmon_storage_table(usage_dicts):
+    """
+    Return the usage dicts formatted as a table
+    """
+    rows = [[title for _, title in ESMON_STORAGE_COLUMNS]]
+    for usage_dict in usage_dicts:
+        row = []
+        for key, _ in ESMON_STORAGE_COLUMNS:
+            value = usage_dict[key]
+            if value is None:
+                value = "-"
+            elif key == "trend":
+                value = ",".join("%.1f" % item for item in value)
+            row.append(str(value))
+        rows.append(row)
+
+    widths = [max(len(row[i]) for row in rows)
+              for i in range(len(ESMON_STORAGE_COLUMNS))]
+    lines = []
+    for row in rows:
+        lines.append("  ".join(value.ljust(widths[i])
+                               for i, value in enumerate(row)).rstrip())
+    return "\n".join(lines)
+
+
+def esmon_storage_parse_config(config, config_fpath):
+    """
+    Return the server host and the Influxdb path on it
+    """
+    # pylint: disable=too-many-return-statements
+    ret, host_configs = esmon_config.install_config_value(config, esmon_common.CSTR_SSH_HOSTS)
+    if ret:
+        return -1, None, None
+
+    ret, server_host_config = esmon_config.install_config_value(config, esmon_common.CSTR_SERVER)
+    if ret:
+        return -1, None, None
+
+    ret, server_host_id = esmon_config.install_config_value(server_host_config,
+                                                            esmon_common.CSTR_HOST_ID)
+    if ret:
+        return -1, None, None
+
+    ret, influxdb_path = esmon_config.install_config_value(server_host_config,
+                                                           esmon_common.CSTR_INFLUXDB_PATH)
+    if ret:
+        return -1, None, None
+
+    for host_config in host_configs:
+        ret, host_id = esmon_config.install_config_value(host_config,
+                                                         esmon_common.CSTR_HOST_ID)
+        if ret:
+            return -1, None, None
+        if host_id != server_host_id:
+            continue
+
+        ret, hostname = esmon_config.install_config_value(host_config,
+                                                          esmon_common.CSTR_HOSTNAME)
+        if ret:
+            return -1, None, None
+
+        ret, local = esmon_config.install_config_value(host_config,
+                                                       esmon_common.CSTR_LOCAL_HOST)
+        if ret:
+            return -1, None, None
+
+        ret, ssh_identity_file = \
+            esmon_config.install_config_value(host_config,
+                                              esmon_common.CSTR_SSH_IDENTITY_FILE)
+        if ret:
+            return -1, None, None
+        server_host = ssh_host.SSHHost(hostname,
+                                       identity_file=ssh_identity_file,
+                                       host_id=host_id, local=local)
+        return 0, server_host, influxdb_path
+
+    logging.error("SSH host with ID [%s] is NOT configured in "
+                  "[ssh_hosts], please correct file [%s]",
+                  server_host_id, config_fpath)
+    return -1, None, None
+
+
+def esmon_storage(config_fpath, json_output, shard_number):
+    """
+    Print the storage usage of the measurements
+    """
+    # pylint: disable=bare-except,too-many-return-statements
+    config_fd = open(config_fpath)
+    ret = 0
+    try:
+        config = yaml.load(config_fd)
+    except:
+        logging.error("not able to load [%s] as yaml file: %s", config_fpath,
+                      traceback.format_exc())
+        ret = -1
+    config_fd.close()
+    if ret:
+        return -1
+
+    ret, server_host, influxdb_path = esmon_storage_parse_config(config,
+                                                                 config_fpath)
+    if ret:
+        logging.error("failed to parse config [%s]", config_fpath)
+        return -1
+
+    client = esmon_influxdb.InfluxdbClient(server_host.sh_hostname,
+                                           esmon_install_nodeps.INFLUXDB_DATABASE_NAME)
+    shards = esmon_storage_shards(client)
+    if shards is None:
+        logging.error("failed to get the shards from server [%s]",
+                      server_host.sh_hostname)
+        return -1
+
+    # Only report the latest shards of each retention policy
+    rp_shards = {}
+    for shard in sorted(shards, key=lambda shard: shard.ss_start_time):
+        rp_shards.setdefault(shard.ss_retention_policy, []).append(shard)
+    shards = []
+    for rp_shard_list in rp_shards.values():
+        shards += rp_shard_list[-shard_number:]
+
+    ret = esmon_storage_disk(server_host, influxdb_path, shards)
+    if ret:
+        logging.error("failed to get the sizes of shards on server [%s]",
+                      server_host.sh_hostname)
+        return -1
+
+    for shard in shards:
+        ret = esmon_storage_points(client, shard)
+        if ret:
+            logging.error("failed to get the points of shard [%s]",
+                          shard.ss_id)
+            return -1
+
+    usages = esmon_storage_measurements(client, shards)
+    usage_dicts = [storage_usage.sm_dict() for storage_usage in usages]
+    if json_output:
+        print(json.dumps(usage_dicts, indent=4, separators=(',', ': ')))
+    else:
+        print(esmon_storage_table(usage_dicts))
+    return 0
+
+
+def usage():
+    """
+    Print usage string
+    """
+    utils.eprint("Usage: %s [--json] [--shards <number>] [config_file]\n"
+                 "    --shards: the number of the latest shards of each "
+                 "retention policy to report, default %d" %
+                 (sys.argv[0], ESMON_STORAGE_SHARDS))
+
+
+def main():
+    """
+    Report the storage efficiency of each measurement in Influxdb
+    """
+    reload(sys)
+    sys.setdefaultencoding("utf-8")
+    config_fpath = esmon_common.ESMON_INSTALL_CONFIG
+    json_output = False
+    shard_number = ESMON_STORAGE_SHARDS
+
+    args = sys.argv[1:]
+    while len(args) > 0 and args[0].startswith("--"):
+        if args[0] == "--json":
+            json_output = True
+            args = args[1:]
+        elif args[0] == "--shards" and len(args) > 1 and args[1].isdigit():
+            shard_number = int(args[1])
+            args = args[2:]
+        else:
+            usage()
+            sys.exit(-1)
+    if len(args) == 1:
+        config_fpath = args[0]
+    elif len(args) > 1 or shard_number == 0:
+        usage()
+        sys.exit(-1)
+
+    utils.configure_logging()
+    console_handler = utils.LOGGING_HANLDERS["console"]
+    console_handler.setLevel(logging.WARNING)
+
+    ret = esmon_storage(config_fpath, json_output, shard_number)
+    if ret:
+        logging.error("failed to report the storage usage of Influxdb")
+        sys.exit(ret)
+    sys.exit(0)
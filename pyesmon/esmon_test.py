@@ -60,7 +60,8 @@ def esmon_do_test_install(workspace, install_server, mnt_path):
 
     command = ("rpm -ivh %s/RPMS/%s/%s/esmon-*.el7.*.rpm" %
                (mnt_path, distro, target_cpu))
-    retval = install_server.sh_run(command)
+    retval = install_server.sh_run(command,
+                                   tail_size=ssh_host.COMMAND_OUTPUT_TAIL_SIZE)
     if retval.cr_exit_status:
         logging.error("failed to run command [%s] on host [%s], "
                       "ret = [%d], stdout = [%s], stderr = [%s]",
@@ -172,6 +173,8 @@ def lustre_host_metric_check(lustre_host, esmon_client):
         logging.error("unsupported Lustre version of [%s]",
                       esmon_client.ec_lustre_version.lv_name)
         return -1
+    # These metrics are collected every slow_gauge_periods intervals
+    interval = collectd.COLLECTD_INTERVAL_TEST * esmon_client.ec_slow_gauge_periods
     measurements = ["ost_filesinfo_total",
                     "ost_filesinfo_free",
                     "ost_kbytesinfo_free",
@@ -191,6 +194,7 @@ def lustre_host_metric_check(lustre_host, esmon_client):
                           "of file system [%s]", measurement, ost.lost_index,
                           fsname)
             ret = esmon_client.ec_influxdb_measurement_check(measurement,
+                                                             interval=interval,
                                                              fqdn=esmon_client.ec_fqdn,
                                                              fs_name=fsname,
                                                              ost_index=ost_index)
@@ -216,6 +220,7 @@ def lustre_host_metric_check(lustre_host, esmon_client):
                           "of file system [%s]", measurement, mdt.lmdt_index,
                           fsname)
             ret = esmon_client.ec_influxdb_measurement_check(measurement,
+                                                             interval=interval,
                                                              fqdn=esmon_client.ec_fqdn,
                                                              fs_name=fsname,
                                                              mdt_index=mdt_index)
@@ -450,10 +455,17 @@ def esmon_test_lustre(workspace, hosts, config, config_fpath, install_config,
             lustre.LustreClient(lustre_fs, host, mnt)
 
         # Umount all clients first, so as to prevent stuck caused by umounted OSTs/MDTs
+        host_services = lustre.lustre_detect_services(lustre_hosts.values())
         for host_id, lustre_host in lustre_hosts.iteritems():
             logging.debug("trying to umount Lustre clients on host [%s] with host_id [%s]",
                           lustre_host.sh_hostname, host_id)
-            ret = lustre_host.lsh_lustre_umount_services(client_only=True)
+            services = host_services.get(lustre_host.sh_hostname)
+            if services is None:
+                logging.info("failed to detect Lustre services on host [%s], "
+                             "reboot is needed", lustre_host.sh_hostname)
+                continue
+            ret = lustre_host.lsh_lustre_umount_services(client_only=True,
+                                                         services=services)
             if ret:
                 logging.info("failed to umount Lustre clients, reboot is needed")
 
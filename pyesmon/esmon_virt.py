@@ -236,7 +236,8 @@ NM_CONTROLLED=no
         ret = server_host.sh_run("which virt-copy-in")
         if ret.cr_exit_status != 0:
             command = ("yum install libguestfs-tools-c -y")
-            retval = server_host.sh_run(command)
+            retval = server_host.sh_run(command,
+                                        tail_size=ssh_host.COMMAND_OUTPUT_TAIL_SIZE)
             if retval.cr_exit_status:
                 logging.error("failed to run command [%s] on host [%s], "
                               "ret = [%d], stdout = [%s], stderr = [%s]",
@@ -645,7 +646,8 @@ EOF
     if ret.cr_exit_status != 0:
         # sshpass rely on epel-release on centos6
         command = ("yum install epel-release -y")
-        retval = server_host.sh_run(command)
+        retval = server_host.sh_run(command,
+                                    tail_size=ssh_host.COMMAND_OUTPUT_TAIL_SIZE)
         if retval.cr_exit_status:
             logging.error("failed to run command [%s] on host [%s], "
                           "ret = [%d], stdout = [%s], stderr = [%s]",
@@ -656,7 +658,8 @@ EOF
                           retval.cr_stderr)
             return -1
         command = ("yum install sshpass -y")
-        retval = server_host.sh_run(command)
+        retval = server_host.sh_run(command,
+                                    tail_size=ssh_host.COMMAND_OUTPUT_TAIL_SIZE)
         if retval.cr_exit_status:
             logging.error("failed to run command [%s] on host [%s], "
                           "ret = [%d], stdout = [%s], stderr = [%s]",
@@ -755,7 +758,8 @@ EOF
             return -1
 
         command = "yum install rsync -y"
-        retval = vm_host.sh_run(command)
+        retval = vm_host.sh_run(command,
+                                tail_size=ssh_host.COMMAND_OUTPUT_TAIL_SIZE)
         if retval.cr_exit_status:
             logging.error("failed to run command [%s] on host [%s], "
                           "ret = [%d], stdout = [%s], stderr = [%s]",
@@ -61,6 +61,299 @@ class GrafanaTemplating(object):
                 "list": self.gt_list}
 
 
+class GrafanaTarget(object):
+    """
+    Each query of a Grafana Panel has an object of this type
+    """
+    # pylint: disable=too-few-public-methods
+    def __init__(self, query, ref_id="A", alias="", result_format="time_series"):
+        # raw InfluxQL query
+        self.gtg_query = query
+        # unique ID of the query in the panel, i.e. A, B, C
+        self.gtg_ref_id = ref_id
+        # alias of the series, i.e. "$tag_fqdn"
+        self.gtg_alias = alias
+        # time_series or table
+        self.gtg_result_format = result_format
+
+    def gtg_json_encoder(self):
+        """
+        Json encoder
+        """
+        return {"alias": self.gtg_alias,
+                "dsType": "influxdb",
+                "query": self.gtg_query,
+                "rawQuery": True,
+                "refId": self.gtg_ref_id,
+                "resultFormat": self.gtg_result_format}
+
+
+class GrafanaPanel(object):
+    """
+    Each Grafana Panel has an object of this type
+    """
+    # pylint: disable=too-few-public-methods,too-many-instance-attributes
+    def __init__(self, panel_id, title, panel_type, datasource):
+        # unique panel id in the dashboard, an integer, None to assign it
+        # automatically when dumping the dashboard
+        self.gp_id = panel_id
+        # title of panel
+        self.gp_title = title
+        # type of panel, i.e. graph, table, singlestat
+        self.gp_type = panel_type
+        # name of the datasource
+        self.gp_datasource = datasource
+        # description shown when hovering on the title
+        self.gp_description = ""
+        # width of the panel, 12 means the full width of the row
+        self.gp_span = 12
+        # queries of the panel, see GrafanaTarget for details
+        self.gp_targets = []
+        # options specific to the panel type, i.e. styles of table
+        self.gp_options = {}
+
+    def gp_json_encoder(self):
+        """
+        Json encoder
+        """
+        panel = {"id": self.gp_id,
+                 "title": self.gp_title,
+                 "type": self.gp_type,
+                 "datasource": self.gp_datasource,
+                 "description": self.gp_description,
+                 "span": self.gp_span,
+                 "targets": self.gp_targets,
+                 "links": []}
+        panel.update(self.gp_type_options())
+        panel.update(self.gp_options)
+        return panel
+
+    def gp_type_options(self):
+        """
+        Return the default options of the panel type
+        """
+        # pylint: disable=no-self-use
+        return {}
+
+
+class GrafanaGraphPanel(GrafanaPanel):
+    """
+    Each Grafana Graph Panel has an object of this type
+    """
+    # pylint: disable=too-few-public-methods,too-many-instance-attributes
+    def __init__(self, title, datasource, panel_id=None):
+        super(GrafanaGraphPanel, self).__init__(panel_id, title, "graph",
+                                                datasource)
+        # unit of the left Y axis, i.e. short, bytes, ns
+        self.ggp_unit = "short"
+        # decimals of the left Y axis, None means auto
+        self.ggp_decimals = None
+        # minimum value of the left Y axis, None means auto
+        self.ggp_min = None
+        # label of the left Y axis
+        self.ggp_label = None
+        # whether to stack the series or not
+        self.ggp_stack = False
+        # whether to show the right Y axis or not
+        self.ggp_right_axis = False
+
+    def gp_type_options(self):
+        """
+        Return the default options of graph panel
+        """
+        return {"aliasColors": {},
+                "bars": False,
+                "fill": 1,
+                "legend": {"avg": False,
+                           "current": False,
+                           "max": False,
+                           "min": False,
+                           "show": True,
+                           "total": False,
+                           "values": False},
+                "lines": True,
+                "linewidth": 1,
+                "nullPointMode": "null",
+                "percentage": False,
+                "pointradius": 5,
+                "points": False,
+                "renderer": "flot",
+                "seriesOverrides": [],
+                "stack": self.ggp_stack,
+                "steppedLine": False,
+                "thresholds": [],
+                "tooltip": {"shared": True,
+                            "sort": 0,
+                            "value_type": "individual"},
+                "xaxis": {"mode": "time",
+                          "show": True,
+                          "values": []},
+                "yaxes": [{"decimals": self.ggp_decimals,
+                           "format": self.ggp_unit,
+                           "label": self.ggp_label,
+                           "logBase": 1,
+                           "max": None,
+                           "min": self.ggp_min,
+                           "show": True},
+                          {"format": "short",
+                           "label": None,
+                           "logBase": 1,
+                           "max": None,
+                           "min": None,
+                           "show": self.ggp_right_axis}]}
+
+
+class GrafanaTablePanel(GrafanaPanel):
+    """
+    Each Grafana Table Panel that aggregates time series, or shows the rows
+    of table queries, has an object of this type
+    """
+    # pylint: disable=too-few-public-methods,too-many-instance-attributes
+    def __init__(self, title, datasource, panel_id=None):
+        super(GrafanaTablePanel, self).__init__(panel_id, title, "table",
+                                                datasource)
+        # unit of the values
+        self.gtbp_unit = "short"
+        # aggregations shown as columns, i.e. Avg, Max, Current
+        self.gtbp_columns = ["Avg", "Max", "Current"]
+        # index of the column to sort by, 0 is the series name
+        self.gtbp_sort_col = len(self.gtbp_columns)
+        # whether to sort in descending order or not
+        self.gtbp_sort_desc = True
+        # timeseries_aggregations, or table to show the rows of the queries
+        # whose result format is table
+        self.gtbp_transform = "timeseries_aggregations"
+        # columns shown as strings rather than numbers in table transform
+        self.gtbp_string_columns = []
+
+    def gp_type_options(self):
+        """
+        Return the default options of table panel
+        """
+        columns = []
+        styles = [{"dateFormat": "YYYY-MM-DD HH:mm:ss",
+                   "pattern": "Time",
+                   "type": "date"}]
+        if self.gtbp_transform == "table":
+            styles[0]["type"] = "hidden"
+            for column in self.gtbp_string_columns:
+                styles.append({"pattern": column,
+                               "type": "string"})
+        else:
+            for column in self.gtbp_columns:
+                columns.append({"text": column, "value": column.lower()})
+        styles.append({"colorMode": None,
+                       "colors": ["rgba(245, 54, 54, 0.9)",
+                                  "rgba(237, 129, 40, 0.89)",
+                                  "rgba(50, 172, 45, 0.97)"],
+                       "decimals": 2,
+                       "pattern": "/.*/",
+                       "thresholds": [],
+                       "type": "number",
+                       "unit": self.gtbp_unit})
+        return {"columns": columns,
+                "filterNull": False,
+                "fontSize": "100%",
+                "pageSize": None,
+                "scroll": True,
+                "showHeader": True,
+                "sort": {"col": self.gtbp_sort_col,
+                         "desc": self.gtbp_sort_desc},
+                "styles": styles,
+                "transform": self.gtbp_transform}
+
+
+class GrafanaPiechartPanel(GrafanaPanel):
+    """
+    Each Grafana Pie Chart Panel has an object of this type
+    """
+    # pylint: disable=too-few-public-methods
+    def __init__(self, title, datasource, panel_id=None):
+        super(GrafanaPiechartPanel, self).__init__(panel_id, title,
+                                                   "grafana-piechart-panel",
+                                                   datasource)
+        # the slices smaller than this percentage are combined as "Others"
+        self.gpp_combine_threshold = ""
+
+    def gp_type_options(self):
+        """
+        Return the default options of pie chart panel
+        """
+        return {"aliasColors": {},
+                "cacheTimeout": None,
+                "combine": {"label": "Others",
+                            "threshold": self.gpp_combine_threshold},
+                "fontSize": "80%",
+                "format": "short",
+                "interval": None,
+                "legend": {"header": "",
+                           "percentage": True,
+                           "percentageDecimals": None,
+                           "show": True,
+                           "sort": None,
+                           "sortDesc": None,
+                           "values": False},
+                "legendType": "Right side",
+                "maxDataPoints": 3,
+                "nullPointMode": "connected",
+                "pieType": "pie",
+                "strokeWidth": "1",
+                "valueName": "current"}
+
+
+class GrafanaTemplateVariable(object):
+    """
+    Each template variable of Grafana Templating has an object of this type
+    """
+    # pylint: disable=too-few-public-methods,too-many-instance-attributes
+    def __init__(self, name, label, query, datasource):
+        # name of the variable, i.e. fqdn means $fqdn
+        self.gtv_name = name
+        # label shown on the dashboard
+        self.gtv_label = label
+        # InfluxQL query to get the values, i.e. SHOW TAG VALUES
+        self.gtv_query = query
+        # name of the datasource
+        self.gtv_datasource = datasource
+        # whether multiple values can be selected
+        self.gtv_multi = True
+        # whether the "All" option is included
+        self.gtv_include_all = True
+        # 1 for refreshing on dashboard load, 2 for on time range change
+        self.gtv_refresh = 1
+        # 1 for alphabetical (asc), 3 for numerical (asc)
+        self.gtv_sort = 1
+        # regex to filter or capture the values
+        self.gtv_regex = ""
+
+    def gtv_json_encoder(self):
+        """
+        Json encoder
+        """
+        if self.gtv_include_all:
+            current = {"text": "All", "value": ["$__all"]}
+        else:
+            current = {}
+        return {"allValue": None,
+                "current": current,
+                "datasource": self.gtv_datasource,
+                "hide": 0,
+                "includeAll": self.gtv_include_all,
+                "label": self.gtv_label,
+                "multi": self.gtv_multi,
+                "name": self.gtv_name,
+                "options": [],
+                "query": self.gtv_query,
+                "refresh": self.gtv_refresh,
+                "regex": self.gtv_regex,
+                "sort": self.gtv_sort,
+                "tagValuesQuery": "",
+                "tags": [],
+                "tagsQuery": "",
+                "type": "query",
+                "useTags": False}
+
+
 class GrafanaAnnotations(object):
     """
     Each Grafana Annotations has an object of this type
@@ -102,8 +395,9 @@ class GrafanaRow(object):
     """
     # pylint: disable=too-few-public-methods
     def __init__(self, title):
-        # whether row is collapsed or not
-        self.gr_collapse = False
+        # whether row is collapsed or not, the panels in a collapsed row are
+        # not queried until the row is expanded
+        self.gr_collapse = True
         # whether a row is editable or not
         self.gr_editable = True
         # height of the row in pixels
@@ -112,6 +406,8 @@ class GrafanaRow(object):
         self.gr_panels = []
         # title of row
         self.gr_title = title
+        # whether to show the title of the row or not
+        self.gr_show_title = True
 
     def gr_json_encoder(self):
         """
@@ -121,6 +417,7 @@ class GrafanaRow(object):
                 "editable": self.gr_editable,
                 "height": self.gr_height,
                 "panels": self.gr_panels,
+                "showTitle": self.gr_show_title,
                 "title": self.gr_title}
 
 
@@ -140,9 +437,9 @@ class GrafanaDashboard(object):
                                   indent=4, separators=(',', ': '))
     dashboard = json.loads(dashboard_string)
     logging.debug("dashboard of [%s]: %s", name, dashboard_string)
-    ret = self.es_grafana_dashboard_replace(name, dashboard)
+    ret = self.es_grafana_dashboard_sync(name, dashboard)
     if ret:
-        logging.error("failed to replace dashboard [%s]: %s", name,
+        logging.error("failed to sync dashboard [%s]: %s", name,
                       dashboard_string)
         return ret
     """
@@ -175,26 +472,47 @@ class GrafanaDashboard(object):
         self.gd_templating = GrafanaTemplating()
         # annotations metadata, see GrafanaAnnotations for details
         self.gd_annotations = GrafanaAnnotations()
+        # auto refresh interval of dashboard, i.e. 1m
+        self.gd_refresh = "1m"
         self.gd_schema_version = 14
         self.gd_version = 0
         self.gd_links = []
 
+    def gd_panel_ids_assign(self):
+        """
+        Assign unique IDs to the panels that have no ID
+        """
+        panel_id = 0
+        for row in self.gd_rows:
+            for panel in row.gr_panels:
+                if panel.gp_id is not None:
+                    panel_id = max(panel_id, panel.gp_id)
+
+        for row in self.gd_rows:
+            for panel in row.gr_panels:
+                if panel.gp_id is None:
+                    panel_id += 1
+                    panel.gp_id = panel_id
+
     def gd_json_encoder(self):
         """
         Json encoder
         """
+        self.gd_panel_ids_assign()
         return {"id": self.gd_id,
                 "title": self.gd_title,
                 "tags": self.gd_tags,
                 "style": self.gd_style,
-                "timzone": self.gd_timzone,
+                "timezone": self.gd_timzone,
                 "editable": self.gd_editable,
                 "hideControls": self.gd_hide_controls,
                 "graphTooltip": self.gd_graph_tooltip,
                 "rows": self.gd_rows,
                 "time": self.gd_time,
                 "timepicker": self.gd_timpicker,
+                "templating": self.gd_templating,
                 "annotations": self.gd_annotations,
+                "refresh": self.gd_refresh,
                 "schemaVersion": self.gd_schema_version,
                 "version": self.gd_version,
                 "links": self.gd_links}
@@ -221,4 +539,10 @@ class GrafanaEncoder(json.JSONEncoder):
             return obj.ga_json_encoder()
         elif isinstance(obj, GrafanaRow):
             return obj.gr_json_encoder()
+        elif isinstance(obj, GrafanaPanel):
+            return obj.gp_json_encoder()
+        elif isinstance(obj, GrafanaTarget):
+            return obj.gtg_json_encoder()
+        elif isinstance(obj, GrafanaTemplateVariable):
+            return obj.gtv_json_encoder()
         return json.JSONEncoder.default(self, obj)
@@ -22,6 +22,21 @@ JOB_ID_UNKNOWN = "unknown"
 
 LUSTRE_BACKEND_FILESYSTEMS = [LDISKFS, ZFS]
 
+LUSTRE_CLIENT_DEVICE_PATTERN = r"^.+:/(?P<fsname>\S+)$"
+LUSTRE_CLIENT_DEVICE_REGULAR = re.compile(LUSTRE_CLIENT_DEVICE_PATTERN)
+# Print the device, mount point and label of each mounted Lustre service in a
+# single command, so that only one round trip is needed for each host
+LUSTRE_MOUNTS_COMMAND = \
+    ("awk '$3 == \"lustre\" {print $1, $2}' /proc/mounts | "
+     "while read device mount_point; do "
+     "case $device in "
+     "*:/*) label=\"\";; "
+     "/*) label=$(e2label $device 2>/dev/null);; "
+     "*) label=$(zfs get -o value -H lustre:svname $device 2>/dev/null);; "
+     "esac; "
+     "echo \"$device $mount_point $label\"; "
+     "done")
+
 
 def lustre_string2index(index_string):
     """
@@ -67,6 +82,38 @@ def lustre_mdt_index2string(index_number):
     return 0, index_string
 
 
+def lustre_detect_services_thread(lustre_host, results):
+    """
+    Detect the Lustre services on a host, save (clients, osts, mdts) into the
+    results dict with the hostname as key
+    """
+    clients = {}
+    osts = {}
+    mdts = {}
+    ret = lustre_host.lsh_lustre_detect_services(clients, osts, mdts)
+    if ret:
+        logging.error("failed to detect Lustre services on host [%s]",
+                      lustre_host.sh_hostname)
+        return
+    results[lustre_host.sh_hostname] = (clients, osts, mdts)
+
+
+def lustre_detect_services(lustre_hosts):
+    """
+    Detect the Lustre services on the hosts in parallel. Return a dict with
+    the hostname as key and (clients, osts, mdts) as value, the hosts failed
+    to be detected are not included.
+    """
+    results = {}
+    threads = []
+    for lustre_host in lustre_hosts:
+        threads.append(utils.thread_start(lustre_detect_services_thread,
+                                          (lustre_host, results)))
+    for thread in threads:
+        thread.join()
+    return results
+
+
 class LustreFilesystem(object):
     """
     Information about Lustre file system
@@ -960,7 +1007,8 @@ class LustreServerHost(ssh_host.SSHHost):
         if not self.lsh_has_fuser() and not self.lsh_fuser_install_failed:
             logging.debug("host [%s] doesnot have fuser, trying to install",
                           self.sh_hostname)
-            ret = self.sh_run("yum install psmisc -y")
+            ret = self.sh_run("yum install psmisc -y",
+                              tail_size=ssh_host.COMMAND_OUTPUT_TAIL_SIZE)
             if ret.cr_exit_status:
                 logging.error("failed to install fuser")
                 self.lsh_fuser_install_failed = True
@@ -1030,45 +1078,61 @@ class LustreServerHost(ssh_host.SSHHost):
             return -1, None
         return 0, retval.cr_stdout.strip()
 
-    def lsh_lustre_detect_services(self, clients, osts, mdts, add_found=False):
+    def lsh_lustre_mounts(self):
         """
-        Detect mounted Lustre services (MDT/OST/clients) from the host
+        Return the list of (device, mount_point, label) of the mounted Lustre
+        services. The label is None for Lustre clients.
         """
-        # pylint: disable=too-many-locals,too-many-branches,too-many-statements
-        server_pattern = (r"^(?P<device>\S+) (?P<mount_point>\S+) lustre .+$")
-        server_regular = re.compile(server_pattern)
-
-        client_pattern = (r"^.+:/(?P<fsname>\S+) (?P<mount_point>\S+) lustre .+$")
-        client_regular = re.compile(client_pattern)
-
-        ost_pattern = (r"^(?P<fsname>\S+)-OST(?P<index_string>[0-9a-f]{4})$")
-        ost_regular = re.compile(ost_pattern)
-
-        mdt_pattern = (r"^(?P<fsname>\S+)-MDT(?P<index_string>[0-9a-f]{4})$")
-        mdt_regular = re.compile(mdt_pattern)
-
-        # Detect Lustre services
-        command = ("cat /proc/mounts")
-        retval = self.sh_run(command)
+        retval = self.sh_run(LUSTRE_MOUNTS_COMMAND)
         if retval.cr_exit_status != 0:
             logging.error("failed to run command [%s] on host [%s], "
                           "ret = [%d], stdout = [%s], stderr = [%s]",
-                          command, self.sh_hostname,
+                          LUSTRE_MOUNTS_COMMAND, self.sh_hostname,
                           retval.cr_exit_status,
                           retval.cr_stdout,
                           retval.cr_stderr)
-            return -1
+            return -1, None
 
+        mounts = []
         for line in retval.cr_stdout.splitlines():
             logging.debug("checking line [%s]", line)
-            match = server_regular.match(line)
-            if not match:
-                continue
+            fields = line.split()
+            if len(fields) < 2 or len(fields) > 3:
+                logging.error("unexpected line [%s] in the output of command "
+                              "[%s] on host [%s]", line, LUSTRE_MOUNTS_COMMAND,
+                              self.sh_hostname)
+                return -1, None
+            device = fields[0]
+            mount_point = fields[1]
+            if len(fields) == 3:
+                label = fields[2]
+            elif LUSTRE_CLIENT_DEVICE_REGULAR.match(device):
+                label = None
+            else:
+                logging.error("failed to get the label of device [%s] on "
+                              "host [%s]", device, self.sh_hostname)
+                return -1, None
+            mounts.append((device, mount_point, label))
+        return 0, mounts
 
-            device = match.group("device")
-            mount_point = match.group("mount_point")
+    def lsh_lustre_detect_services(self, clients, osts, mdts, add_found=False):
+        """
+        Detect mounted Lustre services (MDT/OST/clients) from the host
+        """
+        # pylint: disable=too-many-locals,too-many-branches,too-many-statements
+        ost_pattern = (r"^(?P<fsname>\S+)-OST(?P<index_string>[0-9a-f]{4})$")
+        ost_regular = re.compile(ost_pattern)
 
-            match = client_regular.match(line)
+        mdt_pattern = (r"^(?P<fsname>\S+)-MDT(?P<index_string>[0-9a-f]{4})$")
+        mdt_regular = re.compile(mdt_pattern)
+
+        # Detect Lustre services and the labels of the devices at once
+        ret, mounts = self.lsh_lustre_mounts()
+        if ret:
+            return -1
+
+        for device, mount_point, label in mounts:
+            match = LUSTRE_CLIENT_DEVICE_REGULAR.match(device)
             if match:
                 fsname = match.group("fsname")
                 client_id = lustre_client_id(fsname, mount_point)
@@ -1084,12 +1148,6 @@ class LustreServerHost(ssh_host.SSHHost):
                               fsname, mount_point, self.sh_hostname)
                 continue
 
-            ret, label = self.lsh_lustre_device_label(device)
-            if ret:
-                logging.error("failed to get the label of device [%s] on "
-                              "host [%s]", device, self.sh_hostname)
-                return -1
-
             match = ost_regular.match(label)
             if match:
                 fsname = match.group("fsname")
@@ -1139,19 +1197,23 @@ class LustreServerHost(ssh_host.SSHHost):
 
         return 0
 
-    def lsh_lustre_umount_services(self, client_only=False):
+    def lsh_lustre_umount_services(self, client_only=False, services=None):
         """
-        Umount Lustre OSTs/MDTs/clients on the host
+        Umount Lustre OSTs/MDTs/clients on the host, services is the
+        (clients, osts, mdts) detected before, if any
         """
         # pylint: disable=too-many-return-statements
-        clients = {}
-        osts = {}
-        mdts = {}
-        ret = self.lsh_lustre_detect_services(clients, osts, mdts)
-        if ret:
-            logging.error("failed to detect Lustre services on host [%s]",
-                          self.sh_hostname)
-            return -1
+        if services is not None:
+            clients, osts, mdts = services
+        else:
+            clients = {}
+            osts = {}
+            mdts = {}
+            ret = self.lsh_lustre_detect_services(clients, osts, mdts)
+            if ret:
+                logging.error("failed to detect Lustre services on host [%s]",
+                              self.sh_hostname)
+                return -1
 
         for client in clients.values():
             command = ("umount %s" % client.lc_mnt)
@@ -1258,7 +1320,8 @@ class LustreServerHost(ssh_host.SSHHost):
                      "on host [%s]", self.sh_hostname)
         ret = self.sh_run("which yum-complete-transaction")
         if ret.cr_exit_status != 0:
-            ret = self.sh_run("yum install yum-utils -y")
+            ret = self.sh_run("yum install yum-utils -y",
+                              tail_size=ssh_host.COMMAND_OUTPUT_TAIL_SIZE)
             if ret.cr_exit_status != 0:
                 logging.error("failed to install yum-utils on host "
                               "[%s], ret = %d, stdout = [%s], stderr = [%s]",
@@ -1266,7 +1329,8 @@ class LustreServerHost(ssh_host.SSHHost):
                               ret.cr_stdout, ret.cr_stderr)
                 return -1
 
-        ret = self.sh_run("yum-complete-transaction")
+        ret = self.sh_run("yum-complete-transaction",
+                          tail_size=ssh_host.COMMAND_OUTPUT_TAIL_SIZE)
         if ret.cr_exit_status != 0:
             logging.error("failed to run yum-complete-transaction on host "
                           "[%s], ret = %d, stdout = [%s], stderr = [%s]",
@@ -1284,7 +1348,8 @@ class LustreServerHost(ssh_host.SSHHost):
                           ret.cr_stdout, ret.cr_stderr)
             return -1
 
-        ret = self.sh_run("yum install kernel -y", timeout=1800)
+        ret = self.sh_run("yum install kernel -y", timeout=1800,
+                          tail_size=ssh_host.COMMAND_OUTPUT_TAIL_SIZE)
         if ret.cr_exit_status != 0:
             logging.error("failed to install backup kernel on host [%s], "
                           "ret = %d, stdout = [%s], stderr = [%s]",
@@ -1356,7 +1421,8 @@ class LustreServerHost(ssh_host.SSHHost):
 
         retval = self.sh_run("rpm -qa | grep epel-release")
         if retval.cr_exit_status != 0:
-            retval = self.sh_run("yum install epel-release -y")
+            retval = self.sh_run("yum install epel-release -y",
+                                 tail_size=ssh_host.COMMAND_OUTPUT_TAIL_SIZE)
             if retval.cr_exit_status != 0:
                 logging.error("failed to install EPEL RPM on host [%s]",
                               self.sh_hostname)
@@ -1366,7 +1432,8 @@ class LustreServerHost(ssh_host.SSHHost):
         for rpm in dependent_rpms:
             command += " " + rpm
 
-        retval = self.sh_run(command)
+        retval = self.sh_run(command,
+                             tail_size=ssh_host.COMMAND_OUTPUT_TAIL_SIZE)
         if retval.cr_exit_status != 0:
             logging.error("failed to run command [%s] on host [%s], "
                           "ret = [%d], stdout = [%s], stderr = [%s]",
@@ -1396,7 +1463,8 @@ class LustreServerHost(ssh_host.SSHHost):
         # RHEL6 doesn't has perl-File-Path in yum by default
         if distro == ssh_host.DISTRO_RHEL7:
             # perl-File-Path is reqired by lustre-iokit
-            retval = self.sh_run("yum install perl-File-Path -y")
+            retval = self.sh_run("yum install perl-File-Path -y",
+                                 tail_size=ssh_host.COMMAND_OUTPUT_TAIL_SIZE)
             if retval.cr_exit_status != 0:
                 logging.error("failed to install perl-File-Path on host [%s]",
                               self.sh_hostname)
@@ -1489,7 +1557,8 @@ class LustreServerHost(ssh_host.SSHHost):
 
         logging.info("installing e2fsprogs RPMs under [%s] on host [%s]",
                      host_e2fsprogs_rpm_dir, self.sh_hostname)
-        retval = self.sh_run("rpm -Uvh %s/*.rpm" % host_e2fsprogs_rpm_dir)
+        retval = self.sh_run("rpm -Uvh %s/*.rpm" % host_e2fsprogs_rpm_dir,
+                             tail_size=ssh_host.COMMAND_OUTPUT_TAIL_SIZE)
         if retval.cr_exit_status != 0:
             logging.error("failed to install RPMs under [%s] of e2fsprogs on "
                           "host [%s], ret = %d, stdout = [%s], stderr = [%s]",
@@ -1551,7 +1620,8 @@ class LustreServerHost(ssh_host.SSHHost):
         # always update dracut-kernel first
         logging.info("installing dracut-kernel RPM on host [%s]",
                      self.sh_hostname)
-        retval = self.sh_run("yum update dracut-kernel -y")
+        retval = self.sh_run("yum update dracut-kernel -y",
+                             tail_size=ssh_host.COMMAND_OUTPUT_TAIL_SIZE)
         if retval.cr_exit_status != 0:
             logging.error("failed to install dracut-kernel RPM on "
                           "host [%s], ret = %d, stdout = [%s], stderr = [%s]",
@@ -1565,7 +1635,8 @@ class LustreServerHost(ssh_host.SSHHost):
             rpm_name = lustre_rpms.lr_rpm_names[RPM_KERNEL_FIRMWARE]
             retval = self.sh_run("rpm -ivh --force %s/%s" %
                                  (host_lustre_rpm_dir, rpm_name),
-                                 timeout=ssh_host.LONGEST_TIME_RPM_INSTALL)
+                                 timeout=ssh_host.LONGEST_TIME_RPM_INSTALL,
+                                 tail_size=ssh_host.COMMAND_OUTPUT_TAIL_SIZE)
             if retval.cr_exit_status != 0:
                 logging.error("failed to install kernel RPM on host [%s], "
                               "ret = %d, stdout = [%s], stderr = [%s]",
@@ -1576,7 +1647,8 @@ class LustreServerHost(ssh_host.SSHHost):
         rpm_name = lustre_rpms.lr_rpm_names[RPM_KERNEL]
         retval = self.sh_run("rpm -ivh --force %s/%s" %
                              (host_lustre_rpm_dir, rpm_name),
-                             timeout=ssh_host.LONGEST_TIME_RPM_INSTALL)
+                             timeout=ssh_host.LONGEST_TIME_RPM_INSTALL,
+                             tail_size=ssh_host.COMMAND_OUTPUT_TAIL_SIZE)
         if retval.cr_exit_status != 0:
             logging.error("failed to install kernel RPM on host [%s], "
                           "ret = %d, stdout = [%s], stderr = [%s]",
@@ -1622,11 +1694,13 @@ class LustreServerHost(ssh_host.SSHHost):
                          self.sh_hostname)
             retval = self.sh_run("rpm -ivh --force "
                                  "%s/mlnx-ofa_kernel*.rpm" %
-                                 host_lustre_rpm_dir)
+                                 host_lustre_rpm_dir,
+                                 tail_size=ssh_host.COMMAND_OUTPUT_TAIL_SIZE)
             if retval.cr_exit_status != 0:
                 retval = self.sh_run("yum localinstall -y --nogpgcheck "
                                      "%s/mlnx-ofa_kernel*.rpm" %
-                                     host_lustre_rpm_dir)
+                                     host_lustre_rpm_dir,
+                                     tail_size=ssh_host.COMMAND_OUTPUT_TAIL_SIZE)
                 if retval.cr_exit_status != 0:
                     logging.error("failed to install OFED RPM on host [%s], "
                                   "ret = %d, stdout = [%s], stderr = [%s]",
@@ -1661,7 +1735,8 @@ class LustreServerHost(ssh_host.SSHHost):
                                  "kmod-zfs-%s* spl-0* zfs-0*" %
                                  (host_lustre_rpm_dir, kernel_major_version,
                                   kernel_major_version),
-                                 timeout=install_timeout)
+                                 timeout=install_timeout,
+                                 tail_size=ssh_host.COMMAND_OUTPUT_TAIL_SIZE)
             if retval.cr_exit_status != 0:
                 logging.error("failed to install ZFS RPMs on host "
                               "[%s], ret = %d, stdout = [%s], stderr = [%s]",
@@ -1687,14 +1762,16 @@ class LustreServerHost(ssh_host.SSHHost):
                     retval = self.sh_run("rpm -ivh --force --nodeps %s/%s" %
                                          (host_lustre_rpm_dir,
                                           lustre_rpms.lr_rpm_names[rpm_type]),
-                                         timeout=install_timeout)
+                                         timeout=install_timeout,
+                                         tail_size=ssh_host.COMMAND_OUTPUT_TAIL_SIZE)
                     if retval.cr_exit_status == 0:
                         continue
 
                 retval = self.sh_run("yum localinstall -y --nogpgcheck %s/%s" %
                                      (host_lustre_rpm_dir,
                                       lustre_rpms.lr_rpm_names[rpm_type]),
-                                     timeout=install_timeout)
+                                     timeout=install_timeout,
+                                     tail_size=ssh_host.COMMAND_OUTPUT_TAIL_SIZE)
                 if retval.cr_exit_status != 0:
                     logging.error("failed to install [%s] RPM on host [%s], "
                                   "ret = %d, stdout = [%s], stderr = [%s]",
@@ -34,6 +34,8 @@ LONGEST_TIME_YUM_INSTALL = LONGEST_SIMPLE_COMMAND_TIME * 2
 LONGEST_TIME_RPM_INSTALL = LONGEST_SIMPLE_COMMAND_TIME * 2
 # The longest time that a issue reboot would stop the SSH server
 LONGEST_TIME_ISSUE_REBOOT = 10
+# Only keep the tail of the output of the commands that print a lot
+COMMAND_OUTPUT_TAIL_SIZE = 65536
 
 
 def sh_escape(command):
@@ -114,7 +116,9 @@ def ssh_command(hostname, command, login_name="root", identity_file=None):
 def ssh_run(hostname, command, login_name="root", timeout=None,
             stdout_tee=None, stderr_tee=None, stdin=None,
             return_stdout=True, return_stderr=True,
-            quit_func=None, identity_file=None, flush_tee=False):
+            quit_func=None, identity_file=None, flush_tee=False,
+            stdout_callback=None, stderr_callback=None,
+            callback_lines=True, tail_size=None):
     """
     Use ssh to run command on a remote host
     """
@@ -123,7 +127,10 @@ def ssh_run(hostname, command, login_name="root", timeout=None,
     return utils.run(full_command, timeout=timeout, stdout_tee=stdout_tee,
                      stderr_tee=stderr_tee, stdin=stdin,
                      return_stdout=return_stdout, return_stderr=return_stderr,
-                     quit_func=quit_func, flush_tee=flush_tee)
+                     quit_func=quit_func, flush_tee=flush_tee,
+                     stdout_callback=stdout_callback,
+                     stderr_callback=stderr_callback,
+                     callback_lines=callback_lines, tail_size=tail_size)
 
 
 class SSHHost(object):
@@ -723,7 +730,8 @@ class SSHHost(object):
         if not self.sh_has_rsync():
             logging.debug("host [%s] doesnot have rsync, trying to install",
                           self.sh_hostname)
-            ret = self.sh_run("yum install rsync -y")
+            ret = self.sh_run("yum install rsync -y",
+                              tail_size=COMMAND_OUTPUT_TAIL_SIZE)
             if ret.cr_exit_status:
                 logging.error("failed to install rsync")
                 return -1
@@ -756,11 +764,13 @@ class SSHHost(object):
     def sh_run(self, command, silent=False, login_name="root",
                timeout=LONGEST_SIMPLE_COMMAND_TIME, stdout_tee=None,
                stderr_tee=None, stdin=None, return_stdout=True,
-               return_stderr=True, quit_func=None, flush_tee=False):
+               return_stderr=True, quit_func=None, flush_tee=False,
+               stdout_callback=None, stderr_callback=None,
+               callback_lines=True, tail_size=None):
         """
         Run a command on the host
         """
-        # pylint: disable=too-many-arguments
+        # pylint: disable=too-many-arguments,too-many-locals
         if not silent:
             logging.debug("starting [%s] on host [%s]", command,
                           self.sh_hostname)
@@ -769,7 +779,11 @@ class SSHHost(object):
                             stderr_tee=stderr_tee, stdin=stdin,
                             return_stdout=return_stdout,
                             return_stderr=return_stderr,
-                            quit_func=quit_func, flush_tee=flush_tee)
+                            quit_func=quit_func, flush_tee=flush_tee,
+                            stdout_callback=stdout_callback,
+                            stderr_callback=stderr_callback,
+                            callback_lines=callback_lines,
+                            tail_size=tail_size)
         else:
             ret = ssh_run(self.sh_hostname, command, login_name=login_name,
                           timeout=timeout,
@@ -777,12 +791,17 @@ class SSHHost(object):
                           stdin=stdin, return_stdout=return_stdout,
                           return_stderr=return_stderr, quit_func=quit_func,
                           identity_file=self.sh_identity_file,
-                          flush_tee=flush_tee)
+                          flush_tee=flush_tee,
+                          stdout_callback=stdout_callback,
+                          stderr_callback=stderr_callback,
+                          callback_lines=callback_lines,
+                          tail_size=tail_size)
         if not silent:
             logging.debug("ran [%s] on host [%s], ret = [%d], stdout = [%s], "
                           "stderr = [%s]",
                           command, self.sh_hostname, ret.cr_exit_status,
-                          ret.cr_stdout, ret.cr_stderr)
+                          utils.output_truncate(ret.cr_stdout),
+                          utils.output_truncate(ret.cr_stderr))
         return ret
 
     def sh_get_kernel_ver(self):
@@ -1211,20 +1230,13 @@ class SSHHost(object):
         Return a direction
         """
         info_dict = {}
-        command = ("dumpe2fs -h %s" % (device))
-        retval = self.sh_run(command)
-        if retval.cr_exit_status != 0:
-            logging.error("failed to run command [%s], "
-                          "ret = [%d], stdout = [%s], stderr = [%s]",
-                          command,
-                          retval.cr_exit_status,
-                          retval.cr_stdout,
-                          retval.cr_stderr)
-            return -1, info_dict
-        lines = retval.cr_stdout.splitlines()
-        for line in lines:
+
+        def dumpe2fs_line(line):
+            """
+            Parse a line of dumpe2fs output
+            """
             if line == "":
-                continue
+                return
             name = ""
             pointer = 0
             for character in line:
@@ -1243,7 +1255,18 @@ class SSHHost(object):
 
             value = line[pointer:]
             info_dict[name] = value
-            logging.debug("dumpe2fs name: [%s], value: [%s]", name, value)
+
+        command = ("dumpe2fs -h %s" % (device))
+        retval = self.sh_run(command, stdout_callback=dumpe2fs_line,
+                             tail_size=COMMAND_OUTPUT_TAIL_SIZE)
+        if retval.cr_exit_status != 0:
+            logging.error("failed to run command [%s], "
+                          "ret = [%d], stdout = [%s], stderr = [%s]",
+                          command,
+                          retval.cr_exit_status,
+                          retval.cr_stdout,
+                          retval.cr_stderr)
+            return -1, info_dict
         return 0, info_dict
 
     def sh_zfs_get_srvname(self, device):
@@ -22,6 +22,8 @@ import string
 
 LOG_INFO_FNAME = "info.log"
 LOGGING_HANLDERS = {}
+# The maximum bytes of command output to print in debug log
+COMMAND_LOG_OUTPUT_LIMIT = 16384
 
 
 def eprint(*args, **kwargs):
@@ -95,6 +97,45 @@ def nuke_subprocess(subproc):
             return subproc.poll()
 
 
+def output_truncate(output, limit=COMMAND_LOG_OUTPUT_LIMIT):
+    """
+    Truncate the middle of the output if it is longer than limit, so that it
+    can be printed in the log
+    """
+    if output is None or len(output) <= limit:
+        return output
+    half = limit / 2
+    return ("%s\n...[%d bytes truncated]...\n%s" %
+            (output[:half], len(output) - half * 2, output[-half:]))
+
+
+class TailBuffer(object):
+    """
+    A file-like buffer that only keeps the last tail_size bytes written
+    """
+    def __init__(self, tail_size):
+        self.tb_tail_size = tail_size
+        self.tb_chunks = []
+        self.tb_size = 0
+
+    def write(self, data):
+        """
+        Append data to the buffer, drop the oldest data if too large
+        """
+        self.tb_chunks.append(data)
+        self.tb_size += len(data)
+        while (self.tb_size - len(self.tb_chunks[0]) >= self.tb_tail_size and
+               len(self.tb_chunks) > 1):
+            self.tb_size -= len(self.tb_chunks[0])
+            self.tb_chunks.pop(0)
+
+    def getvalue(self):
+        """
+        Return the data kept in the buffer
+        """
+        return "".join(self.tb_chunks)[-self.tb_tail_size:]
+
+
 class CommandResult(object):
     """
     All command will return a command result of this class
@@ -116,8 +157,15 @@ class CommandJob(object):
     def __init__(self, command, timeout=None, stdout_tee=None,
                  stderr_tee=None, stdin=None, return_stdout=True,
                  return_stderr=True, quit_func=None,
-                 flush_tee=False):
+                 flush_tee=False, stdout_callback=None, stderr_callback=None,
+                 callback_lines=True, tail_size=None):
         # pylint: disable=too-many-arguments
+        """
+        If stdout_callback/stderr_callback is not None, it is called with each
+        line (or each chunk if callback_lines is False) of the output as soon
+        as it is read. If tail_size is not None, only the last tail_size bytes
+        of the output are kept in the result.
+        """
         self.cj_command = command
         self.cj_result = CommandResult()
         self.cj_timeout = timeout
@@ -133,9 +181,21 @@ class CommandJob(object):
             self.cj_string_stdin = None
             self.cj_stdin = None
         if return_stdout:
-            self.cj_stdout_file = StringIO.StringIO()
+            if tail_size is None:
+                self.cj_stdout_file = StringIO.StringIO()
+            else:
+                self.cj_stdout_file = TailBuffer(tail_size)
         if return_stderr:
-            self.cj_stderr_file = StringIO.StringIO()
+            if tail_size is None:
+                self.cj_stderr_file = StringIO.StringIO()
+            else:
+                self.cj_stderr_file = TailBuffer(tail_size)
+        self.cj_stdout_callback = stdout_callback
+        self.cj_stderr_callback = stderr_callback
+        self.cj_callback_lines = callback_lines
+        # The incomplete last line of stdout/stderr for line callbacks
+        self.cj_stdout_partial = ""
+        self.cj_stderr_partial = ""
         self.cj_started = False
         self.cj_killed = False
         self.cj_start_time = None
@@ -196,8 +256,8 @@ class CommandJob(object):
                       "ret = [%d], stdout = [%s], stderr = [%s]",
                       self.cj_command,
                       self.cj_result.cr_exit_status,
-                      self.cj_result.cr_stdout,
-                      self.cj_result.cr_stderr)
+                      output_truncate(self.cj_result.cr_stdout),
+                      output_truncate(self.cj_result.cr_stderr))
 
     def cj_run(self):
         """
@@ -266,6 +326,39 @@ class CommandJob(object):
             buf.write(data)
         if tee:
             tee.write(data)
+        self.cj_callback(data, is_stdout, final_read)
+
+    def cj_callback(self, data, is_stdout, final_read):
+        """
+        Deliver the output to the callback of stdout or stderr
+        """
+        if is_stdout:
+            callback = self.cj_stdout_callback
+        else:
+            callback = self.cj_stderr_callback
+        if callback is None:
+            return
+
+        if not self.cj_callback_lines:
+            if len(data) > 0:
+                callback(data)
+            return
+
+        if is_stdout:
+            data = self.cj_stdout_partial + data
+        else:
+            data = self.cj_stderr_partial + data
+        lines = data.split("\n")
+        partial = lines.pop()
+        for line in lines:
+            callback(line)
+        if final_read and partial != "":
+            callback(partial)
+            partial = ""
+        if is_stdout:
+            self.cj_stdout_partial = partial
+        else:
+            self.cj_stderr_partial = partial
 
     def cj_kill(self):
         """
@@ -333,7 +426,8 @@ class CommandJob(object):
 
 def run(command, timeout=None, stdout_tee=None, stderr_tee=None, stdin=None,
         return_stdout=True, return_stderr=True, quit_func=None,
-        flush_tee=False):
+        flush_tee=False, stdout_callback=None, stderr_callback=None,
+        callback_lines=True, tail_size=None):
     """
     Run a command
     """
@@ -341,7 +435,10 @@ def run(command, timeout=None, stdout_tee=None, stderr_tee=None, stdin=None,
     job = CommandJob(command, timeout=timeout, stdout_tee=stdout_tee,
                      stderr_tee=stderr_tee, stdin=stdin,
                      return_stdout=return_stdout, return_stderr=return_stderr,
-                     quit_func=quit_func, flush_tee=flush_tee)
+                     quit_func=quit_func, flush_tee=flush_tee,
+                     stdout_callback=stdout_callback,
+                     stderr_callback=stderr_callback,
+                     callback_lines=callback_lines, tail_size=tail_size)
     return job.cj_run()
 
 
@@ -0,0 +1,183 @@
+# Copyright (c) 2017 DataDirect Networks, Inc.
+# All Rights Reserved.
+# Author: lixi@ddn.com
+"""
+Tests of the generation of collectd configs
+"""
+import os
+import re
+import shutil
+import tempfile
+import unittest
+
+from pyesmon import collectd
+from pyesmon import esmon_install_nodeps
+from pyesmon import esmon_rollup
+from pyesmon import lustre
+
+
+class FakeHost(object):
+    """
+    The host of the ESMON server
+    """
+    # pylint: disable=too-few-public-methods
+    def __init__(self, hostname):
+        self.sh_hostname = hostname
+
+
+class FakeServer(object):
+    """
+    The ESMON server
+    """
+    # pylint: disable=too-few-public-methods
+    def __init__(self, hostname):
+        self.es_host = FakeHost(hostname)
+
+
+class FakeClient(object):
+    """
+    The attributes of EsmonClient used by CollectdConfig
+    """
+    # pylint: disable=too-few-public-methods
+    def __init__(self):
+        self.ec_esmon_server = FakeServer("server")
+        self.ec_needed_collectd_rpms = []
+
+    def ec_influxdb_measurement_check(self, measurement):
+        """
+        All measurements are on the server
+        """
+        # pylint: disable=unused-argument,no-self-use
+        return 0
+
+
+class TestCollectdConfig(unittest.TestCase):
+    """
+    Generate collectd configs with different options and check the result
+    """
+    def setUp(self):
+        self.workspace = tempfile.mkdtemp()
+        self.client = FakeClient()
+
+    def tearDown(self):
+        shutil.rmtree(self.workspace)
+
+    def dump(self, config):
+        """
+        Return the text of the config
+        """
+        fpath = os.path.join(self.workspace, "collectd.conf")
+        config.cc_dump(fpath)
+        with open(fpath) as config_file:
+            return config_file.read()
+
+    def lustre_config(self, **kwargs):
+        """
+        Return the config with the Lustre plugin enabled by kwargs
+        """
+        config = collectd.CollectdConfig(self.client, 60, "jobid_var")
+        ret = config.cc_plugin_lustre(lustre.LUSTRE_VERSION_2_12, **kwargs)
+        self.assertEqual(ret, 0)
+        return config
+
+    def test_default(self):
+        """
+        No Lustre rule is added without the Lustre plugin
+        """
+        text = self.dump(collectd.CollectdConfig(self.client, 60,
+                                                 "jobid_var"))
+        self.assertIn('Host "server"', text)
+        self.assertIn("Interval 60", text)
+        self.assertNotIn("lustre", text)
+
+    def test_infiniband(self):
+        """
+        The Infiniband plugin doesn't depend on the Lustre options
+        """
+        config = collectd.CollectdConfig(self.client, 60, "jobid_var")
+        config.cc_plugin_infiniband()
+        text = self.dump(config)
+        self.assertIn('Type "port_xmit_data"', text)
+        self.assertIn("collectd-filedata", self.client.ec_needed_collectd_rpms)
+
+    def test_infiniband_drop_unused(self):
+        """
+        Infiniband with the unused counters of Lustre dropped
+        """
+        config = self.lustre_config(lustre_oss=True, lustre_mds=True,
+                                    lustre_exp_ost=True,
+                                    lustre_drop_unused=True)
+        config.cc_plugin_infiniband()
+        text = self.dump(config)
+        self.assertIn('Type "port_xmit_data"', text)
+        self.assertIn("LoadPlugin match_value", text)
+        for rule in ["lustre_ost_jobstats_unused", "lustre_exp_ost_stats_unused",
+                     "lustre_acct_unused"]:
+            self.assertIn(rule, config.cc_post_cache_chain_rules)
+        # Each rule is only added once
+        self.assertEqual(text.count('PluginInstance "^jobstat_"'), 1)
+
+    def test_drop_unused_client(self):
+        """
+        Nothing is dropped on Lustre clients
+        """
+        config = self.lustre_config(lustre_client=True,
+                                    lustre_drop_unused=True)
+        self.assertNotIn("match_value", self.dump(config))
+
+    def test_compact_stats(self):
+        """
+        The detailed stats are only dropped if compact stats is enabled
+        """
+        config = self.lustre_config(lustre_oss=True, lustre_mds=True)
+        self.assertNotIn("lustre_service_stats",
+                         config.cc_post_cache_chain_rules)
+        self.assertNotIn("sum_square", self.dump(config))
+
+        config = self.lustre_config(lustre_oss=True, lustre_mds=True,
+                                    lustre_compact_stats=True)
+        for rule in ["lustre_service_stats", "lustre_ost_brw_stats",
+                     "lustre_ost_jobstats"]:
+            self.assertIn(rule, config.cc_post_cache_chain_rules)
+
+    def test_compact_stats_quantiles(self):
+        """
+        Compact stats drop the moments that the quantile sketches of the
+        service times need, so the rollup service doesn't calculate them
+        """
+        config = self.lustre_config(lustre_oss=True, lustre_compact_stats=True)
+        rule = config.cc_post_cache_chain_rules["lustre_service_stats"]
+        dropped = re.search(r'TypeInstance "_\((.+)\)\$"', rule).group(1)
+        dropped = dropped.split("|")
+        for suffix in ["samples", "sum", "sum_square"]:
+            self.assertIn(suffix, esmon_rollup.ROLLUP_MOMENT_SUFFIXES)
+            self.assertIn(suffix, dropped)
+
+        server = esmon_install_nodeps.EsmonServer(FakeHost("server"), "/tmp",
+                                                  60, 4, "jobid_var")
+        kinds = [quantile["kind"] for quantile in server.es_rollup_quantile_rules()]
+        self.assertIn("moments", kinds)
+
+        server = esmon_install_nodeps.EsmonServer(FakeHost("server"), "/tmp",
+                                                  60, 4, "jobid_var",
+                                                  lustre_compact_stats=True)
+        kinds = [quantile["kind"] for quantile in server.es_rollup_quantile_rules()]
+        # Only the quantiles of the I/O time are left
+        self.assertEqual(kinds, ["histogram"])
+
+    def test_slow_gauge_periods(self):
+        """
+        Quota accounting is collected in its own interval class
+        """
+        config = self.lustre_config(lustre_oss=True, acct_periods=5)
+        self.assertIn("lustre_acct", config.cc_filedatas)
+        self.assertIn("Interval 300", config.cc_filedatas["lustre_acct"])
+        self.assertNotIn('Type "ost_acctuser"', config.cc_filedatas["lustre"])
+
+        config = self.lustre_config(lustre_oss=True)
+        self.assertNotIn("lustre_acct", config.cc_filedatas)
+        self.assertIn('Type "ost_acctuser"', config.cc_filedatas["lustre"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,287 @@
+# Copyright (c) 2017 DataDirect Networks, Inc.
+# All Rights Reserved.
+# Author: lixi@ddn.com
+"""
+Tests of the archive of old shards
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+from pyesmon import esmon_archive
+
+# 2017-06-01T00:00:00Z
+DAY = 1496275200
+NANOSECONDS = esmon_archive.NANOSECONDS_PER_SECOND
+
+
+def partition_new():
+    """
+    Return a partition of two series of a day
+    """
+    partition = esmon_archive.ArchivePartition("autogen", "ost_stats_bytes",
+                                               DAY, {"value": "float",
+                                                     "count": "integer"})
+    base = DAY * NANOSECONDS
+    partition.ap_add({"columns": ["time", "value", "count"],
+                      "tags": {"fs_name": "lustre0", "ost_index": "OST0001"},
+                      "values": [[base + 60 * NANOSECONDS, 4.0, 2],
+                                 [base, 2.0, None]]})
+    partition.ap_add({"columns": ["time", "value", "state"],
+                      "tags": {"fs_name": "lustre0", "ost_index": "OST0000"},
+                      "values": [[base + 60 * NANOSECONDS, 1.0, "up"],
+                                 [base + 3600 * NANOSECONDS, 3.0, "down"]]})
+    return partition
+
+
+class TestArchiveFile(unittest.TestCase):
+    """
+    Write the columnar files and read them back
+    """
+    def setUp(self):
+        self.workspace = tempfile.mkdtemp()
+        self.fpath = os.path.join(self.workspace, "2017-06-01.esa")
+        self.assertEqual(partition_new().ap_write(self.fpath), 0)
+        self.archive_file = esmon_archive.ArchiveFile(self.fpath)
+        self.assertEqual(self.archive_file.af_open(), 0)
+
+    def tearDown(self):
+        self.archive_file.af_close()
+        shutil.rmtree(self.workspace)
+
+    def test_footer(self):
+        """
+        The footer records the time range and the series
+        """
+        footer = self.archive_file.af_footer
+        self.assertEqual(footer["rows"], 4)
+        self.assertEqual(footer["series"], 2)
+        self.assertEqual(footer["min_time"], DAY * NANOSECONDS)
+        self.assertEqual(footer["max_time"], (DAY + 3600) * NANOSECONDS)
+        self.assertEqual(self.archive_file.af_tag_keys(),
+                         ["fs_name", "ost_index"])
+        self.assertEqual(sorted(self.archive_file.af_field_types()),
+                         [("count", "integer"), ("state", "string"),
+                          ("value", "float")])
+
+    def test_columns(self):
+        """
+        The rows are sorted by series and time
+        """
+        base = DAY * NANOSECONDS
+        self.assertEqual(list(self.archive_file.af_times()),
+                         [base + 60 * NANOSECONDS, base + 3600 * NANOSECONDS,
+                          base, base + 60 * NANOSECONDS])
+        dictionary, indexes = self.archive_file.af_tag("ost_index")
+        self.assertEqual([dictionary[index] for index in indexes],
+                         ["OST0000", "OST0000", "OST0001", "OST0001"])
+        dictionary, indexes = self.archive_file.af_tag("host")
+        self.assertEqual(dictionary, [""])
+        self.assertEqual(self.archive_file.af_field("value"),
+                         [1.0, 3.0, 2.0, 4.0])
+        self.assertEqual(self.archive_file.af_field("count"),
+                         [None, None, None, 2])
+        self.assertEqual(self.archive_file.af_field("state"),
+                         ["up", "down", None, None])
+        self.assertIsNone(self.archive_file.af_field("fs_name"))
+
+    def test_invalid(self):
+        """
+        A file that is not an archive can't be opened
+        """
+        fpath = os.path.join(self.workspace, "invalid.esa")
+        with open(fpath, "w") as invalid_file:
+            invalid_file.write("not an archive")
+        self.assertEqual(esmon_archive.ArchiveFile(fpath).af_open(), -1)
+
+
+class TestArchiveScan(unittest.TestCase):
+    """
+    Aggregate the values of the archive files
+    """
+    def setUp(self):
+        self.workspace = tempfile.mkdtemp()
+        self.fpath = os.path.join(self.workspace, "2017-06-01.esa")
+        self.assertEqual(partition_new().ap_write(self.fpath), 0)
+
+    def tearDown(self):
+        shutil.rmtree(self.workspace)
+
+    def scan(self, **kwargs):
+        """
+        Return the values of the aggregates of the scan
+        """
+        args = {"field": "value", "start": None, "end": None, "wheres": {},
+                "group_bys": [], "function": "sum", "interval": None}
+        args.update(kwargs)
+        aggregates = {}
+        ret = esmon_archive.esmon_archive_scan(self.fpath, args["field"],
+                                               args["start"], args["end"],
+                                               args["wheres"],
+                                               args["group_bys"],
+                                               args["function"],
+                                               args["interval"], aggregates)
+        values = dict((key, aggregate.aa_value(args["function"]))
+                      for key, aggregate in aggregates.iteritems())
+        return ret, values
+
+    def test_group_by(self):
+        """
+        The values are aggregated by the tags and the time intervals
+        """
+        self.assertEqual(self.scan(), (0, {((), None): 10.0}))
+        self.assertEqual(self.scan(group_bys=["ost_index"], function="max"),
+                         (0, {(("OST0000",), None): 3.0,
+                              (("OST0001",), None): 4.0}))
+        interval = 3600 * NANOSECONDS
+        self.assertEqual(self.scan(interval=interval, function="count"),
+                         (0, {((), DAY * NANOSECONDS): 3,
+                              ((), DAY * NANOSECONDS + interval): 1}))
+
+    def test_filter(self):
+        """
+        The rows are filtered by the tags and the time range
+        """
+        self.assertEqual(self.scan(wheres={"ost_index": set(["OST0001"])}),
+                         (0, {((), None): 6.0}))
+        self.assertEqual(self.scan(start=(DAY + 60) * NANOSECONDS,
+                                   end=(DAY + 3600) * NANOSECONDS),
+                         (0, {((), None): 5.0}))
+
+    def test_skip(self):
+        """
+        The files that can't match are skipped by the footer
+        """
+        self.assertEqual(self.scan(wheres={"fs_name": set(["lustre1"])}),
+                         (1, {}))
+        self.assertEqual(self.scan(start=(DAY + 7200) * NANOSECONDS),
+                         (1, {}))
+        self.assertEqual(self.scan(field="write_bytes"), (1, {}))
+        self.assertEqual(self.scan(field="state", function="mean"), (-1, {}))
+
+    def test_last(self):
+        """
+        The last value of a string field
+        """
+        self.assertEqual(self.scan(field="state", function="last"),
+                         (0, {((), None): "down"}))
+
+
+class TestImport(unittest.TestCase):
+    """
+    Import the archive files and line protocol files
+    """
+    def setUp(self):
+        self.workspace = tempfile.mkdtemp()
+        self.checkpoint_fpath = os.path.join(self.workspace,
+                                             esmon_archive.ESMON_IMPORT_CHECKPOINT)
+
+    def tearDown(self):
+        shutil.rmtree(self.workspace)
+
+    def test_sort(self):
+        """
+        The lines are sorted by series and time, invalid lines are ignored
+        """
+        lines = ["m,host=b value=1 20", "m,host=a value=2 30",
+                 "m,host=b value=3 10", "m,host=a value=4 abc",
+                 "m,host=a value=5"]
+        self.assertEqual(esmon_archive.esmon_import_sort(lines),
+                         ["m,host=a value=5", "m,host=a value=2 30",
+                          "m,host=b value=3 10", "m,host=b value=1 20"])
+
+    def test_archive_lines(self):
+        """
+        The points of archive files are converted back to line protocol
+        """
+        fpath = os.path.join(self.workspace, "2017-06-01.esa")
+        self.assertEqual(partition_new().ap_write(fpath), 0)
+        archive_file = esmon_archive.ArchiveFile(fpath)
+        self.assertEqual(archive_file.af_open(), 0)
+        lines = esmon_archive.esmon_import_archive_lines(archive_file)
+        archive_file.af_close()
+        base = DAY * NANOSECONDS
+        prefix = "ost_stats_bytes,fs_name=lustre0,ost_index="
+        self.assertEqual(lines,
+                         [prefix + 'OST0000 value=1.0,state="up" %d' %
+                          (base + 60 * NANOSECONDS),
+                          prefix + 'OST0000 value=3.0,state="down" %d' %
+                          (base + 3600 * NANOSECONDS),
+                          prefix + "OST0001 value=2.0 %d" % base,
+                          prefix + "OST0001 value=4.0,count=2i %d" %
+                          (base + 60 * NANOSECONDS)])
+
+    def test_checkpoint(self):
+        """
+        The checkpoint only advances over the leading written blocks
+        """
+        archive_import = esmon_archive.ArchiveImport("localhost",
+                                                     "esmon_database",
+                                                     self.checkpoint_fpath, 1)
+        blocks = [esmon_archive.ImportBlock("a.lp", index)
+                  for index in range(3)]
+        for block in blocks:
+            block.ib_pending = 1
+            block.ib_queued = True
+        archive_import.ai_file_blocks["a.lp"] = 3
+        archive_import.ai_batch_written(blocks[1], 10, 1.0, 0)
+        self.assertEqual(archive_import.ai_checkpoint["a.lp"],
+                         {"blocks": 0, "finished": False})
+        archive_import.ai_batch_written(blocks[0], 10, 1.0, 0)
+        self.assertEqual(archive_import.ai_checkpoint["a.lp"],
+                         {"blocks": 2, "finished": False})
+        archive_import.ai_batch_written(blocks[2], 10, 1.0, 0)
+        self.assertEqual(archive_import.ai_checkpoint["a.lp"],
+                         {"blocks": 3, "finished": True})
+        self.assertEqual(archive_import.ai_points, 30)
+
+    def test_batch_size(self):
+        """
+        The batch size is tuned by the latency of the writes
+        """
+        archive_import = esmon_archive.ArchiveImport("localhost",
+                                                     "esmon_database",
+                                                     self.checkpoint_fpath, 1)
+        block = esmon_archive.ImportBlock("a.lp", 0)
+        block.ib_pending = 10
+        size = archive_import.ai_batch_size
+        archive_import.ai_batch_written(block, size, 0.1, 0)
+        self.assertTrue(archive_import.ai_batch_size > size)
+        size = archive_import.ai_batch_size
+        archive_import.ai_batch_written(block, size, 10.0, 0)
+        self.assertTrue(archive_import.ai_batch_size < size)
+        for _ in range(8):
+            archive_import.ai_batch_written(block, 10, 100.0, 0)
+        self.assertEqual(archive_import.ai_batch_size,
+                         esmon_archive.ESMON_IMPORT_MIN_BATCH_SIZE)
+
+    def test_line_file_resume(self):
+        """
+        The written blocks of the line protocol file are skipped
+        """
+        # pylint: disable=protected-access
+        fpath = os.path.join(self.workspace, "a.lp")
+        with open(fpath, "w") as line_file:
+            line_file.write("# comment\nm value=1 1\nm value=2 2\n"
+                            "m value=3 3\n")
+        archive_import = esmon_archive.ArchiveImport("localhost",
+                                                     "esmon_database",
+                                                     self.checkpoint_fpath, 1)
+        sort_lines = esmon_archive.ESMON_IMPORT_SORT_LINES
+        esmon_archive.ESMON_IMPORT_SORT_LINES = 2
+        try:
+            ret = archive_import._ai_line_file("a.lp", fpath, "n", 1)
+        finally:
+            esmon_archive.ESMON_IMPORT_SORT_LINES = sort_lines
+        self.assertEqual(ret, 0)
+        self.assertEqual(archive_import.ai_file_blocks["a.lp"], 2)
+        block, lines, precision, _ = archive_import.ai_queue.get_nowait()
+        self.assertEqual(block.ib_index, 1)
+        self.assertEqual(lines, ["m value=3 3"])
+        self.assertEqual(precision, "n")
+        self.assertTrue(archive_import.ai_queue.empty())
+
+
+if __name__ == "__main__":
+    unittest.main()
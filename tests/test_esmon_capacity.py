@@ -0,0 +1,198 @@
+# Copyright (c) 2017 DataDirect Networks, Inc.
+# All Rights Reserved.
+# Author: lixi@ddn.com
+"""
+Tests of the capacity planner of the ESMON server
+"""
+import unittest
+
+from pyesmon import esmon_capacity
+from pyesmon import esmon_common
+from pyesmon import lustre
+
+
+def agent_config(host_id, **kwargs):
+    """
+    Return the config of an agent with the options in kwargs
+    """
+    agent = {esmon_common.CSTR_HOST_ID: host_id,
+             esmon_common.CSTR_ENABLE_DISK: False,
+             esmon_common.CSTR_IME: False,
+             esmon_common.CSTR_INFINIBAND: False,
+             esmon_common.CSTR_LUSTRE_CLIENT: False,
+             esmon_common.CSTR_LUSTRE_MDS: False,
+             esmon_common.CSTR_LUSTRE_OSS: False,
+             esmon_common.CSTR_SFAS: [],
+             esmon_common.CSTR_OST_NUMBER: 0,
+             esmon_common.CSTR_MDT_NUMBER: 0,
+             esmon_common.CSTR_EXPORT_NUMBER: 0,
+             esmon_common.CSTR_JOB_NUMBER: 0,
+             esmon_common.CSTR_USER_NUMBER: 0}
+    agent.update(kwargs)
+    return agent
+
+
+def plan_config(agents, **kwargs):
+    """
+    Return the checked config with the agents and the options in kwargs
+    """
+    config = {esmon_common.CSTR_AGENTS: agents,
+              esmon_common.CSTR_COLLECT_INTERVAL: 60,
+              esmon_common.CSTR_CONTINUOUS_QUERY_PERIODS: 4,
+              esmon_common.CSTR_JOBID_VAR: lustre.JOB_ID_UNKNOWN,
+              esmon_common.CSTR_LUSTRE_COMPACT_STATS: False,
+              esmon_common.CSTR_LUSTRE_DROP_UNUSED: False,
+              esmon_common.CSTR_LUSTRE_EXP_OST: False,
+              esmon_common.CSTR_LUSTRE_EXP_MDT: False,
+              esmon_common.CSTR_SLOW_GAUGE_PERIODS: 1,
+              esmon_common.CSTR_ACCT_PERIODS: 1,
+              esmon_common.CSTR_SERVER: {
+                  esmon_common.CSTR_MAX_POINTS_PER_SECOND: 100000,
+                  esmon_common.CSTR_MAX_SERIES: 1000000,
+                  esmon_common.CSTR_MAX_DISK_GB_PER_DAY: 100,
+                  esmon_common.CSTR_STREAMING_ROLLUP: False}}
+    config.update(kwargs)
+    return config
+
+
+def oss_config(**kwargs):
+    """
+    Return the config of an OSS with 4 OSTs
+    """
+    return agent_config("oss0", lustre_oss=True, ost_number=4, job_number=10,
+                        user_number=5, **kwargs)
+
+
+def capacity_plan(config):
+    """
+    Return the plan of the config
+    """
+    plan = esmon_capacity.EsmonCapacityPlan(config)
+    plan.ecp_plan()
+    return plan
+
+
+class TestCapacityPlan(unittest.TestCase):
+    """
+    Estimate the load of the server
+    """
+    def test_system(self):
+        """
+        A host without any option only has the system items
+        """
+        plan = capacity_plan(plan_config([agent_config("client0")]))
+        self.assertEqual(plan.ecp_item_usages.keys(), ["system"])
+        self.assertEqual(plan.ecp_total.ecu_series, 25)
+        self.assertAlmostEqual(plan.ecp_total.ecu_points_per_second, 25 / 60.0)
+        self.assertEqual(plan.ecp_total.ecu_bytes_per_day(),
+                         25 / 60.0 * 86400 * 3)
+        self.assertEqual(plan.ecp_warnings, [])
+
+    def test_instances(self):
+        """
+        The items of OSTs are multiplied by the OSTs, jobs and users
+        """
+        plan = capacity_plan(plan_config([oss_config()]))
+        usages = plan.ecp_item_usages
+        self.assertEqual(usages["ost_stats"].ecu_series, 4 * 5)
+        self.assertEqual(usages["ost_jobstats"].ecu_series, 4 * 10 * 14)
+        self.assertEqual(usages["ost_acct"].ecu_series, 4 * 5 * 6)
+        self.assertNotIn("exp_ost_stats", usages)
+        self.assertNotIn("mdt_jobstats", usages)
+        # The used and free space of each file system
+        self.assertEqual(usages["ost_kbytesinfo"].ecu_cq_series, 3)
+        # The optypes, sums and OSTs of each job
+        self.assertEqual(usages["ost_jobstats"].ecu_cq_series,
+                         10 * 2 + 10 + 10 * 4)
+
+    def test_compact_stats(self):
+        """
+        Compact stats reduce the points of the service and brw stats
+        """
+        series = capacity_plan(plan_config([oss_config()])).ecp_total.ecu_series
+        compact = capacity_plan(plan_config([oss_config()],
+                                            lustre_compact_stats=True))
+        self.assertTrue(compact.ecp_total.ecu_series < series)
+        self.assertEqual(compact.ecp_item_usages["ost_service_stats"].ecu_series,
+                         18 * esmon_capacity.SERVICE_STATS_COMPACT_POINTS)
+
+    def test_drop_unused(self):
+        """
+        Dropping the unused counters reduces the points of jobs and users
+        """
+        plan = capacity_plan(plan_config([oss_config()],
+                                         lustre_drop_unused=True))
+        usages = plan.ecp_item_usages
+        self.assertEqual(usages["ost_jobstats"].ecu_series, 4 * 10 * 14 / 2)
+        self.assertEqual(usages["ost_acct"].ecu_series, 4 * 5 * 6 / 2)
+        self.assertEqual(usages["ost_stats"].ecu_series, 4 * 5)
+        # The continuous queries still have the series of all jobs
+        self.assertEqual(usages["ost_jobstats"].ecu_cq_series,
+                         10 * 2 + 10 + 10 * 4)
+
+    def test_rollup(self):
+        """
+        The rollup service writes the top-K and the quantiles
+        """
+        config = plan_config([oss_config()])
+        usages = capacity_plan(config).ecp_item_usages
+        self.assertNotIn("rollup_topk", usages)
+        self.assertNotIn("rollup_quantiles", usages)
+
+        config[esmon_common.CSTR_SERVER][esmon_common.CSTR_STREAMING_ROLLUP] = True
+        usages = capacity_plan(config).ecp_item_usages
+        self.assertEqual(usages["rollup_topk"].ecu_cq_series, 21)
+        # The LDLM and OSS services, and the I/O time
+        self.assertEqual(usages["rollup_quantiles"].ecu_cq_series,
+                         10 + 18 + 2)
+
+        config[esmon_common.CSTR_LUSTRE_COMPACT_STATS] = True
+        usages = capacity_plan(config).ecp_item_usages
+        self.assertEqual(usages["rollup_quantiles"].ecu_cq_series, 2)
+
+    def test_cqs(self):
+        """
+        The continuous queries of uid are only created with procname_uid
+        """
+        for capacity_cq in esmon_capacity.ESMON_CAPACITY_CQS:
+            uid = "uid" in capacity_cq.ecc_groups
+            self.assertEqual(esmon_capacity.esmon_capacity_cq_enabled(capacity_cq,
+                                                                      lustre.JOB_ID_UNKNOWN),
+                             not uid)
+            self.assertTrue(esmon_capacity.esmon_capacity_cq_enabled(capacity_cq,
+                                                                     lustre.JOB_ID_PROCNAME_UID))
+
+    def test_periods(self):
+        """
+        The slow gauges are collected every few intervals
+        """
+        plan = capacity_plan(plan_config([oss_config()], acct_periods=5))
+        usage = plan.ecp_item_usages["ost_acct"]
+        self.assertAlmostEqual(usage.ecu_points_per_second,
+                               4 * 5 * 6 / 300.0)
+
+    def test_uid_cqs(self):
+        """
+        The continuous queries of uid are only created with procname_uid
+        """
+        config = plan_config([oss_config()],
+                             jobid_var=lustre.JOB_ID_PROCNAME_UID)
+        usages = capacity_plan(config).ecp_item_usages
+        # The uid has the cardinality of the users
+        self.assertEqual(usages["ost_jobstats"].ecu_cq_series,
+                         10 * 2 + 10 + 10 * 4 + 5 * 2 + 5 + 5 * 4)
+
+    def test_limits(self):
+        """
+        The plan warns about the limits that it exceeds
+        """
+        config = plan_config([oss_config()])
+        config[esmon_common.CSTR_SERVER][esmon_common.CSTR_MAX_SERIES] = 10
+        plan = capacity_plan(config)
+        self.assertEqual(len(plan.ecp_warnings), 1)
+        self.assertIn("series", plan.ecp_warnings[0])
+        self.assertEqual(esmon_capacity.esmon_capacity_plan(config), -1)
+
+
+if __name__ == "__main__":
+    unittest.main()
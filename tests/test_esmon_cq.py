@@ -0,0 +1,327 @@
+# Copyright (c) 2017 DataDirect Networks, Inc.
+# All Rights Reserved.
+# Author: lixi@ddn.com
+"""
+Tests of the cost report and tuning of continuous queries
+"""
+import httplib
+import unittest
+
+from pyesmon import esmon_cq
+from pyesmon import esmon_influxdb
+from pyesmon import esmon_install_nodeps
+
+CQ_QUERY = ('CREATE CONTINUOUS QUERY %s ON "esmon_database" BEGIN '
+            'SELECT sum("value") INTO "%s_sum" FROM "%s" '
+            'GROUP BY time(1m), "fs_name" END')
+
+
+class FakeResponse(object):
+    """
+    The response of Influxdb
+    """
+    # pylint: disable=too-few-public-methods
+    def __init__(self, data):
+        self.status_code = httplib.OK
+        self.fr_data = data
+
+    def json(self):
+        """
+        Return the data of the response
+        """
+        return self.fr_data
+
+
+class FakeInfluxdbClient(object):
+    """
+    Influxdb client that returns the result of the query with the prefix
+    """
+    # pylint: disable=too-few-public-methods
+    def __init__(self, results):
+        # Key is the prefix of query, value is the result
+        self.fic_results = results
+        self.fic_queries = []
+
+    def ic_query(self, query, epoch=None, chunk_size=None):
+        """
+        Return the result of the query
+        """
+        # pylint: disable=unused-argument
+        self.fic_queries.append(query)
+        for prefix, result in self.fic_results.iteritems():
+            if query.startswith(prefix):
+                return FakeResponse({"results": [result]})
+        return FakeResponse({"results": [{}]})
+
+
+def cq_query(name):
+    """
+    Return the continuous query with the name
+    """
+    return CQ_QUERY % (name, name, name)
+
+
+def cq_stat(name, durations):
+    """
+    Return the statistics of the continuous query with the execution seconds
+    """
+    stat = esmon_cq.ContinuousQueryStat(name, cq_query(name))
+    stat.cqs_durations = durations
+    return stat
+
+
+class TestInfluxdbCq(unittest.TestCase):
+    """
+    Parse and change the RESAMPLE clause of continuous queries
+    """
+    def test_duration_parse(self):
+        """
+        Durations of InfluxQL
+        """
+        self.assertEqual(esmon_influxdb.influxdb_duration_parse("90s"), 90)
+        self.assertEqual(esmon_influxdb.influxdb_duration_parse("1h30m"),
+                         5400)
+        self.assertEqual(esmon_influxdb.influxdb_duration_parse("1d"), 86400)
+        self.assertIsNone(esmon_influxdb.influxdb_duration_parse("1x"))
+        self.assertIsNone(esmon_influxdb.influxdb_duration_parse("m1"))
+        self.assertIsNone(esmon_influxdb.influxdb_duration_parse(""))
+
+    def test_intervals(self):
+        """
+        EVERY and FOR default to the GROUP BY interval
+        """
+        query = cq_query("cq_a")
+        self.assertEqual(esmon_influxdb.influxdb_cq_intervals(query),
+                         (60, 60, 60))
+        query = esmon_influxdb.influxdb_cq_resample(query,
+                                                    "RESAMPLE EVERY 2m FOR 3m")
+        self.assertEqual(esmon_influxdb.influxdb_cq_intervals(query),
+                         (60, 120, 180))
+        query = query.replace(" FOR 3m", "")
+        self.assertEqual(esmon_influxdb.influxdb_cq_intervals(query),
+                         (60, 120, 60))
+        self.assertEqual(esmon_influxdb.influxdb_cq_intervals("SELECT 1"),
+                         (None, None, None))
+
+    def test_resample_valid(self):
+        """
+        The tuned RESAMPLE clause is kept only if the interval is unchanged
+        """
+        query = cq_query("cq_a")
+        # Not tuned
+        self.assertIsNone(esmon_influxdb.influxdb_cq_resample_valid(query,
+                                                                    60))
+        tuned = esmon_influxdb.influxdb_cq_resample(query,
+                                                    "RESAMPLE EVERY 4m FOR 5m")
+        self.assertEqual(esmon_influxdb.influxdb_cq_resample_valid(tuned, 60),
+                         (60, 240, 300))
+        # The interval of the query has been changed
+        self.assertIsNone(esmon_influxdb.influxdb_cq_resample_valid(tuned,
+                                                                    120))
+        # EVERY is not a multiple of the interval
+        tuned = esmon_influxdb.influxdb_cq_resample(query,
+                                                    "RESAMPLE EVERY 90s")
+        self.assertIsNone(esmon_influxdb.influxdb_cq_resample_valid(tuned, 60))
+        self.assertIsNone(esmon_influxdb.influxdb_cq_resample_valid("SELECT 1",
+                                                                    60))
+
+    def test_resample(self):
+        """
+        The RESAMPLE clause is replaced or removed
+        """
+        query = cq_query("cq_a")
+        clause = esmon_influxdb.influxdb_cq_resample_clause(240, 300)
+        self.assertEqual(clause, "RESAMPLE EVERY 240s FOR 300s")
+        resampled = esmon_influxdb.influxdb_cq_resample(query, clause)
+        self.assertIn('"esmon_database" RESAMPLE EVERY 240s FOR 300s BEGIN ',
+                      resampled)
+        resampled = esmon_influxdb.influxdb_cq_resample(resampled,
+                                                        "RESAMPLE EVERY 2m")
+        self.assertEqual(resampled.count("RESAMPLE"), 1)
+        self.assertIn("RESAMPLE EVERY 2m BEGIN", resampled)
+        self.assertEqual(esmon_influxdb.influxdb_cq_resample(resampled, ""),
+                         query)
+
+
+class TestCqStatistics(unittest.TestCase):
+    """
+    Get the continuous queries and their statistics
+    """
+    def test_queries(self):
+        """
+        Only the queries of the ESMON database with GROUP BY time() are used
+        """
+        database = esmon_install_nodeps.INFLUXDB_DATABASE_NAME
+        values = [["cq_a", cq_query("cq_a")],
+                  ["cq_raw", 'CREATE CONTINUOUS QUERY cq_raw ON '
+                             '"esmon_database" BEGIN SELECT * INTO "b" '
+                             'FROM "a" END']]
+        result = {"series": [{"name": "_internal", "values": values},
+                             {"name": database, "values": values}]}
+        client = FakeInfluxdbClient({"SHOW CONTINUOUS QUERIES": result})
+        stats = esmon_cq.esmon_cq_queries(client)
+        self.assertEqual([stat.cqs_name for stat in stats], ["cq_a"])
+        self.assertEqual(stats[0].cqs_period, 60)
+
+        client = FakeInfluxdbClient({"SHOW CONTINUOUS QUERIES":
+                                     {"error": "not authorized"}})
+        self.assertIsNone(esmon_cq.esmon_cq_queries(client))
+
+    def test_statistics(self):
+        """
+        Durations, points and lag of the runs
+        """
+        stats = [cq_stat("cq_a", []), cq_stat("cq_b", [])]
+        columns = ["time", "durationNs", "pointsWrittenOK", "endTime"]
+        series = [{"tags": {"cq": "cq_a"}, "columns": columns,
+                   "values": [[1000000, 2000000000, 10, 995000000000],
+                              [1060000, 4000000000, 30, 1058000000000],
+                              [1120000, None, None, None]]},
+                  {"tags": {"cq": "cq_removed"}, "columns": columns,
+                   "values": [[1000000, 1000000000, 10, 995000000000]]}]
+        client = FakeInfluxdbClient({"SELECT": {"series": series}})
+        self.assertEqual(esmon_cq.esmon_cq_statistics(client, stats), 0)
+        self.assertIn('"_internal"."monitor"."cq_query"',
+                      client.fic_queries[0])
+        self.assertEqual(stats[0].cqs_durations, [2.0, 4.0])
+        self.assertEqual(stats[0].cqs_points, 40)
+        self.assertEqual(stats[0].cqs_max_lag, 5.0)
+        self.assertEqual(stats[1].cqs_durations, [])
+
+        stat_dict = stats[0].cqs_dict()
+        self.assertEqual(stat_dict["runs"], 2)
+        self.assertEqual(stat_dict["mean_ms"], 3000)
+        self.assertEqual(stat_dict["max_ms"], 4000)
+        self.assertEqual(stat_dict["points"], 20)
+        self.assertEqual(stat_dict["load"], 5.0)
+        stat_dict = stats[1].cqs_dict()
+        self.assertIsNone(stat_dict["mean_ms"])
+        self.assertIsNone(stat_dict["lag_s"])
+
+        client = FakeInfluxdbClient({"SELECT": {"error": "database not found"}})
+        self.assertEqual(esmon_cq.esmon_cq_statistics(client, stats), -1)
+
+    def test_table(self):
+        """
+        Missing values are printed as "-"
+        """
+        stat = cq_stat("cq_a", [])
+        stat.cqs_note = "no statistics"
+        lines = esmon_cq.esmon_cq_table([stat.cqs_dict()]).splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[0].startswith("CQ  "))
+        self.assertEqual(lines[0].index("PERIOD"), lines[1].index("60"))
+        self.assertEqual(lines[1].split()[5:9], ["-", "-", "-", "-"])
+        self.assertTrue(lines[1].endswith("no statistics"))
+
+
+class TestCqRecommend(unittest.TestCase):
+    """
+    Recommend the RESAMPLE periods of continuous queries
+    """
+    def test_duration(self):
+        """
+        The predicted duration grows with the RESAMPLE FOR window
+        """
+        stat = cq_stat("cq_a", [6.0, 12.0])
+        self.assertEqual(stat.cqs_duration(60), 9.0)
+        self.assertEqual(stat.cqs_duration(60, maximum=True), 12.0)
+        # FOR of 180s is three times of the current window
+        self.assertEqual(stat.cqs_duration(120), 18.0)
+        self.assertEqual(stat.cqs_load(), 15.0)
+        self.assertEqual(stat.cqs_load(120), 15.0)
+
+    def test_under_budget(self):
+        """
+        Nothing is changed if the load is under the budget
+        """
+        stats = [cq_stat("cq_a", [6.0]), cq_stat("cq_b", [])]
+        self.assertEqual(esmon_cq.esmon_cq_recommend(stats, 20), 10.0)
+        self.assertIsNone(stats[0].cqs_resample_clause())
+        self.assertEqual(stats[0].cqs_note, "")
+        self.assertEqual(stats[1].cqs_note, "no statistics")
+
+    def test_busy(self):
+        """
+        Queries that use more than half of their period run less frequently
+        """
+        stats = [cq_stat("cq_a", [40.0])]
+        esmon_cq.esmon_cq_recommend(stats, 100)
+        self.assertEqual(stats[0].cqs_new_every, 240)
+        self.assertEqual(stats[0].cqs_new_for, 300)
+        self.assertEqual(stats[0].cqs_resample_clause(),
+                         "RESAMPLE EVERY 240s FOR 300s")
+
+    def test_overrun(self):
+        """
+        Queries that run longer than their period are flagged
+        """
+        stats = [cq_stat("cq_a", [90.0]), cq_stat("cq_b", [1.0])]
+        stats[1].cqs_max_lag = 120.0
+        esmon_cq.esmon_cq_recommend(stats, 1000)
+        self.assertEqual(stats[0].cqs_note, "overrun")
+        self.assertEqual(stats[0].cqs_new_every,
+                         esmon_cq.ESMON_CQ_MAX_EVERY_PERIODS * 60)
+        self.assertEqual(stats[1].cqs_note, "delayed")
+        self.assertEqual(stats[1].cqs_new_every, 60)
+
+    def test_over_budget(self):
+        """
+        The most expensive queries are slowed down until under the budget
+        """
+        stats = [cq_stat("cq_a", [6.0]), cq_stat("cq_b", [3.0])]
+        load = esmon_cq.esmon_cq_recommend(stats, 12)
+        self.assertLessEqual(load, 12)
+        self.assertGreater(stats[0].cqs_new_every, stats[1].cqs_new_every)
+        self.assertEqual(stats[0].cqs_new_for, stats[0].cqs_new_every + 60)
+
+        # The budget can't be met, all queries use the longest periods
+        stats = [cq_stat("cq_a", [6.0]), cq_stat("cq_b", [3.0])]
+        load = esmon_cq.esmon_cq_recommend(stats, 1)
+        self.assertGreater(load, 1)
+        for stat in stats:
+            self.assertEqual(stat.cqs_new_every,
+                             esmon_cq.ESMON_CQ_MAX_EVERY_PERIODS * 60)
+
+
+class TestCqApply(unittest.TestCase):
+    """
+    Recreate the continuous queries with the recommended RESAMPLE clauses
+    """
+    def test_apply(self):
+        """
+        The query is dropped and created again with the new clause
+        """
+        stat = cq_stat("cq_a", [40.0])
+        client = FakeInfluxdbClient({})
+        self.assertEqual(esmon_cq.esmon_cq_apply(client, stat), 0)
+        self.assertEqual(client.fic_queries, [])
+
+        esmon_cq.esmon_cq_recommend([stat], 100)
+        self.assertEqual(esmon_cq.esmon_cq_apply(client, stat), 0)
+        self.assertEqual(len(client.fic_queries), 2)
+        self.assertTrue(client.fic_queries[0].startswith(
+            "DROP CONTINUOUS QUERY cq_a "))
+        self.assertIn("RESAMPLE EVERY 240s FOR 300s BEGIN",
+                      client.fic_queries[1])
+
+    def test_restore(self):
+        """
+        The original query is restored if the new one can't be created
+        """
+        stat = cq_stat("cq_a", [40.0])
+        esmon_cq.esmon_cq_recommend([stat], 100)
+        prefix = ('CREATE CONTINUOUS QUERY cq_a ON "esmon_database" '
+                  'RESAMPLE')
+        client = FakeInfluxdbClient({prefix: {"error": "invalid query"}})
+        self.assertEqual(esmon_cq.esmon_cq_apply(client, stat), -1)
+        self.assertEqual(len(client.fic_queries), 3)
+        self.assertEqual(client.fic_queries[2], stat.cqs_query)
+
+        client = FakeInfluxdbClient({"DROP": {"error": "not authorized"}})
+        self.assertEqual(esmon_cq.esmon_cq_apply(client, stat), -1)
+        self.assertEqual(len(client.fic_queries), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
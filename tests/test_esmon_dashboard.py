@@ -0,0 +1,91 @@
+# Copyright (c) 2017 DataDirect Networks, Inc.
+# All Rights Reserved.
+# Author: lixi@ddn.com
+"""
+Tests of the dashboard generation
+"""
+import json
+import unittest
+
+from pyesmon import esmon_dashboard
+
+
+def dashboard_load(fname):
+    """
+    Return the dashboard as loaded from the Json file
+    """
+    spec = esmon_dashboard.ESMON_DASHBOARDS[fname]
+    return json.loads(esmon_dashboard.dashboard_json(spec.ds_generate()))
+
+
+def dashboard_row_titles(dashboard):
+    """
+    Return the titles of the rows
+    """
+    return [row["title"] for row in dashboard["rows"]]
+
+
+class TestRollupFilter(unittest.TestCase):
+    """
+    Leave out the panels of the measurements not written by the rollup
+    """
+    def test_disabled(self):
+        """
+        No top-K panel if the rollup service is disabled
+        """
+        dashboard = dashboard_load("lustre_statistics.json")
+        rows = len(dashboard["rows"])
+        self.assertIn("Top Talkers", dashboard_row_titles(dashboard))
+        dashboard = esmon_dashboard.dashboard_rollup_filter(dashboard, [])
+        self.assertNotIn("Top Talkers", dashboard_row_titles(dashboard))
+        # The rows of top-K and the quantiles of I/O time are left out
+        self.assertEqual(len(dashboard["rows"]), rows - 2)
+        self.assertNotIn('"topk_', esmon_dashboard.dashboard_json(dashboard))
+
+        dashboard = dashboard_load("lustre_user.json")
+        dashboard = esmon_dashboard.dashboard_rollup_filter(dashboard, [])
+        self.assertNotIn("Top Users", dashboard_row_titles(dashboard))
+
+    def test_enabled(self):
+        """
+        Only the panels of the written measurements are kept
+        """
+        dashboard = dashboard_load("lustre_statistics.json")
+        measurements = ["topk_ost_jobstats_bytes-fs_name-job_id",
+                        "topk_exp_md_stats-fs_name-exp_client"]
+        dashboard = esmon_dashboard.dashboard_rollup_filter(dashboard,
+                                                            measurements)
+        rows = [row for row in dashboard["rows"]
+                if row["title"] == "Top Talkers"]
+        self.assertEqual(len(rows), 1)
+        self.assertEqual([panel["title"] for panel in rows[0]["panels"]],
+                         ["Top I/O Throughput per Job",
+                          "Top Metadata Performance per Client"])
+        # The rows without the measurements of the rollup are not changed
+        titles = [title for title in
+                  dashboard_row_titles(dashboard_load("lustre_statistics.json"))
+                  if not title.startswith("Quantiles")]
+        self.assertEqual(dashboard_row_titles(dashboard), titles)
+
+
+    def test_quantiles(self):
+        """
+        Only the quantile panels of the written measurements are kept
+        """
+        dashboard = dashboard_load("lustre_oss.json")
+        self.assertIn('"qsk_', esmon_dashboard.dashboard_json(dashboard))
+        filtered = esmon_dashboard.dashboard_rollup_filter(dashboard, [])
+        self.assertNotIn('"qsk_', esmon_dashboard.dashboard_json(filtered))
+        for title in dashboard_row_titles(filtered):
+            self.assertFalse(title.startswith("Quantiles"))
+
+        # Only the I/O time is written if compact stats is enabled
+        measurement = "qsk_ost_brw_stats_io_time_samples-field-fs_name"
+        dashboard = dashboard_load("lustre_statistics.json")
+        filtered = esmon_dashboard.dashboard_rollup_filter(dashboard,
+                                                           [measurement])
+        self.assertIn("Quantiles of I/O Time", dashboard_row_titles(filtered))
+
+
+if __name__ == "__main__":
+    unittest.main()
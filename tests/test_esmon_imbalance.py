@@ -0,0 +1,203 @@
+# Copyright (c) 2017 DataDirect Networks, Inc.
+# All Rights Reserved.
+# Author: lixi@ddn.com
+"""
+Tests of the imbalance analytics of OSTs/MDTs
+"""
+import httplib
+import time
+import unittest
+import numpy
+
+from pyesmon import esmon_imbalance
+
+NAN = numpy.nan
+
+
+class FakeResponse(object):
+    """
+    The response of Influxdb
+    """
+    # pylint: disable=too-few-public-methods
+    def __init__(self, data):
+        self.status_code = httplib.OK
+        self.fr_data = data
+
+    def json(self):
+        """
+        Return the data of the response
+        """
+        return self.fr_data
+
+
+class FakeInfluxdbClient(object):
+    """
+    Influxdb client that returns the series
+    """
+    # pylint: disable=too-few-public-methods
+    def __init__(self, series):
+        self.fic_series = series
+        self.fic_queries = []
+
+    def ic_query(self, query, epoch=None, chunk_size=None):
+        """
+        Record the query and return the series
+        """
+        # pylint: disable=unused-argument
+        self.fic_queries.append(query)
+        return FakeResponse({"results": [{"series": self.fic_series}]})
+
+
+class TestImbalanceMatrix(unittest.TestCase):
+    """
+    The statistics of the rows and columns with missing values
+    """
+    def test_nan_mean(self):
+        """
+        The missing values are not counted
+        """
+        matrix = numpy.array([[1.0, 3.0, NAN], [NAN, NAN, NAN]])
+        means = esmon_imbalance.imbalance_nan_mean(matrix, 1)
+        self.assertEqual(means[0], 2.0)
+        self.assertTrue(numpy.isnan(means[1]))
+        stds = esmon_imbalance.imbalance_nan_std(matrix, 1)
+        self.assertEqual(stds[0], 1.0)
+
+    def test_percentiles(self):
+        """
+        The percentiles of each column are interpolated
+        """
+        matrix = numpy.array([[1.0, NAN, NAN],
+                              [2.0, 5.0, NAN],
+                              [3.0, NAN, NAN],
+                              [4.0, 7.0, NAN]])
+        values = esmon_imbalance.imbalance_percentiles(matrix, 50)
+        self.assertEqual(list(values[:2]), [2.5, 6.0])
+        self.assertTrue(numpy.isnan(values[2]))
+        values = esmon_imbalance.imbalance_percentiles(matrix, 100)
+        self.assertEqual(list(values[:2]), [4.0, 7.0])
+
+    def test_last(self):
+        """
+        The last value of each row that is not missing
+        """
+        matrix = numpy.array([[1.0, 2.0, NAN], [NAN, NAN, NAN],
+                              [3.0, NAN, 4.0]])
+        values = esmon_imbalance.imbalance_last(matrix)
+        self.assertEqual(values[0], 2.0)
+        self.assertTrue(numpy.isnan(values[1]))
+        self.assertEqual(values[2], 4.0)
+
+    def test_slopes(self):
+        """
+        The slope of the least squares line of each row
+        """
+        times = numpy.array([100.0, 200.0, 300.0, 400.0])
+        matrix = numpy.array([[10.0, 20.0, NAN, 40.0],
+                              [5.0, 5.0, 5.0, 5.0],
+                              [1.0, NAN, NAN, NAN]])
+        slopes = esmon_imbalance.imbalance_slopes(times, matrix)
+        self.assertAlmostEqual(slopes[0], 0.1)
+        self.assertEqual(slopes[1], 0.0)
+        self.assertTrue(numpy.isnan(slopes[2]))
+
+
+class TestImbalanceAnalyze(unittest.TestCase):
+    """
+    Find the hot and nearly full targets
+    """
+    def test_series(self):
+        """
+        The points are put into the buckets of the rows of the targets
+        """
+        bucket = 3600 * esmon_imbalance.ESMON_IMBALANCE_HOURS / \
+            esmon_imbalance.ESMON_IMBALANCE_BUCKETS
+        now = int(time.time()) / bucket * bucket
+        client = FakeInfluxdbClient([{"tags": {"fs_name": "lustre0",
+                                               "ost_index": "OST0001"},
+                                      "values": [[now, 2.0]]},
+                                     {"tags": {"fs_name": "lustre0",
+                                               "ost_index": "OST0000"},
+                                      "values": [[now - bucket, 1.0],
+                                                 [now, 3.0]]},
+                                     {"tags": {"fs_name": "lustre0",
+                                               "ost_index": ""},
+                                      "values": [[now, 5.0]]}])
+        series = esmon_imbalance.esmon_imbalance_series(client,
+                                                        "ost_kbytesinfo_used",
+                                                        "value", "ost_index",
+                                                        esmon_imbalance.ESMON_IMBALANCE_HOURS)
+        self.assertEqual(series.keys(), ["lustre0"])
+        self.assertEqual(series["lustre0"].ims_targets, ["OST0000", "OST0001"])
+        matrix = series["lustre0"].ims_matrix
+        self.assertEqual(list(matrix[:, -1]), [3.0, 2.0])
+        self.assertEqual(list(matrix[:, -2][:1]), [1.0])
+        self.assertEqual(numpy.count_nonzero(~numpy.isnan(matrix)), 3)
+
+    def test_hot(self):
+        """
+        The target with a large z-score is flagged as hot
+        """
+        metric = esmon_imbalance.ESMON_IMBALANCE_METRICS[0]
+        targets = ["OST%04x" % index for index in range(20)]
+        matrix = numpy.ones((20, 4))
+        matrix[7] = 100.0
+        used = esmon_imbalance.ImbalanceSeries("lustre0", targets,
+                                               numpy.arange(4.0), matrix)
+        summary, flagged = esmon_imbalance.esmon_imbalance_analyze(metric,
+                                                                   used, None)
+        self.assertEqual(summary["max_target"], "OST0007")
+        self.assertEqual(summary["flagged"], 1)
+        self.assertAlmostEqual(summary["mean"], 5.95)
+        self.assertEqual([target["target"] for target in flagged],
+                         ["OST0007"])
+        self.assertEqual(flagged[0]["note"], "hot")
+
+    def test_full(self):
+        """
+        The targets that are nearly full or filling up are flagged
+        """
+        metric = esmon_imbalance.ESMON_IMBALANCE_METRICS[2]
+        times = numpy.arange(0.0, 4 * 86400, 86400)
+        used = esmon_imbalance.ImbalanceSeries("lustre0", ["OST0000",
+                                                           "OST0001",
+                                                           "OST0002"],
+                                               times,
+                                               numpy.array([[10.0] * 4,
+                                                            [95.0] * 4,
+                                                            [10.0, 20.0, 30.0,
+                                                             40.0]]))
+        free = esmon_imbalance.ImbalanceSeries("lustre0", ["OST0002",
+                                                           "OST0001",
+                                                           "OST0000"],
+                                               times,
+                                               numpy.array([[60.0] * 4,
+                                                            [5.0] * 4,
+                                                            [90.0] * 4]))
+        summary, flagged = esmon_imbalance.esmon_imbalance_analyze(metric,
+                                                                   used, free)
+        self.assertEqual(summary["min_full_days"], 6.0)
+        notes = dict((target["target"], target["note"]) for target in flagged)
+        self.assertEqual(notes, {"OST0001": "nearly full",
+                                 "OST0002": "filling up"})
+
+    def test_lines(self):
+        """
+        The summaries and targets are published in line protocol
+        """
+        lines = esmon_imbalance.esmon_imbalance_lines(
+            [{"fs_name": "lustre0", "metric": "ost_throughput", "mean": 1,
+              "max_target": "OST0000", "cv": None}],
+            [{"fs_name": "lustre0", "metric": "ost_throughput",
+              "target": "OST 0", "z": 3.5, "note": 'a "hot" one'}])
+        self.assertEqual(lines,
+                         ['esmon_imbalance,fs_name=lustre0,'
+                          'metric=ost_throughput max_target="OST0000",'
+                          'mean=1.0',
+                          'esmon_imbalance_target,fs_name=lustre0,'
+                          'metric=ost_throughput,target=OST\\ 0 '
+                          'note="a \\"hot\\" one",z=3.5'])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,294 @@
+# Copyright (c) 2017 DataDirect Networks, Inc.
+# All Rights Reserved.
+# Author: lixi@ddn.com
+"""
+Tests of the ESMON server configuration
+"""
+import httplib
+import threading
+import time
+import unittest
+
+from pyesmon import esmon_common
+from pyesmon import esmon_install_nodeps
+from pyesmon import esmon_rollup
+
+
+class FakeHost(object):
+    """
+    The host of the ESMON server
+    """
+    # pylint: disable=too-few-public-methods
+    def __init__(self, hostname):
+        self.sh_hostname = hostname
+
+
+class FakeResponse(object):
+    """
+    The response of Influxdb
+    """
+    # pylint: disable=too-few-public-methods
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+class FakeInfluxdbClient(object):
+    """
+    Influxdb client that records the queries
+    """
+    # pylint: disable=too-few-public-methods
+    def __init__(self):
+        self.fic_queries = []
+
+    def ic_query(self, query, epoch=None, chunk_size=None):
+        """
+        Record the query
+        """
+        # pylint: disable=unused-argument
+        self.fic_queries.append(query)
+        return FakeResponse(httplib.OK)
+
+
+class FakeClient(object):
+    """
+    The ESMON client that records the update of collectd config
+    """
+    def __init__(self, hostname, verifying, apply_ret=0):
+        self.ec_host = FakeHost(hostname)
+        # The clients that are waiting for new datapoints
+        self.fc_verifying = verifying
+        self.fc_apply_ret = apply_ret
+        self.fc_verified = False
+        self.fc_rollbacked = False
+
+    def ec_collectd_config_changed(self):
+        """
+        The config is always changed
+        """
+        # pylint: disable=no-self-use
+        return 0, True
+
+    def ec_collectd_config_apply(self):
+        """
+        Return the given result
+        """
+        return self.fc_apply_ret
+
+    def ec_collectd_config_verify(self):
+        """
+        Wait until all the other clients are being verified too
+        """
+        condition, clients, expected = self.fc_verifying
+        self.fc_verified = True
+        deadline = time.time() + 5
+        with condition:
+            clients.append(self)
+            condition.notify_all()
+            while len(clients) < expected:
+                if time.time() > deadline:
+                    return -1
+                condition.wait(1)
+        return 0
+
+    def ec_collectd_config_rollback(self):
+        """
+        Record the rollback
+        """
+        self.fc_rollbacked = True
+        return 0
+
+
+def esmon_server(**kwargs):
+    """
+    Return an ESMON server with options in kwargs
+    """
+    return esmon_install_nodeps.EsmonServer(FakeHost("server"), "/tmp", 60,
+                                            4, "jobid_var", **kwargs)
+
+
+class TestRollupQuantileRules(unittest.TestCase):
+    """
+    The quantile rules of the rollup service
+    """
+    def test_moments(self):
+        """
+        The service times are estimated from the moments
+        """
+        rules = esmon_server().es_rollup_quantile_rules()
+        kinds = [rule["kind"] for rule in rules]
+        self.assertEqual(kinds.count("histogram"), 1)
+        measurements = [rule["measurement"] for rule in rules
+                        if rule["kind"] == "moments"]
+        self.assertIn("mdt_stats_req_waittime", measurements)
+        # Rules of the services on both MDS and OSS are not duplicated
+        self.assertEqual(len(measurements), len(set(measurements)))
+
+    def test_compact_stats(self):
+        """
+        No moments rule if the moments are not sent to the server
+        """
+        rules = esmon_server(lustre_compact_stats=True).es_rollup_quantile_rules()
+        self.assertEqual([rule["kind"] for rule in rules], ["histogram"])
+        self.assertEqual(rules[0]["measurement"],
+                         "ost_brw_stats_io_time_samples")
+
+
+class TestRollupTopkRules(unittest.TestCase):
+    """
+    The top-K rules of the rollup service
+    """
+    def test_optype(self):
+        """
+        The points of jobstats and export stats are matched by their optypes
+        """
+        topk_rules = []
+        for rule in esmon_server().es_rollup_topk_rules():
+            where = {}
+            for tag, values in rule["where"].iteritems():
+                where[tag] = set(values)
+            topk_rules.append(esmon_rollup.TopkRule(rule["measurement"],
+                                                    rule["topk_measurement"],
+                                                    rule["key_tag"],
+                                                    rule["groups"], where,
+                                                    rule["periods"],
+                                                    rule["k"],
+                                                    rule["windows"]))
+        rollup = esmon_rollup.Rollup("localhost", 8086, "esmon_database", 60,
+                                     0, [], topk_rules, [])
+        rollup.ru_closed_until = 0
+        rollup.ru_first_window = 0
+        lines = []
+        for optype, value in [("read", 100), ("write", 50)]:
+            lines.append("exp_ost_stats_bytes,exp_client=10.0.0.1@o2ib,"
+                         "fs_name=lustre0,optype=%s value=%d 0" %
+                         (optype, value))
+        for optype, value in [("sum_read_bytes", 30), ("min_read_bytes", 1)]:
+            lines.append("ost_jobstats_bytes,fs_name=lustre0,job_id=dd.0,"
+                         "optype=%s value=%d 0" % (optype, value))
+        rollup.ru_add("\n".join(lines), 1000000000)
+        rollup.ru_close(1000)
+        # The sums of the 4 collect intervals of a CQ period are averaged
+        pending = [line for line in rollup.ru_pending
+                   if ",rank=1 " in line]
+        self.assertEqual(sorted(pending),
+                         ['topk_exp_ost_stats_bytes-fs_name-exp_client,'
+                          'fs_name=lustre0,rank=1 key="10.0.0.1@o2ib",'
+                          'sum=37.5,error=0.0 0',
+                          'topk_ost_jobstats_bytes-fs_name-job_id,'
+                          'fs_name=lustre0,rank=1 key="dd.0",sum=7.5,'
+                          'error=0.0 0'])
+
+
+class TestContinuousQuery(unittest.TestCase):
+    """
+    The continuous queries of the aggregated measurements
+    """
+    def test_slow_gauge(self):
+        """
+        The gaps of the measurement collected with a longer interval are
+        filled with the previous value
+        """
+        server = esmon_server(slow_gauge_periods=2)
+        client = FakeInfluxdbClient()
+        server.es_influxdb_client = client
+        self.assertEqual(server.es_influxdb_cq_create("ost_stats_bytes",
+                                                      ["fs_name"]), 0)
+        self.assertEqual(server.es_influxdb_cq_create("ost_kbytesinfo_free",
+                                                      ["fs_name"],
+                                                      item_periods=2), 0)
+        self.assertEqual(len(client.fic_queries), 2)
+        self.assertNotIn("fill(", client.fic_queries[0])
+        self.assertIn('sum("value") / 4 ', client.fic_queries[0])
+        self.assertIn("fill(previous)", client.fic_queries[1])
+        self.assertIn('sum("value") / 2 ', client.fic_queries[1])
+
+    def test_slow_gauge_rollup(self):
+        """
+        The rollup service fills the gaps like the continuous query
+        """
+        server = esmon_server(slow_gauge_periods=2, streaming_rollup=True)
+        server.es_influxdb_client = FakeInfluxdbClient()
+        server.es_influxdb_cq_create("ost_stats_bytes", ["fs_name"])
+        server.es_influxdb_cq_create("ost_kbytesinfo_free", ["fs_name"],
+                                     item_periods=2)
+        fills = [rule["fill_previous"] for rule in server.es_rollup_rules]
+        self.assertEqual(fills, [False, True])
+
+
+class TestSeriesReaperRules(unittest.TestCase):
+    """
+    The rules of the series reaper
+    """
+    def test_disabled(self):
+        """
+        No rule if the idle days are 0
+        """
+        self.assertEqual(esmon_server().es_series_reaper_rules(), [])
+
+    def test_rules(self):
+        """
+        The idle days are converted to seconds
+        """
+        rules = esmon_server(job_idle_days=7).es_series_reaper_rules()
+        self.assertEqual([(rule["tag"], rule["idle_seconds"])
+                          for rule in rules], [("job_id", 7 * 86400)])
+        rules = esmon_server(job_idle_days=7,
+                             client_idle_days=30).es_series_reaper_rules()
+        self.assertEqual([(rule["tag"], rule["idle_seconds"])
+                          for rule in rules],
+                         [("job_id", 7 * 86400), ("exp_client", 30 * 86400)])
+
+
+
+class TestRollingUpdate(unittest.TestCase):
+    """
+    Update the collectd config of clients batch by batch
+    """
+    def test_parallel_verify(self):
+        """
+        The clients of a batch are verified in parallel, and the ones failed
+        to apply are not verified but rollbacked
+        """
+        verifying = (threading.Condition(), [], 3)
+        clients = {}
+        for index in range(4):
+            hostname = "client%d" % index
+            apply_ret = 0
+            if index == 0:
+                apply_ret = -1
+            clients[hostname] = FakeClient(hostname, verifying,
+                                           apply_ret=apply_ret)
+        config = {esmon_common.CSTR_AGENTS_RESTART_BATCH_SIZE: 4,
+                  esmon_common.CSTR_AGENTS_RESTART_CONCURRENCY: 2,
+                  esmon_common.CSTR_AGENTS_RESTART_MAX_FAILURES: 1}
+        ret = esmon_install_nodeps.esmon_clients_rolling_update(config,
+                                                                clients)
+        self.assertEqual(ret, 0)
+        self.assertFalse(clients["client0"].fc_verified)
+        self.assertTrue(clients["client0"].fc_rollbacked)
+        for index in range(1, 4):
+            client = clients["client%d" % index]
+            self.assertTrue(client.fc_verified)
+            self.assertFalse(client.fc_rollbacked)
+
+    def test_max_failures(self):
+        """
+        The update pauses after too many failures
+        """
+        verifying = (threading.Condition(), [], 1)
+        clients = {}
+        for index in range(3):
+            hostname = "client%d" % index
+            clients[hostname] = FakeClient(hostname, verifying, apply_ret=-1)
+        config = {esmon_common.CSTR_AGENTS_RESTART_BATCH_SIZE: 1,
+                  esmon_common.CSTR_AGENTS_RESTART_MAX_FAILURES: 1}
+        ret = esmon_install_nodeps.esmon_clients_rolling_update(config,
+                                                                clients)
+        self.assertEqual(ret, -1)
+        rollbacked = [client for client in clients.values()
+                      if client.fc_rollbacked]
+        self.assertEqual(len(rollbacked), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
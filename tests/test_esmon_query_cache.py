@@ -0,0 +1,279 @@
+# Copyright (c) 2017 DataDirect Networks, Inc.
+# All Rights Reserved.
+# Author: lixi@ddn.com
+"""
+Tests of the caching query proxy
+"""
+import httplib
+import json
+import threading
+import time
+import unittest
+
+from pyesmon import esmon_query_cache
+
+
+class TestQueryNormalize(unittest.TestCase):
+    """
+    Normalize the queries into cache keys
+    """
+    def test_time_align(self):
+        """
+        The lower bound is aligned down and the upper bound up
+        """
+        query = ('SELECT  "value" FROM "ost_stats_bytes"\n'
+                 'WHERE time >= 1500001234ms and time <= 1500061234ms')
+        self.assertEqual(esmon_query_cache.query_normalize(query, 10000),
+                         'SELECT "value" FROM "ost_stats_bytes" WHERE '
+                         'time >= 1500000000ms and time <= 1500070000ms')
+
+    def test_aligned(self):
+        """
+        The aligned bounds are not changed
+        """
+        query = "SELECT * FROM m WHERE time > 10000ms AND time < 20000ms"
+        self.assertEqual(esmon_query_cache.query_normalize(query, 10000),
+                         query)
+
+    def test_cacheable(self):
+        """
+        Only the read only queries are cached
+        """
+        self.assertTrue(esmon_query_cache.query_cacheable("select * from m"))
+        self.assertTrue(esmon_query_cache.query_cacheable("SHOW DATABASES"))
+        self.assertFalse(esmon_query_cache.query_cacheable("DROP SERIES FROM m"))
+        self.assertFalse(esmon_query_cache.query_cacheable("  "))
+
+
+class TestQueryCache(unittest.TestCase):
+    """
+    The LRU cache of the query results
+    """
+    def test_hit(self):
+        """
+        The second query is answered from cache
+        """
+        cache = esmon_query_cache.QueryCache(60, 8)
+        fetches = []
+
+        def fetch():
+            """
+            Fetch from Influxdb
+            """
+            fetches.append(1)
+            return (httplib.OK, "result")
+
+        self.assertEqual(cache.qc_query("q", fetch), (httplib.OK, "result"))
+        self.assertEqual(cache.qc_query("q", fetch), (httplib.OK, "result"))
+        self.assertEqual(len(fetches), 1)
+        stats = cache.qc_stats()
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 1)
+
+    def test_error_not_cached(self):
+        """
+        The failed results are not cached
+        """
+        cache = esmon_query_cache.QueryCache(60, 8)
+        fetches = []
+
+        def fetch():
+            """
+            Fail to fetch from Influxdb
+            """
+            fetches.append(1)
+            return (httplib.BAD_REQUEST, "error")
+
+        cache.qc_query("q", fetch)
+        cache.qc_query("q", fetch)
+        self.assertEqual(len(fetches), 2)
+
+    def test_expire(self):
+        """
+        The expired results are fetched again
+        """
+        cache = esmon_query_cache.QueryCache(-1, 8)
+        fetches = []
+
+        def fetch():
+            """
+            Fetch from Influxdb
+            """
+            fetches.append(1)
+            return (httplib.OK, "result")
+
+        cache.qc_query("q", fetch)
+        cache.qc_query("q", fetch)
+        self.assertEqual(len(fetches), 2)
+
+    def test_lru(self):
+        """
+        The least recently used results are evicted
+        """
+        cache = esmon_query_cache.QueryCache(60, 2)
+        cache.qc_put("a", (httplib.OK, "a"))
+        cache.qc_put("b", (httplib.OK, "b"))
+        cache.qc_query("a", None)
+        cache.qc_put("c", (httplib.OK, "c"))
+        self.assertEqual(list(cache.qc_entries.keys()), ["a", "c"])
+
+    def test_coalesce(self):
+        """
+        Concurrent queries of the same key only fetch once
+        """
+        cache = esmon_query_cache.QueryCache(60, 8)
+        started = threading.Event()
+        release = threading.Event()
+        fetches = []
+        results = []
+
+        def fetch():
+            """
+            Slow fetch from Influxdb
+            """
+            fetches.append(1)
+            started.set()
+            release.wait(10)
+            return (httplib.OK, "result")
+
+        leader = threading.Thread(target=lambda: results.append(cache.qc_query("q", fetch)))
+        leader.start()
+        started.wait(10)
+        follower = threading.Thread(target=lambda: results.append(cache.qc_query("q", fetch)))
+        follower.start()
+        while cache.qc_stats()["coalesced"] == 0:
+            follower.join(0.01)
+        release.set()
+        leader.join()
+        follower.join()
+        self.assertEqual(len(fetches), 1)
+        self.assertEqual(results, [(httplib.OK, "result")] * 2)
+
+
+class TestHotParse(unittest.TestCase):
+    """
+    Parse the line protocol and the queries of the hot tier
+    """
+    def test_line(self):
+        """
+        Parse a line with escaped tags and typed fields
+        """
+        point = esmon_query_cache.hot_line_parse(
+            r'ost_stats,fs_name=lustre,host=oss\ 1 value=1.5,count=3i,'
+            r'state="a b" 1500000000', 1000000000)
+        self.assertEqual(point, ("ost_stats",
+                                 (("fs_name", "lustre"), ("host", "oss 1")),
+                                 {"value": 1.5, "count": 3, "state": "a b"},
+                                 1500000000000000000))
+
+    def test_line_invalid(self):
+        """
+        Invalid lines are ignored
+        """
+        for line in ["ost_stats", "ost_stats value=1 abc",
+                     "ost_stats,host value=1"]:
+            self.assertIsNone(esmon_query_cache.hot_line_parse(line, 1))
+
+    def test_statement(self):
+        """
+        Parse the query of a dashboard panel
+        """
+        now_ns = 1000 * 1000000000
+        statement = esmon_query_cache.hot_statement_parse(
+            'SELECT last("value") / 1024 AS "size" FROM "ost_kbytesfree" '
+            "WHERE \"fs_name\" = 'lustre' AND \"ost_index\" =~ /^OST/ AND "
+            'time > now() - 5m GROUP BY "ost_index"', now_ns)
+        self.assertTrue(statement.hst_last)
+        self.assertEqual(statement.hst_measurement, "ost_kbytesfree")
+        self.assertEqual(statement.hst_projections,
+                         [("value", "/", 1024.0, "size")])
+        self.assertEqual(statement.hst_lower, now_ns - 300 * 1000000000 + 1)
+        self.assertEqual(statement.hst_group_by, ["ost_index"])
+        self.assertEqual(statement.hst_conditions[0],
+                         ("fs_name", "=", "lustre"))
+
+    def test_statement_unsupported(self):
+        """
+        The queries that the hot tier can't answer are sent to Influxdb
+        """
+        for query in ['SELECT mean("value") FROM m WHERE time > now() - 5m',
+                      'SELECT last("value"), "value" FROM m '
+                      'WHERE time > now() - 5m',
+                      'SELECT "value" FROM m WHERE "host" = \'a\'']:
+            self.assertIsNone(esmon_query_cache.hot_statement_parse(query, 0))
+
+
+class TestHotTier(unittest.TestCase):
+    """
+    Answer the queries from the recent points
+    """
+    def setUp(self):
+        self.hot_tier = esmon_query_cache.HotTier("esmon_database", 3600, 4)
+        self.hot_tier.ht_start_time = 0
+        now = int(time.time())
+        self.times = [now - 30, now - 20, now - 10]
+        lines = []
+        for index, timestamp in enumerate(self.times):
+            for host in ["a", "b"]:
+                lines.append("load,host=%s value=%d %d" %
+                             (host, index, timestamp))
+        self.hot_tier.ht_write("\n".join(lines), 1000000000)
+
+    def query(self, query):
+        """
+        Return the result of the query, None if not answered
+        """
+        body = self.hot_tier.ht_query([("db", "esmon_database"),
+                                       ("epoch", "s"), ("q", query)])
+        if body is None:
+            return None
+        return json.loads(body)["results"]
+
+    def test_last(self):
+        """
+        The last value of each group
+        """
+        results = self.query('SELECT last("value") FROM "load" WHERE '
+                             'time > now() - 1m GROUP BY "host"')
+        series = results[0]["series"]
+        self.assertEqual([item["tags"] for item in series],
+                         [{"host": "a"}, {"host": "b"}])
+        self.assertEqual(series[0]["columns"], ["time", "last"])
+        self.assertEqual(series[0]["values"], [[self.times[2], 2]])
+
+    def test_points(self):
+        """
+        The raw points in the time range
+        """
+        results = self.query('SELECT "value" * 2 FROM "load" WHERE '
+                             "\"host\" = 'a' AND time > now() - 1m")
+        self.assertEqual(results[0]["series"][0]["values"],
+                         [[self.times[0], 0], [self.times[1], 2],
+                          [self.times[2], 4]])
+
+    def test_evicted(self):
+        """
+        The queries that need the overwritten points are not answered
+        """
+        now = int(time.time())
+        self.hot_tier.ht_write("\n".join("load,host=a value=0 %d" % timestamp
+                                         for timestamp in range(now - 9, now)),
+                               1000000000)
+        self.assertIsNone(self.query('SELECT "value" FROM "load" WHERE '
+                                     'time > now() - 1m'))
+        self.assertIsNotNone(self.query('SELECT "value" FROM "load" WHERE '
+                                        'time > now() - 3s'))
+
+    def test_max_series(self):
+        """
+        The measurement with rejected series is not answered
+        """
+        self.hot_tier.ht_max_series = 2
+        self.hot_tier.ht_write("load,host=c value=1", 1)
+        self.assertIsNone(self.query('SELECT last("value") FROM "load" WHERE '
+                                     'time > now() - 1m'))
+        self.assertEqual(self.hot_tier.ht_stats()["rejected"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,277 @@
+# Copyright (c) 2017 DataDirect Networks, Inc.
+# All Rights Reserved.
+# Author: lixi@ddn.com
+"""
+Tests of the streaming rollup service
+"""
+import unittest
+
+from pyesmon import esmon_rollup
+
+
+def rollup_new(rules, topk_rules=None, quantile_rules=None):
+    """
+    Return a rollup of 60 second windows that accepts all points
+    """
+    if topk_rules is None:
+        topk_rules = []
+    if quantile_rules is None:
+        quantile_rules = []
+    rollup = esmon_rollup.Rollup("localhost", 8086, "esmon_database", 60, 0,
+                                 rules, topk_rules, quantile_rules)
+    rollup.ru_closed_until = 0
+    rollup.ru_first_window = 0
+    return rollup
+
+
+class TestRollupParse(unittest.TestCase):
+    """
+    Parse the WHERE clauses and the line protocol
+    """
+    def test_where(self):
+        """
+        Only the OR of the values of one tag is supported
+        """
+        self.assertEqual(esmon_rollup.rollup_where_parse(""), {})
+        where = ("WHERE optype = 'sum_read_bytes' OR "
+                 "\"optype\" = 'sum_write_bytes'")
+        self.assertEqual(esmon_rollup.rollup_where_parse(where),
+                         {"optype": set(["sum_read_bytes", "sum_write_bytes"])})
+        self.assertIsNone(esmon_rollup.rollup_where_parse(
+            "WHERE optype = 'a' OR fs_name = 'b'"))
+        self.assertIsNone(esmon_rollup.rollup_where_parse(
+            "WHERE value > 0"))
+
+    def test_line(self):
+        """
+        Only the value field is used
+        """
+        line = r"ost_stats,fs_name=lustre\ 0 count=1i,value=2i 3"
+        self.assertEqual(esmon_rollup.rollup_line_parse(line, 1000),
+                         ("ost_stats", {"fs_name": "lustre 0"}, 2.0, 3000))
+        self.assertIsNone(esmon_rollup.rollup_line_parse(
+            "ost_stats,fs_name=lustre0 count=1 3", 1))
+        self.assertIsNone(esmon_rollup.rollup_line_parse(
+            'ost_stats value="a" 3', 1))
+
+
+class TestRollupRule(unittest.TestCase):
+    """
+    The sums of the continuous queries
+    """
+    def test_sum(self):
+        """
+        The points of a window are summed by the groups and divided by the
+        periods
+        """
+        rules = [esmon_rollup.RollupRule("ost_stats_bytes",
+                                         "cqm_ost_stats_bytes-fs_name",
+                                         ["fs_name"],
+                                         {"optype": set(["sum_read_bytes"])},
+                                         2)]
+        rollup = rollup_new(rules)
+        rollup.ru_add("ost_stats_bytes,fs_name=lustre0,optype=sum_read_bytes "
+                      "value=10 0\n"
+                      "ost_stats_bytes,fs_name=lustre0,optype=sum_read_bytes "
+                      "value=20 30\n"
+                      "ost_stats_bytes,fs_name=lustre0,optype=sum_write_bytes "
+                      "value=40 30\n"
+                      "ost_stats_bytes,optype=sum_read_bytes value=6 30\n",
+                      1000000000)
+        rollup.ru_close(1000)
+        self.assertEqual(sorted(rollup.ru_pending),
+                         ["cqm_ost_stats_bytes-fs_name sum=3.0 0",
+                          "cqm_ost_stats_bytes-fs_name,fs_name=lustre0 "
+                          "sum=15.0 0"])
+
+    def test_fill_previous(self):
+        """
+        The key missing in a window gets the sum of the previous window
+        """
+        rules = [esmon_rollup.RollupRule("ost_kbytesinfo_free",
+                                         "cqm_ost_kbytesinfo_free-fs_name",
+                                         ["fs_name"], {}, 1,
+                                         fill_previous=True),
+                 esmon_rollup.RollupRule("ost_stats_bytes",
+                                         "cqm_ost_stats_bytes-fs_name",
+                                         ["fs_name"], {}, 1)]
+        rollup = rollup_new(rules)
+        rollup.ru_add("ost_kbytesinfo_free,fs_name=lustre0 value=100 0\n"
+                      "ost_stats_bytes,fs_name=lustre0 value=1 0\n"
+                      "ost_stats_bytes,fs_name=lustre0 value=2 60\n"
+                      "ost_stats_bytes,fs_name=lustre0 value=3 120\n", 1000000000)
+        rollup.ru_close(1000)
+        lines = [line for line in rollup.ru_pending
+                 if line.startswith("cqm_ost_kbytesinfo_free")]
+        # Only the window right after the one with point is filled
+        self.assertEqual(sorted(lines),
+                         ["cqm_ost_kbytesinfo_free-fs_name,fs_name=lustre0 "
+                          "sum=100.0 0",
+                          "cqm_ost_kbytesinfo_free-fs_name,fs_name=lustre0 "
+                          "sum=100.0 60"])
+        lines = [line for line in rollup.ru_pending
+                 if line.startswith("cqm_ost_stats_bytes")]
+        self.assertEqual(len(lines), 3)
+
+
+class TestTopk(unittest.TestCase):
+    """
+    The heavy hitters of the sliding windows
+    """
+    def test_space_saving(self):
+        """
+        The heavy hitters are kept when the counters are trimmed
+        """
+        sketch = esmon_rollup.SpaceSaving(2)
+        for key in ["a", "b", "c", "d"]:
+            sketch.ss_add(key, 1)
+        sketch.ss_add("a", 100)
+        sketch.ss_add("b", 50)
+        sketch.ss_add("e", 1)
+        top = sketch.ss_top(2)
+        self.assertEqual([item[0] for item in top], ["a", "b"])
+        self.assertEqual(sketch.ss_total, 155)
+        # The estimation never underestimates, and the error bounds it
+        for _, _, error in top:
+            self.assertTrue(error <= sketch.ss_floor)
+        self.assertTrue(top[0][1] - top[0][2] <= 101 <= top[0][1])
+
+    def test_merge(self):
+        """
+        The merged sketch has the sums of both
+        """
+        first = esmon_rollup.SpaceSaving(4)
+        second = esmon_rollup.SpaceSaving(4)
+        first.ss_add("a", 3)
+        first.ss_add("b", 1)
+        second.ss_add("a", 2)
+        second.ss_add("c", 4)
+        first.ss_merge(second)
+        self.assertEqual(first.ss_top(3), [("a", 5, 0), ("c", 4, 0),
+                                           ("b", 1, 0)])
+        self.assertEqual(first.ss_total, 10)
+
+    def test_sliding_window(self):
+        """
+        The top-K and other bucket are the averages of the sliding window
+        """
+        rule = esmon_rollup.TopkRule("ost_jobstats_bytes",
+                                     "topk_ost_jobstats_bytes-job_id",
+                                     "job_id", ["fs_name"], {}, 1, 1, 2)
+        rollup = rollup_new([], topk_rules=[rule])
+        rollup.ru_add("ost_jobstats_bytes,fs_name=lustre0,job_id=a value=60 0\n"
+                      "ost_jobstats_bytes,fs_name=lustre0,job_id=b value=30 0\n"
+                      "ost_jobstats_bytes,fs_name=lustre0,job_id=b value=90 60\n"
+                      "ost_jobstats_bytes,fs_name=lustre0 value=10 60\n",
+                      1000000000)
+        rollup.ru_close(1000)
+        self.assertEqual(rollup.ru_pending,
+                         ['topk_ost_jobstats_bytes-job_id,fs_name=lustre0,'
+                          'rank=1 key="a",sum=60.0,error=0.0 0',
+                          'topk_ost_jobstats_bytes-job_id,fs_name=lustre0,'
+                          'rank=other key="other",sum=30.0,error=0.0 0',
+                          'topk_ost_jobstats_bytes-job_id,fs_name=lustre0,'
+                          'rank=1 key="b",sum=60.0,error=0.0 60',
+                          'topk_ost_jobstats_bytes-job_id,fs_name=lustre0,'
+                          'rank=other key="other",sum=30.0,error=0.0 60'])
+
+
+class TestQuantile(unittest.TestCase):
+    """
+    The quantiles of the latency distributions
+    """
+    def assert_relative(self, value, expected, accuracy):
+        """
+        Check the relative error of the value
+        """
+        self.assertTrue(abs(value - expected) <= expected * accuracy,
+                        "%r is not close to %r" % (value, expected))
+
+    def test_accuracy(self):
+        """
+        The estimated quantiles have bounded relative errors
+        """
+        sketch = esmon_rollup.DDSketch()
+        for value in range(1, 10001):
+            sketch.dds_add(value)
+        for quantile in [0.5, 0.9, 0.99]:
+            self.assert_relative(sketch.dds_quantile(quantile),
+                                 quantile * 10000, 0.02)
+        self.assertIsNone(esmon_rollup.DDSketch().dds_quantile(0.5))
+
+    def test_merge(self):
+        """
+        Merging is the same as adding all values into one sketch
+        """
+        first = esmon_rollup.DDSketch()
+        second = esmon_rollup.DDSketch()
+        total = esmon_rollup.DDSketch()
+        for value in range(1, 1001):
+            if value % 2:
+                first.dds_add(value)
+            else:
+                second.dds_add(value * 10)
+            total.dds_add(value if value % 2 else value * 10)
+        first.dds_merge(second)
+        self.assertEqual(first.dds_buckets, total.dds_buckets)
+        self.assertEqual(first.dds_quantile(0.9), total.dds_quantile(0.9))
+
+    def test_collapse(self):
+        """
+        The lowest buckets are collapsed, the high quantiles are kept
+        """
+        sketch = esmon_rollup.DDSketch(max_buckets=16)
+        for value in range(1, 10001):
+            sketch.dds_add(value)
+        self.assertTrue(len(sketch.dds_buckets) <= 16)
+        self.assert_relative(sketch.dds_quantile(0.999), 9990, 0.02)
+
+    def test_histogram(self):
+        """
+        Each point of histogram is the weight of the bucket
+        """
+        rule = esmon_rollup.QuantileRule("histogram", "ost_brw_stats_rpc",
+                                         "quantile_ost_brw_stats_rpc",
+                                         ["fs_name"])
+        rollup = rollup_new([], quantile_rules=[rule])
+        rollup.ru_add("ost_brw_stats_rpc,fs_name=lustre0,size=1K value=90 0\n"
+                      "ost_brw_stats_rpc,fs_name=lustre0,size=1M value=10 0\n",
+                      1000000000)
+        rollup.ru_close(1000)
+        self.assertEqual(len(rollup.ru_pending), 1)
+        fields = dict(field.split("=")
+                      for field in rollup.ru_pending[0].split()[1].split(","))
+        self.assert_relative(float(fields["p50"]), 1024, 0.01)
+        self.assert_relative(float(fields["p99"]), 1048576, 0.01)
+
+    def test_moments(self):
+        """
+        The moments of the intervals are approximated by log-normal
+        distributions of each server
+        """
+        rule = esmon_rollup.QuantileRule("moments", "ost_stats_req_waittime",
+                                         "quantile_ost_stats_req_waittime",
+                                         ["fs_name"])
+        rollup = rollup_new([], quantile_rules=[rule])
+        lines = []
+        for timestamp, samples in [(0, 100), (60, 200)]:
+            for role, value in [("samples", samples), ("sum", samples * 10),
+                                ("sum_square", samples * 100),
+                                ("min", 1), ("max", 1000)]:
+                lines.append("ost_stats_req_waittime_%s,fs_name=lustre0,"
+                             "fqdn=oss0 value=%d %d" %
+                             (role, value, timestamp))
+        rollup.ru_add("\n".join(lines), 1000000000)
+        rollup.ru_close(1000)
+        # The first window has no previous cumulative values
+        self.assertEqual(len(rollup.ru_pending), 1)
+        line = rollup.ru_pending[0]
+        self.assertTrue(line.endswith(" 60"))
+        # The values of the interval are all 10
+        fields = dict(field.split("=") for field in line.split()[1].split(","))
+        for field in ["p50", "p99"]:
+            self.assert_relative(float(fields[field]), 10, 0.02)
+
+
+if __name__ == "__main__":
+    unittest.main()
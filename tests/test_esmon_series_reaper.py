@@ -0,0 +1,180 @@
+# Copyright (c) 2017 DataDirect Networks, Inc.
+# All Rights Reserved.
+# Author: lixi@ddn.com
+"""
+Tests of the reaper of stale series
+"""
+import json
+import os
+import re
+import shutil
+import tempfile
+import unittest
+
+from pyesmon import esmon_series_reaper
+
+
+class FakeSeriesReaper(esmon_series_reaper.SeriesReaper):
+    """
+    Reaper that returns the given results instead of querying Influxdb
+    """
+    def __init__(self, rules, results, batch_size=2):
+        super(FakeSeriesReaper, self).__init__("localhost", 8086,
+                                               "esmon_database", rules,
+                                               batch_size=batch_size,
+                                               batch_interval=0)
+        # Key is the prefix of query, value is the result
+        self.fsr_results = results
+        self.fsr_queries = []
+
+    def sr_query(self, query):
+        """
+        Return the result of the query with the prefix
+        """
+        self.fsr_queries.append(query)
+        for prefix, result in self.fsr_results.iteritems():
+            if query.startswith(prefix):
+                return result
+        return {}
+
+
+def job_reaper(**kwargs):
+    """
+    Return a reaper of the job series with two jobs active out of four
+    """
+    rule = esmon_series_reaper.SeriesReaperRule(
+        esmon_series_reaper.SERIES_REAPER_JOB_MEASUREMENTS, "job_id", 86400)
+    results = {"SHOW TAG VALUES": {"series": [
+        {"name": "ost_jobstats_bytes",
+         "values": [["job_id", "1"], ["job_id", "2"], ["job_id", "3"],
+                    ["job_id", "it's"]]},
+        {"name": "mdt_jobstats_samples",
+         "values": [["job_id", "1"]]}]},
+               "SELECT last(*)": {"series": [
+                   {"name": "ost_jobstats_bytes", "tags": {"job_id": "2"}},
+                   {"name": "mdt_jobstats_samples", "tags": {"job_id": "1"}},
+                   # Written after SHOW TAG VALUES
+                   {"name": "ost_jobstats_bytes", "tags": {"job_id": "5"}}]}}
+    return FakeSeriesReaper([rule], results, **kwargs)
+
+
+class TestSeriesReaper(unittest.TestCase):
+    """
+    Find and drop the stale series
+    """
+    def test_quote(self):
+        """
+        The strings and identifiers are escaped for InfluxQL
+        """
+        self.assertEqual(esmon_series_reaper.influxql_string("it's\\"),
+                         "'it\\'s\\\\'")
+        self.assertEqual(esmon_series_reaper.influxql_identifier('a"b'),
+                         '"a\\"b"')
+
+    def test_measurements(self):
+        """
+        The regular expressions match the measurements of continuous queries
+        """
+        job_regex = re.compile(esmon_series_reaper.SERIES_REAPER_JOB_MEASUREMENTS)
+        self.assertTrue(job_regex.match("ost_jobstats_bytes"))
+        self.assertTrue(job_regex.match("cqm_mdt_jobstats_samples-fs_name"))
+        self.assertFalse(job_regex.match("ost_stats_bytes"))
+        client_regex = re.compile(esmon_series_reaper.SERIES_REAPER_CLIENT_MEASUREMENTS)
+        self.assertTrue(client_regex.match("exp_md_stats"))
+        self.assertTrue(client_regex.match("cqm_exp_ost_stats_bytes-fs_name"))
+
+    def test_find(self):
+        """
+        The values without recent points are stale
+        """
+        reaper = job_reaper()
+        stales = reaper.sr_find()
+        self.assertEqual([(stale.srs_measurement, stale.srs_stale_values)
+                          for stale in stales],
+                         [("mdt_jobstats_samples", []),
+                          ("ost_jobstats_bytes", ["1", "3", "it's"])])
+        self.assertEqual(stales[1].srs_row(),
+                         ["ost_jobstats_bytes", "job_id", "1", "4", "1", "3"])
+        self.assertIn("time > now() - 86400s", reaper.fsr_queries[1])
+
+    def test_reap(self):
+        """
+        The stale series are dropped in batches
+        """
+        reaper = job_reaper()
+        self.assertEqual(reaper.sr_reap(False), 0)
+        drops = [query for query in reaper.fsr_queries
+                 if query.startswith("DROP")]
+        self.assertEqual(drops,
+                         ["DROP SERIES FROM \"ost_jobstats_bytes\" WHERE "
+                          "\"job_id\" = '1' OR \"job_id\" = '3'",
+                          "DROP SERIES FROM \"ost_jobstats_bytes\" WHERE "
+                          "\"job_id\" = 'it\\'s'"])
+
+    def test_dry_run(self):
+        """
+        Nothing is dropped in dry run
+        """
+        reaper = job_reaper()
+        self.assertEqual(reaper.sr_reap(True), 0)
+        self.assertEqual([query for query in reaper.fsr_queries
+                          if query.startswith("DROP")], [])
+
+    def test_failure(self):
+        """
+        Nothing is dropped if the active values are unknown
+        """
+        reaper = job_reaper()
+        reaper.fsr_results["SELECT last(*)"] = None
+        self.assertIsNone(reaper.sr_find())
+        self.assertEqual(reaper.sr_reap(False), -1)
+        self.assertEqual([query for query in reaper.fsr_queries
+                          if query.startswith("DROP")], [])
+
+
+class TestSeriesReaperLoad(unittest.TestCase):
+    """
+    Load the config of the reaper
+    """
+    def setUp(self):
+        self.workspace = tempfile.mkdtemp()
+        self.fpath = os.path.join(self.workspace, "esmon_series_reaper.conf")
+
+    def tearDown(self):
+        shutil.rmtree(self.workspace)
+
+    def load(self, config):
+        """
+        Save and load the config
+        """
+        with open(self.fpath, "w") as config_file:
+            json.dump(config, config_file)
+        return esmon_series_reaper.series_reaper_load(self.fpath)
+
+    def test_load(self):
+        """
+        The rules and batch options are loaded
+        """
+        reaper = self.load({"influxdb_host": "server",
+                            "influxdb_port": 8086,
+                            "database": "esmon_database",
+                            "batch_size": 10,
+                            "rules": [{"measurement_regex": "^exp_",
+                                       "tag": "exp_client",
+                                       "idle_seconds": 3600}]})
+        self.assertEqual(reaper.sr_batch_size, 10)
+        self.assertEqual(reaper.sr_batch_interval,
+                         esmon_series_reaper.SERIES_REAPER_BATCH_INTERVAL)
+        self.assertEqual(reaper.sr_rules[0].srr_idle_seconds, 3600)
+
+    def test_invalid(self):
+        """
+        The config without the required options is invalid
+        """
+        self.assertIsNone(self.load({"rules": []}))
+        self.assertIsNone(esmon_series_reaper.series_reaper_load(
+            os.path.join(self.workspace, "nonexistent.conf")))
+
+
+if __name__ == "__main__":
+    unittest.main()
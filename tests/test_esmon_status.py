@@ -0,0 +1,91 @@
+# Copyright (c) 2017 DataDirect Networks, Inc.
+# All Rights Reserved.
+# Author: lixi@ddn.com
+"""
+Tests of the status report of ESMON agents
+"""
+import unittest
+
+from pyesmon import utils
+from pyesmon import esmon_status
+
+
+class FakeHost(object):
+    """
+    A host that returns the given output of the probe command
+    """
+    # pylint: disable=too-few-public-methods
+    def __init__(self, stdout, exit_status=0):
+        self.sh_host_id = "agent1"
+        self.sh_hostname = "agent1"
+        self.fh_stdout = stdout
+        self.fh_exit_status = exit_status
+        self.fh_commands = []
+
+    def sh_run(self, command, timeout=None):
+        """
+        Return the output of the command
+        """
+        # pylint: disable=unused-argument
+        self.fh_commands.append(command)
+        return utils.CommandResult(stdout=self.fh_stdout,
+                                   exit_status=self.fh_exit_status)
+
+
+class TestEsmonAgentStatus(unittest.TestCase):
+    """
+    Parse the output of the probe command
+    """
+    def test_fqdn_command(self):
+        """
+        The fqdn is got in the same way as the fqdn tag of Collectd
+        """
+        self.assertIn("$(hostname)", esmon_status.ESMON_STATUS_PROBE_COMMAND)
+        self.assertNotIn("--fqdn", esmon_status.ESMON_STATUS_PROBE_COMMAND)
+
+    def test_running(self):
+        """
+        Collectd is running
+        """
+        host = FakeHost("running=0\nfqdn=agent1.example.com\n"
+                        "fingerprint=abcd\nprocess= 10240 3600\n")
+        agent_status = esmon_status.EsmonAgentStatus(host)
+        self.assertEqual(agent_status.eas_probe(), 0)
+        self.assertEqual(len(host.fh_commands), 1)
+        agent_status.eas_last_seen = 100
+        status = agent_status.eas_dict(160)
+        self.assertEqual(status["collectd"], "running")
+        self.assertEqual(status["fqdn"], "agent1.example.com")
+        self.assertEqual(status["fingerprint"], "abcd")
+        self.assertEqual(status["rss_kb"], 10240)
+        self.assertEqual(status["uptime"], 3600)
+        self.assertEqual(status["last_seen_ago"], 60)
+
+    def test_stopped(self):
+        """
+        Collectd is stopped and has never been installed
+        """
+        host = FakeHost("running=3\nfqdn=agent1\nfingerprint=\nprocess=\n")
+        agent_status = esmon_status.EsmonAgentStatus(host)
+        self.assertEqual(agent_status.eas_probe(), 0)
+        status = agent_status.eas_dict(160)
+        self.assertEqual(status["collectd"], "stopped")
+        self.assertIsNone(status["fingerprint"])
+        self.assertIsNone(status["rss_kb"])
+        self.assertIsNone(status["last_seen_ago"])
+
+    def test_failure(self):
+        """
+        The status is unknown if the probe fails
+        """
+        agent_status = esmon_status.EsmonAgentStatus(FakeHost("", 255))
+        self.assertEqual(agent_status.eas_probe(), -1)
+        self.assertEqual(agent_status.eas_dict(160)["collectd"], "unknown")
+
+        host = FakeHost("running=0\nprocess=10240\n")
+        agent_status = esmon_status.EsmonAgentStatus(host)
+        self.assertEqual(agent_status.eas_probe(), -1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,208 @@
+# Copyright (c) 2017 DataDirect Networks, Inc.
+# All Rights Reserved.
+# Author: lixi@ddn.com
+"""
+Tests of the storage efficiency report
+"""
+import httplib
+import json
+import unittest
+
+from pyesmon import utils
+from pyesmon import esmon_storage
+
+
+class FakeHost(object):
+    """
+    The ESMON server that returns the given outputs of the commands
+    """
+    # pylint: disable=too-few-public-methods
+    def __init__(self, outputs):
+        self.sh_hostname = "server"
+        # Key is the prefix of command, value is (exit_status, stdout)
+        self.fh_outputs = outputs
+
+    def sh_run(self, command, timeout=None):
+        """
+        Return the output of the command
+        """
+        # pylint: disable=unused-argument
+        for prefix, output in self.fh_outputs.iteritems():
+            if command.startswith(prefix):
+                return utils.CommandResult(stdout=output[1],
+                                           exit_status=output[0])
+        return utils.CommandResult(exit_status=-1)
+
+
+class FakeResponse(object):
+    """
+    The response of Influxdb
+    """
+    # pylint: disable=too-few-public-methods
+    def __init__(self, data):
+        self.status_code = httplib.OK
+        self.fr_data = data
+
+    def json(self):
+        """
+        Return the data of the response
+        """
+        return self.fr_data
+
+
+class FakeInfluxdbClient(object):
+    """
+    Influxdb client that returns the result of the query with the prefix
+    """
+    # pylint: disable=too-few-public-methods
+    def __init__(self, results):
+        # Key is the prefix of query, value is the result
+        self.fic_results = results
+        self.fic_queries = []
+
+    def ic_query(self, query, epoch=None, chunk_size=None):
+        """
+        Return the result of the query
+        """
+        # pylint: disable=unused-argument
+        self.fic_queries.append(query)
+        for prefix, result in self.fic_results.iteritems():
+            if query.startswith(prefix):
+                return FakeResponse({"results": [result]})
+        return FakeResponse({"results": [{}]})
+
+
+def storage_shard(shard_id, start_time, points, shard_bytes=None):
+    """
+    Return a shard with the points of the measurements
+    """
+    shard = esmon_storage.StorageShard(shard_id, "autogen", start_time,
+                                       start_time)
+    shard.ss_measurement_points = points
+    shard.ss_bytes = shard_bytes
+    return shard
+
+
+class TestStorageShard(unittest.TestCase):
+    """
+    Get the shards and their sizes
+    """
+    def test_shards(self):
+        """
+        Only the shards of the ESMON database are reported
+        """
+        columns = ["id", "database", "retention_policy", "shard_group",
+                   "start_time", "end_time", "expiry_time", "owners"]
+        client = FakeInfluxdbClient({"SHOW SHARDS": {"series": [
+            {"name": "_internal", "columns": columns,
+             "values": [[1, "_internal", "monitor", 1, "a", "b", "c", ""]]},
+            {"name": "esmon_database", "columns": columns,
+             "values": [[2, "esmon_database", "autogen", 2,
+                         "2017-06-01T00:00:00Z", "2017-06-08T00:00:00Z",
+                         "2017-06-08T00:00:00Z", ""]]}]}})
+        shards = esmon_storage.esmon_storage_shards(client)
+        self.assertEqual([(shard.ss_id, shard.ss_retention_policy)
+                          for shard in shards], [("2", "autogen")])
+
+    def test_disk(self):
+        """
+        The sizes of the measurements are got from report-disk
+        """
+        shard = storage_shard("2", "a", {})
+        report = {"Measurement": [{"db": "esmon_database", "rp": "autogen",
+                                   "shard": 2, "measurement": "ost_stats",
+                                   "size": 300},
+                                  {"db": "_internal", "rp": "monitor",
+                                   "shard": 1, "measurement": "write",
+                                   "size": 100}]}
+        host = FakeHost({"du ": (0, "1000 /influxdb/data/esmon_database/"
+                                    "autogen/2\n"),
+                         "influx_inspect ": (0, json.dumps(report))})
+        self.assertEqual(esmon_storage.esmon_storage_disk(host, "/influxdb",
+                                                          [shard]), 0)
+        self.assertEqual(shard.ss_bytes, 1000)
+        self.assertEqual(shard.ss_measurement_bytes, {"ost_stats": 300})
+
+    def test_disk_attributed(self):
+        """
+        Without report-disk, the shard size is attributed by the points
+        """
+        shard = storage_shard("2", "a", {"ost_stats": 30, "md_stats": 10})
+        host = FakeHost({"du ": (0, "1000 /influxdb/data/esmon_database/"
+                                    "autogen/2\n"),
+                         "influx_inspect ": (0, "not json")})
+        self.assertEqual(esmon_storage.esmon_storage_disk(host, "/influxdb",
+                                                          [shard]), 0)
+        self.assertIsNone(shard.ss_measurement_bytes)
+        self.assertEqual(shard.ss_attributed_bytes("ost_stats"), 750)
+        self.assertEqual(shard.ss_attributed_bytes("md_stats"), 250)
+        self.assertEqual(shard.ss_attributed_bytes("cpu"), 0)
+
+    def test_points(self):
+        """
+        The points of all fields of each measurement are counted
+        """
+        shard = storage_shard("2", "a", {})
+        client = FakeInfluxdbClient({"SELECT count(*)": {"series": [
+            {"name": "ost_stats", "columns": ["time", "count_sum", "count_value"],
+             "values": [[0, 10, 20]]},
+            {"name": "md_stats", "columns": ["time", "count_value"],
+             "values": [[0, None]]}]}})
+        self.assertEqual(esmon_storage.esmon_storage_points(client, shard), 0)
+        self.assertEqual(shard.ss_measurement_points,
+                         {"ost_stats": 30, "md_stats": 0})
+
+
+class TestStorageMeasurements(unittest.TestCase):
+    """
+    The usages of the measurements over the shards
+    """
+    def test_usages(self):
+        """
+        The usages are summed over the shards and sorted by bytes
+        """
+        shards = [storage_shard("3", "2017-06-08", {"ost_stats": 1000,
+                                                    "cpu": 1000}, 8000),
+                  storage_shard("2", "2017-06-01", {"ost_stats": 1000,
+                                                    "cpu": 1000}, 4000)]
+        client = FakeInfluxdbClient({
+            "SHOW SERIES": {"series": [{"name": "ost_stats",
+                                        "values": [[1]]},
+                                       {"name": "cpu",
+                                        "values": [[200]]}]},
+            'SHOW TAG KEYS FROM "cpu"': {"series": [{"values": [["host"],
+                                                                ["type"]]}]},
+            'SHOW TAG VALUES EXACT CARDINALITY FROM "cpu" WITH KEY = "host"':
+            {"series": [{"values": [[100]]}]},
+            'SHOW TAG VALUES EXACT CARDINALITY FROM "cpu" WITH KEY = "type"':
+            {"series": [{"values": [[2]]}]}})
+        usages = esmon_storage.esmon_storage_measurements(client, shards)
+        usage_dicts = dict((usage_dict["measurement"], usage_dict)
+                           for usage_dict in [storage_usage.sm_dict()
+                                              for storage_usage in usages])
+        self.assertEqual(usage_dicts["ost_stats"]["bytes"], 6000)
+        self.assertEqual(usage_dicts["ost_stats"]["points"], 2000)
+        self.assertEqual(usage_dicts["ost_stats"]["bytes_per_point"], 3.0)
+        # The trend is from old to new shards
+        self.assertEqual(usage_dicts["ost_stats"]["trend"], [2.0, 4.0])
+        self.assertEqual(usage_dicts["ost_stats"]["note"], "")
+        self.assertEqual(usage_dicts["cpu"]["note"],
+                         "high-entropy tags, 5.0 points per series in a "
+                         "shard, tag [host] has 100 values")
+
+    def test_table(self):
+        """
+        The usages are formatted as a table
+        """
+        storage_usage = esmon_storage.StorageMeasurement("autogen", "cpu")
+        storage_usage.sm_bytes = 100
+        storage_usage.sm_points = 50
+        storage_usage.sm_trend = [1.0, 3.0]
+        lines = esmon_storage.esmon_storage_table([storage_usage.sm_dict()])
+        self.assertEqual(lines.splitlines()[1].split(),
+                         ["autogen", "cpu", "100", "50", "-", "2.0",
+                          "1.0,3.0"])
+
+
+if __name__ == "__main__":
+    unittest.main()